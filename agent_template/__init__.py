@@ -7,17 +7,42 @@ Framework mẫu để xây dựng các agent tương tác với LLM.
 __version__ = "1.0.0"
 __author__ = "Agent Template Team"
 
-from agent_template.core.agent import agent, process_input
-from agent_template.memory.persistence import (
-    save_memory, 
-    load_memory, 
-    list_conversations, 
-    create_new_thread,
-    delete_conversation,
-    Memory,
-    Message
-)
-from agent_template.tools.logo import get_logo, display_logo, LogoResult
-from agent_template.workflows.graph import process_with_graph, create_workflow
+import importlib
+import os
+from typing import Any
+
+# Plugin pydantic của logfire được nạp ngay khi model pydantic đầu tiên được tạo
+# (~0.4 giây) dù ứng dụng không dùng; đặt PYDANTIC_DISABLE_PLUGINS="" để bật lại
+os.environ.setdefault("PYDANTIC_DISABLE_PLUGINS", "logfire-plugin")
+
+# Các tên được export, nạp khi truy cập lần đầu để `import agent_template` không
+# kéo theo pydantic-ai, LangGraph, logfire hay việc tạo agent (tên -> module)
+_EXPORTS = {
+    "agent": "agent_template.core.agent",
+    "process_input": "agent_template.core.agent",
+    "save_memory": "agent_template.memory.persistence",
+    "load_memory": "agent_template.memory.persistence",
+    "list_conversations": "agent_template.memory.persistence",
+    "create_new_thread": "agent_template.memory.persistence",
+    "delete_conversation": "agent_template.memory.persistence",
+    "Memory": "agent_template.memory.persistence",
+    "Message": "agent_template.memory.persistence",
+    "get_logo": "agent_template.tools.logo",
+    "display_logo": "agent_template.tools.logo",
+    "LogoResult": "agent_template.tools.logo",
+    "process_with_graph": "agent_template.workflows.graph",
+    "create_workflow": "agent_template.workflows.graph",
+    "get_compiled_workflow": "agent_template.workflows.graph",
+}
+
+__all__ = list(_EXPORTS)
+
+def __getattr__(name: str) -> Any:
+    """Nạp một tên được export khi truy cập lần đầu."""
+    if name in _EXPORTS:
+        value = getattr(importlib.import_module(_EXPORTS[name]), name)
+        globals()[name] = value
+        return value
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 __version__ = "0.1.0" 
\ No newline at end of file
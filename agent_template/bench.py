@@ -0,0 +1,332 @@
+"""
+Công cụ tạo tải cho API của Agent Template.
+
+Gửi request tới `/send_message` với tốc độ mục tiêu (RPS) và báo cáo thông
+lượng, độ trễ p50/p95/p99 và tỷ lệ lỗi. Kết hợp với model cục bộ
+(MODEL_NAME=local) để benchmark mà không tốn lượt gọi API thật.
+
+Chế độ `--startup` đo thời gian khởi động thay vì tạo tải: thời gian import
+package và service trong tiến trình Python mới, và thời gian từ lúc chạy server
+tới khi /health sẵn sàng và request đầu tiên hoàn tất. Có thể đặt ngưỡng để lệnh
+trả mã lỗi khi khởi động chậm đi.
+
+Ví dụ:
+    python -m agent_template.bench --url http://localhost:8000 --rps 20 --duration 30
+    MODEL_NAME=local LIGHT_MODEL=local python -m agent_template.bench --in-process --rps 50
+    python -m agent_template.bench --startup --max-import-ms 500 --max-first-request-ms 5000
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+from typing import Dict, Any, List, Optional
+
+import httpx
+
+def percentile(samples: List[float], p: float) -> float:
+    """Tính phân vị p (0-100) của một danh sách đã sắp xếp."""
+    if not samples:
+        return 0.0
+    index = min(int(round(p / 100 * (len(samples) - 1))), len(samples) - 1)
+    return samples[index]
+
+async def _send(
+    client: httpx.AsyncClient,
+    payload: Dict[str, Any],
+    latencies: List[float],
+    errors: List[str]
+):
+    """Gửi một request và ghi nhận độ trễ hoặc lỗi."""
+    start = time.perf_counter()
+    try:
+        response = await client.post("/send_message", json=payload)
+        if response.status_code != 200:
+            errors.append(f"HTTP {response.status_code}")
+        elif not response.json().get("success", False):
+            errors.append(response.json().get("error") or "success=false")
+        else:
+            latencies.append(time.perf_counter() - start)
+    except httpx.HTTPError as e:
+        errors.append(type(e).__name__)
+
+async def run_load(
+    client: httpx.AsyncClient,
+    rps: float,
+    duration: float,
+    message: str,
+    threads: int = 0,
+    max_in_flight: int = 1000
+) -> Dict[str, Any]:
+    """Tạo tải vòng hở (open-loop) với tốc độ cố định.
+
+    Request thứ i được gửi tại thời điểm i / rps bất kể các request trước đã
+    xong hay chưa, nên độ trễ tăng khi server quá tải thay vì bị che giấu.
+
+    Args:
+        client: Client HTTP trỏ tới API
+        rps: Số request mỗi giây mục tiêu
+        duration: Thời gian tạo tải (giây)
+        message: Nội dung tin nhắn gửi đi
+        threads: Số luồng hội thoại xoay vòng (0 để mỗi request một luồng mới)
+        max_in_flight: Số request đồng thời tối đa
+
+    Returns:
+        Dict báo cáo kết quả
+    """
+    thread_ids: List[Optional[str]] = []
+    for _ in range(threads):
+        response = await client.post("/conversations")
+        thread_ids.append(response.json()["thread_id"])
+
+    latencies: List[float] = []
+    errors: List[str] = []
+    in_flight = asyncio.Semaphore(max_in_flight)
+    tasks = []
+    total = int(rps * duration)
+
+    async def send_one(index: int):
+        async with in_flight:
+            payload = {"message": f"{message} #{index}"}
+            if thread_ids:
+                payload["thread_id"] = thread_ids[index % len(thread_ids)]
+            else:
+                payload["thread_id"] = f"bench-{index}"
+            await _send(client, payload, latencies, errors)
+
+    start = time.perf_counter()
+    for index in range(total):
+        delay = start + index / rps - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        tasks.append(asyncio.create_task(send_one(index)))
+    await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    completed = len(latencies)
+    return {
+        "requests": total,
+        "completed": completed,
+        "errors": len(errors),
+        "error_rate": round(len(errors) / total, 4) if total else 0.0,
+        "elapsed_s": round(elapsed, 3),
+        "target_rps": rps,
+        "throughput_rps": round(completed / elapsed, 2) if elapsed else 0.0,
+        "latency_ms": {
+            "p50": round(percentile(latencies, 50) * 1000, 2),
+            "p95": round(percentile(latencies, 95) * 1000, 2),
+            "p99": round(percentile(latencies, 99) * 1000, 2),
+            "max": round(latencies[-1] * 1000, 2) if latencies else 0.0
+        },
+        "error_samples": sorted(set(errors))[:5]
+    }
+
+async def _run(args: argparse.Namespace) -> Dict[str, Any]:
+    """Chạy benchmark với server có sẵn hoặc ứng dụng trong tiến trình."""
+    timeout = httpx.Timeout(args.timeout)
+    if not args.in_process:
+        async with httpx.AsyncClient(base_url=args.url, timeout=timeout) as client:
+            return await run_load(client, args.rps, args.duration, args.message, args.threads, args.max_in_flight)
+
+    # Chạy APIService ngay trong tiến trình qua ASGI, không cần mở cổng
+    from agent_template.config import AppConfig
+    from agent_template.core.agent_service import AgentService
+    from agent_template.core.api_service import APIService
+
+    config = AppConfig(use_legacy=args.legacy)
+    agent_service = AgentService(config)
+    api_service = APIService(agent_service, config)
+    await agent_service.startup()
+    try:
+        transport = httpx.ASGITransport(app=api_service.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=timeout) as client:
+            return await run_load(client, args.rps, args.duration, args.message, args.threads, args.max_in_flight)
+    finally:
+        await agent_service.shutdown()
+
+# Các module được đo thời gian import trong chế độ --startup
+STARTUP_IMPORTS = ("agent_template", "agent_template.core.agent_service", "agent_template.main")
+
+def measure_import(module: str, runs: int = 3) -> float:
+    """Đo thời gian import một module trong tiến trình Python mới.
+
+    Args:
+        module: Tên module
+        runs: Số lần đo; lấy lần nhanh nhất để giảm nhiễu
+
+    Returns:
+        Thời gian import (ms)
+    """
+    code = (
+        "import time; start = time.perf_counter(); "
+        f"import {module}; print((time.perf_counter() - start) * 1000)"
+    )
+    samples = []
+    for _ in range(runs):
+        output = subprocess.run(
+            [sys.executable, "-c", code], check=True, capture_output=True, text=True
+        ).stdout
+        samples.append(float(output.strip().splitlines()[-1]))
+    return round(min(samples), 2)
+
+def _free_port() -> int:
+    """Lấy một cổng TCP còn trống."""
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def measure_first_request(message: str, timeout: float) -> Dict[str, float]:
+    """Chạy server API với model cục bộ và đo thời gian tới request đầu tiên.
+
+    Args:
+        message: Nội dung tin nhắn đầu tiên
+        timeout: Thời gian chờ tối đa (giây) cho server sẵn sàng và request
+
+    Returns:
+        Dict gồm thời gian tới khi /health sẵn sàng và tới khi request đầu tiên
+        hoàn tất (ms, tính từ lúc chạy tiến trình), cùng độ trễ của request đó
+
+    Raises:
+        RuntimeError: Nếu server không sẵn sàng hoặc request lỗi
+    """
+    port = _free_port()
+    env = {
+        **os.environ,
+        "MODEL_NAME": "local",
+        "ADVANCE_NAME": "local",
+        "LIGHT_MODEL": "local",
+        "OPENAI_API_KEY": os.environ.get("OPENAI_API_KEY", "bench")
+    }
+    url = f"http://127.0.0.1:{port}"
+    start = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "agent_template.main", "--api", "--port", str(port)],
+        env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    try:
+        with httpx.Client(base_url=url, timeout=timeout) as client:
+            while True:
+                if process.poll() is not None:
+                    raise RuntimeError(f"Server dừng với mã {process.returncode}")
+                if time.perf_counter() - start > timeout:
+                    raise RuntimeError(f"Server không sẵn sàng sau {timeout} giây")
+                try:
+                    if client.get("/health").status_code == 200:
+                        break
+                except httpx.HTTPError:
+                    pass
+                time.sleep(0.02)
+            ready = time.perf_counter()
+
+            response = client.post("/send_message", json={"message": message, "thread_id": f"bench-startup-{port}"})
+            done = time.perf_counter()
+            if response.status_code != 200 or not response.json().get("success", False):
+                raise RuntimeError(f"Request đầu tiên lỗi: HTTP {response.status_code}")
+            client.delete(f"/conversations/bench-startup-{port}")
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+    return {
+        "ready_ms": round((ready - start) * 1000, 2),
+        "first_request_ms": round((done - start) * 1000, 2),
+        "first_request_latency_ms": round((done - ready) * 1000, 2)
+    }
+
+def run_startup(args: argparse.Namespace) -> Dict[str, Any]:
+    """Đo thời gian khởi động và so với ngưỡng.
+
+    Returns:
+        Dict báo cáo gồm thời gian import, thời gian tới request đầu tiên và
+        danh sách ngưỡng bị vượt
+    """
+    imports = {module: measure_import(module, args.runs) for module in STARTUP_IMPORTS}
+    first_request = measure_first_request(args.message, args.timeout)
+
+    regressions = []
+    if args.max_import_ms is not None:
+        regressions += [
+            f"import {module}: {elapsed} ms > {args.max_import_ms} ms"
+            for module, elapsed in imports.items() if elapsed > args.max_import_ms
+        ]
+    if args.max_first_request_ms is not None and first_request["first_request_ms"] > args.max_first_request_ms:
+        regressions.append(
+            f"request đầu tiên: {first_request['first_request_ms']} ms > {args.max_first_request_ms} ms"
+        )
+    return {"import_ms": imports, **first_request, "regressions": regressions}
+
+def print_startup_report(report: Dict[str, Any]):
+    """In báo cáo thời gian khởi động dạng dễ đọc."""
+    print("\n===== THỜI GIAN KHỞI ĐỘNG =====")
+    for module, elapsed in report["import_ms"].items():
+        print(f"import {module}: {elapsed} ms")
+    print(f"Server sẵn sàng:      {report['ready_ms']} ms")
+    print(f"Request đầu tiên:     {report['first_request_ms']} ms (độ trễ {report['first_request_latency_ms']} ms)")
+    for regression in report["regressions"]:
+        print(f"  ✗ Vượt ngưỡng: {regression}")
+
+def print_report(report: Dict[str, Any]):
+    """In báo cáo benchmark dạng dễ đọc."""
+    latency = report["latency_ms"]
+    print("\n===== KẾT QUẢ BENCHMARK =====")
+    print(f"Request:        {report['requests']} (hoàn tất {report['completed']}, lỗi {report['errors']})")
+    print(f"Thời gian:      {report['elapsed_s']} s")
+    print(f"Thông lượng:    {report['throughput_rps']} req/s (mục tiêu {report['target_rps']})")
+    print(f"Độ trễ (ms):    p50={latency['p50']}  p95={latency['p95']}  p99={latency['p99']}  max={latency['max']}")
+    print(f"Tỷ lệ lỗi:      {report['error_rate'] * 100:.2f}%")
+    for sample in report["error_samples"]:
+        print(f"  - {sample}")
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    """Phân tích tham số dòng lệnh."""
+    parser = argparse.ArgumentParser(description="Tạo tải cho /send_message của Agent Template")
+    parser.add_argument("--url", default="http://localhost:8000", help="Địa chỉ API")
+    parser.add_argument("--rps", type=float, default=10.0, help="Số request mỗi giây mục tiêu")
+    parser.add_argument("--duration", type=float, default=10.0, help="Thời gian tạo tải (giây)")
+    parser.add_argument("--message", default="Xin chào, đây là tin nhắn benchmark", help="Nội dung tin nhắn")
+    parser.add_argument("--threads", type=int, default=0,
+                        help="Số luồng hội thoại xoay vòng (0 để mỗi request một luồng)")
+    parser.add_argument("--max-in-flight", type=int, default=1000, help="Số request đồng thời tối đa")
+    parser.add_argument("--timeout", type=float, default=60.0, help="Timeout mỗi request (giây)")
+    parser.add_argument("--in-process", action="store_true",
+                        help="Chạy API ngay trong tiến trình (nên dùng với MODEL_NAME=local)")
+    parser.add_argument("--legacy", action="store_true", help="Dùng chế độ legacy khi chạy --in-process")
+    parser.add_argument("--json", action="store_true", help="In báo cáo dạng JSON")
+    parser.add_argument("--startup", action="store_true",
+                        help="Đo thời gian import và thời gian tới request đầu tiên thay vì tạo tải")
+    parser.add_argument("--runs", type=int, default=3, help="Số lần đo thời gian import với --startup")
+    parser.add_argument("--max-import-ms", type=float, default=None,
+                        help="Ngưỡng thời gian import (ms); vượt ngưỡng thì trả mã lỗi")
+    parser.add_argument("--max-first-request-ms", type=float, default=None,
+                        help="Ngưỡng thời gian tới request đầu tiên (ms); vượt ngưỡng thì trả mã lỗi")
+    return parser.parse_args(argv)
+
+def main(argv: Optional[List[str]] = None):
+    """Điểm vào của `python -m agent_template.bench`."""
+    args = parse_args(argv)
+    if args.startup:
+        report = run_startup(args)
+        if args.json:
+            print(json.dumps(report, ensure_ascii=False, indent=2))
+        else:
+            print_startup_report(report)
+        if report["regressions"]:
+            sys.exit(1)
+        return
+
+    report = asyncio.run(_run(args))
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+    else:
+        print_report(report)
+
+if __name__ == "__main__":
+    main()
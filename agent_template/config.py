@@ -5,11 +5,69 @@ Module này định nghĩa cấu hình toàn cục cho ứng dụng.
 """
 
 import os
+from typing import Any, Dict, List, Literal, Optional
+
 from dotenv import load_dotenv
+from pydantic import BaseModel, ConfigDict, Field
 
 # Tải biến môi trường từ file .env
 load_dotenv()
 
+def parse_tier_values(value: str) -> Dict[str, float]:
+    """Phân tích chuỗi dạng "light:1,default:3,advanced:10" thành dict theo hạng model."""
+    result = {}
+    for item in value.split(","):
+        if ":" in item:
+            tier, number = item.split(":", 1)
+            result[tier.strip()] = float(number)
+    return result
+
+def parse_fallback_chains(value: str) -> Dict[str, List[str]]:
+    """Phân tích chuỗi dạng "advanced>default>light,default>light" thành dict hạng model -> hạng dự phòng."""
+    result = {}
+    for item in value.split(","):
+        tiers = [tier.strip() for tier in item.split(">") if tier.strip()]
+        if tiers:
+            result[tiers[0]] = tiers[1:]
+    return result
+
+class RequestConfig(BaseModel):
+    """Ảnh chụp cấu hình bất biến áp dụng cho một request.
+    
+    Được tạo từ mặc định của service, mặc định đã lưu của luồng và các giá trị
+    ghi đè của request. Vì không thể sửa đổi, các request đồng thời đọc ảnh
+    chụp mà không cần khóa; thay đổi cấu hình luôn tạo ảnh chụp mới.
+    """
+    model_config = ConfigDict(frozen=True)
+    
+    use_legacy: bool = False
+    # None để tự chọn hạng model theo nội dung tin nhắn
+    model_type: Optional[Literal["default", "advanced", "light"]] = None
+    # None để dùng giá trị mặc định của hạng model
+    temperature: Optional[float] = Field(None, ge=0, le=2)
+    max_tokens: Optional[int] = Field(None, gt=0)
+    
+    def merge(self, overrides: Optional[Dict[str, Any]]) -> "RequestConfig":
+        """Tạo ảnh chụp mới với các giá trị ghi đè.
+        
+        Args:
+            overrides: Dict các trường cần ghi đè; trường có giá trị None hoặc
+                không thuộc RequestConfig được bỏ qua
+                
+        Returns:
+            Ảnh chụp mới (hoặc chính ảnh chụp này nếu không có gì thay đổi)
+            
+        Raises:
+            ValueError: Nếu giá trị ghi đè không hợp lệ
+        """
+        updates = {
+            key: value for key, value in (overrides or {}).items()
+            if value is not None and key in self.model_fields
+        }
+        if not updates:
+            return self
+        return RequestConfig(**{**self.model_dump(), **updates})
+
 class AppConfig:
     """Lớp cấu hình ứng dụng.
     
@@ -22,6 +80,7 @@ class AppConfig:
         thread_id: str = None,
         api_host: str = None,
         api_port: int = None,
+        api_workers: int = None,
         model_name: str = None,
         temperature: float = None,
         max_tokens: int = None,
@@ -35,6 +94,7 @@ class AppConfig:
             thread_id: ID của luồng hội thoại để sử dụng
             api_host: Host cho API server
             api_port: Cổng cho API server
+            api_workers: Số tiến trình worker của API server
             model_name: Tên model để sử dụng
             temperature: Nhiệt độ cho việc tạo văn bản
             max_tokens: Số token tối đa cho mỗi phản hồi
@@ -50,6 +110,8 @@ class AppConfig:
         # Cấu hình API server
         self.api_host = api_host or os.environ.get("API_HOST", "0.0.0.0")
         self.api_port = api_port or int(os.environ.get("API_PORT", "8000"))
+        self.api_workers = api_workers or int(os.environ.get("API_WORKERS", "1"))
+        self.api_graceful_timeout = int(os.environ.get("API_GRACEFUL_TIMEOUT", "30"))
         
         # Cấu hình model
         self.model_name = model_name or os.environ.get("MODEL_NAME", "openai:gpt-4o-mini")
@@ -72,8 +134,136 @@ class AppConfig:
         # Thư mục lưu trữ bộ nhớ
         self.memory_dir = os.environ.get("MEMORY_DIR", "conversation_memory")
         
-        # Timeout cho tool
+        # Backend lưu trữ hội thoại ("file", "segment_log" hoặc "sqlite")
+        self.memory_backend = os.environ.get("MEMORY_BACKEND", "file")
+        self.memory_db_path = os.environ.get("MEMORY_DB_PATH")
+        self.memory_segment_max_bytes = int(os.environ.get("MEMORY_SEGMENT_MAX_BYTES", str(1024 * 1024)))
+        self.memory_compact_segments = int(os.environ.get("MEMORY_COMPACT_SEGMENTS", "4"))
+        # Gộp các lần ghi bộ nhớ trong khoảng thời gian này (giây). Mặc định 0: lượt
+        # đã ở trên đĩa khi request trả về; > 0 đổi độ bền lấy ít lần ghi hơn
+        self.memory_flush_interval = float(os.environ.get("MEMORY_FLUSH_INTERVAL", "0"))
+        
+        # Cache phản hồi của agent (tắt mặc định)
+        self.response_cache_enabled = os.environ.get("RESPONSE_CACHE", "false").lower() in ("1", "true", "yes")
+        self.response_cache_ttl = float(os.environ.get("RESPONSE_CACHE_TTL", "300"))
+        self.response_cache_max_entries = int(os.environ.get("RESPONSE_CACHE_MAX_ENTRIES", "1024"))
+        self.response_cache_max_bytes = int(os.environ.get("RESPONSE_CACHE_MAX_BYTES", str(16 * 1024 * 1024)))
+        self.response_cache_dir = os.environ.get("RESPONSE_CACHE_DIR") or None
+        
+        # Xử lý tin nhắn theo lô (/send_messages)
+        self.bulk_max_concurrency = int(os.environ.get("BULK_MAX_CONCURRENCY", "8"))
+        self.bulk_max_items = int(os.environ.get("BULK_MAX_ITEMS", "100"))
+        
+        # Bộ định tuyến hạng model ("classifier" hoặc "keyword")
+        self.router = os.environ.get("ROUTER", "classifier")
+        # Chi phí tương đối của mỗi hạng và trọng số chi phí khi chọn hạng
+        self.router_tier_costs = parse_tier_values(os.environ.get("ROUTER_TIER_COSTS", "light:1,default:3,advanced:10"))
+        self.router_cost_weight = float(os.environ.get("ROUTER_COST_WEIGHT", "0.02"))
+        # Xác suất tối thiểu để tin bộ phân loại; thấp hơn thì chọn hạng "default"
+        self.router_min_confidence = float(os.environ.get("ROUTER_MIN_CONFIDENCE", "0.5"))
+        # Mục tiêu độ trễ p95 (ms) và tỷ lệ lỗi tối đa; hạng vượt mục tiêu bị tránh
+        self.router_latency_targets = parse_tier_values(
+            os.environ.get("ROUTER_LATENCY_TARGETS_MS", "light:3000,default:8000,advanced:20000")
+        )
+        self.router_max_error_rate = float(os.environ.get("ROUTER_MAX_ERROR_RATE", "0.2"))
+        self.router_min_samples = int(os.environ.get("ROUTER_MIN_SAMPLES", "20"))
+        self.router_stats_window = int(os.environ.get("ROUTER_STATS_WINDOW", "200"))
+        # Dữ liệu huấn luyện bổ sung (JSONL {"text", "tier"}) và file log quyết định
+        self.router_training_path = os.environ.get("ROUTER_TRAINING_PATH") or None
+        self.router_log_path = os.environ.get("ROUTER_LOG_PATH") or None
+        
+        # Giới hạn lệnh gọi model đồng thời và hàng đợi theo hạng model; request vượt hàng đợi nhận 429
+        self.admission_max_concurrent = parse_tier_values(
+            os.environ.get("ADMISSION_MAX_CONCURRENT", "light:32,default:16,advanced:4")
+        )
+        self.admission_max_queue = parse_tier_values(
+            os.environ.get("ADMISSION_MAX_QUEUE", "light:64,default:32,advanced:8")
+        )
+        self.admission_queue_timeout = float(os.environ.get("ADMISSION_QUEUE_TIMEOUT", "30"))
+        
+        # Giới hạn tốc độ theo client (token bucket): BURST request tối đa, nạp lại RATE request/giây
+        self.rate_limit_enabled = os.environ.get("RATE_LIMIT", "false").lower() == "true"
+        # Thứ tự xác định client: api_key, thread, ip (dùng cách đầu tiên có giá trị)
+        self.rate_limit_key = [
+            source.strip() for source in os.environ.get("RATE_LIMIT_KEY", "api_key,ip").split(",") if source.strip()
+        ]
+        self.rate_limit_message_rate = float(os.environ.get("RATE_LIMIT_MESSAGE_RATE", "1"))
+        self.rate_limit_message_burst = float(os.environ.get("RATE_LIMIT_MESSAGE_BURST", "60"))
+        self.rate_limit_read_rate = float(os.environ.get("RATE_LIMIT_READ_RATE", "20"))
+        self.rate_limit_read_burst = float(os.environ.get("RATE_LIMIT_READ_BURST", "200"))
+        # Nơi lưu bucket: "memory" (mỗi worker một ngân sách) hoặc "sqlite" (dùng chung giữa các worker)
+        self.rate_limit_store = os.environ.get("RATE_LIMIT_STORE", "memory")
+        self.rate_limit_db_path = os.environ.get("RATE_LIMIT_DB_PATH") or None
+        # Lấy IP client từ X-Forwarded-For (chỉ bật khi đứng sau proxy tin cậy)
+        self.rate_limit_trust_proxy = os.environ.get("RATE_LIMIT_TRUST_PROXY", "false").lower() == "true"
+        
+        # Chuỗi model dự phòng theo hạng: hạng đầu được chọn, các hạng sau được thử khi lỗi hoặc quá thời gian
+        self.model_fallback = parse_fallback_chains(
+            os.environ.get("MODEL_FALLBACK", "advanced>default>light,default>light")
+        )
+        # Thời gian tối đa (giây) của một lần gọi model theo hạng (0 là không giới hạn)
+        self.model_timeouts = parse_tier_values(
+            os.environ.get("MODEL_TIMEOUTS", "light:30,default:60,advanced:120")
+        )
+        # Khoảng chờ lũy thừa có jitter giữa hai lần thử (giây)
+        self.fallback_backoff_base = float(os.environ.get("FALLBACK_BACKOFF_BASE", "0.5"))
+        self.fallback_backoff_max = float(os.environ.get("FALLBACK_BACKOFF_MAX", "5"))
+        
+        # Gộp request theo nội dung khi không có Idempotency-Key (request có khóa luôn được gộp)
+        self.coalesce_enabled = os.environ.get("COALESCE", "false").lower() == "true"
+        # Số giây giữ kết quả cho lần thử lại đến muộn
+        self.coalesce_window = float(os.environ.get("COALESCE_WINDOW", "10"))
+        self.coalesce_max_entries = int(os.environ.get("COALESCE_MAX_ENTRIES", "1024"))
+        
+        # Timeout cho tool: mỗi lần gọi và tổng thời gian công cụ trong một lượt
         self.tool_timeout = int(os.environ.get("TOOL_TIMEOUT", "10"))
+        self.tool_turn_timeout = float(os.environ.get("TOOL_TURN_TIMEOUT", str(self.tool_timeout * 3)))
+        # Số luồng chạy công cụ đồng bộ
+        self.tool_workers = int(os.environ.get("TOOL_WORKERS", "8"))
+        
+        # Span logfire cho từng bước của lượt hội thoại (chỉ khi có token)
+        self.logfire_token = os.environ.get("LOGFIRE_TOKEN") or None
+        
+        # Profiling theo request (X-Profile / ?profile=) và thư mục chứa file cProfile
+        self.profiling_enabled = os.environ.get("PROFILING", "false").lower() in ("1", "true", "yes")
+        self.profile_dir = os.environ.get("PROFILE_DIR", "profiles")
+        
+        # Registry agent: số agent tối đa được cache và các hạng được tạo trước khi API sẵn sàng
+        self.agent_registry_size = int(os.environ.get("AGENT_REGISTRY_SIZE", "16"))
+        self.agent_warmup = [
+            tier.strip() for tier in os.environ.get("AGENT_WARMUP", "default,advanced,light").split(",")
+            if tier.strip()
+        ]
+        
+        # Cấu hình pool kết nối HTTP dùng chung cho Deps
+        self.http_max_connections = int(os.environ.get("HTTP_MAX_CONNECTIONS", "100"))
+        self.http_max_keepalive_connections = int(os.environ.get("HTTP_MAX_KEEPALIVE_CONNECTIONS", "20"))
+        self.http_keepalive_expiry = float(os.environ.get("HTTP_KEEPALIVE_EXPIRY", "30"))
+        self.http_timeout = float(os.environ.get("HTTP_TIMEOUT", "30"))
+        self.http2 = os.environ.get("HTTP2", "true").lower() in ("1", "true", "yes")
+        
+        # Cửa sổ lịch sử hội thoại và tóm tắt nền
+        self.history_max_turns = int(os.environ.get("HISTORY_MAX_TURNS", "10"))
+        self.history_token_budget = int(os.environ.get("HISTORY_TOKEN_BUDGET", "2000"))
+        self.history_summary_enabled = os.environ.get("HISTORY_SUMMARY", "true").lower() in ("1", "true", "yes")
+        self.history_summary_max_tokens = int(os.environ.get("HISTORY_SUMMARY_MAX_TOKENS", "300"))
+        
+        # Nhiều worker dùng chung trạng thái qua SQLite: backend file và bản ghi
+        # chờ trong bộ nhớ của từng tiến trình không an toàn giữa các tiến trình.
+        # Chọn SQLite khi người dùng chưa đặt; lựa chọn không an toàn bị từ chối
+        if self.api_workers > 1:
+            if not os.environ.get("MEMORY_BACKEND"):
+                self.memory_backend = "sqlite"
+            elif self.memory_backend != "sqlite":
+                raise ValueError(
+                    f"MEMORY_BACKEND={self.memory_backend} không an toàn khi chạy {self.api_workers} worker; "
+                    "dùng MEMORY_BACKEND=sqlite hoặc bỏ trống"
+                )
+            if self.memory_flush_interval > 0:
+                raise ValueError(
+                    f"MEMORY_FLUSH_INTERVAL={self.memory_flush_interval:g} không an toàn khi chạy "
+                    f"{self.api_workers} worker; đặt 0 hoặc bỏ trống"
+                )
     
     def update(self, updates: dict):
         """Cập nhật cấu hình với một tập các thay đổi.
@@ -85,6 +275,19 @@ class AppConfig:
             if hasattr(self, key):
                 setattr(self, key, value)
     
+    def snapshot(self) -> RequestConfig:
+        """Tạo ảnh chụp cấu hình request mặc định từ cấu hình ứng dụng.
+        
+        Returns:
+            RequestConfig dùng làm mặc định của service
+        """
+        model_type = None
+        if self.use_advanced_model:
+            model_type = "advanced"
+        elif self.use_light_model:
+            model_type = "light"
+        return RequestConfig(use_legacy=self.use_legacy, model_type=model_type)
+    
     def get_model_settings(self) -> dict:
         """Lấy cài đặt model dựa trên cấu hình hiện tại.
         
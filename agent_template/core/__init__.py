@@ -1,11 +1,21 @@
 """
 Gói core chứa các service và module cốt lõi của Agent Template.
+
+Các tên bên dưới được nạp khi truy cập lần đầu, nên import gói core không kéo
+theo FastAPI, uvicorn hay giao diện CLI nếu không dùng tới.
 """
 
-from agent_template.core.agent import Agent, process_input
-from agent_template.core.agent_service import AgentService
-from agent_template.core.cli_service import CLIService
-from agent_template.core.api_service import APIService
+import importlib
+from typing import Any
+
+# Tên được export -> module chứa tên đó
+_EXPORTS = {
+    'Agent': 'agent_template.core.agent',
+    'process_input': 'agent_template.core.agent',
+    'AgentService': 'agent_template.core.agent_service',
+    'CLIService': 'agent_template.core.cli_service',
+    'APIService': 'agent_template.core.api_service',
+}
 
 __all__ = [
     'Agent',
@@ -13,4 +23,12 @@ __all__ = [
     'AgentService',
     'CLIService',
     'APIService',
-] 
\ No newline at end of file
+]
+
+def __getattr__(name: str) -> Any:
+    """Nạp một tên được export khi truy cập lần đầu."""
+    if name in _EXPORTS:
+        value = getattr(importlib.import_module(_EXPORTS[name]), name)
+        globals()[name] = value
+        return value
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -4,26 +4,40 @@ Triển khai core agent sử dụng pydantic-ai.
 Module này định nghĩa chức năng cốt lõi của agent, các công cụ và runtime.
 """
 
+import asyncio
 import os
-from typing import Union, Dict, Any, Optional
+import threading
+import time
+from collections import OrderedDict
+from typing import Union, Dict, Any, Callable, List, Optional, Tuple, AsyncIterator
 from datetime import datetime
 
-import logfire
 from pydantic_ai import Agent, RunContext
+from pydantic_ai.messages import ModelMessage
 from pydantic_ai.settings import ModelSettings
 from dotenv import load_dotenv
-from httpx import AsyncClient
 
 from agent_template.tools.logo import LogoResult, get_logo, display_logo
 from agent_template.utils.prompts import get_simple_assistant_prompt, get_technical_assistant_prompt
-from agent_template.memory.persistence import (
-    Deps, Memory, Message, save_memory, load_memory
+from agent_template.memory.persistence import Deps, Memory, Message
+from agent_template.memory.storage import run_store_call, save_memory_async
+from agent_template.memory.context import (
+    build_message_history, save_turn_messages, schedule_summary_update, with_system_prompt
 )
-from agent_template.config import AppConfig
+from agent_template.config import AppConfig, RequestConfig
+from agent_template.utils.admission import get_admission_controller
+from agent_template.utils.fallback import FallbackAttempt, get_model_fallback
+from agent_template.utils.http_client import get_http_pool
+from agent_template.utils.response_cache import get_response_cache, make_cache_key
+from agent_template.utils.tool_cache import cached_tool
+from agent_template.utils.tool_runner import get_tool_runner, guarded_tool
+from agent_template.utils.local_model import LocalModel, is_local_model
+from agent_template.utils.metrics import configure_logfire, get_metrics, stage
+from agent_template.utils.usage_stats import get_usage_stats
+from agent_template.core.router import RouteDecision, get_router
 
 # Tải biến môi trường
 load_dotenv()
-logfire.configure(send_to_logfire='if-token-present')
 
 # ===== HƯỚNG DẪN: CẤU HÌNH MODEL =====
 # Cấu hình model mặc định
@@ -31,9 +45,29 @@ MODEL_NAME = os.environ.get('MODEL_NAME', 'openai:gpt-4o-mini')
 ADVANCE_NAME = os.environ.get('ADVANCE_NAME', 'openai:gpt-4o')
 LIGHT_MODEL = os.environ.get('LIGHT_MODEL', 'openai:gpt-4o-mini')
 
+def resolve_model(name: str):
+    """Chuyển tên model thành đối tượng model cho Agent.
+    
+    "local" hoặc "local:<tên>" dùng model cục bộ (offline, xác định) để phát
+    triển và benchmark; các tên khác được pydantic-ai tự phân giải.
+    """
+    if is_local_model(name):
+        return LocalModel.from_env(name)
+    return name
+
 # Centralize model settings
-def get_model_settings(model_type="default") -> ModelSettings:
-    """Tạo model settings dựa trên loại model và biến môi trường."""
+def get_model_settings(model_type="default", settings: Optional[RequestConfig] = None) -> ModelSettings:
+    """Tạo model settings dựa trên loại model, biến môi trường và giá trị ghi đè của request."""
+    model_settings = _get_tier_settings(model_type)
+    if settings is not None:
+        if settings.temperature is not None:
+            model_settings["temperature"] = settings.temperature
+        if settings.max_tokens is not None:
+            model_settings["max_tokens"] = settings.max_tokens
+    return model_settings
+
+def _get_tier_settings(model_type: str) -> ModelSettings:
+    """Model settings mặc định của một hạng model."""
     if model_type == "advanced":
         return ModelSettings(
             temperature=float(os.environ.get('ADVANCED_TEMPERATURE', '0.6')),
@@ -50,6 +84,14 @@ def get_model_settings(model_type="default") -> ModelSettings:
             max_tokens=int(os.environ.get('MAX_TOKENS', '1000')),
         )
 
+def get_model_name(model_type="default") -> str:
+    """Lấy tên model tương ứng với loại model."""
+    if model_type == "advanced":
+        return ADVANCE_NAME
+    elif model_type == "light":
+        return LIGHT_MODEL
+    return MODEL_NAME
+
 # Centralize system prompts
 def get_system_prompt(prompt_type="default") -> str:
     """Lấy system prompt dựa trên loại và biến môi trường."""
@@ -66,55 +108,234 @@ def get_system_prompt(prompt_type="default") -> str:
     else:  # default
         return get_simple_assistant_prompt()
 
+# System prompt của từng hạng được tính một lần: giữ nguyên từng byte giữa các
+# lượt để provider cache được phần đầu prompt (xem memory/context.py)
+SYSTEM_PROMPTS = {
+    "default": get_system_prompt("default"),
+    "advanced": get_system_prompt("advanced"),
+    "light": get_system_prompt("light")
+}
+
 # ===== ĐỊNH NGHĨA CÁC AGENT =====
-# Agent chính - sử dụng cấu hình từ biến môi trường
-agent = Agent[
-    Deps,  # Kiểu dependency 
-    Union[str, LogoResult]  # Kiểu kết quả
-](
-    MODEL_NAME,
-    system_prompt=get_system_prompt("default"),
-    model_settings=get_model_settings("default"),
-    retries=int(os.environ.get('RETRIES', '2')),
-)
+# Các agent được tạo khi dùng lần đầu qua AgentRegistry: import module không phải
+# phân giải model, khởi tạo client của provider hay cấu hình logfire
+# Hạng model -> (biến môi trường số lần thử lại, giá trị mặc định):
+# agent chính, agent nâng cao cho nhiệm vụ phức tạp, agent nhỏ gọn cho nhiệm vụ đơn giản
+AGENT_SPECS = {
+    "default": ('RETRIES', '2'),
+    "advanced": ('ADVANCED_RETRIES', '2'),
+    "light": ('LIGHT_RETRIES', '1')
+}
 
-# Định nghĩa agent nâng cao cho nhiệm vụ phức tạp
-advanced_agent = Agent[
-    Deps,  
-    Union[str, LogoResult]
-](
-    ADVANCE_NAME,
-    system_prompt=get_system_prompt("advanced"),
-    model_settings=get_model_settings("advanced"),
-    retries=int(os.environ.get('ADVANCED_RETRIES', '2')),
-)
+# Tên module-level cũ của từng agent, vẫn dùng được qua __getattr__
+AGENT_ATTRIBUTES = {"agent": "default", "advanced_agent": "advanced", "light_agent": "light"}
 
-# Định nghĩa agent nhỏ gọn cho nhiệm vụ đơn giản
-light_agent = Agent[
-    Deps,
-    Union[str, LogoResult]
-](
-    LIGHT_MODEL,
-    system_prompt=get_system_prompt("light"),
-    model_settings=get_model_settings("light"),
-    retries=int(os.environ.get('LIGHT_RETRIES', '1')),
-)
+# Bộ công cụ dùng chung của mọi agent: (hàm, các hạng model dùng công cụ)
+_tools: List[Tuple[Callable[..., Any], Tuple[str, ...]]] = []
+
+# Khóa của một agent: (tên model, loại system prompt, model settings)
+AgentKey = Tuple[str, str, Tuple[Tuple[str, Any], ...]]
+
+class AgentRegistry:
+    """Tạo và cache agent theo (model, loại prompt, model settings).
+
+    Agent được tạo khi dùng lần đầu và dùng lại cho các request cùng khóa; các
+    agent ít dùng nhất bị loại khi vượt giới hạn. Mọi agent dùng chung bộ công
+    cụ đăng ký qua `register_tool`.
+    """
+
+    def __init__(self, max_agents: int = 16):
+        """Khởi tạo registry.
+
+        Args:
+            max_agents: Số agent tối đa giữ trong cache
+        """
+        self.max_agents = max_agents
+        self._agents: "OrderedDict[AgentKey, Tuple[str, Agent]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.builds = 0
+        self.hits = 0
+        self.evictions = 0
+
+    def get(
+        self,
+        model_type: str = "default",
+        settings: Optional[RequestConfig] = None,
+        prompt_type: Optional[str] = None
+    ) -> Agent:
+        """Lấy agent cho một hạng model, tạo khi dùng lần đầu.
+
+        Args:
+            model_type: Hạng model ("default", "advanced" hoặc "light"); hạng
+                không hợp lệ dùng "default"
+            settings: Ảnh chụp cấu hình của request (temperature, max_tokens)
+            prompt_type: Loại system prompt (mặc định theo hạng model)
+
+        Returns:
+            Agent đã gắn các công cụ của hạng model
+        """
+        if model_type not in AGENT_SPECS:
+            model_type = "default"
+        prompt_type = prompt_type or model_type
+        model_settings = get_model_settings(model_type, settings)
+        key = (get_model_name(model_type), prompt_type, tuple(sorted(model_settings.items())))
+
+        with self._lock:
+            entry = self._agents.get(key)
+            if entry is not None:
+                self._agents.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+
+            configure_logfire()
+            new_agent = self._build(model_type, prompt_type, model_settings)
+            self._agents[key] = (model_type, new_agent)
+            self.builds += 1
+            while len(self._agents) > self.max_agents:
+                self._agents.popitem(last=False)
+                self.evictions += 1
+            return new_agent
+
+    def _build(self, model_type: str, prompt_type: str, model_settings: ModelSettings) -> Agent:
+        """Tạo agent và gắn các công cụ đã đăng ký cho hạng model."""
+        retries_env, retries_default = AGENT_SPECS[model_type]
+        new_agent = Agent[
+            Deps,  # Kiểu dependency
+            Union[str, LogoResult]  # Kiểu kết quả
+        ](
+            resolve_model(get_model_name(model_type)),
+            system_prompt=SYSTEM_PROMPTS.get(prompt_type) or get_system_prompt(prompt_type),
+            model_settings=model_settings,
+            retries=int(os.environ.get(retries_env, retries_default)),
+        )
+        for func, model_types in _tools:
+            if model_type in model_types:
+                new_agent.tool(func)
+        return new_agent
+
+    def attach_tool(self, func: Callable[..., Any], model_types: Tuple[str, ...]):
+        """Gắn một công cụ mới đăng ký vào các agent đã tạo của các hạng model."""
+        with self._lock:
+            for model_type, existing in self._agents.values():
+                if model_type in model_types:
+                    existing.tool(func)
+
+    def warmup(self, model_types: Optional[List[str]] = None) -> Dict[str, float]:
+        """Tạo trước agent với cấu hình mặc định của các hạng model.
+
+        Args:
+            model_types: Các hạng cần tạo (mặc định tất cả)
+
+        Returns:
+            Dict hạng model -> thời gian tạo (ms)
+        """
+        timings = {}
+        for model_type in model_types or list(AGENT_SPECS):
+            start = time.perf_counter()
+            self.get(model_type)
+            timings[model_type] = round((time.perf_counter() - start) * 1000, 2)
+        return timings
+
+    def clear(self):
+        """Xóa các agent đã tạo; lần dùng sau sẽ tạo lại."""
+        with self._lock:
+            self._agents.clear()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Lấy thống kê của registry.
+
+        Returns:
+            Dict gồm số agent đang giữ, số lần tạo, trúng, loại bỏ và các khóa
+        """
+        return {
+            "agents": len(self._agents),
+            "max_agents": self.max_agents,
+            "builds": self.builds,
+            "hits": self.hits,
+            "evictions": self.evictions,
+            "keys": [
+                {"model": key[0], "prompt_type": key[1], "settings": dict(key[2])}
+                for key in self._agents
+            ]
+        }
+
+# Registry mặc định của tiến trình
+_default_registry: Optional[AgentRegistry] = None
+
+def get_agent_registry(config: Optional[AppConfig] = None) -> AgentRegistry:
+    """Lấy registry agent dùng chung của tiến trình.
+
+    Args:
+        config: Cấu hình dùng khi registry được tạo lần đầu (tùy chọn)
+
+    Returns:
+        Registry agent dùng chung
+    """
+    global _default_registry
+    if _default_registry is None:
+        _default_registry = AgentRegistry((config or AppConfig()).agent_registry_size)
+    return _default_registry
+
+def __getattr__(name: str) -> Agent:
+    """Truy cập `agent`, `advanced_agent`, `light_agent` như thuộc tính module (tạo khi cần)."""
+    if name in AGENT_ATTRIBUTES:
+        return get_agent(AGENT_ATTRIBUTES[name])
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+def get_response_cache_key(model_type: str, prompt: str, settings: Optional[RequestConfig] = None) -> str:
+    """Tạo khóa cache phản hồi cho một tin nhắn gửi tới agent thuộc loại model đã cho.
+    
+    Khóa gồm model, ModelSettings, system prompt và tin nhắn đã chuẩn hóa, không
+    gồm lịch sử, nên các luồng khác nhau dùng chung được phản hồi; chỉ dùng cho
+    lượt không phụ thuộc lịch sử (xem is_cacheable_turn).
+    """
+    return make_cache_key(
+        get_model_name(model_type),
+        get_model_settings(model_type, settings),
+        SYSTEM_PROMPTS.get(model_type, SYSTEM_PROMPTS["default"]),
+        prompt
+    )
+
+def is_cacheable_turn(memory: Memory) -> bool:
+    """Phản hồi của lượt có được dùng cache không: chỉ khi luồng chưa có lượt nào,
+    tức model không nhận cửa sổ lịch sử, bản tóm tắt hay lệnh gọi công cụ cũ."""
+    return not memory.messages
+
+def get_agent(model_type: str = "default", settings: Optional[RequestConfig] = None) -> Agent:
+    """Trả về agent của một hạng model ("default", "advanced" hoặc "light") từ registry."""
+    return get_agent_registry().get(model_type, settings)
 
 # Lấy agent phù hợp dựa trên cấu hình
 def get_agent_for_config(config: AppConfig) -> Agent:
     """Trả về agent phù hợp dựa trên cấu hình."""
     if config.use_advanced_model:
-        return advanced_agent
+        return get_agent("advanced")
     elif config.use_light_model:
-        return light_agent
+        return get_agent("light")
     else:
-        return agent
+        return get_agent("default")
 
 # ===== ĐĂNG KÝ CÔNG CỤ =====
+def register_tool(*model_types: str) -> Callable[[Callable[..., Any]], Callable[..., Any]]:
+    """Decorator đăng ký một công cụ cho các hạng model (mặc định tất cả).
+
+    Công cụ được gắn vào agent khi agent được tạo, hoặc ngay lập tức vào các
+    agent đã có trong registry.
+    """
+    model_types = model_types or tuple(AGENT_SPECS)
+
+    def decorator(func: Callable[..., Any]) -> Callable[..., Any]:
+        _tools.append((func, model_types))
+        if _default_registry is not None:
+            _default_registry.attach_tool(func, model_types)
+        return func
+
+    return decorator
+
+# Mọi công cụ chạy qua guarded_tool để bị giới hạn bởi TOOL_TIMEOUT/TOOL_TURN_TIMEOUT
 # Công cụ cho tất cả các agent
-@agent.tool
-@advanced_agent.tool
-@light_agent.tool
+@register_tool()
+@guarded_tool
 async def logo(
     ctx: RunContext[Deps],
     style: str = "default",
@@ -144,7 +365,10 @@ async def logo(
     )
 
 # Công cụ chỉ dành cho advanced_agent
-@advanced_agent.tool
+# Kết quả chỉ phụ thuộc tham số nên được cache (xem utils/tool_cache.py)
+@register_tool("advanced")
+@guarded_tool
+@cached_tool(ttl=300)
 async def complex_analysis(
     ctx: RunContext[Deps],
     data: str,
@@ -165,11 +389,8 @@ async def complex_analysis(
 
 # Helper function để đăng ký tool cho tất cả agent
 def register_for_all_agents(func):
-    """Đăng ký một tool cho tất cả các agent."""
-    agent.tool(func)
-    advanced_agent.tool(func)
-    light_agent.tool(func)
-    return func
+    """Đăng ký một tool cho tất cả các agent (chạy qua guarded_tool)."""
+    return register_tool()(guarded_tool(func))
 
 # Ví dụ về đăng ký tool cho tất cả agent
 @register_for_all_agents
@@ -178,11 +399,128 @@ async def get_current_time(ctx: RunContext[Deps]) -> str:
     return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
 
 # ===== XỬ LÝ ĐẦU VÀO =====
+def _history_for_tier(history: List[ModelMessage], model_type: str, tier: str) -> List[ModelMessage]:
+    """Lịch sử gửi cho hạng `tier`: hạng dự phòng dùng system prompt của chính nó."""
+    if tier == model_type:
+        return history
+    return with_system_prompt(history, SYSTEM_PROMPTS.get(tier) or get_system_prompt(tier))
+
+async def run_agent(
+    user_input: str,
+    model_type: str,
+    decision: Optional[RouteDecision],
+    history: List[ModelMessage],
+    deps: Deps,
+    settings: Optional[RequestConfig] = None,
+    config: Optional[AppConfig] = None
+) -> Tuple[Any, str]:
+    """Gọi agent của hạng model theo chuỗi dự phòng (MODEL_FALLBACK).
+    
+    Mỗi lần thử chờ chỗ trong giới hạn của hạng đó (ADMISSION_MAX_CONCURRENT),
+    bị giới hạn thời gian theo MODEL_TIMEOUTS kể từ khi có chỗ chạy và được ghi
+    nhận độ trễ/lỗi cho bộ định tuyến. Lần thử đã chạy công cụ không được
+    chuyển sang hạng khác.
+    
+    Args:
+        user_input: Tin nhắn của người dùng
+        model_type: Hạng model được chọn
+        decision: Quyết định định tuyến (None nếu hạng được chọn thủ công)
+        history: Lịch sử model message gửi kèm (với system prompt của `model_type`)
+        deps: Dependencies của lần chạy
+        settings: Ảnh chụp cấu hình của request (tùy chọn)
+        config: Cấu hình ứng dụng (tùy chọn)
+        
+    Returns:
+        Tuple gồm (kết quả của agent, hạng model đã phục vụ)
+    """
+    async def attempt(run: FallbackAttempt):
+        tier = run.tier
+        active_agent = get_agent(tier, settings)
+        async with get_admission_controller(config).slot(tier):
+            run.start()
+            with stage("agent_run"), get_router(config).observe(tier, decision), get_tool_runner(config).scope() as scope:
+                try:
+                    return await active_agent.run(
+                        user_input,
+                        message_history=_history_for_tier(history, model_type, tier),
+                        deps=deps,
+                        model_settings=get_model_settings(tier, settings)
+                    )
+                finally:
+                    if scope.calls:
+                        run.commit()
+    
+    return await get_model_fallback(config).run(model_type, attempt)
+
+class AgentStream:
+    """Stream phản hồi của agent theo chuỗi dự phòng (MODEL_FALLBACK).
+    
+    Thời gian chờ của mỗi lần thử tính tới đoạn phản hồi đầu tiên. Sau khi
+    stream xong, `result` là kết quả của agent và `tier` là hạng đã phục vụ.
+    
+    Dùng: `async for delta in stream: ...`, và `await stream.aclose()` nếu
+    dừng giữa chừng.
+    """
+    
+    def __init__(
+        self,
+        user_input: str,
+        model_type: str,
+        decision: Optional[RouteDecision],
+        history: List[ModelMessage],
+        deps: Deps,
+        settings: Optional[RequestConfig] = None,
+        config: Optional[AppConfig] = None
+    ):
+        """Khởi tạo stream; tham số như run_agent()."""
+        self.user_input = user_input
+        self.model_type = model_type
+        self.decision = decision
+        self.history = history
+        self.deps = deps
+        self.settings = settings
+        self.config = config
+        self.result = None
+        self.tier: Optional[str] = None
+        self._stream = get_model_fallback(config).stream(model_type, self._attempt)
+    
+    def __aiter__(self) -> AsyncIterator[str]:
+        return self._stream
+    
+    async def aclose(self):
+        """Dừng stream và giải phóng chỗ chạy của lần thử đang chạy."""
+        await self._stream.aclose()
+    
+    async def _attempt(self, run: FallbackAttempt) -> AsyncIterator[str]:
+        """Một lần stream với hạng `run.tier`."""
+        tier = run.tier
+        active_agent = get_agent(tier, self.settings)
+        async with get_admission_controller(self.config).slot(tier):
+            run.start()
+            with stage("agent_run"), get_router(self.config).observe(tier, self.decision), get_tool_runner(self.config).scope() as scope:
+                try:
+                    async with active_agent.run_stream(
+                        self.user_input,
+                        message_history=_history_for_tier(self.history, self.model_type, tier),
+                        deps=self.deps,
+                        model_settings=get_model_settings(tier, self.settings)
+                    ) as result:
+                        async for delta in result.stream_text(delta=True):
+                            yield delta
+                finally:
+                    if scope.calls:
+                        run.commit()
+        self.result = result
+        self.tier = tier
+
 async def process_input(
     thread_id: str, 
     user_input: str, 
     memory: Memory,
-    config: Optional[AppConfig] = None
+    config: Optional[AppConfig] = None,
+    deps: Optional[Deps] = None,
+    use_cache: bool = True,
+    settings: Optional[RequestConfig] = None
 ) -> str:
     """
     Xử lý đầu vào người dùng thông qua agent phù hợp.
@@ -192,51 +530,167 @@ async def process_input(
         user_input: Tin nhắn của người dùng
         memory: Đối tượng Memory với lịch sử hội thoại
         config: Cấu hình ứng dụng (tùy chọn)
+        deps: Dependencies dùng chung (tùy chọn, mặc định dùng pool HTTP của tiến trình)
+        use_cache: Dùng cache phản hồi nếu được bật (False để bỏ qua cache)
+        settings: Ảnh chụp cấu hình của request (hạng model, temperature, max_tokens)
         
     Returns:
         Phản hồi của trợ lý
     """
-    # Tạo dependencies
-    deps = Deps(client=AsyncClient())
-    
-    # Xây dựng prompt với lịch sử hội thoại
-    history_str = memory.get_history_str()
-    context_prompt = f"Cuộc trò chuyện trước đó:\n{history_str}\n\nCâu hỏi hiện tại: {user_input}"
+    # Tạo dependencies từ pool HTTP dùng chung nếu không được truyền vào
+    if deps is None:
+        deps = Deps(client=get_http_pool().client)
     
     # Chọn agent phù hợp dựa trên cấu hình và/hoặc nội dung yêu cầu
-    active_agent = agent  # Mặc định
-    model_type = "default"
-    
-    if config:
-        active_agent = get_agent_for_config(config)
-        if config.use_advanced_model:
-            model_type = "advanced"
-        elif config.use_light_model:
-            model_type = "light"
-    elif "phân tích chi tiết" in user_input.lower() or "advanced" in user_input.lower():
-        active_agent = advanced_agent
-        model_type = "advanced"
-    elif len(user_input) < 30 or "quick" in user_input.lower():
-        active_agent = light_agent
-        model_type = "light"
-    
-    # Lấy phản hồi từ agent phù hợp
-    result = await active_agent.run(
-        context_prompt, 
-        deps=deps,
-        model_settings=get_model_settings(model_type)
-    )
+    with stage("route"):
+        _, model_type, decision = select_agent(user_input, config, settings)
     
-    # Xử lý các loại phản hồi khác nhau
-    if isinstance(result.data, LogoResult):
-        # Xác nhận rằng logo đã được hiển thị
-        content = f"Tôi đã hiển thị logo kiểu {result.data.style} cho bạn. Tôi có thể giúp gì thêm không?"
-    else:
-        content = result.data
+    # Lịch sử có cấu trúc: system prompt, bản tóm tắt và cửa sổ lịch sử gần đây
+    with stage("build_history"):
+        history = await run_store_call(build_message_history, thread_id, memory, SYSTEM_PROMPTS[model_type], config)
+    
+    # Thử lấy phản hồi từ cache trước khi gọi model
+    with stage("cache_lookup"):
+        cache = get_response_cache(config) if use_cache and is_cacheable_turn(memory) else None
+        cache_key = get_response_cache_key(model_type, user_input, settings) if cache else None
+        content = cache.get(cache_key) if cache else None
+    get_metrics().annotate(tier=model_type, cache_hit=content is not None)
+    new_messages = None
+    
+    if content is None:
+        # Lấy phản hồi từ agent phù hợp, chuyển sang hạng dự phòng khi lỗi hoặc quá thời gian
+        result, served_type = await run_agent(user_input, model_type, decision, history, deps, settings, config)
+        get_usage_stats().record(served_type, result.usage(), thread_id)
+        new_messages = result.new_messages()
+        
+        # Xử lý các loại phản hồi khác nhau
+        if isinstance(result.data, LogoResult):
+            # Xác nhận rằng logo đã được hiển thị (không cache vì công cụ có tác dụng phụ)
+            content = f"Tôi đã hiển thị logo kiểu {result.data.style} cho bạn. Tôi có thể giúp gì thêm không?"
+        else:
+            content = result.data
+            # Phản hồi của hạng dự phòng không được cache dưới khóa của hạng đã chọn
+            if cache and served_type == model_type:
+                cache.set(cache_key, content)
     
     # Lưu tin nhắn vào bộ nhớ
+    with stage("save_memory"):
+        await save_turn(thread_id, memory, user_input, content, config, new_messages)
+    
+    return content
+
+async def stream_input(
+    thread_id: str,
+    user_input: str,
+    memory: Memory,
+    config: Optional[AppConfig] = None,
+    deps: Optional[Deps] = None,
+    use_cache: bool = True,
+    settings: Optional[RequestConfig] = None
+) -> AsyncIterator[str]:
+    """
+    Xử lý đầu vào người dùng và trả về phản hồi theo từng đoạn (streaming).
+    
+    Lượt hội thoại được lưu khi stream hoàn tất, hoặc với phần phản hồi đã
+    nhận được nếu người dùng hủy giữa chừng.
+    
+    Args:
+        thread_id: Định danh luồng duy nhất
+        user_input: Tin nhắn của người dùng
+        memory: Đối tượng Memory với lịch sử hội thoại
+        config: Cấu hình ứng dụng (tùy chọn)
+        deps: Dependencies dùng chung (tùy chọn)
+        use_cache: Dùng cache phản hồi nếu được bật (False để bỏ qua cache)
+        settings: Ảnh chụp cấu hình của request (hạng model, temperature, max_tokens)
+        
+    Yields:
+        Các đoạn văn bản mới của phản hồi
+    """
+    if deps is None:
+        deps = Deps(client=get_http_pool().client)
+    
+    _, model_type, decision = select_agent(user_input, config, settings)
+    history = await run_store_call(build_message_history, thread_id, memory, SYSTEM_PROMPTS[model_type], config)
+    
+    # Phản hồi đã cache được trả về trong một đoạn duy nhất
+    cache = get_response_cache(config) if use_cache and is_cacheable_turn(memory) else None
+    cache_key = get_response_cache_key(model_type, user_input, settings) if cache else None
+    cached = cache.get(cache_key) if cache else None
+    if cached is not None:
+        await save_turn(thread_id, memory, user_input, cached, config)
+        yield cached
+        return
+    
+    parts = []
+    stream = AgentStream(user_input, model_type, decision, history, deps, settings, config)
+    try:
+        async for delta in stream:
+            parts.append(delta)
+            yield delta
+    except (GeneratorExit, asyncio.CancelledError):
+        # Người dùng hủy stream: lưu phần phản hồi đã nhận được
+        await stream.aclose()
+        await save_turn(thread_id, memory, user_input, "".join(parts), config)
+        raise
+    get_usage_stats().record(stream.tier, stream.result.usage(), thread_id)
+    
+    content = "".join(parts)
+    # Phản hồi của hạng dự phòng không được cache dưới khóa của hạng đã chọn
+    if cache and stream.tier == model_type:
+        cache.set(cache_key, content)
+    await save_turn(thread_id, memory, user_input, content, config, stream.result.new_messages())
+
+def select_agent(
+    user_input: str,
+    config: Optional[AppConfig] = None,
+    settings: Optional[RequestConfig] = None
+) -> Tuple[Agent, str, Optional[RouteDecision]]:
+    """Chọn agent và loại model phù hợp cho một tin nhắn.
+    
+    Hạng model được chọn thủ công (trong ảnh chụp cấu hình hoặc AppConfig)
+    được ưu tiên; nếu không, bộ định tuyến (ROUTER) chọn theo nội dung tin nhắn.
+    
+    Args:
+        user_input: Tin nhắn của người dùng
+        config: Cấu hình ứng dụng (tùy chọn)
+        settings: Ảnh chụp cấu hình của request; hạng model đã chọn được ưu tiên
+        
+    Returns:
+        Tuple gồm (agent, loại model: "default", "advanced" hoặc "light",
+        quyết định định tuyến hoặc None nếu hạng được chọn thủ công)
+    """
+    if settings and settings.model_type:
+        return get_agent(settings.model_type, settings), settings.model_type, None
+    if config and (config.use_advanced_model or config.use_light_model):
+        model_type = "advanced" if config.use_advanced_model else "light"
+        return get_agent(model_type, settings), model_type, None
+    decision = get_router(config).route(user_input)
+    return get_agent(decision.tier, settings), decision.tier, decision
+
+async def save_turn(
+    thread_id: str,
+    memory: Memory,
+    user_input: str,
+    content: str,
+    config: Optional[AppConfig] = None,
+    model_messages: Optional[List[ModelMessage]] = None
+):
+    """Lưu một lượt hội thoại và lên lịch cập nhật bản tóm tắt.
+    
+    Args:
+        thread_id: Định danh luồng
+        memory: Đối tượng Memory của luồng
+        user_input: Tin nhắn của người dùng
+        content: Phản hồi của trợ lý
+        config: Cấu hình ứng dụng (tùy chọn)
+        model_messages: Model message mới của lượt, gồm cả lệnh gọi công cụ
+            (None nếu phản hồi lấy từ cache hoặc stream bị hủy)
+    """
+    if model_messages:
+        await run_store_call(save_turn_messages, thread_id, len(memory.messages), model_messages, config)
     memory.add_message("human", user_input)
     memory.add_message("ai", content)
-    save_memory(thread_id, memory)
+    await save_memory_async(thread_id, memory)
     
-    return content 
\ No newline at end of file
+    # Gộp các lượt cũ vào bản tóm tắt ở chế độ nền
+    schedule_summary_update(thread_id, memory, get_agent("light"), config) 
\ No newline at end of file
@@ -3,19 +3,44 @@ Service xử lý agent.
 
 Module này định nghĩa lớp service chính để tương tác với agent,
 có thể được sử dụng bởi cả CLI và API.
+
+pydantic-ai, các agent và LangGraph được import bên trong các phương thức cần
+chúng, nên tạo service và xử lý lệnh hệ thống (/help, /list...) không phải chờ
+nạp các thư viện đó.
 """
 
+import asyncio
+import logging
 import os
-from typing import Dict, Any, Optional, List, Tuple
+import time
+from contextlib import nullcontext
+from typing import Dict, Any, Optional, List, Tuple, AsyncIterator
 
-from agent_template.config import AppConfig
-from agent_template.core.agent import process_input
-from agent_template.workflows.graph import process_with_graph
+from agent_template.config import AppConfig, RequestConfig
+from agent_template.core.router import get_router
 from agent_template.memory.persistence import (
-    Memory, load_memory, save_memory, create_new_thread,
-    list_conversations, delete_conversation, get_conversation_history,
-    format_conversation_history
+    Deps, Memory, format_conversation_history
+)
+from agent_template.memory.storage import (
+    get_store, load_memory_async, create_new_thread,
+    list_conversations, delete_conversation, get_conversation_history
 )
+from agent_template.memory.model_history import evict_model_turns
+from agent_template.memory.thread_settings import (
+    SERVICE_THREAD_ID, load_thread_settings, save_thread_settings
+)
+from agent_template.utils.admission import AdmissionRejected, get_admission_controller
+from agent_template.utils.coalescing import RequestCoalescer, coalesce_key
+from agent_template.utils.fallback import get_model_fallback
+from agent_template.utils.http_client import get_http_pool
+from agent_template.utils.metrics import get_metrics, stage
+from agent_template.utils.profiling import RequestProfiler
+from agent_template.utils.thread_locks import ThreadLockManager
+from agent_template.utils.response_cache import get_response_cache
+from agent_template.utils.tool_runner import get_tool_runner
+from agent_template.utils.usage_stats import get_usage_stats
+
+logger = logging.getLogger(__name__)
 
 class AgentService:
     """Service chính để quản lý tương tác với agent.
@@ -31,13 +56,251 @@ class AgentService:
             config: Cấu hình ứng dụng
         """
         self.config = config
+        # Ảnh chụp cấu hình mặc định của service; chỉ được thay thế, không sửa tại chỗ
+        # Mặc định khi khởi động; thay đổi qua POST /config nằm trong backend lưu
+        # trữ (dùng chung giữa các worker) và được áp lên trên ảnh chụp này
+        self.startup_defaults = config.snapshot()
+        # (cấu hình đã lưu, ảnh chụp mặc định tương ứng)
+        self._defaults: Tuple[Dict[str, Any], RequestConfig] = ({}, self.startup_defaults)
+        self.http_pool = get_http_pool(config)
+        self.store = get_store(config)
+        # Cache phản hồi (None nếu RESPONSE_CACHE tắt)
+        self.response_cache = get_response_cache(config)
+        # Bộ định tuyến hạng model (ROUTER)
+        self.router = get_router(config)
+        # Bộ thực thi công cụ (TOOL_TIMEOUT, TOOL_TURN_TIMEOUT, TOOL_WORKERS)
+        self.tool_runner = get_tool_runner(config)
+        # Độ trễ theo bước, số lượt và token (GET /metrics)
+        self.metrics = get_metrics(config)
+        # Giới hạn lệnh gọi model đồng thời theo hạng (ADMISSION_MAX_CONCURRENT, ADMISSION_MAX_QUEUE)
+        self.admission = get_admission_controller(config)
+        # Chuỗi model dự phòng theo hạng (MODEL_FALLBACK, MODEL_TIMEOUTS)
+        self.fallback = get_model_fallback(config)
+        # Gộp các request gửi tin nhắn trùng nhau (Idempotency-Key, hoặc theo nội dung khi bật COALESCE)
+        self.coalescer = RequestCoalescer(config.coalesce_window, config.coalesce_max_entries)
+        # cProfile theo request (PROFILING, PROFILE_DIR)
+        self.profiler = RequestProfiler(config.profile_dir)
+        # Giới hạn số tin nhắn theo lô được xử lý đồng thời trên toàn service
+        self.bulk_semaphore = asyncio.Semaphore(config.bulk_max_concurrency)
+        # Tuần tự hóa các lượt trên cùng một luồng hội thoại
+        # Với nhiều worker, khóa file giữ thứ tự giữa các tiến trình
+        lock_dir = os.path.join(config.memory_dir, "locks") if config.api_workers > 1 else None
+        self.thread_locks = ThreadLockManager(lock_dir=lock_dir)
+    
+    async def startup(self, warmup: bool = True):
+        """Mở các tài nguyên dùng chung khi ứng dụng khởi động.
+        
+        Args:
+            warmup: Nạp trước LangGraph và agent mặc định để request đầu tiên
+                không phải chờ (False để khởi động nhanh, nạp khi dùng lần đầu)
+        """
+        await self.http_pool.open()
+        if warmup:
+            await self.warmup()
+    
+    async def warmup(self) -> Dict[str, Any]:
+        """Chuẩn bị trước mọi thứ request đầu tiên cần.
+        
+        Mở pool HTTP, tạo agent của các hạng trong AGENT_WARMUP và biên dịch đồ
+        thị LangGraph. Gọi nhiều lần không tạo lại những gì đã có.
+        
+        Returns:
+            Dict thời gian (ms) của từng bước và thời gian tạo từng agent
+        """
+        timings: Dict[str, Any] = {}
+        
+        start = time.perf_counter()
+        await self.http_pool.open()
+        timings["http_pool"] = round((time.perf_counter() - start) * 1000, 2)
+        
+        start = time.perf_counter()
+        from agent_template.core.agent import get_agent_registry
+        registry = get_agent_registry(self.config)
+        timings["import"] = round((time.perf_counter() - start) * 1000, 2)
+        timings["agents"] = registry.warmup(self.config.agent_warmup)
+        
+        # Luồng hoặc request có thể bật/tắt legacy nên đồ thị luôn được biên dịch
+        start = time.perf_counter()
+        from agent_template.workflows.graph import get_compiled_workflow
+        get_compiled_workflow()
+        timings["graph"] = round((time.perf_counter() - start) * 1000, 2)
+        
+        logger.info(f"Warmup hoàn tất: {timings}")
+        return timings
+    
+    async def shutdown(self):
+        """Giải phóng các tài nguyên dùng chung khi ứng dụng tắt.
+        
+        Mỗi tài nguyên được đóng kể cả khi tài nguyên trước đó đóng lỗi.
+        """
+        try:
+            await self.http_pool.close()
+        finally:
+            try:
+                self.tool_runner.close()
+            finally:
+                self.store.close()
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """Lấy thống kê runtime của các tài nguyên dùng chung.
+        
+        Returns:
+            Dict gồm thống kê pool HTTP, khóa theo luồng, bộ định tuyến, thực thi công cụ,
+            token và tỷ lệ prompt cache theo hạng model, gộp ghi bộ nhớ, cache phản hồi,
+            registry agent, độ trễ theo bước, hàng đợi gọi model, chuỗi model dự phòng,
+            gộp request trùng nhau và cache kết quả công cụ
+        """
+        stats = {
+            "pid": os.getpid(),
+            "http_pool": self.http_pool.get_stats(),
+            "thread_locks": self.thread_locks.get_stats(),
+            "router": self.router.get_stats(),
+            "tools": self.tool_runner.get_stats(),
+            "usage": get_usage_stats().get_stats(),
+            "admission": self.admission.get_stats(),
+            "fallback": self.fallback.get_stats(),
+            "metrics": self.metrics.get_stats()
+        }
+        if hasattr(self.store, "get_stats"):
+            stats["memory_writes"] = self.store.get_stats()
+        if self.response_cache is not None:
+            stats["response_cache"] = self.response_cache.get_stats()
+        stats["coalescing"] = self.coalescer.get_stats()
+        from agent_template.core.agent import get_agent_registry
+        stats["agents"] = get_agent_registry(self.config).get_stats()
+        from agent_template.utils.tool_cache import get_tool_cache_stats
+        tool_cache = get_tool_cache_stats()
+        if tool_cache:
+            stats["tool_cache"] = tool_cache
+        return stats
+    
+    def get_request_config(
+        self,
+        thread_id: Optional[str] = None,
+        overrides: Optional[Dict[str, Any]] = None
+    ) -> RequestConfig:
+        """Tạo ảnh chụp cấu hình cho một request.
+        
+        Thứ tự ưu tiên: giá trị ghi đè của request, mặc định đã lưu của luồng,
+        mặc định của service. Chỉ đọc các ảnh chụp bất biến nên không cần khóa.
+        
+        Args:
+            thread_id: ID luồng hội thoại (tùy chọn)
+            overrides: Các giá trị ghi đè của request (tùy chọn)
+            
+        Returns:
+            Ảnh chụp cấu hình bất biến
+            
+        Raises:
+            ValueError: Nếu giá trị ghi đè không hợp lệ
+        """
+        settings = self.get_defaults()
+        if thread_id:
+            settings = settings.merge(load_thread_settings(thread_id, self.config))
+        return settings.merge(overrides)
+    
+    def get_defaults(self) -> RequestConfig:
+        """Lấy ảnh chụp cấu hình mặc định hiện tại của service.
+        
+        Cấu hình đã lưu được đọc từ backend mỗi lần (mọi worker thấy cùng giá
+        trị); ảnh chụp chỉ được tạo lại khi cấu hình đã lưu thay đổi.
+        
+        Returns:
+            Ảnh chụp mặc định bất biến
+        """
+        stored = load_thread_settings(SERVICE_THREAD_ID, self.config)
+        cached_stored, defaults = self._defaults
+        if stored is not cached_stored and stored != cached_stored:
+            defaults = self.startup_defaults.merge(stored)
+            self._defaults = (stored, defaults)
+        return defaults
+    
+    def update_defaults(self, updates: Dict[str, Any]) -> RequestConfig:
+        """Cập nhật cấu hình mặc định của service cho mọi worker.
+        
+        Các request đang chạy giữ nguyên ảnh chụp cũ; request mới dùng ảnh chụp mới.
+        
+        Args:
+            updates: Các trường RequestConfig cần đặt (None để quay về giá trị
+                khi khởi động); trường khác bị bỏ qua
+            
+        Returns:
+            Ảnh chụp mặc định mới
+            
+        Raises:
+            ValueError: Nếu giá trị không hợp lệ
+        """
+        fields = {key: value for key, value in updates.items() if key in RequestConfig.model_fields}
+        save_thread_settings(SERVICE_THREAD_ID, fields, self.config)
+        return self.get_defaults()
+    
+    def update_thread_config(self, thread_id: str, updates: Dict[str, Any]) -> Dict[str, Any]:
+        """Lưu cấu hình mặc định của một luồng hội thoại.
+        
+        Args:
+            thread_id: ID luồng hội thoại
+            updates: Các trường RequestConfig cần đặt (None để quay về mặc định của service)
+            
+        Returns:
+            Cấu hình đã lưu của luồng
+            
+        Raises:
+            ValueError: Nếu có trường hoặc giá trị không hợp lệ
+        """
+        return save_thread_settings(thread_id, updates, self.config)
+    
+    def describe_config(self, thread_id: Optional[str] = None) -> Dict[str, Any]:
+        """Mô tả cấu hình hiệu lực của service hoặc của một luồng.
         
-    async def process_message(self, user_input: str, thread_id: Optional[str] = None) -> Dict[str, Any]:
+        Args:
+            thread_id: ID luồng hội thoại (None cho mặc định của service)
+            
+        Returns:
+            Dict gồm các trường RequestConfig cùng tên model và model settings hiệu lực
+        """
+        from agent_template.core.agent import get_model_name, get_model_settings
+        settings = self.get_request_config(thread_id)
+        model_type = settings.model_type or "default"
+        model_settings = get_model_settings(model_type, settings)
+        return {
+            **settings.model_dump(),
+            "model_name": get_model_name(model_type),
+            "temperature": model_settings["temperature"],
+            "max_tokens": model_settings["max_tokens"]
+        }
+    
+    def _create_deps(self) -> Deps:
+        """Tạo dependencies cho agent với client HTTP dùng chung."""
+        return Deps(client=self.http_pool.client)
+        
+    async def process_message(
+        self,
+        user_input: str,
+        thread_id: Optional[str] = None,
+        use_cache: bool = True,
+        overrides: Optional[Dict[str, Any]] = None,
+        profile: Optional[str] = None,
+        idempotency_key: Optional[str] = None,
+        coalesce: bool = True
+    ) -> Dict[str, Any]:
         """Xử lý tin nhắn từ người dùng.
         
+        Request có khóa idempotency giống một request đang chạy trên cùng luồng
+        dùng chung lần xử lý đó; lần thử lại trong COALESCE_WINDOW giây nhận lại
+        kết quả đã có. Khi bật COALESCE, request không có khóa được gộp theo nội
+        dung đã chuẩn hóa; mặc định mỗi request không có khóa là một lượt mới.
+        Kết quả dùng chung có khóa "coalesced" ("inflight" hoặc "completed").
+        
         Args:
             user_input: Nội dung tin nhắn từ người dùng
             thread_id: ID luồng hội thoại (nếu None, sẽ dùng ID mặc định)
+            use_cache: Dùng cache phản hồi nếu được bật (False để bỏ qua cache)
+            overrides: Cấu hình ghi đè cho riêng request này (use_legacy,
+                model_type, temperature, max_tokens)
+            profile: "timing" để trả về thời gian từng bước trong khóa "profile",
+                "cprofile" để chạy thêm cProfile và ghi file (cần PROFILING)
+            idempotency_key: Khóa do client gửi để nhận diện các lần thử lại (tùy chọn)
+            coalesce: Gộp với request giống hệt (False để luôn xử lý riêng)
             
         Returns:
             Dict chứa kết quả xử lý (response và metadata)
@@ -47,21 +310,72 @@ class AgentService:
         
         # Kiểm tra xem tin nhắn có phải là lệnh hệ thống không
         if user_input.startswith('/'):
+            self.coalescer.invalidate(current_thread_id)
             return await self._process_system_command(user_input, current_thread_id)
-            
-        # Xử lý tin nhắn thông thường
+        
+        # Request profiling luôn được xử lý riêng để đo đúng lượt của nó; không có
+        # khóa idempotency thì chỉ gộp theo nội dung khi bật COALESCE
+        if not coalesce or profile or not (idempotency_key or self.config.coalesce_enabled):
+            self.coalescer.invalidate(current_thread_id)
+            return await self._process_turn(user_input, current_thread_id, use_cache, overrides, profile)
+        
+        key = coalesce_key(
+            current_thread_id, user_input, idempotency_key,
+            {"use_cache": use_cache, **(overrides or {})}
+        )
+        result, shared = await self.coalescer.run(
+            key, lambda: self._process_turn(user_input, current_thread_id, use_cache, overrides)
+        )
+        return {**result, "coalesced": shared} if shared else result
+    
+    async def _process_turn(
+        self,
+        user_input: str,
+        current_thread_id: str,
+        use_cache: bool = True,
+        overrides: Optional[Dict[str, Any]] = None,
+        profile: Optional[str] = None
+    ) -> Dict[str, Any]:
+        """Xử lý một lượt hội thoại, tuần tự với các lượt khác của cùng luồng."""
         try:
-            if self.config.use_legacy:
-                memory = load_memory(current_thread_id)
-                response = await process_input(current_thread_id, user_input, memory)
-            else:
-                response = await process_with_graph(current_thread_id, user_input)
-                
-            return {
+            settings = self.get_request_config(current_thread_id, overrides)
+            if profile and not self.config.profiling_enabled:
+                raise ValueError("Profiling chưa được bật (PROFILING=true)")
+            capture = self.profiler.capture(current_thread_id) if profile == "cprofile" else nullcontext({})
+            with capture as profile_info, self.metrics.turn("legacy" if settings.use_legacy else "graph") as turn:
+                async with self.thread_locks.acquire(current_thread_id) as lock_wait:
+                    self.metrics.record_stage("lock_wait", lock_wait)
+                    if settings.use_legacy:
+                        from agent_template.core.agent import process_input
+                        with stage("load_memory"):
+                            memory = await load_memory_async(current_thread_id)
+                        response = await process_input(
+                            current_thread_id, user_input, memory,
+                            deps=self._create_deps(), use_cache=use_cache, settings=settings
+                        )
+                    else:
+                        # LangGraph chỉ được import khi cần
+                        from agent_template.workflows.graph import process_with_graph
+                        response = await process_with_graph(
+                            current_thread_id, user_input,
+                            deps=self._create_deps(), use_cache=use_cache, settings=settings
+                        )
+            
+            result = {
                 "success": True,
                 "response": response,
-                "thread_id": current_thread_id
+                "thread_id": current_thread_id,
+                # Hạng model đã phục vụ lượt (có thể là hạng dự phòng)
+                "model_tier": turn.tier
             }
+            if len(turn.attempts) > 1:
+                result["model_attempts"] = turn.breakdown()["attempts"]
+            if profile:
+                result["profile"] = {**turn.breakdown(), **profile_info}
+            return result
+        except AdmissionRejected:
+            # Để API trả 429 kèm Retry-After thay vì một phản hồi lỗi thông thường
+            raise
         except Exception as e:
             return {
                 "success": False,
@@ -69,6 +383,132 @@ class AgentService:
                 "thread_id": current_thread_id
             }
     
+    async def stream_message(
+        self,
+        user_input: str,
+        thread_id: Optional[str] = None,
+        use_cache: bool = True,
+        overrides: Optional[Dict[str, Any]] = None
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """Xử lý tin nhắn từ người dùng và trả về phản hồi theo từng đoạn.
+        
+        Các sự kiện được trả về dưới dạng dict với khóa "type":
+        "delta" (một đoạn phản hồi mới), "done" (toàn bộ phản hồi),
+        "command" (kết quả lệnh hệ thống) hoặc "error".
+        
+        Args:
+            user_input: Nội dung tin nhắn từ người dùng
+            thread_id: ID luồng hội thoại (nếu None, sẽ dùng ID mặc định)
+            use_cache: Dùng cache phản hồi nếu được bật (False để bỏ qua cache)
+            overrides: Cấu hình ghi đè cho riêng request này
+            
+        Yields:
+            Dict mô tả từng sự kiện của stream
+        """
+        current_thread_id = thread_id or self.config.thread_id
+        
+        # Lệnh hệ thống không cần stream
+        if user_input.startswith('/'):
+            result = await self._process_system_command(user_input, current_thread_id)
+            yield {"type": "command", **result}
+            return
+        
+        try:
+            settings = self.get_request_config(current_thread_id, overrides)
+        except ValueError as e:
+            yield {"type": "error", "error": str(e), "thread_id": current_thread_id}
+            return
+        
+        # Lượt stream mới: lần gửi lại tin nhắn trước đó không còn là lần thử lại
+        self.coalescer.invalidate(current_thread_id)
+        
+        parts = []
+        async with self.thread_locks.acquire(current_thread_id):
+            memory = await load_memory_async(current_thread_id)
+            if settings.use_legacy:
+                from agent_template.core.agent import stream_input
+                stream = stream_input(
+                    current_thread_id, user_input, memory,
+                    deps=self._create_deps(), use_cache=use_cache, settings=settings
+                )
+            else:
+                from agent_template.workflows.graph import stream_with_graph
+                stream = stream_with_graph(
+                    current_thread_id, user_input, memory,
+                    deps=self._create_deps(), use_cache=use_cache, settings=settings
+                )
+            
+            try:
+                async for delta in stream:
+                    parts.append(delta)
+                    yield {"type": "delta", "content": delta}
+            except AdmissionRejected as e:
+                yield {"type": "error", "error": str(e), "retry_after": e.retry_after, "thread_id": current_thread_id}
+                return
+            except Exception as e:
+                yield {"type": "error", "error": str(e), "thread_id": current_thread_id}
+                return
+            finally:
+                # Đóng stream bên trong ngay để phần phản hồi đã nhận được lưu lại khi bị hủy
+                await stream.aclose()
+        
+        yield {"type": "done", "response": "".join(parts), "thread_id": current_thread_id}
+    
+    async def process_messages(
+        self,
+        items: List[Dict[str, Any]],
+        use_cache: bool = True
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """Xử lý một lô tin nhắn đồng thời, trả về kết quả ngay khi từng tin nhắn xong.
+        
+        Tin nhắn được gom theo thread_id: các tin nhắn cùng luồng chạy tuần tự
+        theo thứ tự trong lô, các luồng khác nhau chạy song song trong giới hạn
+        bulk_semaphore (BULK_MAX_CONCURRENCY).
+        
+        Args:
+            items: Danh sách dict gồm "message", "thread_id" (tùy chọn) và
+                "overrides" (cấu hình ghi đè, tùy chọn)
+            use_cache: Dùng cache phản hồi nếu được bật (False để bỏ qua cache)
+            
+        Yields:
+            Kết quả của process_message kèm "index" là vị trí của tin nhắn trong lô
+        """
+        # Tin nhắn không có thread_id thuộc luồng mặc định, cùng nhóm với tin nhắn
+        # ghi rõ luồng đó
+        groups: Dict[str, List[Tuple[int, Dict[str, Any]]]] = {}
+        for index, item in enumerate(items):
+            groups.setdefault(item.get("thread_id") or self.config.thread_id, []).append((index, item))
+        
+        results: asyncio.Queue = asyncio.Queue()
+        
+        async def run_thread(thread_id: str, entries: List[Tuple[int, Dict[str, Any]]]):
+            for index, item in entries:
+                try:
+                    async with self.bulk_semaphore:
+                        # Tin nhắn trùng nhau trong lô là các lượt riêng, không gộp
+                        result = await self.process_message(
+                            item["message"], thread_id, use_cache=use_cache, overrides=item.get("overrides"),
+                            coalesce=False
+                        )
+                except AdmissionRejected as e:
+                    result = {
+                        "success": False, "error": str(e), "retry_after": e.retry_after,
+                        "thread_id": thread_id
+                    }
+                except Exception as e:
+                    result = {"success": False, "error": str(e), "thread_id": thread_id}
+                results.put_nowait({"index": index, **result})
+        
+        tasks = [asyncio.create_task(run_thread(thread_id, entries)) for thread_id, entries in groups.items()]
+        try:
+            for _ in range(len(items)):
+                yield await results.get()
+        finally:
+            # Người gọi ngừng đọc (ví dụ client ngắt kết nối): hủy các tin nhắn còn lại
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+    
     async def _process_system_command(self, command: str, thread_id: str) -> Dict[str, Any]:
         """Xử lý các lệnh hệ thống.
         
@@ -113,7 +553,7 @@ class AgentService:
         
         # Lệnh conversations
         elif cmd == '/conversations':
-            convos = list_conversations()
+            convos, _ = await asyncio.to_thread(self.store.list_threads, 50)
             return {
                 "success": True,
                 "command": "conversations",
@@ -124,8 +564,7 @@ class AgentService:
         # Lệnh load
         elif cmd.startswith('/load '):
             new_id = command[6:].strip()
-            convos = list_conversations()
-            if new_id in convos:
+            if self.store.get_thread_info(new_id) is not None:
                 return {
                     "success": True,
                     "command": "load",
@@ -144,9 +583,10 @@ class AgentService:
         # Lệnh delete
         elif cmd.startswith('/delete '):
             del_id = command[8:].strip()
-            convos = list_conversations()
-            if del_id in convos:
+            if self.store.get_thread_info(del_id) is not None:
+                # Xóa cả dữ liệu phụ của luồng (cấu hình, tóm tắt, model message)
                 delete_conversation(del_id)
+                evict_model_turns(del_id)
                 new_thread_id = thread_id
                 
                 # Nếu xóa hội thoại hiện tại, tạo một cái mới
@@ -168,23 +608,23 @@ class AgentService:
                     "thread_id": thread_id
                 }
         
-        # Lệnh graph
+        # Lệnh graph: lưu chế độ xử lý làm mặc định của luồng hiện tại
         elif cmd == '/graph':
-            self.config.use_legacy = False
+            save_thread_settings(thread_id, {"use_legacy": False}, self.config)
             return {
                 "success": True,
                 "command": "graph",
-                "message": "Đã chuyển sang chế độ xử lý LangGraph.",
+                "message": "Đã chuyển hội thoại này sang chế độ xử lý LangGraph.",
                 "thread_id": thread_id
             }
         
         # Lệnh legacy
         elif cmd == '/legacy':
-            self.config.use_legacy = True
+            save_thread_settings(thread_id, {"use_legacy": True}, self.config)
             return {
                 "success": True,
                 "command": "legacy",
-                "message": "Đã chuyển sang chế độ xử lý legacy (không dùng LangGraph).",
+                "message": "Đã chuyển hội thoại này sang chế độ xử lý legacy (không dùng LangGraph).",
                 "thread_id": thread_id
             }
         
@@ -217,7 +657,7 @@ class AgentService:
         Returns:
             Chuỗi markdown với thông tin trợ giúp
         """
-        current_processor = "legacy" if self.config.use_legacy else "graph"
+        current_processor = "legacy" if self.get_request_config(thread_id).use_legacy else "graph"
         
         return f"""# Trợ giúp
 
@@ -229,8 +669,8 @@ class AgentService:
 - `/load ID` - Tải một hội thoại từ ID
 - `/delete ID` - Xóa hội thoại có ID đã cho
 - `/new` - Tạo hội thoại mới
-- `/graph` - Chuyển sang xử lý LangGraph
-- `/legacy` - Chuyển sang xử lý legacy (không dùng LangGraph)
+- `/graph` - Chuyển hội thoại hiện tại sang xử lý LangGraph
+- `/legacy` - Chuyển hội thoại hiện tại sang xử lý legacy (không dùng LangGraph)
 
 ## Thông tin hiện tại
 - Chế độ xử lý: {current_processor}
@@ -255,6 +695,22 @@ class AgentService:
         """
         return list_conversations()
 
+    def list_conversations_page(
+        self,
+        limit: int = 20,
+        cursor: Optional[str] = None
+    ) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        """Lấy một trang hội thoại kèm metadata, mới cập nhật nhất trước.
+        
+        Args:
+            limit: Số hội thoại tối đa trong trang
+            cursor: Cursor trả về từ trang trước (None cho trang đầu)
+            
+        Returns:
+            Tuple gồm (danh sách metadata hội thoại, cursor trang kế tiếp hoặc None)
+        """
+        return self.store.list_threads(limit, cursor)
+
     def get_conversation_history(self, thread_id: str) -> List[Dict[str, Any]]:
         """Lấy lịch sử hội thoại cho một thread ID cụ thể.
         
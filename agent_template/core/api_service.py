@@ -9,26 +9,59 @@ import asyncio
 import json
 import logging
 import os
-from typing import Optional, Dict, Any, List
+from contextlib import asynccontextmanager
+from typing import Optional, Dict, Any, List, Literal
 
 import uvicorn
-from fastapi import FastAPI, HTTPException, Depends, Body, Query
+from fastapi import FastAPI, HTTPException, Depends, Body, Header, Query
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
-from pydantic import BaseModel
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from pydantic import BaseModel, Field
 
 from agent_template.config import AppConfig
 from agent_template.core.agent_service import AgentService
+from agent_template.memory.storage import get_store
+from agent_template.utils.admission import AdmissionRejected
+from agent_template.utils.profiling import parse_profile_flag
+from agent_template.utils.rate_limit import RateLimitMiddleware, get_rate_limiter
 
 # Thiết lập logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Biến môi trường truyền tham số dòng lệnh từ tiến trình chính sang các worker
+WORKER_LEGACY_ENV = "AGENT_TEMPLATE_LEGACY"
+WORKER_THREAD_ENV = "AGENT_TEMPLATE_THREAD_ID"
+
 # Định nghĩa models Pydantic
 class UserMessage(BaseModel):
-    """Model cho tin nhắn gửi từ người dùng."""
+    """Model cho tin nhắn gửi từ người dùng.
+    
+    Các trường cấu hình (use_legacy, model_type, temperature, max_tokens) chỉ
+    áp dụng cho request này; bỏ trống để dùng mặc định của luồng hoặc service.
+    """
     message: str
     thread_id: Optional[str] = None
+    bypass_cache: bool = False
+    use_legacy: Optional[bool] = None
+    model_type: Optional[Literal["default", "advanced", "light"]] = None
+    temperature: Optional[float] = Field(None, ge=0, le=2)
+    max_tokens: Optional[int] = Field(None, gt=0)
+    
+    def overrides(self) -> Dict[str, Any]:
+        """Các giá trị cấu hình ghi đè của request."""
+        return {
+            "use_legacy": self.use_legacy,
+            "model_type": self.model_type,
+            "temperature": self.temperature,
+            "max_tokens": self.max_tokens
+        }
+
+class BulkMessageRequest(BaseModel):
+    """Model cho một lô tin nhắn gửi tới /send_messages."""
+    messages: List[UserMessage]
+    stream: bool = False
+    bypass_cache: bool = False
 
 class AgentResponse(BaseModel):
     """Model cho phản hồi từ agent."""
@@ -38,6 +71,10 @@ class AgentResponse(BaseModel):
     thread_id: str
     command: Optional[str] = None
     message: Optional[str] = None
+    profile: Optional[Dict[str, Any]] = None
+    model_tier: Optional[str] = None
+    model_attempts: Optional[List[Dict[str, Any]]] = None
+    coalesced: Optional[str] = None
 
 class Conversation(BaseModel):
     """Model cho thông tin hội thoại."""
@@ -61,20 +98,48 @@ class APIService:
         """
         self.agent_service = agent_service
         self.config = config
+        # /health chỉ báo sẵn sàng sau khi warmup xong
+        self.ready = False
+        self.warmup_timings: Dict[str, Any] = {}
+        self.rate_limiter = get_rate_limiter(config) if config.rate_limit_enabled else None
         self.app = self._create_app()
     
+    async def warmup(self):
+        """Tạo trước agent, biên dịch đồ thị và mở pool kết nối rồi đánh dấu sẵn sàng."""
+        if not self.ready:
+            self.warmup_timings = await self.agent_service.warmup()
+            self.ready = True
+    
     def _create_app(self) -> FastAPI:
         """Tạo ứng dụng FastAPI.
         
         Returns:
             Đối tượng FastAPI đã cấu hình
         """
+        @asynccontextmanager
+        async def lifespan(app: FastAPI):
+            # Mở các tài nguyên dùng chung khi khởi động và đóng khi tắt; warmup
+            # chạy tại đây nếu start() chưa chạy (chế độ nhiều worker, run())
+            await self.agent_service.startup(warmup=False)
+            await self.warmup()
+            try:
+                yield
+            finally:
+                await self.agent_service.shutdown()
+                if self.rate_limiter is not None:
+                    self.rate_limiter.close()
+        
         app = FastAPI(
             title="Agent Template API",
             description="API để tương tác với Agent Template",
-            version="1.0.0"
+            version="1.0.0",
+            lifespan=lifespan
         )
         
+        # Giới hạn tốc độ theo client; thêm trước CORS để phản hồi 429 vẫn có header CORS
+        if self.rate_limiter is not None:
+            app.add_middleware(RateLimitMiddleware, limiter=self.rate_limiter)
+        
         # Thêm CORS middleware
         app.add_middleware(
             CORSMiddleware,
@@ -99,56 +164,193 @@ class APIService:
             """Kiểm tra trạng thái API.
             
             Returns:
-                Trạng thái API
+                Trạng thái API; 503 nếu warmup chưa xong
             """
+            if not self.ready:
+                return JSONResponse(status_code=503, content={"status": "starting", "ready": False})
             return {
                 "status": "ok",
-                "version": "1.0.0"
+                "version": "1.0.0",
+                "ready": True,
+                "warmup_ms": self.warmup_timings
             }
         
+        @app.get("/stats", tags=["Health"])
+        async def get_stats():
+            """Lấy thống kê runtime của các tài nguyên dùng chung.
+            
+            Returns:
+                Thống kê pool HTTP, khóa theo luồng, gộp ghi bộ nhớ, cache phản hồi
+                và giới hạn tốc độ
+            """
+            stats = self.agent_service.get_stats()
+            if self.rate_limiter is not None:
+                stats["rate_limit"] = self.rate_limiter.get_stats()
+            return stats
+        
+        @app.get("/metrics", tags=["Health"], response_class=PlainTextResponse)
+        async def get_metrics():
+            """Số liệu độ trễ theo bước, số lượt và token ở định dạng Prometheus.
+            
+            Returns:
+                Văn bản theo định dạng exposition của Prometheus
+            """
+            return PlainTextResponse(
+                self.agent_service.metrics.render(),
+                media_type="text/plain; version=0.0.4; charset=utf-8"
+            )
+        
         @app.post("/send_message", response_model=AgentResponse, tags=["Messaging"])
-        async def send_message(message: UserMessage):
+        async def send_message(
+            message: UserMessage,
+            profile: Optional[str] = Query(None, description="timing hoặc cprofile (cần PROFILING=true)"),
+            x_profile: Optional[str] = Header(None),
+            idempotency_key: Optional[str] = Header(None)
+        ):
             """Gửi tin nhắn đến agent.
             
             Args:
-                message: Nội dung tin nhắn và thread_id tùy chọn
+                message: Nội dung tin nhắn, thread_id và cờ bypass_cache tùy chọn
+                profile: Yêu cầu profiling qua tham số truy vấn
+                x_profile: Yêu cầu profiling qua header X-Profile
+                idempotency_key: Khóa của header Idempotency-Key; các lần thử lại
+                    cùng khóa dùng chung một lượt
                 
             Returns:
-                Phản hồi từ agent
+                Phản hồi từ agent, kèm thời gian từng bước nếu có yêu cầu profiling
             """
             try:
-                result = await self.agent_service.process_message(message.message, message.thread_id)
+                profile_mode = parse_profile_flag(profile or x_profile)
+            except ValueError as e:
+                raise HTTPException(status_code=400, detail=str(e))
+            if profile_mode and not self.config.profiling_enabled:
+                raise HTTPException(status_code=403, detail="Profiling chưa được bật (PROFILING=true)")
+            
+            try:
+                result = await self.agent_service.process_message(
+                    message.message, message.thread_id,
+                    use_cache=not message.bypass_cache, overrides=message.overrides(),
+                    profile=profile_mode, idempotency_key=idempotency_key
+                )
                 return result
+            except AdmissionRejected as e:
+                # Hạng model quá tải: từ chối ngay để client thử lại sau
+                return JSONResponse(
+                    status_code=429,
+                    headers={"Retry-After": str(e.retry_after)},
+                    content={
+                        "success": False,
+                        "error": str(e),
+                        "thread_id": message.thread_id or self.config.thread_id,
+                        "tier": e.tier,
+                        "retry_after": e.retry_after
+                    }
+                )
             except Exception as e:
                 logger.exception("Lỗi khi xử lý tin nhắn")
                 raise HTTPException(status_code=500, detail=str(e))
         
-        @app.get("/conversations", tags=["Conversations"])
-        async def list_conversations():
-            """Lấy danh sách tất cả các cuộc hội thoại.
+        @app.post("/send_message/stream", tags=["Messaging"])
+        async def send_message_stream(message: UserMessage):
+            """Gửi tin nhắn đến agent và nhận phản hồi dạng Server-Sent Events.
             
+            Mỗi sự kiện có dạng `event: <type>` với `data` là JSON: "delta"
+            cho từng đoạn phản hồi, "done" khi hoàn tất, "command" cho lệnh
+            hệ thống và "error" khi có lỗi. Nếu client ngắt kết nối giữa
+            chừng, phần phản hồi đã tạo vẫn được lưu vào hội thoại.
+            
+            Args:
+                message: Nội dung tin nhắn, thread_id và cờ bypass_cache tùy chọn
+                
             Returns:
-                Danh sách các cuộc hội thoại
+                Luồng sự kiện text/event-stream
             """
-            try:
-                thread_ids = self.agent_service.get_all_conversations()
-                conversations = []
-                
-                for thread_id in thread_ids:
-                    # Lấy lịch sử hội thoại để đếm số tin nhắn
-                    history = self.agent_service.get_conversation_history(thread_id)
-                    message_count = len(history) if history else 0
+            async def event_stream():
+                async for event in self.agent_service.stream_message(
+                    message.message, message.thread_id,
+                    use_cache=not message.bypass_cache, overrides=message.overrides()
+                ):
+                    yield f"event: {event['type']}\ndata: {json.dumps(event, ensure_ascii=False)}\n\n"
+            
+            return StreamingResponse(
+                event_stream(),
+                media_type="text/event-stream",
+                headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+            )
+        
+        @app.post("/send_messages", tags=["Messaging"])
+        async def send_messages(request: BulkMessageRequest):
+            """Gửi một lô tin nhắn đến agent và xử lý đồng thời.
+            
+            Các tin nhắn cùng thread_id được xử lý tuần tự theo thứ tự gửi, các
+            luồng khác nhau chạy song song trong giới hạn BULK_MAX_CONCURRENCY.
+            Mỗi kết quả có "index" là vị trí của tin nhắn trong lô.
+            
+            Args:
+                request: Danh sách tin nhắn; stream=True để nhận kết quả dạng
+                    NDJSON ngay khi từng tin nhắn xong
                     
-                    conversations.append(Conversation(
-                        id=thread_id,
-                        created=thread_id,  # Sử dụng thread_id làm timestamp vì thread_id đã là timestamp
-                        message_count=message_count  # Đếm số lượng tin nhắn thực tế
-                    ))
+            Returns:
+                NDJSON stream hoặc một phản hồi gộp với kết quả theo thứ tự gửi
+            """
+            if len(request.messages) > self.config.bulk_max_items:
+                raise HTTPException(
+                    status_code=413,
+                    detail=f"Lô có {len(request.messages)} tin nhắn, tối đa {self.config.bulk_max_items}"
+                )
+            
+            items = [
+                {"message": item.message, "thread_id": item.thread_id, "overrides": item.overrides()}
+                for item in request.messages
+            ]
+            use_cache = not request.bypass_cache
+            
+            if request.stream:
+                async def ndjson_stream():
+                    async for result in self.agent_service.process_messages(items, use_cache=use_cache):
+                        yield json.dumps(result, ensure_ascii=False) + "\n"
                 
-                return {"conversations": conversations}  # Đóng gói trong key "conversations" theo mong đợi của test
+                return StreamingResponse(ndjson_stream(), media_type="application/x-ndjson")
+            
+            results = [result async for result in self.agent_service.process_messages(items, use_cache=use_cache)]
+            results.sort(key=lambda result: result["index"])
+            succeeded = sum(1 for result in results if result["success"])
+            return {
+                "results": results,
+                "succeeded": succeeded,
+                "failed": len(results) - succeeded
+            }
+        
+        @app.get("/conversations", tags=["Conversations"])
+        async def list_conversations(
+            limit: int = Query(20, ge=1, le=100, description="Số hội thoại tối đa mỗi trang"),
+            cursor: Optional[str] = Query(None, description="Cursor trả về từ trang trước")
+        ):
+            """Lấy danh sách hội thoại theo trang, mới cập nhật nhất trước.
+            
+            Metadata (created, last_updated, message_count) được đọc từ chỉ mục
+            của backend lưu trữ nên chi phí chỉ tỷ lệ với kích thước trang.
+            
+            Args:
+                limit: Số hội thoại tối đa mỗi trang
+                cursor: Cursor trả về từ trang trước
+                
+            Returns:
+                Danh sách các cuộc hội thoại và cursor của trang kế tiếp
+            """
+            try:
+                # Backend gộp ghi xả các lần ghi đang chờ trước khi trả trang
+                threads, next_cursor = await asyncio.to_thread(
+                    self.agent_service.list_conversations_page, limit, cursor
+                )
+            except ValueError as e:
+                raise HTTPException(status_code=400, detail=str(e))
             except Exception as e:
                 logger.exception("Lỗi khi lấy danh sách hội thoại")
                 raise HTTPException(status_code=500, detail=str(e))
+            
+            conversations = [Conversation(**thread) for thread in threads]
+            return {"conversations": conversations, "next_cursor": next_cursor}
         
         @app.post("/conversations", response_model=Dict[str, str], tags=["Conversations"])
         async def create_conversation():
@@ -204,27 +406,27 @@ class APIService:
         
         @app.get("/config", tags=["Config"])
         async def get_config():
-            """Lấy cấu hình hiện tại của agent.
+            """Lấy cấu hình mặc định hiện tại của agent.
             
             Returns:
-                Cấu hình hiện tại
+                Cấu hình hiệu lực (chế độ xử lý, hạng model, tên model,
+                temperature, max_tokens)
             """
             try:
                 # Trả về phiên bản đã lọc của cấu hình đóng gói trong key "config"
-                return {
-                    "config": {
-                        "use_legacy": self.config.use_legacy,
-                        "model_name": self.config.model_name,
-                        "temperature": self.config.temperature
-                    }
-                }
+                return {"config": self.agent_service.describe_config()}
             except Exception as e:
                 logger.exception("Lỗi khi lấy cấu hình")
                 raise HTTPException(status_code=500, detail=str(e))
         
         @app.post("/config", tags=["Config"])
         async def update_config(config_data: Dict[str, Any] = Body(...)):
-            """Cập nhật cấu hình agent.
+            """Cập nhật cấu hình mặc định của agent.
+            
+            Cấu hình được lưu trong backend lưu trữ nên áp dụng cho mọi worker;
+            các request đang chạy không bị ảnh hưởng. Chỉ các trường use_legacy,
+            model_type, temperature và max_tokens được áp dụng (null để quay về
+            giá trị khi khởi động).
             
             Args:
                 config_data: Dữ liệu cấu hình cần cập nhật
@@ -233,34 +435,63 @@ class APIService:
                 Cấu hình đã cập nhật
             """
             try:
-                updates = {}
-                if "use_legacy" in config_data:
-                    updates["use_legacy"] = config_data["use_legacy"]
-                if "model_name" in config_data:
-                    updates["model_name"] = config_data["model_name"]
-                if "temperature" in config_data:
-                    updates["temperature"] = config_data["temperature"]
+                self.agent_service.update_defaults(config_data)
+            except ValueError as e:
+                raise HTTPException(status_code=400, detail=str(e))
+            
+            # Trả về cấu hình mới đóng gói trong key "config"
+            return {"config": self.agent_service.describe_config()}
+        
+        @app.get("/conversations/{thread_id}/config", tags=["Config"])
+        async def get_thread_config(thread_id: str):
+            """Lấy cấu hình hiệu lực của một cuộc hội thoại.
+            
+            Args:
+                thread_id: ID của hội thoại
                 
-                # Chỉ cập nhật nếu có thay đổi
-                if updates:
-                    self.config.update(updates)
+            Returns:
+                Cấu hình hiệu lực của luồng
+            """
+            if self.agent_service.store.get_thread_info(thread_id) is None:
+                raise HTTPException(status_code=404, detail=f"Không tìm thấy hội thoại: {thread_id}")
+            return {"config": self.agent_service.describe_config(thread_id)}
+        
+        @app.post("/conversations/{thread_id}/config", tags=["Config"])
+        async def update_thread_config(thread_id: str, config_data: Dict[str, Any] = Body(...)):
+            """Lưu cấu hình mặc định cho một cuộc hội thoại.
+            
+            Giá trị đã lưu áp dụng cho mọi tin nhắn của luồng, trừ khi tin nhắn
+            ghi đè; đặt một trường thành null để quay về mặc định của service.
+            
+            Args:
+                thread_id: ID của hội thoại
+                config_data: Các trường use_legacy, model_type, temperature, max_tokens
                 
-                # Trả về cấu hình mới đóng gói trong key "config"
-                return {
-                    "config": {
-                        "use_legacy": self.config.use_legacy,
-                        "model_name": self.config.model_name,
-                        "temperature": self.config.temperature
-                    }
-                }
-            except Exception as e:
-                logger.exception("Lỗi khi cập nhật cấu hình")
-                raise HTTPException(status_code=500, detail=str(e))
+            Returns:
+                Cấu hình hiệu lực mới của luồng
+            """
+            if self.agent_service.store.get_thread_info(thread_id) is None:
+                raise HTTPException(status_code=404, detail=f"Không tìm thấy hội thoại: {thread_id}")
+            try:
+                self.agent_service.update_thread_config(thread_id, config_data)
+            except ValueError as e:
+                raise HTTPException(status_code=400, detail=str(e))
+            return {"config": self.agent_service.describe_config(thread_id)}
         
         return app
     
     async def start(self):
-        """Khởi động máy chủ API."""
+        """Khởi động máy chủ API với một tiến trình trong event loop hiện tại.
+        
+        Chế độ nhiều worker chạy đồng bộ qua run_workers() trước khi có event
+        loop (xem main.py).
+        """
+        if self.config.api_workers > 1:
+            raise RuntimeError("Chế độ nhiều worker phải được khởi chạy bằng run_workers() ngoài event loop")
+        
+        # Warmup trước khi mở cổng: request đầu tiên và /health không phải chờ tạo agent
+        await self.warmup()
+        
         config = uvicorn.Config(
             self.app,
             host=self.config.api_host,
@@ -273,10 +504,63 @@ class APIService:
         await server.serve()
     
     def run(self):
-        """Chạy máy chủ API một cách đồng bộ."""
+        """Chạy máy chủ API một cách đồng bộ (không được gọi trong event loop)."""
+        if self.config.api_workers > 1:
+            run_workers(self.config)
+            return
+        
         uvicorn.run(
             self.app,
             host=self.config.api_host,
             port=self.config.api_port,
             log_level="info"
-        ) 
\ No newline at end of file
+        )
+
+def run_workers(config: AppConfig):
+    """Chạy API với nhiều tiến trình worker dùng chung một socket.
+    
+    Trình giám sát của uvicorn chạy đồng bộ và tự quản lý tín hiệu, nên hàm
+    này phải được gọi trên luồng chính khi chưa có event loop nào chạy.
+    Tiến trình chính khởi tạo backend lưu trữ (schema SQLite, chế độ WAL)
+    một lần rồi đóng lại trước khi tạo worker, để các worker không tranh
+    nhau khởi tạo. Mỗi worker tạo ứng dụng qua create_app(); khi dừng,
+    uvicorn gửi tín hiệu tới các worker và chờ chúng chạy lifespan shutdown
+    (xả dữ liệu, đóng kết nối) trong giới hạn api_graceful_timeout.
+    
+    Args:
+        config: Cấu hình ứng dụng của tiến trình chính
+    """
+    os.environ["API_WORKERS"] = str(config.api_workers)
+    os.environ[WORKER_LEGACY_ENV] = "1" if config.use_legacy else "0"
+    if config.thread_id:
+        os.environ[WORKER_THREAD_ENV] = config.thread_id
+    
+    get_store(config).close()
+    
+    logger.info(
+        f"API server đang chạy tại http://{config.api_host}:{config.api_port} "
+        f"với {config.api_workers} worker"
+    )
+    uvicorn.run(
+        "agent_template.core.api_service:create_app",
+        factory=True,
+        host=config.api_host,
+        port=config.api_port,
+        workers=config.api_workers,
+        timeout_graceful_shutdown=config.api_graceful_timeout,
+        log_level="info"
+    )
+
+def create_app() -> FastAPI:
+    """Tạo ứng dụng FastAPI cho một tiến trình worker.
+    
+    Cấu hình được đọc từ biến môi trường do tiến trình chính thiết lập.
+    
+    Returns:
+        Đối tượng FastAPI của worker
+    """
+    config = AppConfig(
+        use_legacy=os.environ.get(WORKER_LEGACY_ENV) == "1",
+        thread_id=os.environ.get(WORKER_THREAD_ENV)
+    )
+    return APIService(AgentService(config), config).app
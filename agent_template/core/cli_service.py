@@ -11,6 +11,7 @@ import sys
 from typing import Optional, Dict, Any
 
 from rich.console import Console
+from rich.live import Live
 from rich.markdown import Markdown
 from rich.panel import Panel
 from rich.prompt import Prompt
@@ -55,7 +56,16 @@ class CLIService:
             )
         )
         
-        # Vòng lặp chính
+        # Mở các tài nguyên dùng chung (pool HTTP) trong suốt phiên CLI; agent và
+        # LangGraph được nạp ở tin nhắn đầu tiên để CLI hiện dấu nhắc ngay
+        await self.agent_service.startup(warmup=False)
+        try:
+            await self._run_loop()
+        finally:
+            await self.agent_service.shutdown()
+    
+    async def _run_loop(self):
+        """Vòng lặp chính nhận và xử lý đầu vào từ người dùng."""
         while self.running:
             try:
                 # Nhận đầu vào từ người dùng
@@ -92,6 +102,11 @@ class CLIService:
         Args:
             user_input: Đầu vào từ người dùng
         """
+        # Tin nhắn thông thường được hiển thị dần theo từng đoạn phản hồi
+        if not user_input.startswith('/'):
+            await self._stream_and_display(user_input)
+            return
+        
         # Hiển thị thông báo đang xử lý
         with self.console.status("[bold blue]Đang xử lý...[/bold blue]"):
             # Gửi tin nhắn đến agent
@@ -110,6 +125,28 @@ class CLIService:
             # Hiển thị lỗi
             self.console.print(f"[bold red]Lỗi: {result.get('error', 'Không xác định')}[/bold red]")
     
+    async def _stream_and_display(self, user_input: str):
+        """Gửi tin nhắn và hiển thị phản hồi Markdown ngay khi từng đoạn đến.
+        
+        Args:
+            user_input: Đầu vào từ người dùng
+        """
+        self.console.print("[bold purple]Agent[/bold purple]:")
+        text = ""
+        stream = self.agent_service.stream_message(user_input, self.thread_id)
+        try:
+            with Live(Markdown(text), console=self.console, refresh_per_second=12) as live:
+                async for event in stream:
+                    if event["type"] == "delta":
+                        text += event["content"]
+                        live.update(Markdown(text))
+                    elif event["type"] == "error":
+                        live.update(Markdown(text))
+                        self.console.print(f"[bold red]Lỗi: {event['error']}[/bold red]")
+        finally:
+            # Đóng stream để phần phản hồi đã nhận được lưu lại khi bị ngắt
+            await stream.aclose()
+    
     async def _handle_command_result(self, result: Dict[str, Any]):
         """Xử lý kết quả từ lệnh hệ thống.
         
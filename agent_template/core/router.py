@@ -0,0 +1,633 @@
+"""
+Định tuyến tin nhắn tới hạng model phù hợp.
+
+Bộ định tuyến mặc định dùng một bộ phân loại Naive Bayes trên n-gram ký tự đã
+hiệu chỉnh xác suất, chạy hoàn toàn cục bộ trong chưa tới một mili giây, kết hợp
+với chi phí tương đối của từng hạng và thống kê độ trễ/lỗi thực tế: hạng đang
+vượt mục tiêu độ trễ hoặc tỷ lệ lỗi sẽ được tránh cho tới khi hồi phục. Khi bộ
+phân loại không đủ tự tin, hạng "default" được chọn. Mọi quyết định và kết quả
+được ghi log (JSONL, chỉ có hash và độ dài của tin nhắn) để tinh chỉnh định
+tuyến offline.
+
+Đăng ký bộ định tuyến mới bằng register_router("tên", hàm_tạo) rồi chọn bằng
+biến môi trường ROUTER.
+"""
+
+import hashlib
+import json
+import logging
+import math
+import re
+import threading
+import time
+import uuid
+from collections import Counter, deque
+from contextlib import contextmanager
+from typing import Callable, Dict, Any, Iterable, Iterator, List, Optional, Tuple
+
+from pydantic import BaseModel
+
+from agent_template.config import AppConfig
+
+logger = logging.getLogger(__name__)
+
+# Các hạng model, từ rẻ nhất tới đắt nhất
+TIERS = ("light", "default", "advanced")
+
+# Hạng được chọn khi bộ phân loại không đủ tự tin
+FALLBACK_TIER = "default"
+
+def text_hash(text: str) -> str:
+    """Hash của tin nhắn đã chuẩn hóa, dùng trong log thay cho nội dung gốc."""
+    normalized = re.sub(r"\s+", " ", text).strip().casefold()
+    return hashlib.sha256(normalized.encode("utf-8")).hexdigest()[:16]
+
+# Dữ liệu huấn luyện ban đầu: (tin nhắn, hạng model phù hợp), tiếng Việt và tiếng Anh
+SEED_EXAMPLES: Tuple[Tuple[str, str], ...] = (
+    # light: chào hỏi, cảm ơn, xác nhận, câu hỏi thực tế ngắn
+    ("Xin chào", "light"),
+    ("Chào bạn, bạn khỏe không?", "light"),
+    ("Cảm ơn nhé", "light"),
+    ("Mấy giờ rồi?", "light"),
+    ("Hôm nay là thứ mấy?", "light"),
+    ("ok", "light"),
+    ("hi there", "light"),
+    ("thanks!", "light"),
+    ("quick question: what time is it?", "light"),
+    ("Dịch từ 'hello' sang tiếng Việt", "light"),
+    ("Chào buổi sáng", "light"),
+    ("Tạm biệt, hẹn gặp lại", "light"),
+    ("Được rồi, cảm ơn bạn nhiều", "light"),
+    ("Bạn tên là gì?", "light"),
+    ("Hôm nay ngày bao nhiêu?", "light"),
+    ("Có, tiếp tục đi", "light"),
+    ("Không cần đâu", "light"),
+    ("1 + 1 bằng mấy?", "light"),
+    ("Thủ đô của Pháp là gì?", "light"),
+    ("Dịch 'thank you' sang tiếng Việt", "light"),
+    ("good morning", "light"),
+    ("bye!", "light"),
+    ("yes please", "light"),
+    ("got it, thanks", "light"),
+    ("What's the date today?", "light"),
+    ("Who are you?", "light"),
+    ("How do you say 'cat' in Vietnamese?", "light"),
+    ("What is 12 times 12?", "light"),
+    ("Hiển thị logo giúp tôi", "light"),
+    ("Cho tôi xem logo", "light"),
+    # default: giải thích, viết ngắn, tóm tắt, câu hỏi lập trình thông thường
+    ("Giải thích khái niệm API là gì", "default"),
+    ("Viết một email xin nghỉ phép ngắn gọn", "default"),
+    ("Tóm tắt đoạn văn sau thành ba ý chính", "default"),
+    ("Gợi ý cho tôi vài cách học tiếng Anh hiệu quả", "default"),
+    ("Sự khác nhau giữa list và tuple trong Python là gì?", "default"),
+    ("Write a short product description for a coffee mug", "default"),
+    ("How do I reverse a string in JavaScript?", "default"),
+    ("Explain what a REST API is", "default"),
+    ("Viết một đoạn giới thiệu bản thân để đăng lên LinkedIn", "default"),
+    ("Giải thích cách hoạt động của Git branch", "default"),
+    ("Làm sao để đọc file CSV bằng pandas?", "default"),
+    ("Cho tôi công thức nấu phở bò đơn giản", "default"),
+    ("Viết hàm Python kiểm tra số nguyên tố", "default"),
+    ("Gợi ý tên cho một quán cà phê nhỏ", "default"),
+    ("Tóm tắt nội dung cuốn sách Đắc Nhân Tâm", "default"),
+    ("Sửa lỗi chính tả trong đoạn văn này giúp tôi", "default"),
+    ("Lập danh sách việc cần chuẩn bị cho chuyến đi Đà Lạt", "default"),
+    ("Giải thích sự khác nhau giữa HTTP và HTTPS", "default"),
+    ("Viết câu SQL lấy 10 đơn hàng mới nhất", "default"),
+    ("Docker khác gì so với máy ảo?", "default"),
+    ("What does the map function do in Python?", "default"),
+    ("Write a polite reply declining a meeting invitation", "default"),
+    ("Summarize the main causes of inflation", "default"),
+    ("Give me five ideas for a team building activity", "default"),
+    ("How do I center a div with CSS flexbox?", "default"),
+    ("Explain the difference between a process and a thread", "default"),
+    ("Convert this JSON object into a Python dataclass", "default"),
+    ("What are the pros and cons of remote work?", "default"),
+    ("Draft a tweet announcing our new app release", "default"),
+    ("How can I improve my sleep schedule?", "default"),
+    # advanced: phân tích nhiều bước, thiết kế hệ thống, gỡ lỗi, chứng minh
+    ("Phân tích chi tiết ưu nhược điểm của kiến trúc microservices so với monolith", "advanced"),
+    ("Thiết kế lược đồ cơ sở dữ liệu cho hệ thống đặt vé với yêu cầu mở rộng", "advanced"),
+    ("Tìm lỗi race condition trong đoạn code bất đồng bộ sau và đề xuất cách sửa", "advanced"),
+    ("Chứng minh rằng thuật toán này có độ phức tạp O(n log n) và tối ưu nó", "advanced"),
+    ("So sánh và đánh giá ba chiến lược định giá, kèm tính toán chi phí từng bước", "advanced"),
+    ("Lập kế hoạch chuyển đổi hệ thống thanh toán sang kiến trúc hướng sự kiện", "advanced"),
+    ("Analyze this stack trace and explain the root cause step by step", "advanced"),
+    ("Design a distributed rate limiter and discuss the trade-offs in detail", "advanced"),
+    ("Refactor this module for performance and explain the complexity of each change", "advanced"),
+    ("Thiết kế kiến trúc hệ thống chat thời gian thực cho một triệu người dùng đồng thời", "advanced"),
+    ("Phân tích nguyên nhân rò rỉ bộ nhớ trong dịch vụ Node.js này và đề xuất giải pháp", "advanced"),
+    ("Đánh giá rủi ro bảo mật của luồng xác thực OAuth sau và đề xuất cải tiến", "advanced"),
+    ("Xây dựng mô hình tài chính dự báo dòng tiền 3 năm với các giả định chi tiết", "advanced"),
+    ("So sánh chi tiết PostgreSQL, MongoDB và Cassandra cho hệ thống ghi nhiều", "advanced"),
+    ("Viết và giải thích thuật toán tìm đường đi ngắn nhất có trọng số âm, kèm chứng minh", "advanced"),
+    ("Tối ưu truy vấn SQL chậm này, phân tích execution plan và đề xuất chỉ mục", "advanced"),
+    ("Phân tích chiến lược mở rộng thị trường sang Đông Nam Á cho một startup SaaS", "advanced"),
+    ("Lập kế hoạch migration dữ liệu không downtime từ MySQL sang PostgreSQL", "advanced"),
+    ("Giải thích chi tiết cơ chế đồng thuận Raft và các trường hợp lỗi mạng", "advanced"),
+    ("Review kiến trúc này và chỉ ra các điểm nghẽn khi tải tăng gấp mười lần", "advanced"),
+    ("Prove that this greedy algorithm is optimal and analyze its worst case", "advanced"),
+    ("Debug this deadlock between two services and propose a fix with reasoning", "advanced"),
+    ("Compare Kafka and RabbitMQ for an event-sourced system in depth", "advanced"),
+    ("Design the data model and API for a multi-tenant billing platform", "advanced"),
+    ("Write a detailed threat model for this mobile banking app", "advanced"),
+    ("Plan a step-by-step migration of a monolith to Kubernetes with rollback strategy", "advanced"),
+    ("Evaluate these three machine learning approaches for fraud detection with trade-offs", "advanced"),
+    ("Explain why this concurrent code produces wrong results and rewrite it safely", "advanced"),
+    ("Derive the time and space complexity of this dynamic programming solution", "advanced"),
+)
+
+class RouteDecision(BaseModel):
+    """Một quyết định định tuyến."""
+    id: str
+    tier: str
+    reason: str
+    scores: Dict[str, float] = {}
+
+class TierStats:
+    """Thống kê độ trễ và lỗi của một hạng model trên cửa sổ trượt."""
+
+    def __init__(self, window: int = 200):
+        """Khởi tạo thống kê.
+
+        Args:
+            window: Số kết quả gần nhất dùng để tính phân vị và tỷ lệ lỗi
+        """
+        # (độ trễ giây, có lỗi hay không)
+        self._samples: deque = deque(maxlen=window)
+        self.calls = 0
+        self.errors = 0
+
+    def record(self, latency: float, error: bool):
+        """Ghi nhận kết quả một lần gọi model."""
+        self.calls += 1
+        self.errors += int(error)
+        self._samples.append((latency, error))
+
+    def __len__(self) -> int:
+        """Số mẫu trong cửa sổ hiện tại."""
+        return len(self._samples)
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Tính thống kê trên cửa sổ hiện tại.
+
+        Returns:
+            Dict gồm số lần gọi, số lỗi, số mẫu, tỷ lệ lỗi và độ trễ (ms) p50/p95
+        """
+        samples = list(self._samples)
+        latencies = sorted(latency for latency, _ in samples)
+
+        def percentile(p: float) -> float:
+            if not latencies:
+                return 0.0
+            return latencies[min(int(p * len(latencies)), len(latencies) - 1)] * 1000
+
+        return {
+            "calls": self.calls,
+            "errors": self.errors,
+            "window": len(samples),
+            "error_rate": round(sum(1 for _, error in samples if error) / len(samples), 4) if samples else 0.0,
+            "latency_ms_p50": round(percentile(0.5), 2),
+            "latency_ms_p95": round(percentile(0.95), 2)
+        }
+
+class NgramClassifier:
+    """Bộ phân loại Naive Bayes đa thức trên n-gram ký tự.
+
+    Không cần tách từ nên hoạt động tốt với cả tiếng Việt và tiếng Anh; mỗi
+    lần dự đoán chỉ là một lượt tra dict cho mỗi n-gram của tin nhắn. Các
+    n-gram chồng lên nhau không độc lập nên xác suất thô gần như luôn là 0 hoặc
+    1; `calibrate` chọn nhiệt độ (temperature scaling) bằng kiểm định chéo để
+    xác suất phản ánh độ tin cậy thực.
+    """
+
+    def __init__(self, n_min: int = 2, n_max: int = 4, alpha: float = 1.0):
+        """Khởi tạo bộ phân loại.
+
+        Args:
+            n_min: Độ dài n-gram nhỏ nhất
+            n_max: Độ dài n-gram lớn nhất
+            alpha: Hệ số làm mịn Laplace
+        """
+        self.n_min = n_min
+        self.n_max = n_max
+        self.alpha = alpha
+        self.classes: List[str] = []
+        self._log_priors: Dict[str, float] = {}
+        self._log_likelihoods: Dict[str, Dict[str, float]] = {}
+        self._log_unseen: Dict[str, float] = {}
+        # Nhiệt độ chia điểm log trước softmax (1 là Naive Bayes gốc)
+        self.temperature = 1.0
+
+    def features(self, text: str) -> Counter:
+        """Trích xuất n-gram ký tự và một đặc trưng độ dài của tin nhắn."""
+        normalized = " " + re.sub(r"\s+", " ", text).strip().casefold() + " "
+        grams = Counter(
+            normalized[i:i + n]
+            for n in range(self.n_min, self.n_max + 1)
+            for i in range(len(normalized) - n + 1)
+        )
+        length = len(normalized)
+        grams["__len_short" if length < 40 else "__len_medium" if length < 160 else "__len_long"] += 1
+        return grams
+
+    def fit(self, examples: Iterable[Tuple[str, str]]) -> "NgramClassifier":
+        """Huấn luyện từ các cặp (tin nhắn, nhãn).
+
+        Returns:
+            Chính bộ phân loại (để gọi nối tiếp)
+        """
+        counts: Dict[str, Counter] = {}
+        documents: Counter = Counter()
+        for text, label in examples:
+            counts.setdefault(label, Counter()).update(self.features(text))
+            documents[label] += 1
+
+        vocabulary = set()
+        for grams in counts.values():
+            vocabulary.update(grams)
+        total_documents = sum(documents.values())
+
+        self.classes = sorted(counts)
+        for label in self.classes:
+            total = sum(counts[label].values()) + self.alpha * len(vocabulary)
+            self._log_priors[label] = math.log(documents[label] / total_documents)
+            self._log_likelihoods[label] = {
+                gram: math.log((count + self.alpha) / total) for gram, count in counts[label].items()
+            }
+            self._log_unseen[label] = math.log(self.alpha / total)
+        return self
+
+    def _log_scores(self, text: str) -> Dict[str, float]:
+        """Điểm log (prior + likelihood) của mỗi nhãn, chưa chuẩn hóa."""
+        grams = self.features(text)
+        scores = {}
+        for label in self.classes:
+            likelihoods = self._log_likelihoods[label]
+            unseen = self._log_unseen[label]
+            scores[label] = self._log_priors[label] + sum(
+                count * likelihoods.get(gram, unseen) for gram, count in grams.items()
+            )
+        return scores
+
+    @staticmethod
+    def _softmax(scores: Dict[str, float], temperature: float) -> Dict[str, float]:
+        """Chuẩn hóa điểm log thành xác suất với nhiệt độ đã cho."""
+        top = max(scores.values())
+        exp_scores = {label: math.exp((score - top) / temperature) for label, score in scores.items()}
+        total = sum(exp_scores.values())
+        return {label: value / total for label, value in exp_scores.items()}
+
+    def predict_proba(self, text: str) -> Dict[str, float]:
+        """Dự đoán xác suất của mỗi nhãn cho một tin nhắn."""
+        return self._softmax(self._log_scores(text), self.temperature)
+
+    def calibrate(self, examples: Iterable[Tuple[str, str]], folds: int = 5) -> "NgramClassifier":
+        """Chọn nhiệt độ giảm thiểu log loss trên các mẫu không dùng để huấn luyện.
+
+        Mỗi mẫu được chấm bởi một bộ phân loại huấn luyện trên các fold còn lại;
+        nhiệt độ tốt nhất được chọn trên lưới giá trị.
+
+        Args:
+            examples: Các cặp (tin nhắn, nhãn), thường là dữ liệu đã dùng cho fit
+            folds: Số fold kiểm định chéo
+
+        Returns:
+            Chính bộ phân loại (để gọi nối tiếp)
+        """
+        examples = list(examples)
+        held_out = []
+        for fold in range(folds):
+            train = [example for i, example in enumerate(examples) if i % folds != fold]
+            if len({label for _, label in train}) < 2:
+                continue
+            model = NgramClassifier(self.n_min, self.n_max, self.alpha).fit(train)
+            held_out.extend(
+                (model._log_scores(text), label)
+                for i, (text, label) in enumerate(examples)
+                if i % folds == fold and label in model.classes
+            )
+        if not held_out:
+            return self
+
+        def log_loss(temperature: float) -> float:
+            return -sum(
+                math.log(max(self._softmax(scores, temperature)[label], 1e-12)) for scores, label in held_out
+            ) / len(held_out)
+
+        self.temperature = min((1.5 ** step for step in range(16)), key=log_loss)
+        return self
+
+class Router:
+    """Lớp cơ sở của bộ định tuyến.
+
+    Lớp con cài đặt `_choose`; lớp cơ sở lo thống kê theo hạng và ghi log
+    quyết định/kết quả.
+    """
+
+    name = "base"
+
+    def __init__(self, stats_window: int = 200, log_path: Optional[str] = None):
+        """Khởi tạo bộ định tuyến.
+
+        Args:
+            stats_window: Số kết quả gần nhất giữ lại cho mỗi hạng
+            log_path: File JSONL ghi quyết định và kết quả (None để chỉ ghi logger debug)
+        """
+        self.tier_stats = {tier: TierStats(stats_window) for tier in TIERS}
+        self.decisions: Counter = Counter()
+        self.log_path = log_path
+        self._log_lock = threading.Lock()
+
+    def _choose(self, text: str) -> Tuple[str, str, Dict[str, float]]:
+        """Chọn hạng cho một tin nhắn.
+
+        Returns:
+            Tuple gồm (hạng, lý do, điểm của từng hạng)
+        """
+        raise NotImplementedError
+
+    def route(self, text: str) -> RouteDecision:
+        """Chọn hạng model cho một tin nhắn và ghi log quyết định.
+
+        Args:
+            text: Tin nhắn của người dùng
+
+        Returns:
+            Quyết định định tuyến
+        """
+        tier, reason, scores = self._choose(text)
+        decision = RouteDecision(id=uuid.uuid4().hex[:16], tier=tier, reason=reason, scores=scores)
+        self.decisions[tier] += 1
+        if self._logging_enabled():
+            self._log({
+                "event": "decision",
+                "id": decision.id,
+                "router": self.name,
+                "tier": tier,
+                "reason": reason,
+                "scores": {label: round(score, 4) for label, score in scores.items()},
+                # Không ghi nội dung tin nhắn: chỉ hash (để nối với dữ liệu đã gán nhãn) và độ dài
+                "text_hash": text_hash(text),
+                "length": len(text)
+            })
+        return decision
+
+    def record_outcome(
+        self,
+        tier: str,
+        latency: float,
+        error: bool = False,
+        decision: Optional[RouteDecision] = None
+    ):
+        """Ghi nhận kết quả một lần gọi model của một hạng.
+
+        Args:
+            tier: Hạng model đã phục vụ
+            latency: Thời gian gọi model (giây)
+            error: Lần gọi có lỗi hay không
+            decision: Quyết định định tuyến tương ứng (None nếu hạng được chọn thủ công)
+        """
+        if tier in self.tier_stats:
+            self.tier_stats[tier].record(latency, error)
+        if self._logging_enabled():
+            self._log({
+                "event": "outcome",
+                "id": decision.id if decision else None,
+                "tier": tier,
+                "latency_ms": round(latency * 1000, 2),
+                "error": error
+            })
+
+    @contextmanager
+    def observe(self, tier: str, decision: Optional[RouteDecision] = None) -> Iterator[None]:
+        """Đo thời gian và lỗi của khối lệnh gọi model trong `with`.
+
+        Lần gọi bị hủy (CancelledError) không được tính là kết quả.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        except Exception:
+            self.record_outcome(tier, time.perf_counter() - start, True, decision)
+            raise
+        self.record_outcome(tier, time.perf_counter() - start, False, decision)
+
+    def _logging_enabled(self) -> bool:
+        """Có cần ghi log quyết định/kết quả hay không."""
+        return bool(self.log_path) or logger.isEnabledFor(logging.DEBUG)
+
+    def _log(self, record: Dict[str, Any]):
+        """Ghi một bản ghi quyết định hoặc kết quả."""
+        record["ts"] = round(time.time(), 3)
+        line = json.dumps(record, ensure_ascii=False)
+        logger.debug(line)
+        if not self.log_path:
+            return
+        try:
+            with self._log_lock, open(self.log_path, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+        except OSError:
+            logger.exception("Không thể ghi log định tuyến")
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Lấy thống kê định tuyến.
+
+        Returns:
+            Dict gồm tên bộ định tuyến, số quyết định theo hạng và thống kê từng hạng
+        """
+        return {
+            "router": self.name,
+            "decisions": dict(self.decisions),
+            "tiers": {tier: stats.snapshot() for tier, stats in self.tier_stats.items()}
+        }
+
+class KeywordRouter(Router):
+    """Bộ định tuyến theo từ khóa và độ dài tin nhắn (hành vi cũ)."""
+
+    name = "keyword"
+
+    @classmethod
+    def from_config(cls, config: AppConfig) -> "KeywordRouter":
+        """Tạo bộ định tuyến từ cấu hình ứng dụng."""
+        return cls(stats_window=config.router_stats_window, log_path=config.router_log_path)
+
+    def _choose(self, text: str) -> Tuple[str, str, Dict[str, float]]:
+        lowered = text.lower()
+        if "phân tích chi tiết" in lowered or "advanced" in lowered:
+            return "advanced", "keyword", {}
+        elif len(text) < 30 or "quick" in lowered:
+            return "light", "keyword", {}
+        return "default", "keyword", {}
+
+class ClassifierRouter(Router):
+    """Bộ định tuyến theo bộ phân loại n-gram, chi phí và sức khỏe của từng hạng.
+
+    Điểm của mỗi hạng là xác suất từ bộ phân loại trừ đi `cost_weight * chi phí`.
+    Khi xác suất cao nhất dưới `min_confidence`, hạng FALLBACK_TIER được chọn
+    thay cho hạng có điểm cao nhất. Nếu hạng được chọn đang vượt mục tiêu độ trễ p95 hoặc tỷ lệ lỗi
+    (khi đã có đủ mẫu), hạng khỏe gần nó nhất (theo thứ tự chi phí) được chọn,
+    ưu tiên hạng có điểm cao hơn khi hai hạng cách đều. Cứ sau `min_samples`
+    lần tránh, một request được gửi thử tới hạng đó để phát hiện khi nó hồi phục.
+    """
+
+    name = "classifier"
+
+    def __init__(
+        self,
+        classifier: NgramClassifier,
+        tier_costs: Optional[Dict[str, float]] = None,
+        cost_weight: float = 0.02,
+        latency_targets: Optional[Dict[str, float]] = None,
+        max_error_rate: float = 0.2,
+        min_samples: int = 20,
+        stats_window: int = 200,
+        log_path: Optional[str] = None,
+        min_confidence: float = 0.5
+    ):
+        """Khởi tạo bộ định tuyến.
+
+        Args:
+            classifier: Bộ phân loại đã huấn luyện (và hiệu chỉnh)
+            tier_costs: Chi phí tương đối của mỗi hạng
+            cost_weight: Trọng số chi phí khi tính điểm
+            latency_targets: Mục tiêu độ trễ p95 (ms) của mỗi hạng
+            max_error_rate: Tỷ lệ lỗi tối đa trước khi tránh một hạng
+            min_samples: Số mẫu tối thiểu trước khi xét sức khỏe của một hạng
+            stats_window: Số kết quả gần nhất giữ lại cho mỗi hạng
+            log_path: File JSONL ghi quyết định và kết quả
+            min_confidence: Xác suất tối thiểu để tin lựa chọn của bộ phân loại
+        """
+        super().__init__(stats_window, log_path)
+        self.classifier = classifier
+        self.min_confidence = min_confidence
+        self.tier_costs = tier_costs or {}
+        self.cost_weight = cost_weight
+        self.latency_targets = latency_targets or {}
+        self.max_error_rate = max_error_rate
+        self.min_samples = min_samples
+        # Số lần tránh một hạng trước khi gửi thử một request tới hạng đó
+        self.probe_every = max(min_samples, 1)
+        self._avoided: Counter = Counter()
+
+    @classmethod
+    def from_config(cls, config: AppConfig) -> "ClassifierRouter":
+        """Tạo bộ định tuyến từ cấu hình, huấn luyện và hiệu chỉnh trên dữ liệu mẫu và ROUTER_TRAINING_PATH."""
+        examples = load_training_examples(config.router_training_path)
+        return cls(
+            NgramClassifier().fit(examples).calibrate(examples),
+            tier_costs=config.router_tier_costs,
+            cost_weight=config.router_cost_weight,
+            latency_targets=config.router_latency_targets,
+            max_error_rate=config.router_max_error_rate,
+            min_samples=config.router_min_samples,
+            stats_window=config.router_stats_window,
+            log_path=config.router_log_path,
+            min_confidence=config.router_min_confidence
+        )
+
+    def _unhealthy_reason(self, tier: str) -> Optional[str]:
+        """Lý do một hạng đang vượt mục tiêu (None nếu hạng khỏe hoặc chưa đủ mẫu)."""
+        if len(self.tier_stats[tier]) < self.min_samples:
+            return None
+        stats = self.tier_stats[tier].snapshot()
+        if stats["error_rate"] > self.max_error_rate:
+            return "error_rate"
+        target = self.latency_targets.get(tier)
+        if target and stats["latency_ms_p95"] > target:
+            return "latency"
+        return None
+
+    def _choose(self, text: str) -> Tuple[str, str, Dict[str, float]]:
+        probabilities = self.classifier.predict_proba(text)
+        scores = {
+            tier: probabilities.get(tier, 0.0) - self.cost_weight * self.tier_costs.get(tier, 0.0)
+            for tier in TIERS
+        }
+        best = max(scores, key=scores.get)
+        chosen_by = "classifier"
+        if max(probabilities.values(), default=0.0) < self.min_confidence:
+            best, chosen_by = FALLBACK_TIER, "low_confidence"
+        # Các hạng theo khoảng cách tới hạng tốt nhất, rồi theo điểm
+        ranked = sorted(TIERS, key=lambda tier: (abs(TIERS.index(tier) - TIERS.index(best)), -scores[tier]))
+        unhealthy = {}
+        for tier in ranked:
+            reason = self._unhealthy_reason(tier)
+            if reason is None:
+                if not unhealthy:
+                    return tier, chosen_by, scores
+                skipped = ",".join(f"{name}:{why}" for name, why in unhealthy.items())
+                return tier, f"avoid[{skipped}]", scores
+            # Thỉnh thoảng vẫn gửi thử để thống kê của hạng bị tránh được làm mới
+            self._avoided[tier] += 1
+            if self._avoided[tier] >= self.probe_every:
+                self._avoided[tier] = 0
+                return tier, f"probe[{reason}]", scores
+            unhealthy[tier] = reason
+        # Mọi hạng đều vượt mục tiêu: giữ lựa chọn ban đầu
+        return best, "all_unhealthy", scores
+
+def load_training_examples(path: Optional[str] = None) -> List[Tuple[str, str]]:
+    """Lấy dữ liệu huấn luyện: dữ liệu mẫu cùng các dòng {"text", "tier"} trong file JSONL.
+
+    Args:
+        path: File JSONL bổ sung (tùy chọn)
+
+    Returns:
+        Danh sách cặp (tin nhắn, hạng)
+    """
+    examples = list(SEED_EXAMPLES)
+    if not path:
+        return examples
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                if record.get("tier") in TIERS and record.get("text"):
+                    examples.append((record["text"], record["tier"]))
+    except (OSError, ValueError):
+        logger.exception(f"Không thể đọc dữ liệu huấn luyện định tuyến: {path}")
+    return examples
+
+# ===== ĐĂNG KÝ BỘ ĐỊNH TUYẾN =====
+ROUTERS: Dict[str, Callable[[AppConfig], Router]] = {
+    "classifier": ClassifierRouter.from_config,
+    "keyword": KeywordRouter.from_config,
+}
+
+# Bộ định tuyến mặc định của tiến trình và tên đăng ký của nó
+_default_router: Optional[Router] = None
+_default_router_name: Optional[str] = None
+
+def register_router(name: str, factory: Callable[[AppConfig], Router]):
+    """Đăng ký (hoặc thay thế) một bộ định tuyến.
+
+    Args:
+        name: Tên dùng trong biến môi trường ROUTER
+        factory: Hàm nhận AppConfig và trả về Router
+    """
+    global _default_router
+    ROUTERS[name] = factory
+    if _default_router_name == name:
+        _default_router = None
+
+def get_router(config: Optional[AppConfig] = None) -> Router:
+    """Lấy bộ định tuyến dùng chung của tiến trình.
+
+    Args:
+        config: Cấu hình dùng khi bộ định tuyến được tạo lần đầu (tùy chọn)
+
+    Returns:
+        Bộ định tuyến được chọn bởi ROUTER
+    """
+    global _default_router, _default_router_name
+    if _default_router is None:
+        config = config or AppConfig()
+        if config.router not in ROUTERS:
+            raise KeyError(f"Không tìm thấy bộ định tuyến: {config.router}")
+        _default_router = ROUTERS[config.router](config)
+        _default_router_name = config.router
+    return _default_router
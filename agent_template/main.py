@@ -14,9 +14,7 @@ from typing import Optional, Dict, Any
 
 from agent_template.config import AppConfig
 from agent_template.core.agent_service import AgentService
-from agent_template.core.cli_service import CLIService
-from agent_template.core.api_service import APIService
-from agent_template.memory.persistence import create_new_thread, Memory
+from agent_template.memory.storage import create_new_thread
 
 # Vô hiệu hóa logging từ httpx
 logging.getLogger("httpx").setLevel(logging.WARNING)
@@ -94,89 +92,129 @@ def ask_user_choice() -> Dict[str, Any]:
     
     return user_args
 
-async def main(args: Optional[Dict[str, Any]] = None):
-    """Hàm chính để khởi chạy ứng dụng.
+def parse_args() -> Dict[str, Any]:
+    """Phân tích tham số dòng lệnh.
+    
+    Returns:
+        Dict chứa các tùy chọn đã chọn
+    """
+    parser = argparse.ArgumentParser(description="Agent Template")
+    parser.add_argument(
+        "--thread", "-t", 
+        help="ID của luồng hội thoại để sử dụng"
+    )
+    parser.add_argument(
+        "--legacy", "-l", 
+        action="store_true", 
+        help="Sử dụng xử lý legacy thay vì LangGraph"
+    )
+    parser.add_argument(
+        "--api", "-a", 
+        action="store_true", 
+        help="Chạy ứng dụng dưới dạng HTTP API thay vì CLI"
+    )
+    parser.add_argument(
+        "--port", "-p", 
+        type=int, 
+        default=8000, 
+        help="Cổng cho API server (mặc định: 8000)"
+    )
+    parser.add_argument(
+        "--host", 
+        type=str, 
+        default="0.0.0.0", 
+        help="Host cho API server (mặc định: 0.0.0.0)"
+    )
+    parser.add_argument(
+        "--workers", "-w",
+        type=int,
+        default=None,
+        help="Số tiến trình worker cho API server (mặc định: 1, hoặc API_WORKERS)"
+    )
+    parser.add_argument(
+        "--interactive", "-i",
+        action="store_true",
+        help="Chạy trong chế độ tương tác (hỏi người dùng muốn CLI hay API)"
+    )
+    parsed_args = parser.parse_args()
+    
+    # Nếu người dùng yêu cầu chế độ tương tác
+    if parsed_args.interactive:
+        return ask_user_choice()
+    # Chuyển đổi Namespace thành dict
+    return vars(parsed_args)
+
+def create_config(args: Dict[str, Any]) -> AppConfig:
+    """Tạo cấu hình ứng dụng từ các tùy chọn.
     
     Args:
-        args: Các tham số dòng lệnh đã được phân tích (tùy chọn)
+        args: Các tùy chọn đã chọn
+    
+    Returns:
+        Cấu hình ứng dụng
     """
-    # Phân tích tham số dòng lệnh nếu chưa được cung cấp
-    if args is None:
-        parser = argparse.ArgumentParser(description="Agent Template")
-        parser.add_argument(
-            "--thread", "-t", 
-            help="ID của luồng hội thoại để sử dụng"
-        )
-        parser.add_argument(
-            "--legacy", "-l", 
-            action="store_true", 
-            help="Sử dụng xử lý legacy thay vì LangGraph"
-        )
-        parser.add_argument(
-            "--api", "-a", 
-            action="store_true", 
-            help="Chạy ứng dụng dưới dạng HTTP API thay vì CLI"
-        )
-        parser.add_argument(
-            "--port", "-p", 
-            type=int, 
-            default=8000, 
-            help="Cổng cho API server (mặc định: 8000)"
-        )
-        parser.add_argument(
-            "--host", 
-            type=str, 
-            default="0.0.0.0", 
-            help="Host cho API server (mặc định: 0.0.0.0)"
-        )
-        parser.add_argument(
-            "--interactive", "-i",
-            action="store_true",
-            help="Chạy trong chế độ tương tác (hỏi người dùng muốn CLI hay API)"
-        )
-        parsed_args = parser.parse_args()
-        
-        # Nếu người dùng yêu cầu chế độ tương tác
-        if parsed_args.interactive:
-            args = ask_user_choice()
-        else:
-            # Chuyển đổi Namespace thành dict
-            args = vars(parsed_args)
-    
-    # Tạo cấu hình ứng dụng
-    config = AppConfig(
+    # Số worker phải có trong môi trường trước khi backend lưu trữ được tạo
+    if args.get("workers"):
+        os.environ["API_WORKERS"] = str(args["workers"])
+    
+    return AppConfig(
         use_legacy=args.get("legacy", False),
         thread_id=args.get("thread") or create_new_thread(),
         api_host=args.get("host", "0.0.0.0"),
         api_port=args.get("port", 8000)
     )
+
+async def main(args: Optional[Dict[str, Any]] = None, config: Optional[AppConfig] = None):
+    """Hàm chính để khởi chạy ứng dụng trong event loop.
+    
+    Args:
+        args: Các tham số dòng lệnh đã được phân tích (tùy chọn)
+        config: Cấu hình đã tạo từ `args` (tùy chọn)
+    """
+    if args is None:
+        args = parse_args()
+    if config is None:
+        config = create_config(args)
     
     # Tạo agent service
     agent_service = AgentService(config)
     
     # Chạy ứng dụng dựa trên tham số
     if args.get("api", False):
-        # Chạy dưới dạng API server
+        # Chạy dưới dạng API server (FastAPI/uvicorn chỉ được import ở chế độ này)
+        from agent_template.core.api_service import APIService
         api_service = APIService(agent_service, config)
         print(f"\nKhởi động API server tại http://{config.api_host}:{config.api_port}")
         print("Nhấn Ctrl+C để dừng server.")
         await api_service.start()
     else:
         # Chạy dưới dạng CLI
+        from agent_template.core.cli_service import CLIService
         cli_service = CLIService(agent_service, config)
         await cli_service.start()
 
+def run(args: Dict[str, Any]):
+    """Khởi chạy ứng dụng từ dòng lệnh.
+    
+    Chế độ API nhiều worker chạy trình giám sát đồng bộ của uvicorn trên
+    luồng chính, trước khi có event loop; các chế độ khác chạy main().
+    
+    Args:
+        args: Các tùy chọn đã chọn
+    """
+    config = create_config(args)
+    if args.get("api", False) and config.api_workers > 1:
+        from agent_template.core.api_service import run_workers
+        print(f"\nKhởi động API server tại http://{config.api_host}:{config.api_port} ({config.api_workers} worker)")
+        print("Nhấn Ctrl+C để dừng server.")
+        run_workers(config)
+        return
+    asyncio.run(main(args, config))
+
 if __name__ == "__main__":
-    # Nếu không có tham số, chuyển sang chế độ tương tác
-    if len(sys.argv) == 1:
-        try:
-            asyncio.run(main(ask_user_choice()))
-        except KeyboardInterrupt:
-            print("\nĐã phát hiện Ctrl+C. Thoát ứng dụng...")
-            sys.exit(0)
-    else:
-        try:
-            asyncio.run(main())
-        except KeyboardInterrupt:
-            print("\nĐã phát hiện Ctrl+C. Thoát ứng dụng...")
-            sys.exit(0) 
\ No newline at end of file
+    try:
+        # Nếu không có tham số, chuyển sang chế độ tương tác
+        run(ask_user_choice() if len(sys.argv) == 1 else parse_args())
+    except KeyboardInterrupt:
+        print("\nĐã phát hiện Ctrl+C. Thoát ứng dụng...")
+        sys.exit(0)
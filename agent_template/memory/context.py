@@ -0,0 +1,291 @@
+"""
+Xây dựng ngữ cảnh hội thoại cho prompt.
+
+Module này giữ nguyên văn N lượt gần nhất trong giới hạn token và gộp các lượt
+cũ hơn vào một bản tóm tắt được cập nhật nền bởi light_agent. Ngữ cảnh được
+truyền cho agent dưới dạng message_history có cấu trúc.
+"""
+
+import asyncio
+import logging
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from pydantic import BaseModel
+from pydantic_ai.messages import (
+    ModelMessage, ModelRequest, ModelResponse, SystemPromptPart, TextPart, UserPromptPart
+)
+from pydantic_ai.settings import ModelSettings
+
+from agent_template.config import AppConfig
+from agent_template.memory.persistence import Deps, Memory, Message
+from agent_template.memory.model_history import load_model_turns, save_model_turn
+from agent_template.memory.storage import get_store
+from agent_template.utils.http_client import get_http_pool
+from agent_template.utils.prompts import get_current_date_str
+
+logger = logging.getLogger(__name__)
+
+class ConversationSummary(BaseModel):
+    """Bản tóm tắt các lượt cũ của một luồng hội thoại."""
+    summary: str = ""
+    summarized_count: int = 0  # Số tin nhắn đầu tiên đã được gộp vào bản tóm tắt
+    updated: Optional[str] = None
+
+# Loại dữ liệu phụ (và khóa) chứa bản tóm tắt của luồng ở backend lưu trữ
+SUMMARY = "summary"
+
+# Cấu hình mặc định khi không có AppConfig được truyền vào
+_default_config: Optional[AppConfig] = None
+
+# Các tác vụ tóm tắt đang chạy theo thread_id
+_summary_tasks: Dict[str, asyncio.Task] = {}
+
+def _get_config(config: Optional[AppConfig]) -> AppConfig:
+    """Lấy cấu hình được truyền vào hoặc cấu hình mặc định."""
+    global _default_config
+    if config is not None:
+        return config
+    if _default_config is None:
+        _default_config = AppConfig()
+    return _default_config
+
+def estimate_tokens(text: str) -> int:
+    """Ước lượng số token của một chuỗi (~4 ký tự mỗi token)."""
+    return len(text) // 4 + 1
+
+def format_messages(messages: List[Message]) -> str:
+    """Định dạng danh sách tin nhắn thành đoạn hội thoại."""
+    return "\n".join(f"{message.role}: {message.content}" for message in messages)
+
+# ===== LƯU TRỮ BẢN TÓM TẮT =====
+def load_summary(thread_id: str, config: Optional[AppConfig] = None) -> ConversationSummary:
+    """Tải bản tóm tắt của một luồng hội thoại.
+
+    Args:
+        thread_id: ID luồng hội thoại
+        config: Cấu hình ứng dụng (tùy chọn)
+
+    Returns:
+        Bản tóm tắt (rỗng nếu chưa có)
+    """
+    data = get_store(_get_config(config)).load_thread_data(thread_id, SUMMARY)
+    try:
+        return ConversationSummary(**data.get(SUMMARY, {}))
+    except ValueError:
+        return ConversationSummary()
+
+def save_summary(thread_id: str, summary: ConversationSummary, config: Optional[AppConfig] = None):
+    """Lưu bản tóm tắt của một luồng hội thoại.
+
+    Args:
+        thread_id: ID luồng hội thoại
+        summary: Bản tóm tắt cần lưu
+        config: Cấu hình ứng dụng (tùy chọn)
+    """
+    get_store(_get_config(config)).save_thread_data(thread_id, SUMMARY, SUMMARY, summary.model_dump())
+
+def delete_summary(thread_id: str, config: Optional[AppConfig] = None):
+    """Xóa bản tóm tắt của một luồng hội thoại (nếu có).
+
+    Args:
+        thread_id: ID luồng hội thoại
+        config: Cấu hình ứng dụng (tùy chọn)
+    """
+    get_store(_get_config(config)).delete_thread_data(thread_id, SUMMARY)
+
+# ===== CỬA SỔ LỊCH SỬ =====
+def select_recent_window(
+    messages: List[Message],
+    max_turns: int,
+    token_budget: int
+) -> Tuple[int, List[Message]]:
+    """Chọn các tin nhắn gần nhất trong giới hạn số lượt và token.
+
+    Args:
+        messages: Toàn bộ tin nhắn của luồng
+        max_turns: Số lượt (cặp human/ai) tối đa giữ nguyên văn
+        token_budget: Số token tối đa cho phần giữ nguyên văn
+
+    Returns:
+        Tuple gồm (chỉ số bắt đầu cửa sổ, danh sách tin nhắn trong cửa sổ);
+        cửa sổ luôn bắt đầu bằng một tin nhắn human
+    """
+    start = len(messages)
+    used_tokens = 0
+    max_messages = max_turns * 2
+
+    while start > 0 and len(messages) - start < max_messages:
+        cost = estimate_tokens(messages[start - 1].content)
+        if used_tokens + cost > token_budget:
+            break
+        used_tokens += cost
+        start -= 1
+
+    # Cửa sổ bắt đầu bằng tin nhắn human: tin nhắn ai mà tin nhắn human của nó
+    # bị cắt bởi ngân sách token được bỏ (nó được gộp vào bản tóm tắt)
+    while start < len(messages) and messages[start].role != "human":
+        start += 1
+
+    return start, messages[start:]
+
+def build_message_history(
+    thread_id: str,
+    memory: Memory,
+    system_prompt: str,
+    config: Optional[AppConfig] = None
+) -> List[ModelMessage]:
+    """Xây dựng message_history cho agent từ bản tóm tắt và cửa sổ lịch sử gần đây.
+
+    Thứ tự được giữ ổn định để provider cache được phần đầu prompt: system
+    prompt (không đổi giữa các lượt), bản tóm tắt, các lượt trong cửa sổ (dùng
+    model message đã lưu, gồm cả lệnh gọi công cụ, nếu có), rồi tới phần thay
+    đổi theo ngày ở cuối. Tin nhắn hiện tại được agent thêm sau cùng.
+
+    Args:
+        thread_id: ID luồng hội thoại
+        memory: Đối tượng Memory với lịch sử hội thoại
+        system_prompt: System prompt của agent sẽ xử lý lượt này
+        config: Cấu hình ứng dụng (tùy chọn)
+
+    Returns:
+        Danh sách model message truyền vào `message_history`
+    """
+    config = _get_config(config)
+    start, _ = select_recent_window(
+        memory.messages, config.history_max_turns, config.history_token_budget
+    )
+    summary = load_summary(thread_id, config) if config.history_summary_enabled else None
+
+    history: List[ModelMessage] = [ModelRequest(parts=[SystemPromptPart(system_prompt)])]
+    if summary and summary.summary:
+        history.append(ModelRequest(parts=[
+            SystemPromptPart(f"Tóm tắt cuộc trò chuyện trước đó:\n{summary.summary}")
+        ]))
+
+    turns = load_model_turns(thread_id, config) if start < len(memory.messages) else {}
+    messages = memory.messages
+    index = start
+    while index < len(messages):
+        message = messages[index]
+        if message.role == "human" and index in turns:
+            history.extend(turns[index])
+            index += 2
+            continue
+        # Lượt không có model message (bộ nhớ cũ, cache phản hồi, stream bị hủy)
+        if message.role == "human":
+            history.append(ModelRequest(parts=[UserPromptPart(message.content)]))
+        else:
+            history.append(ModelResponse(parts=[TextPart(message.content)]))
+        index += 1
+
+    history.append(ModelRequest(parts=[SystemPromptPart(get_current_date_str())]))
+    return history
+
+def with_system_prompt(history: List[ModelMessage], system_prompt: str) -> List[ModelMessage]:
+    """Thay system prompt ở đầu lịch sử (khi lượt được chuyển sang hạng model khác).
+
+    Args:
+        history: Lịch sử từ build_message_history()
+        system_prompt: System prompt của agent sẽ xử lý lượt này
+
+    Returns:
+        Lịch sử mới với system prompt đã thay, phần còn lại dùng chung
+    """
+    return [ModelRequest(parts=[SystemPromptPart(system_prompt)])] + history[1:]
+
+def save_turn_messages(
+    thread_id: str,
+    index: int,
+    messages: List[ModelMessage],
+    config: Optional[AppConfig] = None
+):
+    """Lưu model message của một lượt để dùng lại ở các lượt sau.
+
+    Args:
+        thread_id: ID luồng hội thoại
+        index: Vị trí tin nhắn human của lượt trong Memory
+        messages: Model message mới của lượt (result.new_messages())
+        config: Cấu hình ứng dụng (tùy chọn)
+    """
+    save_model_turn(thread_id, index, messages, _get_config(config))
+
+# ===== TÓM TẮT NỀN =====
+async def _update_summary(
+    thread_id: str,
+    messages: List[Message],
+    window_start: int,
+    summarizer,
+    config: AppConfig
+):
+    """Gộp các tin nhắn nằm ngoài cửa sổ vào bản tóm tắt của luồng."""
+    summary = load_summary(thread_id, config)
+    pending = messages[summary.summarized_count:window_start]
+    if not pending:
+        return
+
+    prompt = (
+        "Cập nhật bản tóm tắt cuộc trò chuyện bằng các tin nhắn mới. "
+        "Giữ lại các sự kiện, sở thích và thông tin quan trọng về người dùng, "
+        "trả lời chỉ bằng bản tóm tắt mới.\n\n"
+        f"Bản tóm tắt hiện tại:\n{summary.summary or '(chưa có)'}\n\n"
+        f"Tin nhắn mới:\n{format_messages(pending)}"
+    )
+    result = await summarizer.run(
+        prompt,
+        deps=Deps(client=get_http_pool().client),
+        model_settings=ModelSettings(max_tokens=config.history_summary_max_tokens)
+    )
+
+    save_summary(thread_id, ConversationSummary(
+        summary=str(result.data),
+        summarized_count=window_start,
+        updated=datetime.now().isoformat()
+    ), config)
+
+def schedule_summary_update(
+    thread_id: str,
+    memory: Memory,
+    summarizer,
+    config: Optional[AppConfig] = None
+) -> Optional[asyncio.Task]:
+    """Lên lịch cập nhật bản tóm tắt ngoài luồng xử lý request.
+
+    Chỉ chạy khi có tin nhắn đã rời khỏi cửa sổ mà chưa được tóm tắt, và
+    mỗi luồng hội thoại chỉ có tối đa một tác vụ tóm tắt tại một thời điểm.
+
+    Args:
+        thread_id: ID luồng hội thoại
+        memory: Đối tượng Memory sau khi đã thêm lượt mới
+        summarizer: Agent dùng để tóm tắt (thường là light_agent)
+        config: Cấu hình ứng dụng (tùy chọn)
+
+    Returns:
+        Tác vụ nền đã tạo, hoặc None nếu không cần tóm tắt
+    """
+    config = _get_config(config)
+    if not config.history_summary_enabled:
+        return None
+
+    running = _summary_tasks.get(thread_id)
+    if running is not None and not running.done():
+        return None
+
+    messages = list(memory.messages)
+    window_start, _ = select_recent_window(
+        messages, config.history_max_turns, config.history_token_budget
+    )
+    if window_start <= load_summary(thread_id, config).summarized_count:
+        return None
+
+    async def _run():
+        try:
+            await _update_summary(thread_id, messages, window_start, summarizer, config)
+        except Exception:
+            logger.exception(f"Lỗi khi tóm tắt hội thoại {thread_id}")
+        finally:
+            _summary_tasks.pop(thread_id, None)
+
+    task = asyncio.create_task(_run())
+    _summary_tasks[thread_id] = task
+    return task
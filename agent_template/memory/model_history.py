@@ -0,0 +1,128 @@
+"""
+Lịch sử dạng model message của từng luồng hội thoại.
+
+Bộ nhớ hội thoại (Memory) chỉ giữ văn bản human/ai của mỗi lượt. Module này lưu
+thêm các model message của pydantic-ai cho từng lượt, gồm cả lệnh gọi và kết
+quả công cụ, để lượt sau gửi lại lịch sử dưới dạng message_history có cấu trúc
+thay vì một chuỗi định dạng lại mỗi lần. Mỗi lượt là một khóa trong dữ liệu phụ
+"model_turns" của luồng ở backend lưu trữ đang dùng (MEMORY_BACKEND), nên lưu
+một lượt chỉ ghi lượt đó; chỉ các lượt có thể còn nằm trong cửa sổ lịch sử được
+giữ lại.
+"""
+
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Tuple
+
+from pydantic_ai.messages import ModelMessage, ModelMessagesTypeAdapter, ModelRequest, SystemPromptPart
+
+from agent_template.config import AppConfig
+from agent_template.memory.storage import get_store
+
+# Loại dữ liệu phụ của luồng chứa model message theo lượt
+MODEL_TURNS = "model_turns"
+
+# Số luồng tối đa giữ các lượt đã phân tích trong cache
+MAX_CACHED_THREADS = 256
+
+# thread_id -> (dữ liệu thô backend trả về, các lượt đã phân tích), theo thứ tự
+# dùng gần nhất; chỉ dùng với backend trả lại cùng dict khi dữ liệu chưa đổi
+_cache: "OrderedDict[str, Tuple[Dict[str, Any], Dict[int, List[ModelMessage]]]]" = OrderedDict()
+_cache_lock = threading.Lock()
+
+def load_model_turns(thread_id: str, config: AppConfig) -> Dict[int, List[ModelMessage]]:
+    """Tải các model message đã lưu của một luồng.
+
+    Args:
+        thread_id: ID luồng hội thoại
+        config: Cấu hình ứng dụng
+
+    Returns:
+        Dict vị trí tin nhắn human của lượt trong Memory -> model message của
+        lượt đó (rỗng nếu chưa có); không được sửa
+    """
+    store = get_store(config)
+    raw = store.load_thread_data(thread_id, MODEL_TURNS)
+    if not raw or not store.caches_thread_data:
+        evict_model_turns(thread_id)
+        return _parse(raw)
+
+    # Backend file trả lại cùng dict khi dữ liệu chưa đổi: khỏi phân tích lại
+    with _cache_lock:
+        cached = _cache.get(thread_id)
+        if cached is not None and cached[0] is raw:
+            _cache.move_to_end(thread_id)
+            return cached[1]
+
+    turns = _parse(raw)
+    with _cache_lock:
+        _cache[thread_id] = (raw, turns)
+        _cache.move_to_end(thread_id)
+        while len(_cache) > MAX_CACHED_THREADS:
+            _cache.popitem(last=False)
+    return turns
+
+def _parse(raw: Dict[str, Any]) -> Dict[int, List[ModelMessage]]:
+    """Phân tích dữ liệu thô thành model message theo lượt (rỗng nếu dữ liệu hỏng)."""
+    try:
+        return {
+            int(index): ModelMessagesTypeAdapter.validate_python(messages)
+            for index, messages in raw.items()
+        }
+    except ValueError:
+        return {}
+
+def evict_model_turns(thread_id: str):
+    """Bỏ các lượt đã phân tích của một luồng khỏi cache (ví dụ khi luồng bị xóa).
+
+    Args:
+        thread_id: ID luồng hội thoại
+    """
+    with _cache_lock:
+        _cache.pop(thread_id, None)
+
+def save_model_turn(
+    thread_id: str,
+    index: int,
+    messages: List[ModelMessage],
+    config: AppConfig
+):
+    """Lưu model message của một lượt mới.
+
+    System prompt không được lưu: nó được thêm lại ở đầu mỗi lượt theo hạng
+    model đang dùng. Các lượt đã nằm ngoài cửa sổ lịch sử (HISTORY_MAX_TURNS)
+    bị xóa để dữ liệu không lớn dần.
+
+    Args:
+        thread_id: ID luồng hội thoại
+        index: Vị trí tin nhắn human của lượt trong Memory
+        messages: Model message mới của lượt (result.new_messages())
+        config: Cấu hình ứng dụng
+    """
+    stored = []
+    for message in messages:
+        if isinstance(message, ModelRequest):
+            parts = [part for part in message.parts if not isinstance(part, SystemPromptPart)]
+            if not parts:
+                continue
+            message = ModelRequest(parts=parts, kind=message.kind)
+        stored.append(message)
+
+    store = get_store(config)
+    store.save_thread_data(
+        thread_id, MODEL_TURNS, str(index), ModelMessagesTypeAdapter.dump_python(stored, mode="json")
+    )
+    oldest = index - 2 * (config.history_max_turns - 1)
+    stale = [key for key in store.load_thread_data(thread_id, MODEL_TURNS) if int(key) < oldest]
+    if stale:
+        store.delete_thread_data(thread_id, MODEL_TURNS, stale)
+
+def delete_model_turns(thread_id: str, config: AppConfig):
+    """Xóa model message đã lưu của một luồng (nếu có).
+
+    Args:
+        thread_id: ID luồng hội thoại
+        config: Cấu hình ứng dụng
+    """
+    evict_model_turns(thread_id)
+    get_store(config).delete_thread_data(thread_id, MODEL_TURNS)
@@ -0,0 +1,334 @@
+"""
+Backend lưu trữ dạng log phân đoạn chỉ ghi nối (append-only).
+
+Mỗi luồng hội thoại là một thư mục chứa các file segment đánh số tăng dần.
+Mỗi lượt chỉ ghi nối các Message mới vào segment đang mở, segment cũ được
+gộp (compact) ở chế độ nền và bản ghi cuối bị ghi dở sẽ được cắt bỏ khi đọc.
+Dữ liệu phụ của luồng nằm trong thư mục `_data` cạnh các thư mục luồng.
+"""
+
+import json
+import logging
+import os
+import shutil
+import threading
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, List, Optional, Tuple
+
+from agent_template.memory.persistence import Memory, Message
+from agent_template.memory.storage import ConversationStore
+from agent_template.memory.thread_data import ThreadDataLog
+
+logger = logging.getLogger(__name__)
+
+SEGMENT_SUFFIX = ".log"
+
+def _encode_record(record: Dict[str, Any]) -> bytes:
+    """Mã hóa một bản ghi thành dòng `<crc32> <json>\\n`."""
+    payload = json.dumps(record, ensure_ascii=False).encode("utf-8")
+    return b"%08x " % zlib.crc32(payload) + payload + b"\n"
+
+def _decode_record(line: bytes) -> Optional[Dict[str, Any]]:
+    """Giải mã một dòng bản ghi, trả về None nếu dòng bị hỏng hoặc ghi dở."""
+    if not line.endswith(b"\n") or len(line) < 10:
+        return None
+    checksum, payload = line[:8], line[9:-1]
+    try:
+        if int(checksum, 16) != zlib.crc32(payload):
+            return None
+        return json.loads(payload)
+    except ValueError:
+        return None
+
+class SegmentLogStore(ConversationStore):
+    """Lưu trữ hội thoại bằng log phân đoạn chỉ ghi nối cho mỗi luồng.
+
+    Ghi một lượt chỉ tốn chi phí tỷ lệ với số tin nhắn mới thay vì toàn bộ
+    lịch sử. Các thao tác trên cùng một luồng được tuần tự hóa bằng khóa.
+    """
+
+    def __init__(
+        self,
+        root_dir: str,
+        segment_max_bytes: int = 1024 * 1024,
+        compact_segments: int = 4
+    ):
+        """Khởi tạo backend log phân đoạn.
+
+        Args:
+            root_dir: Thư mục gốc chứa thư mục của từng luồng
+            segment_max_bytes: Kích thước tối đa của một segment trước khi mở segment mới
+            compact_segments: Số segment đã đóng để kích hoạt gộp nền
+        """
+        self.root_dir = root_dir
+        self.segment_max_bytes = segment_max_bytes
+        self.compact_segments = compact_segments
+        os.makedirs(root_dir, exist_ok=True)
+
+        self._locks: Dict[str, threading.Lock] = {}
+        self._locks_guard = threading.Lock()
+        self._counts: Dict[str, int] = {}
+        self._compactor: Optional[ThreadPoolExecutor] = None
+        # Các luồng đang chờ/đang gộp; được sửa từ cả luồng gộp nền
+        self._compacting: set = set()
+        self._compacting_lock = threading.Lock()
+
+        # Chỉ mục metadata và dữ liệu phụ nằm cạnh thư mục các luồng
+        self.data = ThreadDataLog(os.path.join(root_dir, "_data"))
+        self.index = self._open_index(os.path.join(root_dir, "_index.log"))
+
+    # ===== TIỆN ÍCH NỘI BỘ =====
+    def _lock(self, thread_id: str) -> threading.Lock:
+        """Lấy khóa của một luồng hội thoại."""
+        with self._locks_guard:
+            return self._locks.setdefault(thread_id, threading.Lock())
+
+    def _thread_dir(self, thread_id: str) -> str:
+        """Thư mục chứa các segment của một luồng."""
+        return os.path.join(self.root_dir, thread_id)
+
+    def _segments(self, thread_id: str) -> List[Tuple[int, str]]:
+        """Liệt kê các segment của luồng theo thứ tự số hiệu."""
+        thread_dir = self._thread_dir(thread_id)
+        if not os.path.isdir(thread_dir):
+            return []
+        segments = []
+        for name in os.listdir(thread_dir):
+            if name.endswith(SEGMENT_SUFFIX):
+                try:
+                    segments.append((int(name[:-len(SEGMENT_SUFFIX)]), os.path.join(thread_dir, name)))
+                except ValueError:
+                    continue
+        return sorted(segments)
+
+    def _segment_path(self, thread_id: str, number: int) -> str:
+        """Đường dẫn của segment theo số hiệu."""
+        return os.path.join(self._thread_dir(thread_id), f"{number:08d}{SEGMENT_SUFFIX}")
+
+    def _read_segment(self, path: str, repair: bool) -> List[Dict[str, Any]]:
+        """Đọc các bản ghi hợp lệ của một segment.
+
+        Nếu gặp bản ghi hỏng (ghi dở do sự cố), phần còn lại của file bị bỏ qua
+        và được cắt khỏi file khi `repair` là True.
+        """
+        records = []
+        valid_bytes = 0
+        with open(path, "rb") as f:
+            for line in f:
+                record = _decode_record(line)
+                if record is None:
+                    break
+                records.append(record)
+                valid_bytes += len(line)
+
+        if repair and valid_bytes < os.path.getsize(path):
+            logger.warning(f"Cắt bản ghi ghi dở ở cuối segment {path}")
+            with open(path, "r+b") as f:
+                f.truncate(valid_bytes)
+        return records
+
+    def _live_segments(self, thread_id: str) -> List[Tuple[int, str]]:
+        """Lấy các segment còn hiệu lực, dọn các segment đã được gộp.
+
+        Segment gộp bắt đầu bằng bản ghi meta `{"compacted_from": n}`; mọi
+        segment có số hiệu trong khoảng [n, số hiệu segment gộp) là bản cũ
+        còn sót lại nếu tiến trình dừng giữa lúc gộp.
+        """
+        segments = self._segments(thread_id)
+        live = []
+        covered_from = None
+        for number, path in reversed(segments):
+            if covered_from is not None and number >= covered_from:
+                os.remove(path)
+                continue
+            live.append((number, path))
+            with open(path, "rb") as f:
+                first = _decode_record(f.readline())
+            if first and "compacted_from" in first:
+                covered_from = first["compacted_from"]
+        return list(reversed(live))
+
+    def _read_messages(self, thread_id: str) -> List[Dict[str, Any]]:
+        """Đọc toàn bộ tin nhắn của luồng từ các segment."""
+        segments = self._live_segments(thread_id)
+        messages = []
+        for index, (_, path) in enumerate(segments):
+            is_last = index == len(segments) - 1
+            for record in self._read_segment(path, repair=is_last):
+                if "message" in record:
+                    messages.append(record["message"])
+        return messages
+
+    def _write_segment(self, path: str, records: List[Dict[str, Any]]):
+        """Ghi một segment mới qua file tạm rồi thay thế nguyên tử vào `path`."""
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(b"".join(_encode_record(record) for record in records))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+    def _rewrite(self, thread_id: str, messages: List[Message]):
+        """Viết lại toàn bộ luồng (gọi khi đã giữ khóa), an toàn khi tiến trình dừng giữa chừng.
+
+        Toàn bộ tin nhắn được ghi vào một segment mới có số hiệu lớn hơn mọi
+        segment hiện có, bắt đầu bằng bản ghi meta `{"compacted_from": n}` phủ
+        tất cả segment cũ. Segment mới chỉ xuất hiện (qua os.replace) khi đã
+        ghi xong; trước đó các segment cũ vẫn nguyên vẹn, sau đó chúng là bản
+        cũ và được dọn bởi _live_segments.
+        """
+        os.makedirs(self._thread_dir(thread_id), exist_ok=True)
+        segments = self._segments(thread_id)
+        compacted_from = segments[0][0] if segments else 1
+        number = segments[-1][0] + 1 if segments else 1
+        records = [{"compacted_from": compacted_from}]
+        records.extend({"message": message.model_dump()} for message in messages)
+        self._write_segment(self._segment_path(thread_id, number), records)
+        self._live_segments(thread_id)
+
+    def _append(self, thread_id: str, messages: List[Message]):
+        """Ghi nối các tin nhắn vào segment đang mở (gọi khi đã giữ khóa)."""
+        os.makedirs(self._thread_dir(thread_id), exist_ok=True)
+        segments = self._live_segments(thread_id)
+        if segments and os.path.getsize(segments[-1][1]) < self.segment_max_bytes:
+            path = segments[-1][1]
+        else:
+            path = self._segment_path(thread_id, segments[-1][0] + 1 if segments else 1)
+
+        data = b"".join(_encode_record({"message": message.model_dump()}) for message in messages)
+        with open(path, "ab") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+
+    # ===== GỘP SEGMENT NỀN =====
+    def _maybe_schedule_compaction(self, thread_id: str):
+        """Lên lịch gộp segment nếu số segment đã đóng vượt ngưỡng."""
+        if len(self._segments(thread_id)) - 1 < self.compact_segments:
+            return
+        with self._compacting_lock:
+            if thread_id in self._compacting:
+                return
+            if self._compactor is None:
+                self._compactor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="segment-compactor")
+            self._compacting.add(thread_id)
+            self._compactor.submit(self._compact_in_background, thread_id)
+
+    def _compact_in_background(self, thread_id: str):
+        """Chạy gộp segment trên luồng nền."""
+        try:
+            self.compact(thread_id)
+        except Exception:
+            logger.exception(f"Lỗi khi gộp segment của hội thoại {thread_id}")
+        finally:
+            with self._compacting_lock:
+                self._compacting.discard(thread_id)
+
+    def compact(self, thread_id: str):
+        """Gộp tất cả segment đã đóng của một luồng thành một segment.
+
+        Segment đang mở không bị đụng tới. Bản gộp được ghi ra file tạm rồi
+        thay thế nguyên tử vào vị trí segment đã đóng cuối cùng.
+
+        Args:
+            thread_id: ID luồng hội thoại
+        """
+        with self._lock(thread_id):
+            sealed = self._live_segments(thread_id)[:-1]
+            if len(sealed) < 2:
+                return
+
+            # Giữ phạm vi của lần gộp trước để bản cũ còn sót vẫn được nhận ra
+            compacted_from = sealed[0][0]
+            records = []
+            for _, path in sealed:
+                for record in self._read_segment(path, repair=False):
+                    if "message" in record:
+                        records.append(record)
+                    elif "compacted_from" in record:
+                        compacted_from = min(compacted_from, record["compacted_from"])
+            records.insert(0, {"compacted_from": compacted_from})
+
+            target_number, target_path = sealed[-1]
+            self._write_segment(target_path, records)
+
+            for number, path in sealed[:-1]:
+                os.remove(path)
+
+    # ===== API LƯU TRỮ =====
+    def create_thread(self, thread_id: str):
+        """Ghi nhận luồng mới trong chỉ mục metadata."""
+        self.index.upsert(thread_id, 0)
+
+    def save_memory(self, thread_id: str, memory: Memory):
+        """Lưu bộ nhớ của luồng bằng cách chỉ ghi nối các tin nhắn mới.
+
+        Args:
+            thread_id: ID luồng hội thoại
+            memory: Đối tượng Memory cần lưu
+        """
+        with self._lock(thread_id):
+            persisted = self._counts.get(thread_id)
+            if persisted is None:
+                persisted = len(self._read_messages(thread_id))
+
+            messages = list(memory.messages)
+            rewrite = len(messages) < persisted
+            # Bộ nhớ bị rút ngắn (ví dụ ghi đè lịch sử): viết lại toàn bộ luồng
+            new_messages = messages if rewrite else messages[persisted:]
+            if new_messages or rewrite:
+                try:
+                    if rewrite:
+                        self._rewrite(thread_id, messages)
+                    else:
+                        self._append(thread_id, new_messages)
+                except Exception:
+                    # Lần ghi sau sẽ đọc lại (và sửa) log thay vì tin vào bộ đếm cũ
+                    self._counts.pop(thread_id, None)
+                    raise
+            self._counts[thread_id] = len(messages)
+            if new_messages or rewrite or self.index.get(thread_id) is None:
+                self.index.upsert(thread_id, len(messages))
+
+        self._maybe_schedule_compaction(thread_id)
+
+    def load_memory(self, thread_id: str) -> Memory:
+        """Tải bộ nhớ của một luồng hội thoại.
+
+        Args:
+            thread_id: ID luồng hội thoại
+
+        Returns:
+            Đối tượng Memory (rỗng nếu luồng chưa tồn tại)
+        """
+        with self._lock(thread_id):
+            messages = self._read_messages(thread_id)
+            self._counts[thread_id] = len(messages)
+        return Memory(messages=[Message(**message) for message in messages])
+
+    def list_conversations(self) -> List[str]:
+        """Liệt kê ID của tất cả các luồng hội thoại (bỏ qua các mục nội bộ bắt đầu bằng "_")."""
+        return sorted(
+            name for name in os.listdir(self.root_dir)
+            if not name.startswith("_") and os.path.isdir(os.path.join(self.root_dir, name))
+        )
+
+    def get_conversation_history(self, thread_id: str) -> List[Dict[str, Any]]:
+        """Lấy lịch sử tin nhắn của một luồng dưới dạng dict."""
+        with self._lock(thread_id):
+            return self._read_messages(thread_id)
+
+    def delete_conversation(self, thread_id: str):
+        """Xóa toàn bộ segment và dữ liệu phụ của một luồng hội thoại."""
+        with self._lock(thread_id):
+            shutil.rmtree(self._thread_dir(thread_id), ignore_errors=True)
+            self._counts.pop(thread_id, None)
+            self.data.delete(thread_id)
+            self.index.remove(thread_id)
+
+    def close(self):
+        """Chờ các tác vụ gộp nền hoàn tất."""
+        if self._compactor is not None:
+            self._compactor.shutdown(wait=True)
+            self._compactor = None
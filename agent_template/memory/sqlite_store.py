@@ -0,0 +1,232 @@
+"""
+Backend lưu trữ hội thoại bằng SQLite.
+
+Dữ liệu nằm trong một file SQLite ở chế độ WAL với bảng threads và messages
+có chỉ mục, phù hợp khi số lượng luồng hội thoại lớn. Dữ liệu phụ của luồng
+nằm trong bảng thread_data, mỗi khóa một dòng.
+"""
+
+import json
+import os
+import sqlite3
+import threading
+from datetime import datetime
+from typing import Dict, Any, List, Optional, Tuple
+
+from agent_template.memory.persistence import Memory, Message
+from agent_template.memory.storage import ConversationStore
+from agent_template.memory.thread_index import encode_cursor, decode_cursor
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS threads (
+    id TEXT PRIMARY KEY,
+    created TEXT NOT NULL,
+    last_updated TEXT NOT NULL,
+    message_count INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS idx_threads_last_updated ON threads (last_updated, id);
+CREATE TABLE IF NOT EXISTS messages (
+    thread_id TEXT NOT NULL REFERENCES threads (id) ON DELETE CASCADE,
+    seq INTEGER NOT NULL,
+    role TEXT NOT NULL,
+    content TEXT NOT NULL,
+    timestamp TEXT,
+    PRIMARY KEY (thread_id, seq)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS thread_data (
+    thread_id TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    key TEXT NOT NULL,
+    value TEXT NOT NULL,
+    PRIMARY KEY (thread_id, kind, key)
+) WITHOUT ROWID;
+"""
+
+# Các câu lệnh cố định được sqlite3 cache dưới dạng prepared statement
+SQL_GET_COUNT = "SELECT message_count FROM threads WHERE id = ?"
+SQL_UPSERT_THREAD = """
+INSERT INTO threads (id, created, last_updated, message_count) VALUES (?, ?, ?, ?)
+ON CONFLICT (id) DO UPDATE SET last_updated = excluded.last_updated,
+                               message_count = excluded.message_count
+"""
+SQL_INSERT_MESSAGE = "INSERT INTO messages (thread_id, seq, role, content, timestamp) VALUES (?, ?, ?, ?, ?)"
+SQL_DELETE_MESSAGES = "DELETE FROM messages WHERE thread_id = ?"
+SQL_SELECT_MESSAGES = "SELECT role, content, timestamp FROM messages WHERE thread_id = ? ORDER BY seq"
+SQL_LIST_THREADS = "SELECT id FROM threads ORDER BY id"
+SQL_GET_THREAD = "SELECT id, created, last_updated, message_count FROM threads WHERE id = ?"
+SQL_PAGE_THREADS = """
+SELECT id, created, last_updated, message_count FROM threads
+ORDER BY last_updated DESC, id DESC LIMIT ?
+"""
+SQL_PAGE_THREADS_AFTER = """
+SELECT id, created, last_updated, message_count FROM threads
+WHERE (last_updated, id) < (?, ?)
+ORDER BY last_updated DESC, id DESC LIMIT ?
+"""
+SQL_DELETE_THREAD = "DELETE FROM threads WHERE id = ?"
+SQL_SELECT_DATA = "SELECT key, value FROM thread_data WHERE thread_id = ? AND kind = ?"
+SQL_UPSERT_DATA = """
+INSERT INTO thread_data (thread_id, kind, key, value) VALUES (?, ?, ?, ?)
+ON CONFLICT (thread_id, kind, key) DO UPDATE SET value = excluded.value
+"""
+SQL_DELETE_DATA_KEY = "DELETE FROM thread_data WHERE thread_id = ? AND kind = ? AND key = ?"
+SQL_DELETE_DATA_KIND = "DELETE FROM thread_data WHERE thread_id = ? AND kind = ?"
+SQL_DELETE_DATA = "DELETE FROM thread_data WHERE thread_id = ?"
+
+class SqliteStore(ConversationStore):
+    """Lưu trữ hội thoại trong SQLite (WAL) với chỉ mục cho threads và messages.
+
+    Mỗi luồng hệ điều hành dùng một kết nối riêng; WAL cho phép đọc song song
+    trong khi một kết nối khác đang ghi.
+    """
+
+    blocking = True
+
+    def __init__(self, db_path: str, busy_timeout: float = 5.0):
+        """Khởi tạo backend SQLite.
+
+        Args:
+            db_path: Đường dẫn file cơ sở dữ liệu
+            busy_timeout: Thời gian (giây) chờ khi cơ sở dữ liệu đang bị khóa
+        """
+        self.db_path = db_path
+        self.busy_timeout = busy_timeout
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+
+        self._local = threading.local()
+        self._connections: List[sqlite3.Connection] = []
+        self._connections_lock = threading.Lock()
+
+        conn = self._connection()
+        conn.executescript(SCHEMA)
+
+    def _connection(self) -> sqlite3.Connection:
+        """Lấy kết nối SQLite của luồng hiện tại, tạo mới nếu chưa có."""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(
+                self.db_path,
+                timeout=self.busy_timeout,
+                check_same_thread=False,
+                cached_statements=64
+            )
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA foreign_keys=ON")
+            self._local.conn = conn
+            with self._connections_lock:
+                self._connections.append(conn)
+        return conn
+
+    def create_thread(self, thread_id: str):
+        """Tạo bản ghi cho một luồng hội thoại mới."""
+        now = datetime.now().isoformat()
+        conn = self._connection()
+        with conn:
+            conn.execute(
+                "INSERT OR IGNORE INTO threads (id, created, last_updated, message_count) VALUES (?, ?, ?, 0)",
+                (thread_id, now, now)
+            )
+
+    def save_memory(self, thread_id: str, memory: Memory):
+        """Lưu bộ nhớ của luồng, chỉ chèn (theo lô) các tin nhắn mới.
+
+        Args:
+            thread_id: ID luồng hội thoại
+            memory: Đối tượng Memory cần lưu
+        """
+        messages = list(memory.messages)
+        now = datetime.now().isoformat()
+        conn = self._connection()
+        with conn:
+            # Giữ khóa ghi ngay từ đầu để bộ đếm không bị tiến trình khác thay đổi
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute(SQL_GET_COUNT, (thread_id,)).fetchone()
+            persisted = row[0] if row else 0
+
+            if len(messages) < persisted:
+                # Bộ nhớ bị rút ngắn: viết lại toàn bộ luồng
+                conn.execute(SQL_DELETE_MESSAGES, (thread_id,))
+                persisted = 0
+
+            conn.execute(SQL_UPSERT_THREAD, (thread_id, now, now, len(messages)))
+            conn.executemany(SQL_INSERT_MESSAGE, [
+                (thread_id, seq, message.role, message.content, getattr(message, "timestamp", None))
+                for seq, message in enumerate(messages[persisted:], start=persisted)
+            ])
+
+    def _select_messages(self, thread_id: str) -> List[Dict[str, Any]]:
+        """Đọc tin nhắn của một luồng theo thứ tự."""
+        rows = self._connection().execute(SQL_SELECT_MESSAGES, (thread_id,)).fetchall()
+        return [{"role": role, "content": content, "timestamp": timestamp} for role, content, timestamp in rows]
+
+    def load_memory(self, thread_id: str) -> Memory:
+        """Tải bộ nhớ của một luồng hội thoại."""
+        return Memory(messages=[Message(**message) for message in self._select_messages(thread_id)])
+
+    def list_conversations(self) -> List[str]:
+        """Liệt kê ID của tất cả các luồng hội thoại."""
+        return [row[0] for row in self._connection().execute(SQL_LIST_THREADS)]
+
+    def get_conversation_history(self, thread_id: str) -> List[Dict[str, Any]]:
+        """Lấy lịch sử tin nhắn của một luồng dưới dạng dict."""
+        return self._select_messages(thread_id)
+
+    def get_thread_info(self, thread_id: str) -> Optional[Dict[str, Any]]:
+        """Lấy metadata của một luồng từ bảng threads."""
+        row = self._connection().execute(SQL_GET_THREAD, (thread_id,)).fetchone()
+        if row is None:
+            return None
+        return dict(zip(("id", "created", "last_updated", "message_count"), row))
+
+    def list_threads(self, limit: int = 20, cursor: Optional[str] = None) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        """Lấy một trang luồng theo last_updated giảm dần (keyset pagination trên chỉ mục)."""
+        conn = self._connection()
+        # Lấy dư một bản ghi để biết còn trang kế tiếp hay không
+        if cursor:
+            last_updated, thread_id = decode_cursor(cursor)
+            rows = conn.execute(SQL_PAGE_THREADS_AFTER, (last_updated, thread_id, limit + 1)).fetchall()
+        else:
+            rows = conn.execute(SQL_PAGE_THREADS, (limit + 1,)).fetchall()
+
+        items = [dict(zip(("id", "created", "last_updated", "message_count"), row)) for row in rows[:limit]]
+        next_cursor = None
+        if len(rows) > limit and items:
+            next_cursor = encode_cursor(items[-1]["last_updated"], items[-1]["id"])
+        return items, next_cursor
+
+    def delete_conversation(self, thread_id: str):
+        """Xóa một luồng cùng toàn bộ tin nhắn và dữ liệu phụ của nó."""
+        conn = self._connection()
+        with conn:
+            conn.execute(SQL_DELETE_MESSAGES, (thread_id,))
+            conn.execute(SQL_DELETE_DATA, (thread_id,))
+            conn.execute(SQL_DELETE_THREAD, (thread_id,))
+
+    def load_thread_data(self, thread_id: str, kind: str) -> Dict[str, Any]:
+        """Đọc dữ liệu phụ `kind` của luồng từ bảng thread_data."""
+        rows = self._connection().execute(SQL_SELECT_DATA, (thread_id, kind)).fetchall()
+        return {key: json.loads(value) for key, value in rows}
+
+    def save_thread_data(self, thread_id: str, kind: str, key: str, value: Any):
+        """Ghi (chèn hoặc thay) một khóa của dữ liệu phụ."""
+        conn = self._connection()
+        with conn:
+            conn.execute(SQL_UPSERT_DATA, (thread_id, kind, key, json.dumps(value, ensure_ascii=False)))
+
+    def delete_thread_data(self, thread_id: str, kind: str, keys: Optional[List[str]] = None):
+        """Xóa các khóa (None để xóa tất cả) của dữ liệu phụ `kind`."""
+        conn = self._connection()
+        with conn:
+            if keys is None:
+                conn.execute(SQL_DELETE_DATA_KIND, (thread_id, kind))
+            else:
+                conn.executemany(SQL_DELETE_DATA_KEY, [(thread_id, kind, key) for key in keys])
+
+    def close(self):
+        """Đóng tất cả kết nối SQLite đã mở."""
+        with self._connections_lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections.clear()
+        self._local = threading.local()
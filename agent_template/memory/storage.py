@@ -0,0 +1,466 @@
+"""
+Lựa chọn backend lưu trữ hội thoại.
+
+Module này định nghĩa giao diện ConversationStore và cung cấp cùng API với
+memory.persistence (save_memory, load_memory, list_conversations, ...) nhưng
+chuyển tiếp tới backend được chọn qua MEMORY_BACKEND: "file" (mặc định, một
+file cho mỗi luồng), "segment_log" hoặc "sqlite". Khi MEMORY_FLUSH_INTERVAL > 0,
+các lần ghi được gộp lại (CoalescingStore) và xả xuống backend sau khoảng đó. Dữ liệu
+phụ của luồng (ví dụ model message của từng lượt) cũng nằm trong backend đó
+(load_thread_data, save_thread_data, delete_thread_data).
+"""
+
+import asyncio
+import logging
+import os
+import threading
+from datetime import datetime
+from typing import Callable, Dict, Any, List, Optional, Tuple
+
+from agent_template.config import AppConfig
+from agent_template.memory import persistence
+from agent_template.memory.persistence import Memory
+from agent_template.memory.thread_data import ThreadDataLog
+from agent_template.memory.thread_index import ThreadIndex
+
+logger = logging.getLogger(__name__)
+
+class ConversationStore:
+    """Giao diện chung của các backend lưu trữ hội thoại.
+
+    Backend mới cần cài đặt các phương thức dưới đây và được đăng ký trong
+    create_store(). Backend dựa trên file dùng ThreadIndex (self.index) để
+    trả lời list_threads/get_thread_info mà không đọc lịch sử tin nhắn, và
+    ThreadDataLog (self.data) cho dữ liệu phụ của luồng.
+    """
+
+    index: Optional[ThreadIndex] = None
+    data: Optional[ThreadDataLog] = None
+    # Lệnh gọi có thể chặn lâu (ví dụ chờ khóa ghi SQLite) nên chạy ngoài event loop
+    blocking: bool = False
+
+    def _open_index(self, path: str) -> ThreadIndex:
+        """Mở chỉ mục metadata, xây dựng lại một lần từ dữ liệu cũ nếu chưa có."""
+        index = ThreadIndex(path)
+        if not index.existed:
+            for thread_id in self.list_conversations():
+                history = self.get_conversation_history(thread_id)
+                timestamps = [m.get("timestamp") for m in history if m.get("timestamp")]
+                index.upsert(
+                    thread_id,
+                    len(history),
+                    created=timestamps[0] if timestamps else None,
+                    last_updated=timestamps[-1] if timestamps else None
+                )
+        return index
+
+    def get_thread_info(self, thread_id: str) -> Optional[Dict[str, Any]]:
+        """Lấy metadata (created, last_updated, message_count) của một luồng."""
+        return self.index.get(thread_id)
+
+    def list_threads(self, limit: int = 20, cursor: Optional[str] = None) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        """Lấy một trang metadata luồng, sắp xếp theo last_updated giảm dần.
+
+        Args:
+            limit: Số luồng tối đa trong trang
+            cursor: Cursor của trang trước (None cho trang đầu)
+
+        Returns:
+            Tuple gồm (danh sách metadata, cursor trang kế tiếp hoặc None)
+        """
+        return self.index.page(limit, cursor)
+
+    def create_thread(self, thread_id: str):
+        """Ghi nhận một luồng hội thoại mới (tùy chọn với từng backend)."""
+
+    def save_memory(self, thread_id: str, memory: Memory):
+        """Lưu bộ nhớ của một luồng hội thoại."""
+        raise NotImplementedError
+
+    def load_memory(self, thread_id: str) -> Memory:
+        """Tải bộ nhớ của một luồng hội thoại."""
+        raise NotImplementedError
+
+    def list_conversations(self) -> List[str]:
+        """Liệt kê ID của tất cả các luồng hội thoại."""
+        raise NotImplementedError
+
+    def get_conversation_history(self, thread_id: str) -> List[Dict[str, Any]]:
+        """Lấy lịch sử tin nhắn của một luồng dưới dạng dict."""
+        raise NotImplementedError
+
+    def delete_conversation(self, thread_id: str):
+        """Xóa một luồng hội thoại."""
+        raise NotImplementedError
+
+    @property
+    def caches_thread_data(self) -> bool:
+        """load_thread_data trả lại cùng dict khi dữ liệu chưa đổi (có thể cache theo định danh)."""
+        return self.data is not None
+
+    def load_thread_data(self, thread_id: str, kind: str) -> Dict[str, Any]:
+        """Đọc dữ liệu phụ `kind` của luồng: khóa -> giá trị JSON (rỗng nếu chưa có; không được sửa)."""
+        return self.data.load(thread_id, kind)
+
+    def save_thread_data(self, thread_id: str, kind: str, key: str, value: Any):
+        """Ghi giá trị JSON của một khóa trong dữ liệu phụ `kind` của luồng."""
+        self.data.save(thread_id, kind, key, value)
+
+    def delete_thread_data(self, thread_id: str, kind: str, keys: Optional[List[str]] = None):
+        """Xóa các khóa (None để xóa tất cả) trong dữ liệu phụ `kind` của luồng."""
+        self.data.delete(thread_id, kind, keys)
+
+    def close(self):
+        """Giải phóng tài nguyên của backend."""
+
+class FileStore(ConversationStore):
+    """Backend mặc định, chuyển tiếp tới các hàm của memory.persistence."""
+
+    def __init__(self, index_path: str, data_dir: str):
+        """Khởi tạo backend file.
+
+        Args:
+            index_path: Đường dẫn file log của chỉ mục metadata
+            data_dir: Thư mục chứa dữ liệu phụ của các luồng
+        """
+        self.index = self._open_index(index_path)
+        self.data = ThreadDataLog(data_dir)
+
+    def create_thread(self, thread_id: str):
+        """Ghi nhận luồng mới trong chỉ mục metadata."""
+        self.index.upsert(thread_id, 0)
+
+    def save_memory(self, thread_id: str, memory: Memory):
+        """Ghi lại toàn bộ file bộ nhớ của luồng và cập nhật chỉ mục."""
+        persistence.save_memory(thread_id, memory)
+        self.index.upsert(thread_id, len(memory.messages))
+
+    def load_memory(self, thread_id: str) -> Memory:
+        """Tải bộ nhớ của luồng từ file."""
+        return persistence.load_memory(thread_id)
+
+    def list_conversations(self) -> List[str]:
+        """Liệt kê các luồng hội thoại."""
+        return persistence.list_conversations()
+
+    def get_conversation_history(self, thread_id: str) -> List[Dict[str, Any]]:
+        """Lấy lịch sử tin nhắn của luồng."""
+        return persistence.get_conversation_history(thread_id)
+
+    def delete_conversation(self, thread_id: str):
+        """Xóa file bộ nhớ và dữ liệu phụ của luồng."""
+        persistence.delete_conversation(thread_id)
+        self.data.delete(thread_id)
+        self.index.remove(thread_id)
+
+class CoalescingStore(ConversationStore):
+    """Lớp bọc gộp các lần ghi liên tiếp của cùng một luồng thành một lần xả.
+
+    save_memory chỉ ghi nhận trạng thái mới nhất của luồng; một luồng xả duy
+    nhất, sống suốt vòng đời của store, xả tất cả luồng đang chờ xuống backend
+    sau `flush_interval` giây (backend như SqliteStore giữ một kết nối cho mỗi
+    luồng hệ điều hành nên không tạo luồng mới cho mỗi lần xả). Lần ghi lỗi được
+    đưa lại hàng chờ và thử lại ở lần xả sau. Đọc bộ nhớ của luồng đang chờ được
+    trả lời từ bản chờ ghi (kể cả metadata của luồng), list_conversations và
+    list_threads xả trước.
+    """
+
+    def __init__(self, store: ConversationStore, flush_interval: float):
+        """Khởi tạo lớp gộp ghi.
+
+        Args:
+            store: Backend lưu trữ thực sự
+            flush_interval: Thời gian (giây) gom các lần ghi trước khi xả
+        """
+        self.store = store
+        self.flush_interval = flush_interval
+        self._pending: Dict[str, Memory] = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        # Báo cho luồng xả có bản chờ ghi mới; _closed dừng luồng xả khi đóng
+        self._wakeup = threading.Event()
+        self._closed = threading.Event()
+        self._worker: Optional[threading.Thread] = None
+        self._saves = 0
+        self._flushes = 0
+        self._writes = 0
+        self._failures = 0
+
+    def __getattr__(self, name: str):
+        """Chuyển tiếp các thuộc tính riêng của backend (ví dụ compact)."""
+        return getattr(self.store, name)
+
+    @property
+    def index(self) -> Optional[ThreadIndex]:
+        """Chỉ mục metadata của backend bên dưới."""
+        return self.store.index
+
+    def flush(self, thread_id: Optional[str] = None):
+        """Ghi các bộ nhớ đang chờ xuống backend.
+
+        Args:
+            thread_id: Chỉ xả luồng này (None để xả tất cả)
+        """
+        with self._flush_lock:
+            with self._lock:
+                if thread_id is None:
+                    pending = self._pending
+                    self._pending = {}
+                elif thread_id in self._pending:
+                    pending = {thread_id: self._pending.pop(thread_id)}
+                else:
+                    return
+            if not pending:
+                return
+
+            self._flushes += 1
+            failed = False
+            for pending_id, memory in pending.items():
+                try:
+                    self.store.save_memory(pending_id, memory)
+                    self._writes += 1
+                except Exception:
+                    logger.exception(f"Lỗi khi lưu bộ nhớ của hội thoại {pending_id}")
+                    self._failures += 1
+                    failed = True
+                    # Đưa lại hàng chờ, trừ khi luồng đã có trạng thái mới hơn
+                    with self._lock:
+                        self._pending.setdefault(pending_id, memory)
+            if failed:
+                self._wakeup.set()
+
+    def _run(self):
+        """Vòng lặp của luồng xả: chờ bản ghi mới, gom trong flush_interval rồi xả."""
+        while not self._closed.is_set():
+            self._wakeup.wait()
+            # Gom các lần ghi tiếp theo; close() cắt ngang khoảng chờ
+            self._closed.wait(self.flush_interval)
+            self._wakeup.clear()
+            if self._closed.is_set():
+                return
+            self.flush()
+
+    def _pending_memory(self, thread_id: str) -> Optional[Memory]:
+        """Lấy bản sao bộ nhớ đang chờ ghi của một luồng (nếu có)."""
+        with self._lock:
+            memory = self._pending.get(thread_id)
+            return Memory(messages=list(memory.messages)) if memory is not None else None
+
+    def create_thread(self, thread_id: str):
+        """Ghi nhận luồng mới ở backend bên dưới."""
+        self.store.create_thread(thread_id)
+
+    def save_memory(self, thread_id: str, memory: Memory):
+        """Ghi nhận trạng thái mới nhất của luồng và hẹn giờ xả."""
+        with self._lock:
+            self._pending[thread_id] = memory
+            self._saves += 1
+            if self._worker is None and not self._closed.is_set():
+                self._worker = threading.Thread(target=self._run, name="memory-flush", daemon=True)
+                self._worker.start()
+        self._wakeup.set()
+
+    def load_memory(self, thread_id: str) -> Memory:
+        """Tải bộ nhớ, ưu tiên bản đang chờ ghi."""
+        memory = self._pending_memory(thread_id)
+        return memory if memory is not None else self.store.load_memory(thread_id)
+
+    def list_conversations(self) -> List[str]:
+        """Liệt kê các luồng hội thoại sau khi xả các lần ghi đang chờ."""
+        self.flush()
+        return self.store.list_conversations()
+
+    def get_conversation_history(self, thread_id: str) -> List[Dict[str, Any]]:
+        """Lấy lịch sử tin nhắn, ưu tiên bản đang chờ ghi."""
+        memory = self._pending_memory(thread_id)
+        if memory is not None:
+            return [message.model_dump() for message in memory.messages]
+        return self.store.get_conversation_history(thread_id)
+
+    def get_thread_info(self, thread_id: str) -> Optional[Dict[str, Any]]:
+        """Lấy metadata của luồng, cập nhật theo bản chờ ghi mà không xả."""
+        info = self.store.get_thread_info(thread_id)
+        with self._lock:
+            memory = self._pending.get(thread_id)
+            messages = list(memory.messages) if memory is not None else None
+        if messages is None:
+            return info
+
+        now = datetime.now().isoformat()
+        if info is None:
+            info = {"id": thread_id, "created": messages[0].timestamp if messages else now}
+        info["message_count"] = len(messages)
+        info["last_updated"] = (messages[-1].timestamp if messages else "") or now
+        return info
+
+    def list_threads(self, limit: int = 20, cursor: Optional[str] = None) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        """Lấy một trang metadata luồng sau khi xả các lần ghi đang chờ.
+
+        Lần xả ghi xuống backend nên cần gọi ngoài event loop (asyncio.to_thread).
+        """
+        self.flush()
+        return self.store.list_threads(limit, cursor)
+
+    def delete_conversation(self, thread_id: str):
+        """Bỏ bản chờ ghi và xóa luồng ở backend."""
+        with self._flush_lock:
+            with self._lock:
+                self._pending.pop(thread_id, None)
+            self.store.delete_conversation(thread_id)
+
+    @property
+    def caches_thread_data(self) -> bool:
+        """Như backend: dữ liệu phụ không đi qua lớp gộp ghi."""
+        return self.store.caches_thread_data
+
+    @property
+    def blocking(self) -> bool:
+        """Như backend: đọc luồng không có bản chờ ghi đi thẳng xuống backend."""
+        return self.store.blocking
+
+    def load_thread_data(self, thread_id: str, kind: str) -> Dict[str, Any]:
+        """Đọc dữ liệu phụ của luồng từ backend (dữ liệu phụ không bị gộp ghi)."""
+        return self.store.load_thread_data(thread_id, kind)
+
+    def save_thread_data(self, thread_id: str, kind: str, key: str, value: Any):
+        """Ghi dữ liệu phụ của luồng thẳng xuống backend."""
+        self.store.save_thread_data(thread_id, kind, key, value)
+
+    def delete_thread_data(self, thread_id: str, kind: str, keys: Optional[List[str]] = None):
+        """Xóa dữ liệu phụ của luồng ở backend."""
+        self.store.delete_thread_data(thread_id, kind, keys)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Thống kê gộp ghi: số lần lưu, số lần xả, số lần ghi thực sự và số lần ghi lỗi."""
+        return {
+            "saves": self._saves,
+            "flushes": self._flushes,
+            "writes": self._writes,
+            "failures": self._failures,
+            "pending": len(self._pending),
+            "flush_interval": self.flush_interval
+        }
+
+    def close(self):
+        """Dừng luồng xả, xả các lần ghi đang chờ rồi đóng backend."""
+        self._closed.set()
+        self._wakeup.set()
+        if self._worker is not None:
+            self._worker.join(timeout=self.flush_interval + 5)
+        self.flush()
+        self.store.close()
+
+def create_store(config: AppConfig):
+    """Tạo backend lưu trữ theo cấu hình.
+
+    Args:
+        config: Cấu hình ứng dụng
+
+    Returns:
+        Đối tượng backend lưu trữ
+    """
+    backend = config.memory_backend.lower()
+    if backend == "file":
+        store = FileStore(
+            os.path.join(config.memory_dir, "threads_index.log"),
+            os.path.join(config.memory_dir, "thread_data")
+        )
+    elif backend == "segment_log":
+        from agent_template.memory.segment_log import SegmentLogStore
+        store = SegmentLogStore(
+            os.path.join(config.memory_dir, "threads"),
+            segment_max_bytes=config.memory_segment_max_bytes,
+            compact_segments=config.memory_compact_segments
+        )
+    elif backend == "sqlite":
+        from agent_template.memory.sqlite_store import SqliteStore
+        store = SqliteStore(config.memory_db_path or os.path.join(config.memory_dir, "conversations.db"))
+    else:
+        raise ValueError(f"Backend lưu trữ không hợp lệ: {config.memory_backend}")
+
+    if config.memory_flush_interval > 0:
+        store = CoalescingStore(store, config.memory_flush_interval)
+    return store
+
+# Backend dùng chung của tiến trình
+_store = None
+_store_lock = threading.Lock()
+
+def get_store(config: Optional[AppConfig] = None):
+    """Lấy backend lưu trữ dùng chung của tiến trình.
+
+    Args:
+        config: Cấu hình dùng khi backend được tạo lần đầu (tùy chọn)
+
+    Returns:
+        Backend lưu trữ
+    """
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = create_store(config or AppConfig())
+    return _store
+
+# ===== API TƯƠNG THÍCH VỚI memory.persistence =====
+def create_new_thread() -> str:
+    """Tạo ID luồng hội thoại mới và ghi nhận nó trong backend đang dùng."""
+    thread_id = persistence.create_new_thread()
+    get_store().create_thread(thread_id)
+    return thread_id
+
+def save_memory(thread_id: str, memory: Memory):
+    """Lưu bộ nhớ của một luồng qua backend đang dùng."""
+    get_store().save_memory(thread_id, memory)
+
+def load_memory(thread_id: str) -> Memory:
+    """Tải bộ nhớ của một luồng qua backend đang dùng."""
+    return get_store().load_memory(thread_id)
+
+# ===== GỌI TỪ EVENT LOOP =====
+async def run_store_call(func: Callable[..., Any], *args: Any) -> Any:
+    """Gọi một hàm dùng backend lưu trữ từ event loop.
+
+    Với backend có I/O chặn (blocking = True, ví dụ SQLite khi không gộp ghi,
+    mỗi lần ghi chờ khóa tới busy timeout), hàm chạy trong thread pool để
+    không chặn các request khác; backend khác được gọi trực tiếp.
+
+    Args:
+        func: Hàm cần gọi
+        *args: Tham số của hàm
+
+    Returns:
+        Kết quả của hàm
+    """
+    if get_store().blocking:
+        return await asyncio.to_thread(func, *args)
+    return func(*args)
+
+async def save_memory_async(thread_id: str, memory: Memory):
+    """Lưu bộ nhớ của một luồng từ event loop (xem run_store_call)."""
+    await run_store_call(save_memory, thread_id, memory)
+
+async def load_memory_async(thread_id: str) -> Memory:
+    """Tải bộ nhớ của một luồng từ event loop (xem run_store_call)."""
+    return await run_store_call(load_memory, thread_id)
+
+def list_conversations() -> List[str]:
+    """Liệt kê các luồng hội thoại qua backend đang dùng."""
+    return get_store().list_conversations()
+
+def get_conversation_history(thread_id: str) -> List[Dict[str, Any]]:
+    """Lấy lịch sử của một luồng qua backend đang dùng."""
+    return get_store().get_conversation_history(thread_id)
+
+def list_threads(limit: int = 20, cursor: Optional[str] = None) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    """Lấy một trang metadata luồng qua backend đang dùng."""
+    return get_store().list_threads(limit, cursor)
+
+def get_thread_info(thread_id: str) -> Optional[Dict[str, Any]]:
+    """Lấy metadata của một luồng qua backend đang dùng."""
+    return get_store().get_thread_info(thread_id)
+
+def delete_conversation(thread_id: str):
+    """Xóa một luồng hội thoại (cùng dữ liệu phụ của nó) qua backend đang dùng."""
+    get_store().delete_conversation(thread_id)
+
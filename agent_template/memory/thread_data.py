@@ -0,0 +1,170 @@
+"""
+Dữ liệu phụ theo luồng hội thoại cho các backend dựa trên file.
+
+Ngoài bộ nhớ hội thoại, mỗi luồng có thể có dữ liệu phụ theo loại (ví dụ model
+message của từng lượt), mỗi loại là một tập khóa -> giá trị JSON. Mỗi (luồng,
+loại) là một file log chỉ ghi nối `<root>/<thread_id>/<kind>.log`: ghi một khóa
+chỉ nối thêm một dòng thay vì viết lại cả file, và log được gộp lại khi có quá
+nhiều bản ghi thừa. Dữ liệu đã đọc được cache theo thời điểm sửa đổi và kích
+thước file nên thay đổi từ tiến trình worker khác vẫn được thấy.
+"""
+
+import json
+import logging
+import os
+import shutil
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+LOG_SUFFIX = ".log"
+
+class ThreadDataLog:
+    """Lưu dữ liệu phụ của các luồng bằng log chỉ ghi nối theo (luồng, loại)."""
+
+    def __init__(self, root_dir: str, max_cached: int = 1024):
+        """Khởi tạo kho dữ liệu phụ.
+
+        Args:
+            root_dir: Thư mục chứa thư mục dữ liệu của từng luồng
+            max_cached: Số (luồng, loại) tối đa giữ dữ liệu đã đọc trong cache
+        """
+        self.root_dir = root_dir
+        self.max_cached = max_cached
+        self._lock = threading.Lock()
+        # (thread_id, kind) -> (mtime_ns, kích thước, số dòng, dữ liệu), theo thứ tự dùng gần nhất
+        self._cache: "OrderedDict[Tuple[str, str], Tuple[int, int, int, Dict[str, Any]]]" = OrderedDict()
+
+    def _path(self, thread_id: str, kind: str) -> str:
+        """Đường dẫn file log của một loại dữ liệu của luồng."""
+        return os.path.join(self.root_dir, thread_id, f"{kind}{LOG_SUFFIX}")
+
+    def _read(self, thread_id: str, kind: str) -> Tuple[int, Dict[str, Any]]:
+        """Đọc log (gọi khi đã giữ khóa), trả về (số dòng, dữ liệu).
+
+        Dòng hỏng (ghi dở do sự cố) bị bỏ qua và log được viết lại.
+        """
+        path = self._path(thread_id, kind)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            self._cache.pop((thread_id, kind), None)
+            return 0, {}
+
+        cached = self._cache.get((thread_id, kind))
+        if cached is not None and cached[:2] == (stat.st_mtime_ns, stat.st_size):
+            self._cache.move_to_end((thread_id, kind))
+            return cached[2], cached[3]
+
+        lines = 0
+        corrupted = False
+        data: Dict[str, Any] = {}
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                lines += 1
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    corrupted = True
+                    continue
+                if record.get("deleted"):
+                    data.pop(record["key"], None)
+                else:
+                    data[record["key"]] = record["value"]
+
+        if corrupted:
+            logger.warning(f"Bỏ bản ghi hỏng trong {path}")
+            return self._rewrite(thread_id, kind, data), data
+        self._store(thread_id, kind, stat, lines, data)
+        return lines, data
+
+    def _store(self, thread_id: str, kind: str, stat: os.stat_result, lines: int, data: Dict[str, Any]):
+        """Đưa dữ liệu vào cache, loại mục dùng lâu nhất nếu vượt giới hạn (gọi khi đã giữ khóa)."""
+        self._cache[(thread_id, kind)] = (stat.st_mtime_ns, stat.st_size, lines, data)
+        self._cache.move_to_end((thread_id, kind))
+        while len(self._cache) > self.max_cached:
+            self._cache.popitem(last=False)
+
+    def _remember(self, thread_id: str, kind: str, lines: int, data: Dict[str, Any]):
+        """Cập nhật cache sau khi ghi (gọi khi đã giữ khóa)."""
+        self._store(thread_id, kind, os.stat(self._path(thread_id, kind)), lines, data)
+
+    def _rewrite(self, thread_id: str, kind: str, data: Dict[str, Any]) -> int:
+        """Ghi lại log chỉ với dữ liệu hiện tại, trả về số dòng mới."""
+        path = self._path(thread_id, kind)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            for key, value in data.items():
+                f.write(json.dumps({"key": key, "value": value}, ensure_ascii=False) + "\n")
+        os.replace(tmp_path, path)
+        self._remember(thread_id, kind, len(data), data)
+        return len(data)
+
+    def _append(self, thread_id: str, kind: str, records: Iterable[Dict[str, Any]], lines: int, data: Dict[str, Any]):
+        """Ghi nối các bản ghi, gộp log nếu có quá nhiều bản ghi thừa."""
+        payload = "".join(json.dumps(record, ensure_ascii=False) + "\n" for record in records)
+        path = self._path(thread_id, kind)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "a", encoding="utf-8") as f:
+            f.write(payload)
+        lines += payload.count("\n")
+        if lines > 2 * len(data) + 16:
+            self._rewrite(thread_id, kind, data)
+        else:
+            self._remember(thread_id, kind, lines, data)
+
+    def load(self, thread_id: str, kind: str) -> Dict[str, Any]:
+        """Đọc dữ liệu phụ của luồng.
+
+        Args:
+            thread_id: ID luồng hội thoại
+            kind: Loại dữ liệu
+
+        Returns:
+            Dict khóa -> giá trị (rỗng nếu chưa có); không được sửa. Mỗi lần
+            ghi tạo dict mới nên dict trả về không đổi khi chưa có lần ghi nào
+        """
+        with self._lock:
+            return self._read(thread_id, kind)[1]
+
+    def save(self, thread_id: str, kind: str, key: str, value: Any):
+        """Ghi giá trị của một khóa.
+
+        Args:
+            thread_id: ID luồng hội thoại
+            kind: Loại dữ liệu
+            key: Khóa
+            value: Giá trị dạng JSON
+        """
+        with self._lock:
+            lines, data = self._read(thread_id, kind)
+            self._append(thread_id, kind, [{"key": key, "value": value}], lines, {**data, key: value})
+
+    def delete(self, thread_id: str, kind: Optional[str] = None, keys: Optional[Iterable[str]] = None):
+        """Xóa dữ liệu phụ của luồng.
+
+        Args:
+            thread_id: ID luồng hội thoại
+            kind: Loại dữ liệu (None để xóa mọi loại của luồng)
+            keys: Các khóa cần xóa (None để xóa cả loại dữ liệu)
+        """
+        with self._lock:
+            if kind is None:
+                for cached in [cached for cached in self._cache if cached[0] == thread_id]:
+                    del self._cache[cached]
+                shutil.rmtree(os.path.join(self.root_dir, thread_id), ignore_errors=True)
+                return
+            if keys is None:
+                self._cache.pop((thread_id, kind), None)
+                path = self._path(thread_id, kind)
+                if os.path.exists(path):
+                    os.remove(path)
+                return
+
+            lines, data = self._read(thread_id, kind)
+            removed = [key for key in keys if key in data]
+            if removed:
+                remaining = {key: value for key, value in data.items() if key not in removed}
+                self._append(thread_id, kind, [{"key": key, "deleted": True} for key in removed], lines, remaining)
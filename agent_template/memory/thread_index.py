@@ -0,0 +1,175 @@
+"""
+Chỉ mục metadata của các luồng hội thoại.
+
+Giữ created, last_updated và message_count của mỗi luồng trong bộ nhớ, sắp xếp
+theo last_updated, và ghi nối mọi thay đổi vào một file log để liệt kê hội
+thoại theo trang mà không phải đọc lịch sử tin nhắn. Log được gộp lại (khi tải
+và trong lúc chạy) khi số bản ghi vượt 2 lần số luồng cộng COMPACT_SLACK.
+"""
+
+import base64
+import bisect
+import json
+import logging
+import os
+import threading
+from datetime import datetime
+from typing import Dict, Any, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Số bản ghi thừa được phép trong log ngoài 2 lần số luồng trước khi gộp
+COMPACT_SLACK = 100
+
+def encode_cursor(last_updated: str, thread_id: str) -> str:
+    """Mã hóa vị trí trang thành cursor dạng chuỗi."""
+    raw = json.dumps([last_updated, thread_id]).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii")
+
+def decode_cursor(cursor: str) -> Tuple[str, str]:
+    """Giải mã cursor thành (last_updated, thread_id).
+
+    Raises:
+        ValueError: Nếu cursor không hợp lệ
+    """
+    try:
+        last_updated, thread_id = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        return str(last_updated), str(thread_id)
+    except Exception as e:
+        raise ValueError(f"Cursor không hợp lệ: {cursor}") from e
+
+class ThreadIndex:
+    """Chỉ mục metadata luồng hội thoại, lưu bằng log chỉ ghi nối.
+
+    Danh sách khóa (last_updated, id) được giữ theo thứ tự nên mỗi trang chỉ
+    tốn O(log n + kích thước trang).
+    """
+
+    def __init__(self, path: str):
+        """Khởi tạo và tải chỉ mục từ file log.
+
+        Args:
+            path: Đường dẫn file log của chỉ mục
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        self._threads: Dict[str, Dict[str, Any]] = {}
+        self._order: List[Tuple[str, str]] = []
+        # Số bản ghi hiện có trong file log
+        self._lines = 0
+        self.existed = os.path.exists(path)
+        self._load()
+
+    def _load(self):
+        """Đọc lại log và gộp log nếu có nhiều bản ghi thừa hoặc hỏng."""
+        lines = 0
+        corrupted = False
+        if self.existed:
+            with open(self.path, "r", encoding="utf-8") as f:
+                for line in f:
+                    lines += 1
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        corrupted = True
+                        continue
+                    if record.get("deleted"):
+                        self._threads.pop(record["id"], None)
+                    else:
+                        self._threads[record["id"]] = record
+        self._order = sorted((info["last_updated"], thread_id) for thread_id, info in self._threads.items())
+
+        self._lines = lines
+        if corrupted or self._needs_compaction():
+            self._rewrite()
+
+    def _needs_compaction(self) -> bool:
+        """Log có quá nhiều bản ghi thừa so với số luồng hiện có."""
+        return self._lines > 2 * len(self._threads) + COMPACT_SLACK
+
+    def _rewrite(self):
+        """Ghi lại log chỉ với trạng thái hiện tại."""
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            for info in self._threads.values():
+                f.write(json.dumps(info, ensure_ascii=False) + "\n")
+        os.replace(tmp_path, self.path)
+        self._lines = len(self._threads)
+
+    def _append(self, record: Dict[str, Any]):
+        """Ghi nối một thay đổi vào log, gộp log nếu có quá nhiều bản ghi thừa."""
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self._lines += 1
+        if self._needs_compaction():
+            self._rewrite()
+
+    def _remove_order(self, info: Dict[str, Any]):
+        """Bỏ khóa sắp xếp của một luồng khỏi danh sách."""
+        key = (info["last_updated"], info["id"])
+        position = bisect.bisect_left(self._order, key)
+        if position < len(self._order) and self._order[position] == key:
+            self._order.pop(position)
+
+    def upsert(self, thread_id: str, message_count: int, created: Optional[str] = None,
+               last_updated: Optional[str] = None):
+        """Cập nhật metadata của một luồng sau khi lưu.
+
+        Args:
+            thread_id: ID luồng hội thoại
+            message_count: Số tin nhắn hiện có
+            created: Thời điểm tạo (chỉ dùng khi luồng chưa có trong chỉ mục)
+            last_updated: Thời điểm cập nhật (mặc định là hiện tại)
+        """
+        now = last_updated or datetime.now().isoformat()
+        with self._lock:
+            previous = self._threads.get(thread_id)
+            if previous is not None:
+                self._remove_order(previous)
+            info = {
+                "id": thread_id,
+                "created": previous["created"] if previous else (created or now),
+                "last_updated": now,
+                "message_count": message_count
+            }
+            self._threads[thread_id] = info
+            bisect.insort(self._order, (now, thread_id))
+            self._append(info)
+
+    def remove(self, thread_id: str):
+        """Xóa một luồng khỏi chỉ mục."""
+        with self._lock:
+            info = self._threads.pop(thread_id, None)
+            if info is not None:
+                self._remove_order(info)
+                self._append({"id": thread_id, "deleted": True})
+
+    def get(self, thread_id: str) -> Optional[Dict[str, Any]]:
+        """Lấy metadata của một luồng (None nếu không tồn tại)."""
+        info = self._threads.get(thread_id)
+        return dict(info) if info else None
+
+    def page(self, limit: int = 20, cursor: Optional[str] = None) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        """Lấy một trang luồng hội thoại, mới cập nhật nhất trước.
+
+        Args:
+            limit: Số luồng tối đa trong trang
+            cursor: Cursor trả về từ trang trước (None cho trang đầu)
+
+        Returns:
+            Tuple gồm (danh sách metadata, cursor của trang kế tiếp hoặc None)
+        """
+        with self._lock:
+            end = len(self._order)
+            if cursor:
+                end = bisect.bisect_left(self._order, decode_cursor(cursor))
+            start = max(end - limit, 0)
+            keys = self._order[start:end]
+            items = [dict(self._threads[thread_id]) for _, thread_id in reversed(keys)]
+
+        next_cursor = None
+        if start > 0 and items:
+            next_cursor = encode_cursor(items[-1]["last_updated"], items[-1]["id"])
+        return items, next_cursor
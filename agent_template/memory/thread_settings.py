@@ -0,0 +1,78 @@
+"""
+Cấu hình mặc định đã lưu của từng luồng hội thoại.
+
+Mỗi luồng có thể lưu các giá trị mặc định riêng (chế độ xử lý, hạng model,
+temperature, max_tokens) được áp dụng cho mọi request của luồng đó, trừ khi
+request ghi đè. Cấu hình mặc định của service được lưu cùng cách dưới luồng
+dành riêng SERVICE_THREAD_ID. Mỗi trường là một khóa trong dữ liệu phụ "settings" của luồng ở
+backend lưu trữ đang dùng (MEMORY_BACKEND), nên mọi worker dùng chung cấu hình
+và thấy thay đổi ngay ở request kế tiếp; backend dựa trên file cache dữ liệu
+đã đọc nên đường nóng chỉ cần một lần stat file.
+"""
+
+from typing import Any, Dict
+
+from agent_template.config import AppConfig, RequestConfig
+from agent_template.memory.storage import get_store
+
+# Loại dữ liệu phụ của luồng chứa cấu hình mặc định
+SETTINGS = "settings"
+
+# "Luồng" dành riêng chứa cấu hình mặc định của service (POST /config), để mọi
+# worker dùng chung; ID luồng thật là chuỗi thời gian nên không trùng
+SERVICE_THREAD_ID = "_service"
+
+def load_thread_settings(thread_id: str, config: AppConfig) -> Dict[str, Any]:
+    """Tải cấu hình mặc định đã lưu của một luồng hội thoại.
+
+    Args:
+        thread_id: ID luồng hội thoại
+        config: Cấu hình ứng dụng
+
+    Returns:
+        Dict các trường RequestConfig đã lưu (rỗng nếu chưa có); không được sửa
+    """
+    return get_store(config).load_thread_data(thread_id, SETTINGS)
+
+def save_thread_settings(thread_id: str, updates: Dict[str, Any], config: AppConfig) -> Dict[str, Any]:
+    """Cập nhật cấu hình mặc định của một luồng hội thoại.
+
+    Args:
+        thread_id: ID luồng hội thoại
+        updates: Các trường RequestConfig cần đặt; giá trị None xóa trường đó
+            để luồng quay về mặc định của service
+        config: Cấu hình ứng dụng
+
+    Returns:
+        Cấu hình đã lưu của luồng
+
+    Raises:
+        ValueError: Nếu có trường không hợp lệ
+    """
+    unknown = set(updates) - set(RequestConfig.model_fields)
+    if unknown:
+        raise ValueError(f"Trường cấu hình không hợp lệ: {', '.join(sorted(unknown))}")
+
+    store = get_store(config)
+    current = store.load_thread_data(thread_id, SETTINGS)
+    settings = {**current, **updates}
+    settings = {key: value for key, value in settings.items() if value is not None}
+    # Kiểm tra giá trị trước khi ghi
+    RequestConfig().merge(settings)
+
+    for key, value in updates.items():
+        if value is not None and current.get(key) != value:
+            store.save_thread_data(thread_id, SETTINGS, key, value)
+    removed = [key for key, value in updates.items() if value is None and key in current]
+    if removed:
+        store.delete_thread_data(thread_id, SETTINGS, removed)
+    return settings
+
+def delete_thread_settings(thread_id: str, config: AppConfig):
+    """Xóa cấu hình đã lưu của một luồng hội thoại (nếu có).
+
+    Args:
+        thread_id: ID luồng hội thoại
+        config: Cấu hình ứng dụng
+    """
+    get_store(config).delete_thread_data(thread_id, SETTINGS)
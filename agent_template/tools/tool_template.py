@@ -5,7 +5,9 @@ Hướng dẫn:
 1. Sao chép file này với tên mới (ví dụ: weather.py)
 2. Thay đổi tên class, biến và hàm
 3. Cập nhật docstrings và logic
-4. Import công cụ trong core/agent.py và đăng ký với @agent.tool
+4. Import công cụ trong core/agent.py và đăng ký với @agent.tool, kèm @guarded_tool
+   từ utils/tool_runner.py để áp dụng TOOL_TIMEOUT
+   (thêm @cached_tool(ttl=...) từ utils/tool_cache.py nếu công cụ không có tác dụng phụ)
 5. Xử lý kết quả trong process_input() và process_node()
 """
 
@@ -0,0 +1,216 @@
+"""
+Kiểm soát số lệnh gọi model đồng thời theo hạng model.
+
+Mỗi hạng (light, default, advanced) có giới hạn số lệnh gọi model chạy cùng
+lúc (ADMISSION_MAX_CONCURRENT) và một hàng đợi có giới hạn
+(ADMISSION_MAX_QUEUE). Khi hết chỗ chạy, request chờ trong hàng đợi tối đa
+ADMISSION_QUEUE_TIMEOUT giây; khi hàng đợi đã đầy hoặc chờ quá lâu, request bị
+từ chối ngay với AdmissionRejected (API trả 429 kèm Retry-After) thay vì cùng
+dồn vào provider và cùng chậm lại.
+
+Giới hạn áp dụng cho từng tiến trình worker: chạy với `--workers N`, provider
+nhận tối đa N × ADMISSION_MAX_CONCURRENT lệnh gọi đồng thời cho mỗi hạng (và
+tổng hàng đợi N × ADMISSION_MAX_QUEUE), nên cần chia giới hạn theo số worker.
+
+Độ sâu hàng đợi, số lệnh đang chạy và thời gian chờ có trong GET /stats (khóa
+`admission`) và GET /metrics.
+"""
+
+import asyncio
+import math
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Deque, Dict, Optional
+
+from agent_template.config import AppConfig
+from agent_template.utils.metrics import get_metrics
+
+class AdmissionRejected(Exception):
+    """Lệnh gọi model bị từ chối vì hạng model đang quá tải."""
+
+    def __init__(self, tier: str, retry_after: int, reason: str):
+        """Khởi tạo lỗi.
+
+        Args:
+            tier: Hạng model bị quá tải
+            retry_after: Số giây gợi ý chờ trước khi thử lại
+            reason: Lý do ("queue_full" hoặc "queue_timeout")
+        """
+        super().__init__(f"Hạng model {tier} đang quá tải, thử lại sau {retry_after} giây")
+        self.tier = tier
+        self.retry_after = retry_after
+        self.reason = reason
+
+class TierLimiter:
+    """Giới hạn đồng thời và hàng đợi của một hạng model."""
+
+    def __init__(self, tier: str, max_concurrent: int, max_queue: int, queue_timeout: float, sample_size: int = 512):
+        """Khởi tạo bộ giới hạn.
+
+        Args:
+            tier: Hạng model
+            max_concurrent: Số lệnh gọi model chạy cùng lúc tối đa
+            max_queue: Số request chờ tối đa; vượt quá thì từ chối ngay
+            queue_timeout: Thời gian chờ tối đa (giây) trong hàng đợi
+            sample_size: Số mẫu thời gian chờ gần nhất dùng để tính phân vị
+        """
+        self.tier = tier
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self._semaphore = asyncio.Semaphore(max_concurrent)
+        self.running = 0
+        self.waiting = 0
+        self.max_waiting = 0
+        self.admitted = 0
+        self.rejected: Dict[str, int] = {"queue_full": 0, "queue_timeout": 0}
+        self._waits: Deque[float] = deque(maxlen=sample_size)
+        # Thời gian giữ chỗ trung bình (EWMA), dùng để ước lượng Retry-After
+        self._avg_hold = 1.0
+
+    def retry_after(self) -> int:
+        """Ước lượng số giây tới khi hàng đợi hiện tại được xử lý hết."""
+        rounds = (self.waiting + 1) / max(self.max_concurrent, 1)
+        return max(1, math.ceil(rounds * self._avg_hold))
+
+    def _publish(self):
+        """Cập nhật gauge độ sâu hàng đợi và số lệnh đang chạy."""
+        metrics = get_metrics()
+        metrics.admission_queue.set(self.waiting, tier=self.tier)
+        metrics.admission_running.set(self.running, tier=self.tier)
+
+    def _reject(self, reason: str):
+        """Ghi nhận một lần từ chối."""
+        self.rejected[reason] += 1
+        get_metrics().admission_rejected.inc(tier=self.tier, reason=reason)
+
+    @asynccontextmanager
+    async def slot(self) -> AsyncIterator[float]:
+        """Giữ một chỗ chạy lệnh gọi model trong phạm vi khối `async with`.
+
+        Yields:
+            Thời gian (giây) đã chờ trong hàng đợi
+
+        Raises:
+            AdmissionRejected: Nếu hàng đợi đầy hoặc chờ quá ADMISSION_QUEUE_TIMEOUT
+        """
+        start = time.perf_counter()
+        if self._semaphore.locked():
+            if self.waiting >= self.max_queue:
+                self._reject("queue_full")
+                raise AdmissionRejected(self.tier, self.retry_after(), "queue_full")
+            self.waiting += 1
+            self.max_waiting = max(self.max_waiting, self.waiting)
+            self._publish()
+            try:
+                await asyncio.wait_for(self._semaphore.acquire(), self.queue_timeout)
+            except asyncio.TimeoutError:
+                self._reject("queue_timeout")
+                raise AdmissionRejected(self.tier, self.retry_after(), "queue_timeout")
+            finally:
+                self.waiting -= 1
+        else:
+            await self._semaphore.acquire()
+
+        waited = time.perf_counter() - start
+        self._waits.append(waited)
+        self.admitted += 1
+        self.running += 1
+        self._publish()
+        metrics = get_metrics()
+        metrics.admission_wait.observe(waited, tier=self.tier)
+        metrics.record_stage("admission_wait", waited)
+        held_from = time.perf_counter()
+        try:
+            yield waited
+        finally:
+            self.running -= 1
+            self._semaphore.release()
+            self._avg_hold = 0.8 * self._avg_hold + 0.2 * (time.perf_counter() - held_from)
+            self._publish()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Lấy thống kê của hạng model.
+
+        Returns:
+            Dict gồm giới hạn, số lệnh đang chạy/chờ, số lần từ chối và thời
+            gian chờ p50/p95 (ms)
+        """
+        waits = sorted(self._waits)
+
+        def percentile(p: float) -> float:
+            if not waits:
+                return 0.0
+            return round(waits[min(int(p * len(waits)), len(waits) - 1)] * 1000, 2)
+
+        return {
+            "max_concurrent": self.max_concurrent,
+            "max_queue": self.max_queue,
+            "running": self.running,
+            "waiting": self.waiting,
+            "max_waiting": self.max_waiting,
+            "admitted": self.admitted,
+            "rejected": dict(self.rejected),
+            "wait_ms_p50": percentile(0.5),
+            "wait_ms_p95": percentile(0.95),
+            "retry_after": self.retry_after()
+        }
+
+class AdmissionController:
+    """Bộ giới hạn của tất cả các hạng model."""
+
+    def __init__(self, max_concurrent: Dict[str, float], max_queue: Dict[str, float], queue_timeout: float):
+        """Khởi tạo bộ kiểm soát.
+
+        Args:
+            max_concurrent: Hạng model -> số lệnh gọi đồng thời tối đa
+            max_queue: Hạng model -> số request chờ tối đa
+            queue_timeout: Thời gian chờ tối đa (giây) trong hàng đợi
+        """
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self._limiters: Dict[str, TierLimiter] = {}
+
+    @classmethod
+    def from_config(cls, config: AppConfig) -> "AdmissionController":
+        """Tạo bộ kiểm soát từ cấu hình ứng dụng."""
+        return cls(config.admission_max_concurrent, config.admission_max_queue, config.admission_queue_timeout)
+
+    def limiter(self, tier: str) -> TierLimiter:
+        """Lấy bộ giới hạn của một hạng model (hạng không cấu hình dùng giá trị của "default")."""
+        limiter = self._limiters.get(tier)
+        if limiter is None:
+            limiter = self._limiters[tier] = TierLimiter(
+                tier,
+                int(self.max_concurrent.get(tier, self.max_concurrent.get("default", 16))),
+                int(self.max_queue.get(tier, self.max_queue.get("default", 32))),
+                self.queue_timeout
+            )
+        return limiter
+
+    def slot(self, tier: str):
+        """Giữ một chỗ chạy lệnh gọi model của hạng (`async with controller.slot(tier):`)."""
+        return self.limiter(tier).slot()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Lấy thống kê theo hạng model."""
+        return {tier: limiter.get_stats() for tier, limiter in self._limiters.items()}
+
+# Bộ kiểm soát mặc định của tiến trình
+_default_controller: Optional[AdmissionController] = None
+
+def get_admission_controller(config: Optional[AppConfig] = None) -> AdmissionController:
+    """Lấy bộ kiểm soát số lệnh gọi model dùng chung của tiến trình.
+
+    Args:
+        config: Cấu hình dùng khi bộ kiểm soát được tạo lần đầu (tùy chọn)
+
+    Returns:
+        Bộ kiểm soát dùng chung
+    """
+    global _default_controller
+    if _default_controller is None:
+        _default_controller = AdmissionController.from_config(config or AppConfig())
+    return _default_controller
@@ -0,0 +1,157 @@
+"""
+Gộp các request gửi tin nhắn trùng nhau (single-flight).
+
+Khi client thử lại hoặc giao diện gửi hai lần, các request giống nhau đang chạy
+đồng thời dùng chung một lần gọi model và một lượt được lưu. Hai request được
+coi là giống nhau khi có cùng thread_id và cùng khóa idempotency (header
+`Idempotency-Key`), hoặc khi không có khóa và bật COALESCE, cùng nội dung tin
+nhắn đã chuẩn hóa và cùng cấu hình ghi đè.
+
+Kết quả thành công được giữ thêm COALESCE_WINDOW giây để lần thử lại đến muộn
+nhận lại đúng phản hồi đó mà không gọi model lần nữa. Với khóa theo nội dung,
+chỉ lượt mới nhất của luồng được giữ: khi luồng có lượt khác, tin nhắn giống hệt
+gửi sau đó là một lượt mới chứ không phải lần thử lại.
+
+Trạng thái nằm trong bộ nhớ của từng tiến trình worker.
+"""
+
+import asyncio
+import json
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Tuple
+
+def normalize_message(text: str) -> str:
+    """Chuẩn hóa tin nhắn để so sánh: bỏ khoảng trắng thừa, không phân biệt hoa thường."""
+    return " ".join(text.split()).casefold()
+
+def coalesce_key(
+    thread_id: str,
+    message: str,
+    idempotency_key: Optional[str] = None,
+    options: Optional[Dict[str, Any]] = None
+) -> Tuple[str, str, str]:
+    """Tạo khóa gộp cho một request gửi tin nhắn.
+
+    Args:
+        thread_id: Luồng hội thoại
+        message: Nội dung tin nhắn
+        idempotency_key: Khóa idempotency do client gửi (tùy chọn)
+        options: Các tùy chọn ảnh hưởng tới phản hồi (cấu hình ghi đè, cache)
+
+    Returns:
+        Tuple gồm (thread_id, loại khóa "key" hoặc "message", giá trị)
+    """
+    if idempotency_key:
+        return thread_id, "key", idempotency_key
+    options_json = json.dumps(options or {}, sort_keys=True, default=str)
+    return thread_id, "message", f"{normalize_message(message)}\x00{options_json}"
+
+class RequestCoalescer:
+    """Gộp các request trùng nhau đang chạy và nhớ kết quả trong một khoảng ngắn."""
+
+    def __init__(self, window: float = 10.0, max_entries: int = 1024):
+        """Khởi tạo bộ gộp.
+
+        Args:
+            window: Số giây giữ kết quả đã hoàn tất (0 để chỉ gộp request đang chạy)
+            max_entries: Số kết quả tối đa giữ trong bộ nhớ
+        """
+        self.window = window
+        self.max_entries = max_entries
+        # Khóa -> lần xử lý đang chạy
+        self._inflight: Dict[Hashable, asyncio.Future] = {}
+        # Khóa -> (thời điểm hết hạn, kết quả)
+        self._completed: "OrderedDict[Hashable, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        # thread_id -> khóa theo nội dung của lượt mới nhất đã hoàn tất
+        self._latest: Dict[str, Hashable] = {}
+        self.executed = 0
+        self.coalesced = 0
+        self.replayed = 0
+
+    def invalidate(self, thread_id: str):
+        """Bỏ kết quả theo nội dung của luồng (luồng vừa có lượt mới hoặc bị thay đổi)."""
+        key = self._latest.pop(thread_id, None)
+        if key is not None:
+            self._completed.pop(key, None)
+
+    def _lookup(self, key: Hashable) -> Optional[Dict[str, Any]]:
+        """Kết quả đã hoàn tất còn hạn của khóa (None nếu không có)."""
+        entry = self._completed.get(key)
+        if entry is None:
+            return None
+        if entry[0] <= time.monotonic():
+            del self._completed[key]
+            return None
+        return entry[1]
+
+    def _remember(self, key: Tuple[str, str, str], result: Dict[str, Any]):
+        """Giữ kết quả thành công trong COALESCE_WINDOW giây."""
+        if self.window <= 0 or not result.get("success"):
+            return
+        thread_id, kind, _ = key
+        if kind == "message":
+            self._latest[thread_id] = key
+        self._completed[key] = (time.monotonic() + self.window, result)
+        self._completed.move_to_end(key)
+        while len(self._completed) > self.max_entries:
+            old_key, _ = self._completed.popitem(last=False)
+            if self._latest.get(old_key[0]) == old_key:
+                del self._latest[old_key[0]]
+
+    async def run(
+        self,
+        key: Tuple[str, str, str],
+        call: Callable[[], Awaitable[Dict[str, Any]]]
+    ) -> Tuple[Dict[str, Any], Optional[str]]:
+        """Chạy request, hoặc dùng chung kết quả của request giống hệt.
+
+        Args:
+            key: Khóa từ coalesce_key()
+            call: Hàm xử lý request khi chưa có lần xử lý nào dùng được
+
+        Returns:
+            Tuple gồm (kết quả, None nếu request được xử lý, "inflight" nếu dùng
+            chung lần xử lý đang chạy hoặc "completed" nếu dùng kết quả đã hoàn tất)
+        """
+        result = self._lookup(key)
+        if result is not None:
+            self.replayed += 1
+            return result, "completed"
+
+        future = self._inflight.get(key)
+        if future is not None:
+            self.coalesced += 1
+            # shield: một request bị hủy không hủy lần xử lý dùng chung
+            return await asyncio.shield(future), "inflight"
+
+        self.executed += 1
+        # Lượt mới trên luồng: lần gửi lại tin nhắn trước đó không còn là lần thử lại
+        self.invalidate(key[0])
+
+        async def execute() -> Dict[str, Any]:
+            try:
+                result = await call()
+                self._remember(key, result)
+                return result
+            finally:
+                self._inflight.pop(key, None)
+
+        future = self._inflight[key] = asyncio.ensure_future(execute())
+        return await asyncio.shield(future), None
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Lấy thống kê gộp request.
+
+        Returns:
+            Dict gồm số lần xử lý, số request gộp vào lần đang chạy, số lần dùng
+            lại kết quả, số request đang chạy và số kết quả đang giữ
+        """
+        return {
+            "executed": self.executed,
+            "coalesced": self.coalesced,
+            "replayed": self.replayed,
+            "inflight": len(self._inflight),
+            "completed": len(self._completed),
+            "window": self.window
+        }
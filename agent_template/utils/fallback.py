@@ -0,0 +1,284 @@
+"""
+Chuỗi model dự phòng theo hạng model.
+
+Mỗi hạng có một chuỗi hạng được thử lần lượt (MODEL_FALLBACK, ví dụ
+"advanced>default>light"): lần thử bị quá thời gian (MODEL_TIMEOUTS, theo hạng
+của lần thử) hoặc gặp lỗi model/kết nối thì chuyển sang hạng tiếp theo sau một
+khoảng chờ lũy thừa có jitter (FALLBACK_BACKOFF_BASE, FALLBACK_BACKOFF_MAX).
+Lặp lại một hạng trong chuỗi (ví dụ "advanced>advanced>default") để thử lại
+chính hạng đó.
+
+Thời gian của lần thử chỉ tính từ khi lệnh gọi có chỗ chạy (sau hàng đợi
+admission). Không chuyển hạng khi lệnh gọi bị từ chối vì quá tải
+(AdmissionRejected, API trả 429), khi lỗi không phải của model, hoặc khi lần
+thử đã có tác dụng phụ (công cụ đã chạy, đoạn stream đã gửi cho client): chạy
+lại khi đó có thể thực hiện công cụ hai lần.
+
+Hạng đã phục vụ lượt được ghi vào lượt đang đo (trả về trong khóa `model_tier`
+của phản hồi); số lần thử theo hạng và kết quả có trong GET /stats (khóa
+`fallback`) và GET /metrics.
+"""
+
+import asyncio
+import random
+import time
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple, TypeVar
+
+from agent_template.config import AppConfig
+from agent_template.utils.metrics import get_metrics
+
+T = TypeVar("T")
+
+def is_fallback_error(error: BaseException) -> bool:
+    """Lỗi có cho phép chuyển sang hạng dự phòng không (quá thời gian, lỗi model hoặc kết nối)."""
+    # Import tại đây để module nhẹ khi khởi động
+    import httpx
+    from pydantic_ai.exceptions import ModelHTTPError, UnexpectedModelBehavior
+
+    errors: Tuple[type, ...] = (asyncio.TimeoutError, ModelHTTPError, UnexpectedModelBehavior, httpx.TransportError)
+    try:
+        import openai
+        errors += (openai.APIConnectionError, openai.APIStatusError)
+    except ImportError:
+        pass
+    return isinstance(error, errors)
+
+class FallbackAttempt:
+    """Một lần thử với một hạng model trong chuỗi dự phòng."""
+
+    def __init__(self, tier: str, timeout: Optional[float]):
+        """Khởi tạo lần thử.
+
+        Args:
+            tier: Hạng model của lần thử
+            timeout: Thời gian tối đa (giây) của lần thử (None nếu không giới hạn)
+        """
+        self.tier = tier
+        self.timeout = timeout
+        # Lần thử đã có tác dụng phụ, không được chạy lại với hạng khác
+        self.committed = False
+        # Lần thử bị hủy vì quá thời gian
+        self.expired = False
+        self._task: Optional[asyncio.Task] = None
+        self._handle: Optional[asyncio.TimerHandle] = None
+
+    def start(self):
+        """Bắt đầu tính thời gian; gọi sau khi lệnh gọi đã có chỗ chạy."""
+        if self.timeout is None or self._handle is not None:
+            return
+        self._task = asyncio.current_task()
+        self._handle = asyncio.get_running_loop().call_later(self.timeout, self._expire)
+
+    def stop(self):
+        """Ngừng tính thời gian (model đã bắt đầu trả lời hoặc lần thử kết thúc)."""
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+
+    def commit(self):
+        """Đánh dấu lần thử đã có tác dụng phụ: lỗi sau đó không chuyển hạng."""
+        self.committed = True
+
+    def _expire(self):
+        """Hết thời gian: hủy task đang chạy lần thử."""
+        self._handle = None
+        if self._task is not None and not self._task.done():
+            self.expired = True
+            self._task.cancel()
+
+    def timeout_error(self) -> asyncio.TimeoutError:
+        """Lỗi quá thời gian thay cho CancelledError do _expire() gây ra."""
+        uncancel = getattr(self._task, "uncancel", None)
+        if uncancel is not None:
+            uncancel()
+        return asyncio.TimeoutError(f"Hạng model {self.tier} không phản hồi sau {self.timeout:g} giây")
+
+class ModelFallback:
+    """Thử lần lượt các hạng model trong chuỗi dự phòng của hạng được chọn."""
+
+    def __init__(
+        self,
+        chains: Dict[str, List[str]],
+        timeouts: Dict[str, float],
+        backoff_base: float = 0.5,
+        backoff_max: float = 5.0
+    ):
+        """Khởi tạo chuỗi dự phòng.
+
+        Args:
+            chains: Hạng model -> các hạng dự phòng theo thứ tự
+            timeouts: Hạng model -> thời gian tối đa (giây) của một lần thử (0 là không giới hạn)
+            backoff_base: Khoảng chờ gốc (giây) trước lần thử thứ hai; nhân đôi sau mỗi lần
+            backoff_max: Khoảng chờ tối đa (giây) giữa hai lần thử
+        """
+        self.chains = chains
+        self.timeouts = timeouts
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        # Hạng -> kết quả ("ok", "timeout", "error") -> số lần thử
+        self.attempts: Dict[str, Dict[str, int]] = {}
+        # Hạng được chọn -> hạng đã phục vụ -> số lượt
+        self.served: Dict[str, Dict[str, int]] = {}
+
+    @classmethod
+    def from_config(cls, config: AppConfig) -> "ModelFallback":
+        """Tạo chuỗi dự phòng từ cấu hình ứng dụng."""
+        return cls(config.model_fallback, config.model_timeouts, config.fallback_backoff_base, config.fallback_backoff_max)
+
+    def chain(self, tier: str) -> List[str]:
+        """Các hạng sẽ được thử cho một hạng model, bắt đầu từ chính nó."""
+        return [tier] + self.chains.get(tier, [])
+
+    def timeout(self, tier: str) -> Optional[float]:
+        """Thời gian tối đa của một lần thử với hạng model (None nếu không giới hạn)."""
+        timeout = self.timeouts.get(tier, self.timeouts.get("default", 0))
+        return timeout if timeout > 0 else None
+
+    def backoff(self, retry: int) -> float:
+        """Khoảng chờ trước lần thử lại thứ `retry` (tính từ 0), jitter toàn phần."""
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** retry)))
+
+    def _record(self, tier: str, outcome: str, seconds: float):
+        """Ghi nhận kết quả một lần thử."""
+        counts = self.attempts.setdefault(tier, {"ok": 0, "timeout": 0, "error": 0})
+        counts[outcome] += 1
+        get_metrics().record_attempt(tier, outcome, seconds)
+
+    def _attempts(self, tier: str) -> List[FallbackAttempt]:
+        """Các lần thử cho một hạng model theo chuỗi dự phòng."""
+        return [FallbackAttempt(candidate, self.timeout(candidate)) for candidate in self.chain(tier)]
+
+    def _failed(
+        self,
+        attempt: FallbackAttempt,
+        error: BaseException,
+        start: float,
+        last: bool
+    ) -> Optional[BaseException]:
+        """Ghi nhận lần thử thất bại.
+
+        Returns:
+            Lỗi cần ném ra ngay (lần thử cuối, đã có tác dụng phụ hoặc lỗi không
+            cho phép chuyển hạng), hoặc None để thử hạng tiếp theo
+        """
+        timed_out = isinstance(error, asyncio.TimeoutError)
+        self._record(attempt.tier, "timeout" if timed_out else "error", time.perf_counter() - start)
+        if last or attempt.committed or not is_fallback_error(error):
+            return error
+        return None
+
+    def _served(self, tier: str, candidate: str, start: float):
+        """Ghi nhận lần thử thành công."""
+        self._record(candidate, "ok", time.perf_counter() - start)
+        served = self.served.setdefault(tier, {})
+        served[candidate] = served.get(candidate, 0) + 1
+        get_metrics().annotate(tier=candidate)
+
+    async def run(self, tier: str, call: Callable[[FallbackAttempt], Awaitable[T]]) -> Tuple[T, str]:
+        """Gọi model theo chuỗi dự phòng của hạng.
+
+        Args:
+            tier: Hạng model được chọn
+            call: Hàm thực hiện một lần gọi model với `attempt.tier`; gọi
+                `attempt.start()` khi đã có chỗ chạy và `attempt.commit()` khi
+                lần thử đã có tác dụng phụ
+
+        Returns:
+            Tuple gồm (kết quả của lần thử thành công, hạng đã phục vụ)
+
+        Raises:
+            asyncio.TimeoutError: Lần thử cuối quá thời gian
+            Exception: Lỗi của lần thử cuối, hoặc lỗi không cho phép chuyển hạng
+                (ví dụ AdmissionRejected) được ném ra ngay
+        """
+        attempts = self._attempts(tier)
+        for retry, attempt in enumerate(attempts):
+            if retry:
+                await asyncio.sleep(self.backoff(retry - 1))
+            start = time.perf_counter()
+            try:
+                result = await call(attempt)
+            except asyncio.CancelledError:
+                if not attempt.expired:
+                    raise
+                error = self._failed(attempt, attempt.timeout_error(), start, retry == len(attempts) - 1)
+            except Exception as e:
+                error = self._failed(attempt, e, start, retry == len(attempts) - 1)
+            else:
+                self._served(tier, attempt.tier, start)
+                return result, attempt.tier
+            finally:
+                attempt.stop()
+            if error is not None:
+                raise error
+
+    async def stream(self, tier: str, call: Callable[[FallbackAttempt], AsyncIterator[T]]) -> AsyncIterator[T]:
+        """Stream phản hồi theo chuỗi dự phòng của hạng.
+
+        Thời gian của lần thử tính tới đoạn đầu tiên. Khi đoạn đầu tiên đã được
+        gửi đi, lỗi sau đó được ném ra thay vì chuyển hạng.
+
+        Args:
+            tier: Hạng model được chọn
+            call: Async generator của một lần stream với `attempt.tier`; gọi
+                `attempt.start()` khi đã có chỗ chạy
+
+        Yields:
+            Các đoạn của lần thử thành công
+        """
+        attempts = self._attempts(tier)
+        for retry, attempt in enumerate(attempts):
+            if retry:
+                await asyncio.sleep(self.backoff(retry - 1))
+            start = time.perf_counter()
+            stream = call(attempt)
+            try:
+                async for item in stream:
+                    attempt.stop()
+                    attempt.commit()
+                    yield item
+            except asyncio.CancelledError:
+                if not attempt.expired:
+                    raise
+                error = self._failed(attempt, attempt.timeout_error(), start, retry == len(attempts) - 1)
+            except Exception as e:
+                error = self._failed(attempt, e, start, retry == len(attempts) - 1)
+            else:
+                self._served(tier, attempt.tier, start)
+                return
+            finally:
+                attempt.stop()
+                await stream.aclose()
+            if error is not None:
+                raise error
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Lấy thống kê chuỗi dự phòng.
+
+        Returns:
+            Dict gồm chuỗi và timeout theo hạng, số lần thử theo kết quả và
+            số lượt theo hạng được chọn -> hạng đã phục vụ
+        """
+        return {
+            "chains": {tier: self.chain(tier) for tier in self.chains},
+            "timeouts": dict(self.timeouts),
+            "attempts": {tier: dict(counts) for tier, counts in self.attempts.items()},
+            "served": {tier: dict(counts) for tier, counts in self.served.items()}
+        }
+
+# Chuỗi dự phòng mặc định của tiến trình
+_default_fallback: Optional[ModelFallback] = None
+
+def get_model_fallback(config: Optional[AppConfig] = None) -> ModelFallback:
+    """Lấy chuỗi model dự phòng dùng chung của tiến trình.
+
+    Args:
+        config: Cấu hình dùng khi chuỗi dự phòng được tạo lần đầu (tùy chọn)
+
+    Returns:
+        Chuỗi dự phòng dùng chung
+    """
+    global _default_fallback
+    if _default_fallback is None:
+        _default_fallback = ModelFallback.from_config(config or AppConfig())
+    return _default_fallback
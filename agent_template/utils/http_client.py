@@ -0,0 +1,154 @@
+"""
+Pool kết nối HTTP dùng chung cho agent.
+
+Module này quản lý một AsyncClient duy nhất cho toàn ứng dụng để các công cụ
+tái sử dụng kết nối (keep-alive, HTTP/2) thay vì tạo client mới cho mỗi tin nhắn.
+"""
+
+import logging
+import weakref
+from typing import Dict, Any, Optional
+
+from httpx import AsyncClient, Limits, Timeout
+
+from agent_template.config import AppConfig
+
+logger = logging.getLogger(__name__)
+
+def _http2_available() -> bool:
+    """Kiểm tra gói h2 (cần cho HTTP/2) đã được cài đặt hay chưa."""
+    try:
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+class HTTPClientPool:
+    """Pool kết nối HTTP có vòng đời gắn với ứng dụng.
+
+    Client được tạo khi service khởi động (`open`) và đóng khi tắt (`close`).
+    Nếu được dùng trước khi mở, client sẽ được tạo lười ở lần truy cập đầu tiên.
+    """
+
+    def __init__(
+        self,
+        max_connections: int = 100,
+        max_keepalive_connections: int = 20,
+        keepalive_expiry: float = 30.0,
+        timeout: float = 30.0,
+        http2: bool = True
+    ):
+        """Khởi tạo pool kết nối.
+
+        Args:
+            max_connections: Số kết nối đồng thời tối đa
+            max_keepalive_connections: Số kết nối keep-alive được giữ lại tối đa
+            keepalive_expiry: Thời gian (giây) giữ một kết nối nhàn rỗi
+            timeout: Timeout mặc định (giây) cho mỗi request
+            http2: Bật HTTP/2 nếu gói h2 có sẵn
+        """
+        self.limits = Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry
+        )
+        self.timeout = Timeout(timeout)
+        self.http2 = http2 and _http2_available()
+        if http2 and not self.http2:
+            logger.warning("Không tìm thấy gói h2, pool HTTP sẽ dùng HTTP/1.1")
+
+        self._client: Optional[AsyncClient] = None
+        self._requests = 0
+        self._connections_created = 0
+        self._seen_connections: "weakref.WeakSet" = weakref.WeakSet()
+
+    @classmethod
+    def from_config(cls, config: AppConfig) -> "HTTPClientPool":
+        """Tạo pool từ cấu hình ứng dụng."""
+        return cls(
+            max_connections=config.http_max_connections,
+            max_keepalive_connections=config.http_max_keepalive_connections,
+            keepalive_expiry=config.http_keepalive_expiry,
+            timeout=config.http_timeout,
+            http2=config.http2
+        )
+
+    @property
+    def client(self) -> AsyncClient:
+        """AsyncClient dùng chung, được tạo nếu chưa có."""
+        if self._client is None or self._client.is_closed:
+            self._client = AsyncClient(
+                limits=self.limits,
+                timeout=self.timeout,
+                http2=self.http2,
+                event_hooks={
+                    "request": [self._on_request],
+                    "response": [self._on_response]
+                }
+            )
+        return self._client
+
+    async def open(self) -> AsyncClient:
+        """Mở pool khi ứng dụng khởi động."""
+        return self.client
+
+    async def close(self):
+        """Đóng tất cả kết nối khi ứng dụng tắt."""
+        if self._client is not None and not self._client.is_closed:
+            await self._client.aclose()
+        self._client = None
+
+    async def _on_request(self, request):
+        """Đếm số request đi qua pool."""
+        self._requests += 1
+
+    async def _on_response(self, response):
+        """Ghi nhận các kết nối mới được mở trong pool."""
+        for connection in self._pool_connections():
+            if connection not in self._seen_connections:
+                self._seen_connections.add(connection)
+                self._connections_created += 1
+
+    def _pool_connections(self) -> list:
+        """Lấy danh sách kết nối hiện có của transport (httpcore)."""
+        if self._client is None:
+            return []
+        pool = getattr(self._client._transport, "_pool", None)
+        return list(getattr(pool, "connections", []))
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Lấy thống kê của pool.
+
+        Returns:
+            Dict chứa số kết nối mở/nhàn rỗi, số request và tỷ lệ tái sử dụng
+        """
+        connections = self._pool_connections()
+        idle = sum(1 for connection in connections if connection.is_idle())
+        reused = max(self._requests - self._connections_created, 0)
+        return {
+            "open_connections": len(connections),
+            "idle_connections": idle,
+            "requests": self._requests,
+            "connections_created": self._connections_created,
+            "reuse_ratio": round(reused / self._requests, 4) if self._requests else 0.0,
+            "http2": self.http2,
+            "max_connections": self.limits.max_connections,
+            "max_keepalive_connections": self.limits.max_keepalive_connections
+        }
+
+# Pool mặc định của tiến trình
+_default_pool: Optional[HTTPClientPool] = None
+
+def get_http_pool(config: Optional[AppConfig] = None) -> HTTPClientPool:
+    """Lấy pool HTTP dùng chung của tiến trình.
+
+    Args:
+        config: Cấu hình dùng khi pool được tạo lần đầu (tùy chọn)
+
+    Returns:
+        Pool HTTP dùng chung
+    """
+    global _default_pool
+    if _default_pool is None:
+        _default_pool = HTTPClientPool.from_config(config or AppConfig())
+    return _default_pool
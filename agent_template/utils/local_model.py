@@ -0,0 +1,196 @@
+"""
+Model cục bộ (offline) cho phát triển và benchmark.
+
+Chọn bằng cách đặt MODEL_NAME, ADVANCE_NAME hoặc LIGHT_MODEL thành "local" (hoặc
+"local:<tên>"). Model trả về văn bản xác định theo hội thoại, gọi công cụ khi
+tin nhắn nhắc tới tên công cụ (nhiều công cụ được gọi song song trong cùng một
+bước), với độ trễ và tốc độ sinh token cấu hình được, nên không tốn lượt gọi API
+thật. Lần gọi không stream mô phỏng prompt cache của provider: phần đầu hội
+thoại đã gặp trước đó được báo là token đã cache trong usage.
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+from collections import OrderedDict
+from typing import Dict, Any, List, AsyncIterator, Union
+
+from pydantic_ai.messages import (
+    ModelMessage, ModelRequest, ModelResponse, TextPart, ToolCallPart,
+    ToolReturnPart, UserPromptPart
+)
+from pydantic_ai.models import ModelRequestParameters
+from pydantic_ai.models.function import FunctionModel, AgentInfo, DeltaToolCall, DeltaToolCalls
+from pydantic_ai.settings import ModelSettings
+from pydantic_ai.tools import ToolDefinition
+from pydantic_ai.usage import Usage
+
+# Từ vựng dùng để sinh văn bản xác định
+VOCABULARY = (
+    "agent", "phản", "hồi", "cục", "bộ", "dữ", "liệu", "kiểm", "thử", "hệ", "thống",
+    "luồng", "hội", "thoại", "công", "cụ", "kết", "quả", "nhanh", "ổn", "định",
+    "model", "token", "bộ", "nhớ", "tóm", "tắt", "yêu", "cầu", "xử", "lý"
+)
+
+def is_local_model(name: str) -> bool:
+    """Kiểm tra tên model có trỏ tới model cục bộ hay không."""
+    return name == "local" or name.startswith("local:")
+
+class LocalModel(FunctionModel):
+    """Model xác định chạy hoàn toàn trong tiến trình.
+
+    Cùng prompt luôn cho cùng phản hồi. Độ trễ gồm `latency` giây trước token
+    đầu tiên và `response_tokens / tokens_per_second` giây cho phần còn lại.
+    """
+
+    def __init__(
+        self,
+        name: str = "local",
+        latency: float = 0.0,
+        tokens_per_second: float = 0.0,
+        response_tokens: int = 40
+    ):
+        """Khởi tạo model cục bộ.
+
+        Args:
+            name: Tên model (ví dụ "local" hoặc "local:fast")
+            latency: Độ trễ (giây) trước token đầu tiên
+            tokens_per_second: Tốc độ sinh token (0 để sinh tức thì)
+            response_tokens: Số token của mỗi phản hồi văn bản
+        """
+        super().__init__(self._respond, stream_function=self._stream_respond, model_name=name)
+        self._system = "local"
+        self.latency = latency
+        self.tokens_per_second = tokens_per_second
+        self.response_tokens = response_tokens
+        # Mã băm các phần đầu hội thoại đã gặp -> số token prompt của phần đó
+        self._prefix_cache: "OrderedDict[str, int]" = OrderedDict()
+        self.prefix_cache_size = 4096
+
+    @classmethod
+    def from_env(cls, name: str = "local") -> "LocalModel":
+        """Tạo model cục bộ từ biến môi trường LOCAL_MODEL_*."""
+        return cls(
+            name=name,
+            latency=float(os.environ.get("LOCAL_MODEL_LATENCY", "0")),
+            tokens_per_second=float(os.environ.get("LOCAL_MODEL_TOKENS_PER_SECOND", "0")),
+            response_tokens=int(os.environ.get("LOCAL_MODEL_RESPONSE_TOKENS", "40"))
+        )
+
+    async def request(
+        self,
+        messages: List[ModelMessage],
+        model_settings: Union[ModelSettings, None],
+        model_request_parameters: ModelRequestParameters
+    ):
+        """Gọi model và ghi số token prompt trùng phần đầu đã gặp vào usage."""
+        response, usage = await super().request(messages, model_settings, model_request_parameters)
+        cached_tokens = min(self._match_prefix(messages), usage.request_tokens or 0)
+        usage = Usage(
+            requests=usage.requests,
+            request_tokens=usage.request_tokens,
+            response_tokens=usage.response_tokens,
+            total_tokens=usage.total_tokens,
+            details={**(usage.details or {}), "cached_tokens": cached_tokens}
+        )
+        return response, usage
+
+    def _match_prefix(self, messages: List[ModelMessage]) -> int:
+        """Tìm phần đầu dài nhất đã gặp và ghi nhớ mọi phần đầu của lần gọi này."""
+        digest = hashlib.sha256()
+        tokens = 0
+        cached_tokens = 0
+        for message in messages:
+            for part in message.parts:
+                text = _part_text(part)
+                digest.update(f"{part.part_kind}\0{text}\0".encode("utf-8"))
+                if isinstance(message, ModelRequest):
+                    tokens += len(text.split())
+            key = digest.hexdigest()
+            if key in self._prefix_cache:
+                self._prefix_cache.move_to_end(key)
+                cached_tokens = tokens
+            else:
+                self._prefix_cache[key] = tokens
+                if len(self._prefix_cache) > self.prefix_cache_size:
+                    self._prefix_cache.popitem(last=False)
+        return cached_tokens
+
+    # ===== SINH PHẢN HỒI =====
+    def _plan(self, messages: List[ModelMessage], info: AgentInfo) -> Union[List[str], List[ToolCallPart]]:
+        """Quyết định phản hồi: danh sách token văn bản hoặc các lệnh gọi công cụ."""
+        request = messages[-1] if messages and isinstance(messages[-1], ModelRequest) else None
+        parts = request.parts if request else []
+        tool_returns = [part for part in parts if isinstance(part, ToolReturnPart)]
+        prompt = " ".join(part.content for part in parts if isinstance(part, UserPromptPart) and isinstance(part.content, str))
+
+        if tool_returns:
+            # Đã có kết quả công cụ: trả lời bằng văn bản chứa kết quả đó
+            summary = "; ".join(f"{part.tool_name}: {part.model_response_str()}" for part in tool_returns)
+            return [f"Kết quả công cụ {summary}."]
+
+        # Chỉ xét câu hỏi hiện tại; lịch sử nằm ở các message trước đó
+        question = prompt.strip()
+        calls = [
+            ToolCallPart(tool_name=tool.name, args=_tool_args(tool, question))
+            for tool in info.function_tools
+            if tool.name.lower() in question.lower()
+        ]
+        if calls:
+            return calls
+
+        # Phản hồi phụ thuộc cả lịch sử, giống một model thật
+        conversation = "\n".join(_part_text(part) for message in messages for part in message.parts)
+        digest = hashlib.sha256(f"{self.model_name}\n{conversation}".encode("utf-8")).digest()
+        words = [VOCABULARY[digest[i % len(digest)] % len(VOCABULARY)] for i in range(max(self.response_tokens - 1, 0))]
+        return [f"[{self.model_name}]"] + [f" {word}" for word in words]
+
+    async def _respond(self, messages: List[ModelMessage], info: AgentInfo) -> ModelResponse:
+        """Trả về toàn bộ phản hồi sau thời gian trễ mô phỏng."""
+        plan = self._plan(messages, info)
+        delay = self.latency + (len(plan) / self.tokens_per_second if self.tokens_per_second > 0 else 0)
+        if delay > 0:
+            await asyncio.sleep(delay)
+        if plan and isinstance(plan[0], ToolCallPart):
+            return ModelResponse(parts=plan, model_name=self.model_name)
+        return ModelResponse(parts=[TextPart("".join(plan))], model_name=self.model_name)
+
+    async def _stream_respond(self, messages: List[ModelMessage], info: AgentInfo) -> AsyncIterator[Union[str, DeltaToolCalls]]:
+        """Trả về phản hồi theo từng token với tốc độ mô phỏng."""
+        plan = self._plan(messages, info)
+        if self.latency > 0:
+            await asyncio.sleep(self.latency)
+        if plan and isinstance(plan[0], ToolCallPart):
+            yield {index: DeltaToolCall(name=call.tool_name, json_args=json.dumps(call.args)) for index, call in enumerate(plan)}
+            return
+        for token in plan:
+            if self.tokens_per_second > 0:
+                await asyncio.sleep(1 / self.tokens_per_second)
+            yield token
+
+def _part_text(part: Any) -> str:
+    """Nội dung của một phần message, bỏ qua thời điểm."""
+    if isinstance(part, ToolCallPart):
+        return f"{part.tool_name} {part.args_as_json_str()}"
+    if isinstance(part, ToolReturnPart):
+        return f"{part.tool_name} {part.model_response_str()}"
+    content = getattr(part, "content", "")
+    return content if isinstance(content, str) else json.dumps(content, default=str)
+
+def _tool_args(tool: ToolDefinition, prompt: str) -> Dict[str, Any]:
+    """Tạo tham số xác định cho các tham số bắt buộc của một công cụ."""
+    schema = tool.parameters_json_schema or {}
+    properties = schema.get("properties", {})
+    args = {}
+    for name in schema.get("required", []):
+        kind = properties.get(name, {}).get("type")
+        if kind == "integer":
+            args[name] = 1
+        elif kind == "number":
+            args[name] = 1.0
+        elif kind == "boolean":
+            args[name] = True
+        else:
+            args[name] = prompt[:200]
+    return args
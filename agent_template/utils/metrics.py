@@ -0,0 +1,337 @@
+"""
+Đo độ trễ theo từng bước của một lượt hội thoại và xuất dạng Prometheus.
+
+Một lượt được chia thành các bước (chờ khóa luồng, tải bộ nhớ, chọn hạng
+model, dựng lịch sử, tra cache, chạy agent, chạy công cụ, lưu bộ nhớ). Mỗi bước
+được bọc bằng `stage("tên")`; thời gian được ghi vào lượt hiện tại (ContextVar)
+và đưa vào histogram khi lượt kết thúc, gắn nhãn hạng model và kết quả cache
+của lượt. Số token theo hạng được cộng dồn qua `record_tokens`.
+
+`GET /metrics` trả về toàn bộ số liệu ở định dạng văn bản của Prometheus. Khi
+có LOGFIRE_TOKEN, mỗi lượt và mỗi bước còn được ghi thành span của logfire.
+"""
+
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from agent_template.config import AppConfig
+
+# Ngưỡng bucket (giây) của các histogram độ trễ
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+Labels = Tuple[Tuple[str, str], ...]
+
+def _format_labels(labels: Labels, extra: str = "") -> str:
+    """Định dạng nhãn theo cú pháp Prometheus."""
+    parts = [f'{name}="{_escape(value)}"' for name, value in labels]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+def _escape(value: str) -> str:
+    """Thoát các ký tự đặc biệt trong giá trị nhãn."""
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+class Histogram:
+    """Histogram có nhãn với các bucket cố định."""
+
+    def __init__(self, name: str, help_text: str, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = buckets
+        # nhãn -> [số đếm theo bucket..., tổng, số lần]
+        self._series: Dict[Labels, List[float]] = {}
+
+    def observe(self, value: float, **labels: str):
+        """Ghi nhận một giá trị."""
+        key = tuple(sorted(labels.items()))
+        series = self._series.get(key)
+        if series is None:
+            series = self._series[key] = [0.0] * (len(self.buckets) + 2)
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                series[index] += 1
+        series[-2] += value
+        series[-1] += 1
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        """Số lần, tổng và trung bình (ms) của từng chuỗi nhãn."""
+        return {
+            ",".join(f"{name}={value}" for name, value in labels): {
+                "count": int(series[-1]),
+                "avg_ms": round(series[-2] / series[-1] * 1000, 2) if series[-1] else 0.0
+            }
+            for labels, series in self._series.items()
+        }
+
+    def render(self) -> List[str]:
+        """Các dòng văn bản Prometheus của histogram."""
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        for labels, series in sorted(self._series.items()):
+            for bound, count in zip(self.buckets, series):
+                le = f'le="{bound}"'
+                lines.append(f"{self.name}_bucket{_format_labels(labels, le)} {int(count)}")
+            le = 'le="+Inf"'
+            lines.append(f"{self.name}_bucket{_format_labels(labels, le)} {int(series[-1])}")
+            lines.append(f"{self.name}_sum{_format_labels(labels)} {series[-2]:.6f}")
+            lines.append(f"{self.name}_count{_format_labels(labels)} {int(series[-1])}")
+        return lines
+
+class Counter:
+    """Bộ đếm có nhãn."""
+
+    def __init__(self, name: str, help_text: str):
+        self.name = name
+        self.help_text = help_text
+        self._series: Dict[Labels, float] = {}
+
+    def inc(self, amount: float = 1, **labels: str):
+        """Tăng bộ đếm."""
+        key = tuple(sorted(labels.items()))
+        self._series[key] = self._series.get(key, 0) + amount
+
+    def snapshot(self) -> Dict[str, float]:
+        """Giá trị của từng chuỗi nhãn."""
+        return {
+            ",".join(f"{name}={value}" for name, value in labels): value
+            for labels, value in self._series.items()
+        }
+
+    def render(self) -> List[str]:
+        """Các dòng văn bản Prometheus của bộ đếm."""
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        for labels, value in sorted(self._series.items()):
+            lines.append(f"{self.name}{_format_labels(labels)} {value:g}")
+        return lines
+
+class Gauge:
+    """Giá trị tức thời có nhãn."""
+
+    def __init__(self, name: str, help_text: str):
+        self.name = name
+        self.help_text = help_text
+        self._series: Dict[Labels, float] = {}
+
+    def set(self, value: float, **labels: str):
+        """Đặt giá trị."""
+        self._series[tuple(sorted(labels.items()))] = value
+
+    def render(self) -> List[str]:
+        """Các dòng văn bản Prometheus của gauge."""
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} gauge"]
+        for labels, value in sorted(self._series.items()):
+            lines.append(f"{self.name}{_format_labels(labels)} {value:g}")
+        return lines
+
+class Turn:
+    """Các bước đã đo của một lượt hội thoại."""
+
+    def __init__(self, mode: str):
+        self.mode = mode
+        self.tier = "unknown"
+        self.cache = "miss"
+        self.status = "ok"
+        self.start = time.perf_counter()
+        # Tổng thời gian (giây), có khi lượt kết thúc
+        self.elapsed: Optional[float] = None
+        # (tên bước, thời điểm bắt đầu tính từ đầu lượt, số giây)
+        self.stages: List[Tuple[str, float, float]] = []
+        # Các lần gọi model theo chuỗi dự phòng: hạng, kết quả, số giây
+        self.attempts: List[Tuple[str, str, float]] = []
+
+    def breakdown(self) -> Dict[str, Any]:
+        """Thời gian từng bước của lượt, dùng cho profiling theo request.
+
+        Returns:
+            Dict gồm hạng model, kết quả cache, tổng thời gian, các bước theo
+            thứ tự bắt đầu và tổng thời gian theo từng loại bước (ms)
+        """
+        elapsed = self.elapsed if self.elapsed is not None else time.perf_counter() - self.start
+        totals: Dict[str, float] = {}
+        for name, _, seconds in self.stages:
+            totals[name] = totals.get(name, 0.0) + seconds
+        return {
+            "tier": self.tier,
+            "cache": self.cache,
+            "mode": self.mode,
+            "total_ms": round(elapsed * 1000, 2),
+            "stages": [
+                {"stage": name, "start_ms": round(offset * 1000, 2), "ms": round(seconds * 1000, 2)}
+                for name, offset, seconds in sorted(self.stages, key=lambda stage: stage[1])
+            ],
+            "stage_totals_ms": {name: round(seconds * 1000, 2) for name, seconds in totals.items()},
+            "attempts": [
+                {"tier": tier, "outcome": outcome, "ms": round(seconds * 1000, 2)}
+                for tier, outcome, seconds in self.attempts
+            ]
+        }
+
+# Lượt đang được đo; task công cụ do pydantic-ai tạo thừa hưởng context
+_current_turn: ContextVar[Optional[Turn]] = ContextVar("metrics_turn", default=None)
+
+class Metrics:
+    """Số liệu độ trễ theo bước, số lượt và token của tiến trình."""
+
+    def __init__(self, logfire_enabled: bool = False):
+        """Khởi tạo bộ số liệu.
+
+        Args:
+            logfire_enabled: Ghi thêm span logfire cho mỗi lượt và mỗi bước
+        """
+        self.logfire_enabled = logfire_enabled
+        self._lock = threading.Lock()
+        self.stage_seconds = Histogram(
+            "agent_stage_seconds", "Độ trễ của từng bước trong một lượt hội thoại"
+        )
+        self.turn_seconds = Histogram("agent_turn_seconds", "Độ trễ toàn bộ một lượt hội thoại")
+        self.turns = Counter("agent_turns_total", "Số lượt hội thoại theo hạng model, kết quả cache và trạng thái")
+        self.tokens = Counter("agent_tokens_total", "Số token theo hạng model và loại (prompt, cached, response)")
+        self.admission_wait = Histogram(
+            "agent_admission_wait_seconds", "Thời gian chờ trong hàng đợi trước khi gọi model"
+        )
+        self.admission_queue = Gauge("agent_admission_queue_depth", "Số request đang chờ gọi model theo hạng")
+        self.admission_running = Gauge("agent_admission_running", "Số lệnh gọi model đang chạy theo hạng")
+        self.admission_rejected = Counter(
+            "agent_admission_rejected_total", "Số request bị từ chối vì hạng model quá tải"
+        )
+        self.model_attempts = Counter(
+            "agent_model_attempts_total", "Số lần gọi model theo hạng và kết quả (ok, timeout, error)"
+        )
+        self.rate_limited = Counter(
+            "agent_rate_limited_total", "Số request bị từ chối vì client vượt giới hạn tốc độ"
+        )
+
+    def _span(self, name: str, **attributes: Any):
+        """Span logfire nếu được bật, nếu không thì không làm gì."""
+        if not self.logfire_enabled:
+            return nullcontext()
+        configure_logfire()
+        import logfire
+        return logfire.span(name, **attributes)
+
+    @contextmanager
+    def turn(self, mode: str) -> Iterator[Turn]:
+        """Đo một lượt hội thoại; các bước bên trong được gắn vào lượt này.
+
+        Args:
+            mode: Chế độ xử lý ("graph", "legacy", "stream"...)
+
+        Yields:
+            Lượt đang đo; người gọi có thể đặt tier, cache và status
+        """
+        turn = Turn(mode)
+        token = _current_turn.set(turn)
+        try:
+            with self._span("agent.turn", mode=mode):
+                yield turn
+        except BaseException:
+            turn.status = "error"
+            raise
+        finally:
+            _current_turn.reset(token)
+            turn.elapsed = time.perf_counter() - turn.start
+            with self._lock:
+                for stage_name, _, seconds in turn.stages:
+                    self.stage_seconds.observe(seconds, stage=stage_name, tier=turn.tier)
+                self.turn_seconds.observe(turn.elapsed, tier=turn.tier, mode=mode)
+                self.turns.inc(tier=turn.tier, mode=mode, cache=turn.cache, status=turn.status)
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        """Đo một bước; ngoài lượt, bước được ghi ngay với hạng "unknown"."""
+        start = time.perf_counter()
+        try:
+            with self._span(f"agent.{name}"):
+                yield
+        finally:
+            self.record_stage(name, time.perf_counter() - start)
+
+    def record_stage(self, name: str, seconds: float):
+        """Ghi một bước đã đo sẵn (ví dụ thời gian chờ khóa)."""
+        turn = _current_turn.get()
+        if turn is not None:
+            turn.stages.append((name, time.perf_counter() - seconds - turn.start, seconds))
+        else:
+            with self._lock:
+                self.stage_seconds.observe(seconds, stage=name, tier="unknown")
+
+    def annotate(self, tier: Optional[str] = None, cache_hit: Optional[bool] = None):
+        """Gắn hạng model và kết quả cache cho lượt hiện tại (nếu có)."""
+        turn = _current_turn.get()
+        if turn is None:
+            return
+        if tier is not None:
+            turn.tier = tier
+        if cache_hit is not None:
+            turn.cache = "hit" if cache_hit else "miss"
+
+    def record_attempt(self, tier: str, outcome: str, seconds: float):
+        """Ghi nhận một lần gọi model trong chuỗi dự phòng vào lượt hiện tại (nếu có)."""
+        with self._lock:
+            self.model_attempts.inc(tier=tier, outcome=outcome)
+        turn = _current_turn.get()
+        if turn is not None:
+            turn.attempts.append((tier, outcome, seconds))
+
+    def record_tokens(self, tier: str, request_tokens: int, cached_tokens: int, response_tokens: int):
+        """Cộng dồn số token của một lần gọi model."""
+        with self._lock:
+            self.tokens.inc(request_tokens, tier=tier, kind="prompt")
+            self.tokens.inc(cached_tokens, tier=tier, kind="cached")
+            self.tokens.inc(response_tokens, tier=tier, kind="response")
+
+    def render(self) -> str:
+        """Toàn bộ số liệu ở định dạng văn bản của Prometheus."""
+        with self._lock:
+            lines = []
+            for metric in (
+                self.stage_seconds, self.turn_seconds, self.turns, self.tokens,
+                self.admission_wait, self.admission_queue, self.admission_running, self.admission_rejected,
+                self.model_attempts, self.rate_limited
+            ):
+                lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Tóm tắt số liệu dạng dict cho GET /stats."""
+        with self._lock:
+            return {
+                "stages": self.stage_seconds.snapshot(),
+                "turns": self.turns.snapshot(),
+                "tokens": self.tokens.snapshot()
+            }
+
+_logfire_configured = False
+
+def configure_logfire():
+    """Cấu hình logfire một lần; chỉ gửi dữ liệu khi có LOGFIRE_TOKEN."""
+    global _logfire_configured
+    if not _logfire_configured:
+        import logfire
+        logfire.configure(send_to_logfire='if-token-present')
+        _logfire_configured = True
+
+# Bộ số liệu mặc định của tiến trình
+_default_metrics: Optional[Metrics] = None
+
+def get_metrics(config: Optional[AppConfig] = None) -> Metrics:
+    """Lấy bộ số liệu dùng chung của tiến trình.
+
+    Args:
+        config: Cấu hình dùng khi bộ số liệu được tạo lần đầu (tùy chọn)
+
+    Returns:
+        Bộ số liệu dùng chung
+    """
+    global _default_metrics
+    if _default_metrics is None:
+        config = config or AppConfig()
+        _default_metrics = Metrics(logfire_enabled=bool(config.logfire_token))
+    return _default_metrics
+
+def stage(name: str):
+    """Đo một bước bằng bộ số liệu dùng chung (`with stage("load_memory"): ...`)."""
+    return get_metrics().stage(name)
@@ -0,0 +1,96 @@
+"""
+Profiling theo yêu cầu cho từng request.
+
+Khi PROFILING được bật, client có thể yêu cầu profiling một lần gửi tin nhắn
+qua header `X-Profile` hoặc tham số `?profile=`. Giá trị `timing` (hoặc `1`)
+chỉ trả về thời gian từng bước của lượt; giá trị `cprofile` còn chạy cProfile
+trong suốt lần gọi và ghi file `.prof` vào PROFILE_DIR để xem bằng `pstats`
+hoặc snakeviz.
+
+cProfile đo mọi code chạy trên luồng của event loop trong thời gian đó, kể cả
+các request khác đang chạy xen kẽ; chỉ một request được chạy cProfile tại một
+thời điểm.
+"""
+
+import cProfile
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, Optional
+
+# Giá trị cờ profiling hợp lệ -> chế độ
+PROFILE_MODES = {
+    "1": "timing",
+    "true": "timing",
+    "yes": "timing",
+    "timing": "timing",
+    "cprofile": "cprofile"
+}
+
+def parse_profile_flag(value: Optional[str]) -> Optional[str]:
+    """Chuyển giá trị header/tham số thành chế độ profiling.
+
+    Args:
+        value: Giá trị của `X-Profile` hoặc `?profile=` (None nếu không có)
+
+    Returns:
+        "timing", "cprofile" hoặc None nếu không yêu cầu profiling
+
+    Raises:
+        ValueError: Nếu giá trị không hợp lệ
+    """
+    if value is None or value.strip().lower() in ("", "0", "false", "no"):
+        return None
+    mode = PROFILE_MODES.get(value.strip().lower())
+    if mode is None:
+        raise ValueError(f"Giá trị profile không hợp lệ: {value} (dùng timing hoặc cprofile)")
+    return mode
+
+class RequestProfiler:
+    """Chạy cProfile cho một request và ghi kết quả ra file."""
+
+    def __init__(self, directory: str):
+        """Khởi tạo profiler.
+
+        Args:
+            directory: Thư mục chứa file .prof
+        """
+        self.directory = directory
+        self._active = threading.Lock()
+
+    @contextmanager
+    def capture(self, name: str) -> Iterator[Dict[str, Any]]:
+        """Chạy cProfile trong phạm vi khối `with`.
+
+        Nếu một request khác đang được profiling, khối vẫn chạy nhưng không
+        có file; thông tin được trả về qua dict.
+
+        Args:
+            name: Tên gợi nhớ đưa vào tên file (ví dụ thread_id)
+
+        Yields:
+            Dict được điền "profile_file" (đường dẫn file .prof) hoặc
+            "profile_error" khi khối kết thúc
+        """
+        info: Dict[str, Any] = {}
+        if not self._active.acquire(blocking=False):
+            info["profile_error"] = "Đang có request khác chạy cProfile"
+            yield info
+            return
+
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+            try:
+                yield info
+            finally:
+                profiler.disable()
+            os.makedirs(self.directory, exist_ok=True)
+            safe_name = re.sub(r"[^A-Za-z0-9_.-]", "_", name)[:64]
+            path = os.path.join(self.directory, f"{safe_name}-{time.strftime('%Y%m%d%H%M%S')}-{os.getpid()}.prof")
+            profiler.dump_stats(path)
+            info["profile_file"] = path
+        finally:
+            self._active.release()
@@ -56,10 +56,12 @@ def get_simple_assistant_prompt() -> str:
 
 
 def get_technical_assistant_prompt() -> str:
-       """Prompt cho assistant chuyên về kỹ thuật."""
-       return f"""Bạn là một chuyên gia kỹ thuật, tập trung vào việc cung cấp hướng dẫn và giải pháp chính xác.
+       """Prompt cho assistant chuyên về kỹ thuật.
 
-{get_current_date_str()}
+       Không chứa ngày hiện tại để prompt giữ nguyên giữa các lượt; ngày được
+       thêm ở cuối lịch sử (xem memory/context.py).
+       """
+       return f"""Bạn là một chuyên gia kỹ thuật, tập trung vào việc cung cấp hướng dẫn và giải pháp chính xác.
 
 {MEMORY_INSTRUCTIONS}
 
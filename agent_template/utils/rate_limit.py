@@ -0,0 +1,435 @@
+"""
+Giới hạn tốc độ request theo client bằng token bucket.
+
+Mỗi client (API key, thread_id hoặc địa chỉ IP, theo thứ tự trong
+RATE_LIMIT_KEY) có một bucket riêng cho từng nhóm endpoint: "message" cho các
+endpoint gửi tin nhắn (tốn lượt gọi model) và "read" cho các endpoint còn lại.
+Bucket chứa tối đa BURST token và được nạp lại RATE token mỗi giây; mỗi request
+tiêu một token (mỗi tin nhắn trong lô /send_messages tiêu một token), hết token
+thì API trả 429 kèm Retry-After.
+
+Giới hạn tốc độ tắt mặc định (RATE_LIMIT=true để bật): sau một proxy, mọi client
+có cùng IP nên cần RATE_LIMIT_TRUST_PROXY hoặc khóa theo API key.
+
+Trạng thái bucket mặc định nằm trong bộ nhớ của tiến trình (RATE_LIMIT_STORE=
+memory). Khi chạy nhiều worker, dùng "sqlite" để các worker chia sẻ ngân sách,
+hoặc đăng ký backend riêng (ví dụ Redis) bằng register_bucket_store().
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from agent_template.config import AppConfig
+from agent_template.utils.metrics import get_metrics
+
+class BucketStore:
+    """Giao diện chung của nơi lưu trạng thái token bucket.
+
+    Backend mới cần cài đặt take() và được đăng ký bằng register_bucket_store().
+    Backend có I/O chặn (file, mạng) đặt blocking = True để take() chạy trong
+    thread pool thay vì trên event loop.
+    """
+
+    blocking: bool = False
+
+    def take(self, key: str, capacity: float, rate: float, cost: float = 1.0) -> Tuple[bool, float]:
+        """Lấy token khỏi bucket của một khóa.
+
+        Args:
+            key: Khóa của bucket (nhóm endpoint và client)
+            capacity: Số token tối đa của bucket
+            rate: Số token được nạp lại mỗi giây
+            cost: Số token request cần
+
+        Returns:
+            Tuple gồm (được phép hay không, số giây phải chờ nếu bị từ chối)
+        """
+        raise NotImplementedError
+
+    def size(self) -> int:
+        """Số bucket đang được lưu (-1 nếu backend không hỗ trợ)."""
+        return -1
+
+    def close(self):
+        """Giải phóng tài nguyên của backend."""
+
+def _refill(tokens: float, updated: float, now: float, capacity: float, rate: float) -> float:
+    """Số token của bucket sau khi nạp lại tới thời điểm now."""
+    return min(capacity, tokens + max(0.0, now - updated) * rate)
+
+class MemoryBucketStore(BucketStore):
+    """Bucket trong bộ nhớ tiến trình; bucket lâu không dùng bị loại khi vượt giới hạn."""
+
+    def __init__(self, max_keys: int = 100_000):
+        """Khởi tạo backend.
+
+        Args:
+            max_keys: Số bucket tối đa giữ trong bộ nhớ
+        """
+        self.max_keys = max_keys
+        # khóa -> [số token, thời điểm cập nhật (time.monotonic)]
+        self._buckets: "OrderedDict[str, List[float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, key: str, capacity: float, rate: float, cost: float = 1.0) -> Tuple[bool, float]:
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = [capacity, now]
+                if len(self._buckets) > self.max_keys:
+                    # Bucket bị loại được tạo lại đầy khi dùng lần sau
+                    self._buckets.popitem(last=False)
+            else:
+                self._buckets.move_to_end(key)
+                bucket[0] = _refill(bucket[0], bucket[1], now, capacity, rate)
+                bucket[1] = now
+            if bucket[0] >= cost:
+                bucket[0] -= cost
+                return True, 0.0
+            return False, (cost - bucket[0]) / rate if rate > 0 else float("inf")
+
+    def size(self) -> int:
+        return len(self._buckets)
+
+class SqliteBucketStore(BucketStore):
+    """Bucket trong SQLite, dùng chung giữa các tiến trình worker trên cùng máy.
+
+    take() có thể chờ khóa ghi tới 5 giây nên được RateLimiter chạy trong thread
+    pool. Kết nối được mở khi cần và mở lại sau close().
+    """
+
+    blocking = True
+
+    def __init__(self, path: str):
+        """Khởi tạo backend.
+
+        Args:
+            path: Đường dẫn file cơ sở dữ liệu
+        """
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+
+    def _connection(self) -> sqlite3.Connection:
+        """Kết nối SQLite, mở khi cần (gọi khi đang giữ _lock)."""
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS buckets (key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL)"
+            )
+        return self._conn
+
+    def take(self, key: str, capacity: float, rate: float, cost: float = 1.0) -> Tuple[bool, float]:
+        # Đồng hồ thực để các tiến trình dùng chung mốc thời gian
+        now = time.time()
+        with self._lock:
+            conn = self._connection()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = conn.execute("SELECT tokens, updated FROM buckets WHERE key = ?", (key,)).fetchone()
+                tokens = capacity if row is None else _refill(row[0], row[1], now, capacity, rate)
+                allowed = tokens >= cost
+                if allowed:
+                    tokens -= cost
+                conn.execute(
+                    "INSERT OR REPLACE INTO buckets (key, tokens, updated) VALUES (?, ?, ?)", (key, tokens, now)
+                )
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        if allowed:
+            return True, 0.0
+        return False, (cost - tokens) / rate if rate > 0 else float("inf")
+
+    def size(self) -> int:
+        with self._lock:
+            return self._connection().execute("SELECT COUNT(*) FROM buckets").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+# Tên backend -> hàm tạo backend từ cấu hình
+BUCKET_STORES: Dict[str, Callable[[AppConfig], BucketStore]] = {
+    "memory": lambda config: MemoryBucketStore(),
+    "sqlite": lambda config: SqliteBucketStore(
+        config.rate_limit_db_path or os.path.join(config.memory_dir, "rate_limit.db")
+    ),
+}
+
+def register_bucket_store(name: str, factory: Callable[[AppConfig], BucketStore]):
+    """Đăng ký (hoặc thay thế) một backend lưu bucket, chọn bằng RATE_LIMIT_STORE.
+
+    Args:
+        name: Tên backend
+        factory: Hàm nhận AppConfig và trả về BucketStore
+    """
+    BUCKET_STORES[name] = factory
+
+# Endpoint gửi tin nhắn (gọi model); các endpoint khác dùng ngân sách "read"
+MESSAGE_PATHS = frozenset({"/send_message", "/send_message/stream", "/send_messages"})
+# Endpoint gửi theo lô: mỗi tin nhắn trong lô tốn một token
+BULK_PATH = "/send_messages"
+# Endpoint không bị giới hạn (kiểm tra trạng thái, số liệu, tài liệu)
+EXEMPT_PATHS = frozenset({"/", "/health", "/metrics", "/docs", "/redoc", "/openapi.json"})
+# Các cách xác định client hợp lệ trong RATE_LIMIT_KEY
+KEY_SOURCES = ("api_key", "thread", "ip")
+
+class RateLimiter:
+    """Ngân sách token bucket theo nhóm endpoint và client."""
+
+    def __init__(
+        self,
+        store: BucketStore,
+        budgets: Dict[str, Tuple[float, float]],
+        key_sources: Tuple[str, ...] = ("api_key", "ip"),
+        trust_proxy: bool = False
+    ):
+        """Khởi tạo bộ giới hạn.
+
+        Args:
+            store: Nơi lưu trạng thái bucket
+            budgets: Nhóm endpoint ("message", "read") -> (số token tối đa, token nạp lại mỗi giây)
+            key_sources: Thứ tự các cách xác định client ("api_key", "thread", "ip")
+            trust_proxy: Lấy IP client từ X-Forwarded-For (chỉ bật khi đứng sau proxy tin cậy)
+
+        Raises:
+            ValueError: Nếu key_sources có giá trị không hợp lệ
+        """
+        invalid = [source for source in key_sources if source not in KEY_SOURCES]
+        if invalid:
+            raise ValueError(f"RATE_LIMIT_KEY không hợp lệ: {', '.join(invalid)} (dùng {', '.join(KEY_SOURCES)})")
+        self.store = store
+        self.budgets = budgets
+        self.key_sources = key_sources
+        self.trust_proxy = trust_proxy
+        self.allowed: Dict[str, int] = {scope: 0 for scope in budgets}
+        self.rejected: Dict[str, int] = {scope: 0 for scope in budgets}
+
+    @classmethod
+    def from_config(cls, config: AppConfig) -> "RateLimiter":
+        """Tạo bộ giới hạn từ cấu hình ứng dụng."""
+        if config.rate_limit_store not in BUCKET_STORES:
+            raise ValueError(f"Backend giới hạn tốc độ không hợp lệ: {config.rate_limit_store}")
+        return cls(
+            BUCKET_STORES[config.rate_limit_store](config),
+            {
+                "message": (config.rate_limit_message_burst, config.rate_limit_message_rate),
+                "read": (config.rate_limit_read_burst, config.rate_limit_read_rate)
+            },
+            tuple(config.rate_limit_key),
+            config.rate_limit_trust_proxy
+        )
+
+    async def check(self, scope: str, client: str, cost: float = 1.0) -> Tuple[bool, float]:
+        """Tiêu token của client trong nhóm endpoint.
+
+        Backend có I/O chặn (blocking = True) chạy trong thread pool để không
+        giữ event loop.
+
+        Args:
+            scope: Nhóm endpoint ("message" hoặc "read")
+            client: Khóa client (ví dụ "ip:10.0.0.1")
+            cost: Số token cần (số tin nhắn với /send_messages)
+
+        Returns:
+            Tuple gồm (được phép hay không, số giây phải chờ nếu bị từ chối)
+        """
+        capacity, rate = self.budgets[scope]
+        key = f"{scope}:{client}"
+        if self.store.blocking:
+            allowed, retry_after = await asyncio.to_thread(self.store.take, key, capacity, rate, cost)
+        else:
+            allowed, retry_after = self.store.take(key, capacity, rate, cost)
+        if allowed:
+            self.allowed[scope] += 1
+        else:
+            self.rejected[scope] += 1
+            get_metrics().rate_limited.inc(scope=scope)
+        return allowed, retry_after
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Lấy thống kê giới hạn tốc độ.
+
+        Returns:
+            Dict gồm ngân sách, số request được phép/bị từ chối theo nhóm và số bucket
+        """
+        return {
+            "key": list(self.key_sources),
+            "budgets": {scope: {"burst": burst, "rate": rate} for scope, (burst, rate) in self.budgets.items()},
+            "allowed": dict(self.allowed),
+            "rejected": dict(self.rejected),
+            "buckets": self.store.size()
+        }
+
+    def close(self):
+        """Đóng backend lưu bucket."""
+        self.store.close()
+
+def _header(scope: Dict[str, Any], name: bytes) -> Optional[str]:
+    """Lấy giá trị header (tên viết thường) từ ASGI scope."""
+    for key, value in scope["headers"]:
+        if key == name:
+            return value.decode("latin-1")
+    return None
+
+class _BufferedBody:
+    """Đọc body của request một lần khi cần và trả lại cho app qua receive()."""
+
+    def __init__(self, receive):
+        self._receive = receive
+        self._messages: Optional[List[Dict[str, Any]]] = None
+        self._payload: Any = None
+
+    async def json(self) -> Any:
+        """Body đã phân tích JSON (None nếu rỗng hoặc không hợp lệ)."""
+        if self._messages is None:
+            self._messages = []
+            body = b""
+            while True:
+                message = await self._receive()
+                self._messages.append(message)
+                if message["type"] != "http.request":
+                    break
+                body += message.get("body", b"")
+                if not message.get("more_body"):
+                    break
+            try:
+                self._payload = json.loads(body) if body else None
+            except ValueError:
+                self._payload = None
+        return self._payload
+
+    async def receive(self):
+        """Hàm receive cho app: phát lại các message đã đọc trước."""
+        if self._messages:
+            return self._messages.pop(0)
+        return await self._receive()
+
+async def _send_json(send, status: int, payload: Dict[str, Any], headers: List[Tuple[bytes, bytes]] = ()):
+    """Gửi một phản hồi JSON trực tiếp qua ASGI."""
+    body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(body)).encode()),
+            *headers
+        ]
+    })
+    await send({"type": "http.response.body", "body": body})
+
+class RateLimitMiddleware:
+    """Middleware ASGI áp dụng RateLimiter cho các request HTTP.
+
+    Viết trực tiếp trên ASGI (không dùng BaseHTTPMiddleware) để mỗi request chỉ
+    tốn một lần tra bucket. Body chỉ được đọc khi cần: để đếm số tin nhắn của
+    /send_messages (mỗi tin nhắn tốn một token) hoặc lấy thread_id từ JSON.
+    """
+
+    def __init__(self, app, limiter: RateLimiter):
+        self.app = app
+        self.limiter = limiter
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] in EXEMPT_PATHS or scope["method"] == "OPTIONS":
+            await self.app(scope, receive, send)
+            return
+
+        limit_scope = "message" if scope["path"] in MESSAGE_PATHS else "read"
+        body = _BufferedBody(receive)
+        cost = 1
+        if scope["path"] == BULK_PATH:
+            payload = await body.json()
+            items = payload.get("messages") if isinstance(payload, dict) else None
+            cost = max(1, len(items)) if isinstance(items, list) else 1
+            capacity = self.limiter.budgets[limit_scope][0]
+            if cost > capacity:
+                # Không bao giờ đủ token: thử lại cũng vô ích
+                await _send_json(send, 413, {
+                    "success": False,
+                    "error": f"Lô có {cost} tin nhắn, vượt giới hạn {capacity:g} tin nhắn (RATE_LIMIT_MESSAGE_BURST)"
+                })
+                return
+
+        client = await self._client_key(scope, body, limit_scope)
+        allowed, retry_after = await self.limiter.check(limit_scope, client, cost)
+        if allowed:
+            await self.app(scope, body.receive, send)
+            return
+
+        retry_seconds = max(1, int(retry_after + 0.999)) if retry_after != float("inf") else 3600
+        await _send_json(send, 429, {
+            "success": False,
+            "error": f"Vượt giới hạn tốc độ, thử lại sau {retry_seconds} giây",
+            "retry_after": retry_seconds
+        }, [(b"retry-after", str(retry_seconds).encode())])
+
+    async def _client_key(self, scope, body: _BufferedBody, limit_scope: str) -> str:
+        """Xác định khóa client theo RATE_LIMIT_KEY."""
+        for source in self.limiter.key_sources:
+            if source == "api_key":
+                api_key = _header(scope, b"x-api-key")
+                if api_key is None:
+                    authorization = _header(scope, b"authorization")
+                    if authorization and authorization.lower().startswith("bearer "):
+                        api_key = authorization[7:]
+                if api_key:
+                    # Chỉ lưu băm của API key trong khóa bucket
+                    return "key:" + hashlib.sha256(api_key.encode()).hexdigest()[:16]
+            elif source == "thread":
+                thread_id = await self._thread_id(scope, body, limit_scope)
+                if thread_id:
+                    return f"thread:{thread_id}"
+            elif source == "ip":
+                forwarded = _header(scope, b"x-forwarded-for") if self.limiter.trust_proxy else None
+                if forwarded:
+                    return "ip:" + forwarded.split(",")[0].strip()
+                client = scope.get("client")
+                return f"ip:{client[0] if client else 'unknown'}"
+        return "anonymous"
+
+    async def _thread_id(self, scope, body: _BufferedBody, limit_scope: str) -> Optional[str]:
+        """Lấy thread_id từ đường dẫn /conversations/{id} hoặc body JSON của tin nhắn."""
+        path = scope["path"]
+        if path.startswith("/conversations/"):
+            return path.split("/")[2] or None
+        if limit_scope != "message" or path == BULK_PATH:
+            return None
+        payload = await body.json()
+        thread_id = payload.get("thread_id") if isinstance(payload, dict) else None
+        return str(thread_id) if thread_id else None
+
+# Bộ giới hạn mặc định của tiến trình
+_default_limiter: Optional[RateLimiter] = None
+
+def get_rate_limiter(config: Optional[AppConfig] = None) -> RateLimiter:
+    """Lấy bộ giới hạn tốc độ dùng chung của tiến trình.
+
+    Args:
+        config: Cấu hình dùng khi bộ giới hạn được tạo lần đầu (tùy chọn)
+
+    Returns:
+        Bộ giới hạn dùng chung
+    """
+    global _default_limiter
+    if _default_limiter is None:
+        _default_limiter = RateLimiter.from_config(config or AppConfig())
+    return _default_limiter
@@ -0,0 +1,248 @@
+"""
+Cache phản hồi của agent.
+
+Lưu phản hồi văn bản theo khóa gồm tên model, ModelSettings, hash system prompt
+và tin nhắn đã chuẩn hóa, để các câu hỏi lặp lại giữa các luồng (FAQ, health
+probe của bot) không phải gọi model lần nữa. Khóa không gồm lịch sử nên chỉ
+lượt không phụ thuộc lịch sử (tin nhắn đầu tiên của luồng) được dùng cache. Bộ nhớ dùng LRU + TTL có giới hạn dung lượng,
+tầng đĩa (tùy chọn) giữ các mục lâu hơn giữa các lần khởi động.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Any, Optional, Tuple
+
+from agent_template.config import AppConfig
+
+logger = logging.getLogger(__name__)
+
+def normalize_prompt(prompt: str) -> str:
+    """Chuẩn hóa prompt: bỏ khoảng trắng thừa và không phân biệt hoa thường."""
+    return re.sub(r"\s+", " ", prompt).strip().casefold()
+
+def make_cache_key(
+    model_name: str,
+    model_settings: Optional[Dict[str, Any]],
+    system_prompt: str,
+    prompt: str
+) -> str:
+    """Tạo khóa cache cho một lần gọi model.
+
+    Args:
+        model_name: Tên model
+        model_settings: ModelSettings của lần gọi
+        system_prompt: System prompt của agent
+        prompt: Prompt gửi tới model
+
+    Returns:
+        Khóa dạng chuỗi hex SHA-256
+    """
+    raw = json.dumps([
+        model_name,
+        dict(model_settings or {}),
+        hashlib.sha256(system_prompt.encode("utf-8")).hexdigest(),
+        normalize_prompt(prompt)
+    ], sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+class ResponseCache:
+    """Cache phản hồi LRU + TTL trong bộ nhớ với tầng đĩa tùy chọn.
+
+    Mỗi mục hết hạn sau `ttl` giây. Khi vượt `max_entries` hoặc `max_bytes`,
+    các mục ít được dùng gần đây nhất bị loại khỏi bộ nhớ.
+    """
+
+    def __init__(
+        self,
+        ttl: float = 300.0,
+        max_entries: int = 1024,
+        max_bytes: int = 16 * 1024 * 1024,
+        disk_dir: Optional[str] = None
+    ):
+        """Khởi tạo cache.
+
+        Args:
+            ttl: Thời gian sống (giây) của một mục
+            max_entries: Số mục tối đa trong bộ nhớ
+            max_bytes: Tổng dung lượng (byte) tối đa của các phản hồi trong bộ nhớ
+            disk_dir: Thư mục của tầng đĩa (None để tắt)
+        """
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.disk_dir = disk_dir
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+
+        # key -> (thời điểm hết hạn, phản hồi, kích thước)
+        self._entries: "OrderedDict[str, Tuple[float, str, int]]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._disk_hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    @classmethod
+    def from_config(cls, config: AppConfig) -> "ResponseCache":
+        """Tạo cache từ cấu hình ứng dụng."""
+        return cls(
+            ttl=config.response_cache_ttl,
+            max_entries=config.response_cache_max_entries,
+            max_bytes=config.response_cache_max_bytes,
+            disk_dir=config.response_cache_dir
+        )
+
+    # ===== TẦNG BỘ NHỚ =====
+    def _remove(self, key: str):
+        """Xóa một mục khỏi bộ nhớ (gọi khi đã giữ khóa)."""
+        _, _, size = self._entries.pop(key)
+        self._bytes -= size
+
+    def _put_memory(self, key: str, value: str, expires: float):
+        """Thêm một mục vào bộ nhớ và loại các mục cũ nếu vượt giới hạn."""
+        size = len(value.encode("utf-8"))
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (expires, value, size)
+            self._bytes += size
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self._evictions += 1
+
+    # ===== TẦNG ĐĨA =====
+    def _disk_path(self, key: str) -> str:
+        """Đường dẫn file của một mục trên đĩa."""
+        return os.path.join(self.disk_dir, f"{key}.json")
+
+    def _get_disk(self, key: str) -> Optional[Tuple[float, str]]:
+        """Đọc một mục còn hạn từ đĩa (None nếu không có hoặc đã hết hạn)."""
+        path = self._disk_path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                record = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if record["expires"] <= time.time():
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            return None
+        return record["expires"], record["response"]
+
+    def _put_disk(self, key: str, value: str, expires: float):
+        """Ghi một mục xuống đĩa (ghi file tạm rồi thay thế nguyên tử)."""
+        path = self._disk_path(key)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({"expires": expires, "response": value}, f, ensure_ascii=False)
+            os.replace(tmp_path, path)
+        except OSError:
+            logger.exception("Không thể ghi cache phản hồi xuống đĩa")
+
+    # ===== API =====
+    def get(self, key: str) -> Optional[str]:
+        """Lấy phản hồi đã cache.
+
+        Args:
+            key: Khóa tạo bởi make_cache_key
+
+        Returns:
+            Phản hồi đã cache hoặc None nếu không có
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[0] > now:
+                    self._entries.move_to_end(key)
+                    self._hits += 1
+                    return entry[1]
+                self._remove(key)
+
+        if self.disk_dir:
+            record = self._get_disk(key)
+            if record is not None:
+                expires, value = record
+                self._put_memory(key, value, expires)
+                with self._lock:
+                    self._disk_hits += 1
+                return value
+
+        with self._lock:
+            self._misses += 1
+        return None
+
+    def set(self, key: str, value: str):
+        """Lưu một phản hồi vào cache.
+
+        Args:
+            key: Khóa tạo bởi make_cache_key
+            value: Phản hồi văn bản
+        """
+        expires = time.time() + self.ttl
+        self._put_memory(key, value, expires)
+        if self.disk_dir:
+            self._put_disk(key, value, expires)
+
+    def clear(self):
+        """Xóa toàn bộ cache (cả tầng đĩa)."""
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+        if self.disk_dir:
+            for name in os.listdir(self.disk_dir):
+                if name.endswith(".json"):
+                    os.remove(os.path.join(self.disk_dir, name))
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Lấy thống kê cache.
+
+        Returns:
+            Dict gồm số lần trúng (bộ nhớ/đĩa), trượt, tỷ lệ trúng, số mục và dung lượng
+        """
+        lookups = self._hits + self._disk_hits + self._misses
+        return {
+            "hits": self._hits,
+            "disk_hits": self._disk_hits,
+            "misses": self._misses,
+            "hit_ratio": round((self._hits + self._disk_hits) / lookups, 4) if lookups else 0.0,
+            "evictions": self._evictions,
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "max_entries": self.max_entries,
+            "max_bytes": self.max_bytes,
+            "ttl": self.ttl,
+            "disk": bool(self.disk_dir)
+        }
+
+# Cache mặc định của tiến trình
+_default_cache: Optional[ResponseCache] = None
+
+def get_response_cache(config: Optional[AppConfig] = None) -> Optional[ResponseCache]:
+    """Lấy cache phản hồi dùng chung của tiến trình.
+
+    Args:
+        config: Cấu hình dùng khi cache được tạo lần đầu (tùy chọn)
+
+    Returns:
+        Cache phản hồi, hoặc None nếu cache bị tắt (RESPONSE_CACHE)
+    """
+    global _default_cache
+    if _default_cache is None:
+        config = config or AppConfig()
+        if not config.response_cache_enabled:
+            return None
+        _default_cache = ResponseCache.from_config(config)
+    return _default_cache
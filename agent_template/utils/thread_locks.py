@@ -0,0 +1,157 @@
+"""
+Khóa bất đồng bộ theo từng luồng hội thoại.
+
+Các lượt trên cùng một luồng được xử lý tuần tự theo thứ tự đến, trong khi các
+luồng khác nhau vẫn chạy song song hoàn toàn. Khi chạy nhiều worker, khóa file
+(flock) theo từng luồng giữ thứ tự này giữa các tiến trình. Thời gian chờ khóa
+được ghi lại để theo dõi mức độ tranh chấp.
+"""
+
+import asyncio
+import logging
+import os
+import time
+import zlib
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Dict, Any, AsyncIterator, List, Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows không có flock
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+class ThreadLockManager:
+    """Quản lý một asyncio.Lock cho mỗi luồng hội thoại đang được dùng.
+
+    Khóa được tạo khi cần và bị loại bỏ khi không còn ai giữ hoặc chờ, nên số
+    khóa trong bộ nhớ chỉ tỷ lệ với số luồng đang hoạt động.
+    """
+
+    def __init__(self, sample_size: int = 1024, lock_dir: Optional[str] = None, lock_stripes: int = 1024):
+        """Khởi tạo bộ quản lý khóa.
+
+        Args:
+            sample_size: Số mẫu thời gian chờ gần nhất dùng để tính phân vị
+            lock_dir: Thư mục chứa file khóa dùng chung giữa các tiến trình
+                (None để chỉ khóa trong tiến trình hiện tại)
+            lock_stripes: Số file khóa; mỗi luồng được băm vào một file
+        """
+        if lock_dir and fcntl is None:
+            logger.warning("Hệ điều hành không hỗ trợ flock, chỉ khóa trong từng tiến trình")
+            lock_dir = None
+        if lock_dir:
+            os.makedirs(lock_dir, exist_ok=True)
+        self.lock_dir = lock_dir
+        self.lock_stripes = lock_stripes
+
+        # thread_id -> [khóa, số tác vụ đang giữ hoặc chờ]
+        self._locks: Dict[str, List[Any]] = {}
+        self._acquisitions = 0
+        self._contended = 0
+        self._total_wait = 0.0
+        self._max_wait = 0.0
+        self._samples: deque = deque(maxlen=sample_size)
+
+    @asynccontextmanager
+    async def acquire(self, thread_id: str) -> AsyncIterator[float]:
+        """Giữ khóa của một luồng trong phạm vi khối `async with`.
+
+        Args:
+            thread_id: ID luồng hội thoại
+
+        Yields:
+            Thời gian (giây) đã chờ để lấy được khóa
+        """
+        entry = self._locks.get(thread_id)
+        if entry is None:
+            entry = self._locks[thread_id] = [asyncio.Lock(), 0]
+        entry[1] += 1
+
+        lock = entry[0]
+        start = time.perf_counter()
+        try:
+            if lock.locked():
+                self._contended += 1
+            await lock.acquire()
+        except BaseException:
+            self._release_entry(thread_id, entry)
+            raise
+
+        fd = None
+        try:
+            if self.lock_dir:
+                fd = await self._acquire_file_lock(thread_id)
+            waited = time.perf_counter() - start
+            self._record_wait(waited)
+            yield waited
+        finally:
+            if fd is not None:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+                os.close(fd)
+            lock.release()
+            self._release_entry(thread_id, entry)
+
+    async def _acquire_file_lock(self, thread_id: str) -> int:
+        """Lấy khóa file của luồng giữa các tiến trình.
+
+        Dùng flock không chặn và thử lại với thời gian chờ tăng dần để không
+        chiếm luồng của event loop hay thread pool trong lúc chờ.
+
+        Returns:
+            File descriptor đang giữ khóa
+        """
+        stripe = zlib.crc32(thread_id.encode("utf-8")) % self.lock_stripes
+        fd = os.open(os.path.join(self.lock_dir, f"{stripe:04d}.lock"), os.O_RDWR | os.O_CREAT, 0o644)
+        delay = 0.001
+        try:
+            while True:
+                try:
+                    fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    return fd
+                except BlockingIOError:
+                    await asyncio.sleep(delay)
+                    delay = min(delay * 2, 0.05)
+        except BaseException:
+            os.close(fd)
+            raise
+
+    def _release_entry(self, thread_id: str, entry: List[Any]):
+        """Giảm bộ đếm người dùng và bỏ khóa khi không còn ai dùng."""
+        entry[1] -= 1
+        if entry[1] == 0 and self._locks.get(thread_id) is entry:
+            del self._locks[thread_id]
+
+    def _record_wait(self, waited: float):
+        """Ghi nhận thời gian chờ của một lần lấy khóa."""
+        self._acquisitions += 1
+        self._total_wait += waited
+        self._max_wait = max(self._max_wait, waited)
+        self._samples.append(waited)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Lấy thống kê thời gian chờ khóa.
+
+        Returns:
+            Dict gồm số lần lấy khóa, số lần phải chờ, số luồng đang có khóa
+            và thời gian chờ (ms) trung bình, p50, p95, lớn nhất
+        """
+        samples = sorted(self._samples)
+
+        def percentile(p: float) -> float:
+            if not samples:
+                return 0.0
+            return samples[min(int(p * len(samples)), len(samples) - 1)] * 1000
+
+        return {
+            "cross_process": bool(self.lock_dir),
+            "active_threads": len(self._locks),
+            "acquisitions": self._acquisitions,
+            "contended": self._contended,
+            "wait_ms_avg": (self._total_wait / self._acquisitions * 1000) if self._acquisitions else 0.0,
+            "wait_ms_p50": percentile(0.5),
+            "wait_ms_p95": percentile(0.95),
+            "wait_ms_max": self._max_wait * 1000
+        }
@@ -0,0 +1,238 @@
+"""
+Cache kết quả công cụ theo TTL.
+
+Decorator `cached_tool` đặt ngay dưới `@agent.tool` hoặc `register_for_all_agents`
+để các lần gọi công cụ với cùng tham số trong thời gian TTL dùng lại kết quả
+cũ. Các lần gọi trùng nhau đang chạy đồng thời được gộp thành một lần thực thi
+(single-flight). Mỗi công cụ có TTL, hàm tạo khóa và giới hạn số mục riêng;
+thống kê tỷ lệ trúng được lấy qua get_tool_cache_stats().
+
+Ví dụ:
+    @register_for_all_agents
+    @cached_tool(ttl=300, key=lambda location: location.strip().casefold())
+    async def weather(ctx: RunContext[Deps], location: str) -> str:
+        ...
+"""
+
+import asyncio
+import functools
+import inspect
+import json
+import threading
+import time
+import typing
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+
+class ToolCache:
+    """Cache LRU + TTL cho kết quả của một công cụ."""
+
+    def __init__(self, name: str, ttl: float, max_entries: int):
+        """Khởi tạo cache.
+
+        Args:
+            name: Tên công cụ
+            ttl: Thời gian sống (giây) của một kết quả
+            max_entries: Số kết quả tối đa giữ trong bộ nhớ
+        """
+        self.name = name
+        self.ttl = ttl
+        self.max_entries = max_entries
+        # key -> (thời điểm hết hạn, kết quả)
+        self._entries: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+        # key -> lần thực thi đang chạy (asyncio.Task hoặc threading.Event cho công cụ đồng bộ)
+        self._inflight: Dict[Hashable, Any] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+
+    def get(self, key: Hashable, count: bool = True) -> Tuple[bool, Any]:
+        """Lấy kết quả còn hạn.
+
+        Args:
+            key: Khóa cache
+            count: Tính lần trúng vào thống kê hay không
+
+        Returns:
+            Tuple gồm (có kết quả hay không, kết quả)
+        """
+        with self._lock:
+            found, value = self._lookup(key)
+            if found:
+                self.hits += int(count)
+            return found, value
+
+    def _lookup(self, key: Hashable) -> Tuple[bool, Any]:
+        """Lấy kết quả còn hạn (gọi khi đã giữ khóa), bỏ mục đã hết hạn."""
+        entry = self._entries.get(key)
+        if entry is not None:
+            if entry[0] > time.monotonic():
+                self._entries.move_to_end(key)
+                return True, entry[1]
+            del self._entries[key]
+        return False, None
+
+    def set(self, key: Hashable, value: Any):
+        """Lưu một kết quả và loại các mục cũ nhất nếu vượt giới hạn."""
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        """Xóa toàn bộ kết quả đã cache."""
+        with self._lock:
+            self._entries.clear()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Lấy thống kê cache của công cụ.
+
+        Returns:
+            Dict gồm số lần trúng, trượt, gộp, tỷ lệ trúng, số mục và TTL
+        """
+        with self._lock:
+            calls = self.hits + self.misses + self.coalesced
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "coalesced": self.coalesced,
+                "hit_ratio": round((self.hits + self.coalesced) / calls, 4) if calls else 0.0,
+                "evictions": self.evictions,
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl": self.ttl
+            }
+
+# Cache của tất cả công cụ đã đăng ký theo tên
+_tool_caches: Dict[str, ToolCache] = {}
+
+def _default_key(**arguments: Any) -> Hashable:
+    """Khóa mặc định: JSON của các tham số, không phụ thuộc thứ tự."""
+    return json.dumps(arguments, sort_keys=True, ensure_ascii=False, default=str)
+
+def cached_tool(
+    ttl: float = 60.0,
+    key: Optional[Callable[..., Hashable]] = None,
+    max_entries: int = 256,
+    name: Optional[str] = None
+) -> Callable[[Callable[..., Any]], Callable[..., Any]]:
+    """Decorator cache kết quả của một công cụ theo TTL.
+
+    Chữ ký, type hint và docstring của công cụ được giữ nguyên nên pydantic-ai
+    vẫn tạo đúng schema. Lần gọi lỗi không được cache.
+
+    Args:
+        ttl: Thời gian sống (giây) của một kết quả
+        key: Hàm nhận các tham số của công cụ (trừ RunContext) dưới dạng keyword
+            và trả về khóa cache; mặc định dùng toàn bộ tham số
+        max_entries: Số kết quả tối đa giữ trong bộ nhớ cho công cụ này
+        name: Tên dùng trong thống kê (mặc định là tên hàm)
+
+    Returns:
+        Decorator bọc công cụ
+    """
+    make_key = key or _default_key
+
+    def decorator(func: Callable[..., Any]) -> Callable[..., Any]:
+        from pydantic_ai import RunContext
+
+        cache = ToolCache(name or func.__name__, ttl, max_entries)
+        _tool_caches[cache.name] = cache
+        signature = inspect.signature(func)
+        # Tham số RunContext (nếu có) không thuộc khóa cache
+        context_params = {
+            param.name for param in signature.parameters.values()
+            if param.annotation is RunContext or typing.get_origin(param.annotation) is RunContext
+        }
+
+        def cache_key(args: Tuple[Any, ...], kwargs: Dict[str, Any]) -> Hashable:
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            arguments = {
+                param: value for param, value in bound.arguments.items()
+                if param not in context_params
+            }
+            return make_key(**arguments)
+
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                cache_key_value = cache_key(args, kwargs)
+                found, value = cache.get(cache_key_value)
+                if found:
+                    return value
+
+                with cache._lock:
+                    task = cache._inflight.get(cache_key_value)
+                    if task is not None:
+                        cache.coalesced += 1
+                    else:
+                        cache.misses += 1
+                if task is None:
+                    async def run():
+                        try:
+                            result = await func(*args, **kwargs)
+                            cache.set(cache_key_value, result)
+                            return result
+                        finally:
+                            cache._inflight.pop(cache_key_value, None)
+
+                    task = cache._inflight[cache_key_value] = asyncio.ensure_future(run())
+                # shield: một người gọi bị hủy không hủy lần thực thi dùng chung
+                return await asyncio.shield(task)
+
+            async_wrapper.tool_cache = cache
+            return async_wrapper
+
+        @functools.wraps(func)
+        def sync_wrapper(*args, **kwargs):
+            cache_key_value = cache_key(args, kwargs)
+            found, value = cache.get(cache_key_value)
+            if found:
+                return value
+
+            while True:
+                with cache._lock:
+                    # Kết quả có thể vừa được lưu bởi lần thực thi đã chờ
+                    found, value = cache._lookup(cache_key_value)
+                    if found:
+                        cache.coalesced += 1
+                        return value
+                    event = cache._inflight.get(cache_key_value)
+                    if event is None:
+                        # Không còn lần thực thi nào (chưa có hoặc đã lỗi): trở thành chủ
+                        event = cache._inflight[cache_key_value] = threading.Event()
+                        cache.misses += 1
+                        break
+                event.wait()
+
+            try:
+                result = func(*args, **kwargs)
+                cache.set(cache_key_value, result)
+                return result
+            finally:
+                with cache._lock:
+                    cache._inflight.pop(cache_key_value, None)
+                event.set()
+
+        sync_wrapper.tool_cache = cache
+        return sync_wrapper
+
+    return decorator
+
+def get_tool_cache_stats() -> Dict[str, Dict[str, Any]]:
+    """Lấy thống kê cache của từng công cụ.
+
+    Returns:
+        Dict tên công cụ -> thống kê cache
+    """
+    return {name: cache.get_stats() for name, cache in _tool_caches.items()}
+
+def clear_tool_caches():
+    """Xóa kết quả đã cache của tất cả công cụ."""
+    for cache in _tool_caches.values():
+        cache.clear()
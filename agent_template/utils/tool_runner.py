@@ -0,0 +1,290 @@
+"""
+Lớp thực thi công cụ có giới hạn thời gian.
+
+Mỗi lần gọi công cụ bị giới hạn bởi hai mốc: thời gian chờ của riêng công cụ
+(TOOL_TIMEOUT hoặc giá trị truyền cho `guarded_tool`) và ngân sách thời gian
+chung cho tất cả công cụ trong một lượt (TOOL_TURN_TIMEOUT). Khi vượt mốc, công
+cụ bị hủy và model nhận thông báo lỗi qua ModelRetry để trả lời mà không cần
+kết quả đó, thay vì cả lượt bị treo.
+
+pydantic-ai chạy các lệnh gọi công cụ trong cùng một bước như các task song
+song; lớp này giữ nguyên điều đó, đưa công cụ đồng bộ sang thread pool riêng
+để không chặn event loop, và hủy các công cụ còn chạy khi lượt kết thúc.
+"""
+
+import asyncio
+import functools
+import inspect
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Deque, Dict, Iterator, Optional, Set
+
+from agent_template.config import AppConfig
+from agent_template.utils.metrics import get_metrics
+
+class ToolScope:
+    """Phạm vi thực thi công cụ của một lượt hội thoại."""
+
+    def __init__(self, deadline: float):
+        """Khởi tạo phạm vi.
+
+        Args:
+            deadline: Thời điểm (time.monotonic) hết ngân sách công cụ của lượt
+        """
+        self.deadline = deadline
+        # Các task công cụ đang chạy, bị hủy khi lượt kết thúc
+        self.tasks: Set[asyncio.Task] = set()
+        # Số lệnh gọi công cụ trong phạm vi (lượt có tác dụng phụ không được chạy lại)
+        self.calls = 0
+
+    def remaining(self) -> float:
+        """Số giây còn lại của ngân sách công cụ."""
+        return self.deadline - time.monotonic()
+
+# Phạm vi của lượt hiện tại; task công cụ do pydantic-ai tạo thừa hưởng context
+_current_scope: ContextVar[Optional[ToolScope]] = ContextVar("tool_scope", default=None)
+
+class ToolStats:
+    """Thống kê thực thi của một công cụ."""
+
+    def __init__(self, sample_size: int = 256):
+        self.calls = 0
+        self.timeouts = 0
+        self.cancelled = 0
+        self.errors = 0
+        self.samples: Deque[float] = deque(maxlen=sample_size)
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Trả về thống kê dạng dict."""
+        samples = sorted(self.samples)
+
+        def percentile(p: float) -> float:
+            if not samples:
+                return 0.0
+            return round(samples[min(int(p * len(samples)), len(samples) - 1)] * 1000, 2)
+
+        return {
+            "calls": self.calls,
+            "timeouts": self.timeouts,
+            "cancelled": self.cancelled,
+            "errors": self.errors,
+            "latency_ms_p50": percentile(0.5),
+            "latency_ms_p95": percentile(0.95)
+        }
+
+class ToolRunner:
+    """Thực thi công cụ với thời gian chờ, hủy và thread pool cho công cụ đồng bộ."""
+
+    def __init__(self, tool_timeout: float, turn_timeout: float, max_workers: int):
+        """Khởi tạo bộ thực thi.
+
+        Args:
+            tool_timeout: Thời gian chờ mặc định (giây) của một lần gọi công cụ
+            turn_timeout: Ngân sách thời gian (giây) cho tất cả công cụ trong một lượt
+            max_workers: Số luồng tối đa chạy công cụ đồng bộ
+        """
+        self.tool_timeout = tool_timeout
+        self.turn_timeout = turn_timeout
+        self.max_workers = max_workers
+        self._executor: Optional[ThreadPoolExecutor] = None
+        # Bảo vệ thống kê: công cụ có thể chạy trên nhiều event loop (nhiều luồng)
+        self._lock = threading.Lock()
+        self._stats: Dict[str, ToolStats] = {}
+        self._running = 0
+        self._max_running = 0
+
+    @classmethod
+    def from_config(cls, config: AppConfig) -> "ToolRunner":
+        """Tạo bộ thực thi từ cấu hình ứng dụng."""
+        return cls(config.tool_timeout, config.tool_turn_timeout, config.tool_workers)
+
+    @property
+    def executor(self) -> ThreadPoolExecutor:
+        """Thread pool cho công cụ đồng bộ, được tạo khi cần."""
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="tool")
+            return self._executor
+
+    @contextmanager
+    def scope(self) -> Iterator[ToolScope]:
+        """Mở phạm vi công cụ cho một lượt; bọc quanh lệnh gọi agent.
+
+        Các công cụ gọi trong phạm vi dùng chung ngân sách TOOL_TURN_TIMEOUT.
+        Khi phạm vi đóng (kể cả khi lượt bị hủy hoặc lỗi), công cụ còn chạy bị hủy.
+
+        Yields:
+            Phạm vi của lượt
+        """
+        scope = ToolScope(time.monotonic() + self.turn_timeout)
+        token = _current_scope.set(scope)
+        try:
+            yield scope
+        finally:
+            _current_scope.reset(token)
+            for task in list(scope.tasks):
+                task.cancel()
+
+    async def run(
+        self,
+        name: str,
+        func: Callable[..., Any],
+        args: tuple,
+        kwargs: Dict[str, Any],
+        timeout: Optional[float] = None
+    ) -> Any:
+        """Gọi một công cụ trong giới hạn thời gian.
+
+        Args:
+            name: Tên công cụ
+            func: Hàm công cụ (đồng bộ hoặc bất đồng bộ)
+            args: Tham số vị trí
+            kwargs: Tham số từ khóa
+            timeout: Thời gian chờ riêng của công cụ (None để dùng TOOL_TIMEOUT)
+
+        Returns:
+            Kết quả của công cụ
+
+        Raises:
+            ModelRetry: Nếu công cụ vượt thời gian chờ hoặc lượt đã hết ngân sách
+        """
+        # pydantic-ai đã được nạp khi công cụ chạy; import tại đây để module nhẹ khi khởi động
+        from pydantic_ai import ModelRetry
+
+        with self._lock:
+            stats = self._stats.get(name)
+            if stats is None:
+                stats = self._stats[name] = ToolStats()
+            stats.calls += 1
+
+        timeout = self.tool_timeout if timeout is None else timeout
+        scope = _current_scope.get()
+        if scope is not None:
+            scope.calls += 1
+            remaining = scope.remaining()
+            if remaining <= 0:
+                with self._lock:
+                    stats.timeouts += 1
+                raise ModelRetry(f"Đã hết thời gian dành cho công cụ trong lượt này, không gọi {name}. Hãy trả lời với thông tin hiện có.")
+            timeout = min(timeout, remaining)
+
+        if inspect.iscoroutinefunction(func):
+            call = func(*args, **kwargs)
+        else:
+            # Công cụ đồng bộ chạy trong thread pool riêng. Luồng không thể bị
+            # dừng giữa chừng: khi hết giờ, kết quả muộn bị bỏ qua
+            loop = asyncio.get_running_loop()
+            call = loop.run_in_executor(self.executor, functools.partial(func, *args, **kwargs))
+
+        task = asyncio.current_task()
+        if scope is not None and task is not None:
+            scope.tasks.add(task)
+        with self._lock:
+            self._running += 1
+            self._max_running = max(self._max_running, self._running)
+        start = time.perf_counter()
+        try:
+            return await asyncio.wait_for(call, timeout)
+        except asyncio.TimeoutError:
+            with self._lock:
+                stats.timeouts += 1
+            raise ModelRetry(f"Công cụ {name} không phản hồi trong {timeout:.1f} giây. Hãy trả lời mà không dùng kết quả của nó.")
+        except asyncio.CancelledError:
+            with self._lock:
+                stats.cancelled += 1
+            raise
+        except ModelRetry:
+            raise
+        except Exception:
+            with self._lock:
+                stats.errors += 1
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                self._running -= 1
+                stats.samples.append(elapsed)
+            get_metrics().record_stage("tool", elapsed)
+            if scope is not None and task is not None:
+                scope.tasks.discard(task)
+
+    def close(self):
+        """Dừng thread pool khi ứng dụng tắt.
+
+        Lệnh gọi còn chờ trong hàng đợi bị hủy; không chờ các công cụ đồng bộ
+        đang chạy (luồng không thể bị dừng giữa chừng, kết quả muộn bị bỏ qua).
+        Lần gọi công cụ sau đó tạo thread pool mới.
+        """
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Lấy thống kê thực thi công cụ.
+
+        Returns:
+            Dict gồm cấu hình thời gian chờ, số công cụ đang chạy, số công cụ
+            chạy đồng thời lớn nhất và thống kê của từng công cụ
+        """
+        with self._lock:
+            return {
+                "tool_timeout": self.tool_timeout,
+                "turn_timeout": self.turn_timeout,
+                "max_workers": self.max_workers,
+                "running": self._running,
+                "max_concurrent": self._max_running,
+                "tools": {name: stats.snapshot() for name, stats in self._stats.items()}
+            }
+
+# Bộ thực thi mặc định của tiến trình
+_default_runner: Optional[ToolRunner] = None
+
+def get_tool_runner(config: Optional[AppConfig] = None) -> ToolRunner:
+    """Lấy bộ thực thi công cụ dùng chung của tiến trình.
+
+    Args:
+        config: Cấu hình dùng khi bộ thực thi được tạo lần đầu (tùy chọn)
+
+    Returns:
+        Bộ thực thi công cụ dùng chung
+    """
+    global _default_runner
+    if _default_runner is None:
+        _default_runner = ToolRunner.from_config(config or AppConfig())
+    return _default_runner
+
+def guarded_tool(
+    func: Optional[Callable[..., Any]] = None,
+    *,
+    timeout: Optional[float] = None
+) -> Callable[..., Any]:
+    """Decorator chạy công cụ qua ToolRunner.
+
+    Đặt ngay dưới `@agent.tool` (và trên `@cached_tool` nếu có). Công cụ đồng bộ
+    được bọc thành hàm bất đồng bộ chạy trong thread pool; chữ ký và docstring
+    được giữ nguyên nên schema của công cụ không đổi.
+
+    Args:
+        func: Hàm công cụ (khi dùng dạng `@guarded_tool` không có ngoặc)
+        timeout: Thời gian chờ riêng (giây), mặc định dùng TOOL_TIMEOUT
+
+    Returns:
+        Công cụ đã bọc, hoặc decorator nếu chưa truyền func
+    """
+    def decorator(tool_func: Callable[..., Any]) -> Callable[..., Any]:
+        if getattr(tool_func, "guarded", False):
+            return tool_func
+
+        @functools.wraps(tool_func)
+        async def wrapper(*args, **kwargs):
+            return await get_tool_runner().run(tool_func.__name__, tool_func, args, kwargs, timeout)
+
+        wrapper.guarded = True
+        return wrapper
+
+    return decorator(func) if func is not None else decorator
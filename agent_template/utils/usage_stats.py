@@ -0,0 +1,85 @@
+"""
+Thống kê token và tỷ lệ trúng prompt cache của provider.
+
+Provider (OpenAI, Anthropic...) tự cache phần đầu prompt giống hệt giữa các lần
+gọi và báo số token đã cache trong usage. Module này ghi lại tỷ lệ đó cho từng
+lần gọi model và cộng dồn theo hạng model để xem trong GET /stats.
+"""
+
+import logging
+from typing import TYPE_CHECKING, Any, Dict, Optional
+
+from agent_template.utils.metrics import get_metrics
+
+if TYPE_CHECKING:
+    from pydantic_ai.usage import Usage
+
+logger = logging.getLogger(__name__)
+
+# Tên trường số token đã cache trong Usage.details theo từng provider
+CACHED_TOKEN_FIELDS = ("cached_tokens", "cache_read_input_tokens")
+
+def get_cached_tokens(usage: "Usage") -> int:
+    """Lấy số token prompt được provider đọc từ cache."""
+    details = usage.details or {}
+    return sum(details.get(field, 0) for field in CACHED_TOKEN_FIELDS)
+
+class UsageStats:
+    """Cộng dồn token prompt, token đã cache và token phản hồi theo hạng model."""
+
+    def __init__(self):
+        self._tiers: Dict[str, Dict[str, int]] = {}
+
+    def record(self, model_type: str, usage: "Usage", thread_id: Optional[str] = None) -> Dict[str, Any]:
+        """Ghi nhận usage của một lần xử lý.
+
+        Args:
+            model_type: Hạng model đã xử lý
+            usage: Usage của lần chạy agent (result.usage())
+            thread_id: ID luồng hội thoại, chỉ dùng cho log (tùy chọn)
+
+        Returns:
+            Dict gồm số token prompt, token đã cache và tỷ lệ cache của lần gọi
+        """
+        request_tokens = usage.request_tokens or 0
+        cached_tokens = get_cached_tokens(usage)
+        ratio = round(cached_tokens / request_tokens, 4) if request_tokens else 0.0
+
+        tier = self._tiers.get(model_type)
+        if tier is None:
+            tier = self._tiers[model_type] = {"calls": 0, "request_tokens": 0, "cached_tokens": 0, "response_tokens": 0}
+        tier["calls"] += 1
+        tier["request_tokens"] += request_tokens
+        tier["cached_tokens"] += cached_tokens
+        tier["response_tokens"] += usage.response_tokens or 0
+        get_metrics().record_tokens(model_type, request_tokens, cached_tokens, usage.response_tokens or 0)
+
+        logger.info(
+            f"Usage {model_type} (luồng {thread_id}): {request_tokens} token prompt, "
+            f"{cached_tokens} từ cache ({ratio:.0%})"
+        )
+        return {"request_tokens": request_tokens, "cached_tokens": cached_tokens, "cached_ratio": ratio}
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Lấy thống kê token theo hạng model.
+
+        Returns:
+            Dict hạng model -> số lần gọi, tổng token và tỷ lệ token prompt đã cache
+        """
+        return {
+            model_type: {
+                **tier,
+                "cached_ratio": round(tier["cached_tokens"] / tier["request_tokens"], 4) if tier["request_tokens"] else 0.0
+            }
+            for model_type, tier in self._tiers.items()
+        }
+
+# Thống kê mặc định của tiến trình
+_default_stats: Optional[UsageStats] = None
+
+def get_usage_stats() -> UsageStats:
+    """Lấy thống kê usage dùng chung của tiến trình."""
+    global _default_stats
+    if _default_stats is None:
+        _default_stats = UsageStats()
+    return _default_stats
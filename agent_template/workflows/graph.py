@@ -4,19 +4,33 @@ Triển khai luồng công việc LangGraph.
 Định nghĩa các thành phần máy trạng thái sử dụng LangGraph đồng thời tích hợp với pydantic-ai.
 """
 
-from typing import Dict, List, Union, Any, TypedDict, Annotated, Literal
+import asyncio
+import functools
+import threading
+from typing import Dict, List, Union, Any, TypedDict, Annotated, Literal, Optional, Callable, AsyncIterator
 from datetime import datetime
 
 from langgraph.graph import StateGraph, START, END
 from langgraph.graph.message import add_messages
-from httpx import AsyncClient
 from langchain.schema import HumanMessage, AIMessage, BaseMessage
 
 from agent_template.tools.logo import LogoResult
-from agent_template.core.agent import agent
-from agent_template.memory.persistence import (
-    Deps, Memory, Message, save_memory, load_memory
+from agent_template.config import RequestConfig
+from agent_template.core.agent import (
+    SYSTEM_PROMPTS, AgentStream, get_agent, get_response_cache_key, is_cacheable_turn, run_agent, select_agent
 )
+from agent_template.memory.context import (
+    build_message_history, save_turn_messages, schedule_summary_update
+)
+from agent_template.memory.persistence import Deps, Memory, Message
+from agent_template.memory.storage import (
+    load_memory_async, run_store_call, save_memory_async
+)
+from agent_template.utils.admission import AdmissionRejected
+from agent_template.utils.http_client import get_http_pool
+from agent_template.utils.metrics import get_metrics, stage
+from agent_template.utils.response_cache import get_response_cache
+from agent_template.utils.usage_stats import get_usage_stats
 
 # ===== HƯỚNG DẪN: ĐỊNH NGHĨA TRẠNG THÁI =====
 # Định nghĩa TypedDict cho trạng thái trong luồng công việc
@@ -29,6 +43,10 @@ class AgentState(TypedDict):
     thread_id: str
     status: str
     tool_calls: List[Dict[str, Any]]
+    deps: Optional[Deps]
+    stream: Optional[asyncio.Queue]
+    use_cache: bool
+    settings: Optional[RequestConfig]
 
 # ===== HƯỚNG DẪN: TẠO NODE XỬ LÝ =====
 # Node này xử lý đầu vào người dùng và gọi agent để tạo phản hồi
@@ -64,16 +82,83 @@ async def process_node(state: AgentState) -> AgentState:
         # Không có tin nhắn người dùng để xử lý
         return state
     
-    # Tạo dependencies
-    deps = Deps(client=AsyncClient())
+    # Lấy dependencies từ trạng thái, hoặc tạo từ pool HTTP dùng chung
+    deps = state.get("deps") or Deps(client=get_http_pool().client)
+    
+    # Hạng model theo ảnh chụp cấu hình của request hoặc bộ định tuyến
+    settings = state.get("settings")
+    with stage("route"):
+        _, model_type, decision = select_agent(user_input, settings=settings)
+    
+    # Lịch sử có cấu trúc: system prompt, bản tóm tắt và cửa sổ lịch sử gần đây
+    with stage("build_history"):
+        history = await run_store_call(build_message_history, thread_id, memory, SYSTEM_PROMPTS[model_type])
+    
+    # Trả lời từ cache phản hồi nếu có
+    with stage("cache_lookup"):
+        cache = get_response_cache() if state.get("use_cache", True) and is_cacheable_turn(memory) else None
+        cache_key = get_response_cache_key(model_type, user_input, settings) if cache else None
+        cached = cache.get(cache_key) if cache else None
+    get_metrics().annotate(tier=model_type, cache_hit=cached is not None)
+    new_messages = None
+    
+    # Xử lý với agent; khi có hàng đợi stream, đẩy từng đoạn phản hồi ra ngoài
+    stream = state.get("stream")
+    if cached is not None:
+        if stream is not None:
+            stream.put_nowait(cached)
+        content = cached
+    elif stream is not None:
+        parts = []
+        # Stream theo chuỗi dự phòng của hạng model; chỉ chuyển hạng trước đoạn đầu tiên
+        agent_stream = AgentStream(user_input, model_type, decision, history, deps, settings)
+        try:
+            async for delta in agent_stream:
+                parts.append(delta)
+                stream.put_nowait(delta)
+        except asyncio.CancelledError:
+            # Stream bị hủy: lưu phần phản hồi đã tạo được
+            await agent_stream.aclose()
+            memory.add_message("human", user_input)
+            memory.add_message("ai", "".join(parts))
+            await save_memory_async(thread_id, memory)
+            raise
+        content = "".join(parts)
+        if cache and agent_stream.tier == model_type:
+            cache.set(cache_key, content)
+        get_usage_stats().record(agent_stream.tier, agent_stream.result.usage(), thread_id)
+        new_messages = agent_stream.result.new_messages()
+    else:
+        # Gọi agent theo chuỗi dự phòng của hạng model (MODEL_FALLBACK)
+        result, served_type = await run_agent(user_input, model_type, decision, history, deps, settings)
+        get_usage_stats().record(served_type, result.usage(), thread_id)
+        new_messages = result.new_messages()
+        content = _result_content(result, state)
+        if cache and served_type == model_type and not isinstance(result.data, LogoResult):
+            cache.set(cache_key, content)
+    
+    # Thêm vào tin nhắn - sử dụng AIMessage trực tiếp thay vì dict
+    state["messages"].append(AIMessage(content=content))
+    
+    # Lưu vào bộ nhớ, kèm model message của lượt (gồm cả lệnh gọi công cụ)
+    with stage("save_memory"):
+        if new_messages:
+            await run_store_call(save_turn_messages, thread_id, len(memory.messages), new_messages)
+        memory.add_message("human", user_input)
+        memory.add_message("ai", content)
+        await save_memory_async(thread_id, memory)
     
-    # Xây dựng prompt với lịch sử hội thoại
-    history_str = memory.get_history_str()
-    context_prompt = f"Cuộc trò chuyện trước đó:\n{history_str}\n\nCâu hỏi hiện tại: {user_input}"
+    # Gộp các lượt cũ vào bản tóm tắt ở chế độ nền
+    schedule_summary_update(thread_id, memory, get_agent("light"))
     
-    # Xử lý với agent
-    result = await agent.run(context_prompt, deps=deps)
+    # Cập nhật trạng thái
+    state["memory"] = memory
+    state["status"] = "completed"
     
+    return state
+
+def _result_content(result, state: AgentState) -> str:
+    """Chuyển kết quả của agent thành nội dung phản hồi, ghi lại các lệnh gọi công cụ."""
     # ===== HƯỚNG DẪN: XỬ LÝ KẾT QUẢ TOOL =====
     # Thêm điều kiện ở đây để xử lý kết quả từ các công cụ khác nhau
     # Xử lý phản hồi
@@ -103,19 +188,7 @@ async def process_node(state: AgentState) -> AgentState:
     else:
         content = result.data
     
-    # Thêm vào tin nhắn - sử dụng AIMessage trực tiếp thay vì dict
-    state["messages"].append(AIMessage(content=content))
-    
-    # Lưu vào bộ nhớ
-    memory.add_message("human", user_input)
-    memory.add_message("ai", content)
-    save_memory(thread_id, memory)
-    
-    # Cập nhật trạng thái
-    state["memory"] = memory
-    state["status"] = "completed"
-    
-    return state
+    return content
 
 # ===== HƯỚNG DẪN: TẠO NODE MỚI =====
 # Mẫu để tạo một node mới xử lý chức năng cụ thể
@@ -186,6 +259,14 @@ def route_by_tool(state: AgentState) -> Literal["process", "custom_tool", "other
         return "process"  # Quay lại node xử lý chính
 """
 
+def timed_node(name: str, node: Callable[[AgentState], Any]) -> Callable[[AgentState], Any]:
+    """Bọc một node để thời gian chạy được ghi thành bước "node:<tên>" của lượt."""
+    @functools.wraps(node)
+    async def wrapper(state: AgentState) -> AgentState:
+        with stage(f"node:{name}"):
+            return await node(state)
+    return wrapper
+
 # ===== HƯỚNG DẪN: TẠO ĐỒ THỊ LUỒNG CÔNG VIỆC =====
 # Tạo đồ thị luồng công việc
 def create_workflow() -> StateGraph:
@@ -198,12 +279,13 @@ def create_workflow() -> StateGraph:
     workflow = StateGraph(AgentState)
     
     # Thêm các nút
-    workflow.add_node("process", process_node)
+    # timed_node ghi thời gian của node vào số liệu và profiling theo request
+    workflow.add_node("process", timed_node("process", process_node))
     
     # ===== HƯỚNG DẪN: THÊM NODE MỚI VÀO ĐỒ THỊ =====
     # Thêm các node tùy chỉnh của bạn vào đây
-    # workflow.add_node("custom_tool", custom_tool_node)
-    # workflow.add_node("other_tool", other_tool_node)
+    # workflow.add_node("custom_tool", timed_node("custom_tool", custom_tool_node))
+    # workflow.add_node("other_tool", timed_node("other_tool", other_tool_node))
     
     # Thêm các cạnh
     workflow.add_edge(START, "process")
@@ -240,17 +322,93 @@ def create_workflow() -> StateGraph:
     # Biên dịch đồ thị
     return workflow.compile()
 
+# ===== HƯỚNG DẪN: CACHE ĐỒ THỊ ĐÃ BIÊN DỊCH =====
+# Đồ thị được biên dịch một lần cho mỗi biến thể và dùng chung giữa các request.
+# Đăng ký biến thể mới bằng register_workflow("tên", hàm_tạo_đồ_thị)
+WORKFLOW_BUILDERS: Dict[str, Callable[[], Any]] = {
+    "default": create_workflow,
+}
+
+_compiled_workflows: Dict[str, Any] = {}
+_compiled_lock = threading.Lock()
+
+def get_compiled_workflow(variant: str = "default"):
+    """Lấy đồ thị đã biên dịch cho một biến thể, biên dịch ở lần dùng đầu tiên.
+    
+    Đồ thị đã biên dịch không giữ trạng thái giữa các lần chạy nên có thể
+    dùng chung an toàn cho các request đồng thời.
+    
+    Args:
+        variant: Tên biến thể luồng công việc trong WORKFLOW_BUILDERS
+        
+    Returns:
+        Đồ thị LangGraph đã biên dịch
+    """
+    compiled = _compiled_workflows.get(variant)
+    if compiled is not None:
+        return compiled
+    
+    with _compiled_lock:
+        # Kiểm tra lại sau khi giữ khóa để chỉ biên dịch một lần
+        compiled = _compiled_workflows.get(variant)
+        if compiled is None:
+            if variant not in WORKFLOW_BUILDERS:
+                raise KeyError(f"Không tìm thấy biến thể luồng công việc: {variant}")
+            compiled = WORKFLOW_BUILDERS[variant]()
+            _compiled_workflows[variant] = compiled
+        return compiled
+
+def register_workflow(variant: str, builder: Callable[[], Any]):
+    """Đăng ký (hoặc thay thế) một biến thể luồng công việc.
+    
+    Bản biên dịch cũ của biến thể này sẽ bị loại khỏi cache.
+    
+    Args:
+        variant: Tên biến thể
+        builder: Hàm trả về đồ thị đã biên dịch
+    """
+    with _compiled_lock:
+        WORKFLOW_BUILDERS[variant] = builder
+        _compiled_workflows.pop(variant, None)
+
+def rebuild_workflows(variant: Optional[str] = None):
+    """Biên dịch lại đồ thị khi tập node thay đổi.
+    
+    Args:
+        variant: Biến thể cần biên dịch lại (None để biên dịch lại tất cả)
+    """
+    with _compiled_lock:
+        if variant is None:
+            _compiled_workflows.clear()
+        else:
+            _compiled_workflows.pop(variant, None)
+    
+    for name in ([variant] if variant else list(WORKFLOW_BUILDERS)):
+        get_compiled_workflow(name)
+
 # Hàm để xử lý đầu vào người dùng thông qua luồng công việc
-async def process_with_graph(thread_id: str, user_input: str, memory: Memory = None) -> str:
+async def process_with_graph(
+    thread_id: str,
+    user_input: str,
+    memory: Memory = None,
+    deps: Optional[Deps] = None,
+    variant: str = "default",
+    use_cache: bool = True,
+    settings: Optional[RequestConfig] = None
+) -> str:
     """Xử lý đầu vào người dùng sử dụng luồng công việc LangGraph.
     
-    Hàm này khởi tạo một đồ thị luồng công việc, chạy nó với đầu vào
-    của người dùng và trả về phản hồi.
+    Hàm này lấy đồ thị luồng công việc đã biên dịch từ cache, chạy nó với
+    đầu vào của người dùng và trả về phản hồi.
     
     Args:
         thread_id: ID cuộc trò chuyện
         user_input: Tin nhắn của người dùng
         memory: Đối tượng bộ nhớ với lịch sử hội thoại
+        deps: Dependencies dùng chung (tùy chọn)
+        variant: Biến thể luồng công việc cần dùng
+        use_cache: Dùng cache phản hồi nếu được bật (False để bỏ qua cache)
+        settings: Ảnh chụp cấu hình của request (hạng model, temperature, max_tokens)
         
     Returns:
         Phản hồi của agent
@@ -258,10 +416,11 @@ async def process_with_graph(thread_id: str, user_input: str, memory: Memory = N
     try:
         # Tải bộ nhớ nếu không được cung cấp
         if memory is None:
-            memory = load_memory(thread_id)
+            with stage("load_memory"):
+                memory = await load_memory_async(thread_id)
             
-        # Tạo luồng công việc
-        workflow = create_workflow()
+        # Lấy luồng công việc đã biên dịch từ cache
+        workflow = get_compiled_workflow(variant)
         
         # ===== HƯỚNG DẪN: KHỞI TẠO TRẠNG THÁI =====
         # Tùy chỉnh trạng thái ban đầu nếu cần thêm các trường
@@ -272,7 +431,11 @@ async def process_with_graph(thread_id: str, user_input: str, memory: Memory = N
             "memory": memory,
             "thread_id": thread_id,
             "status": "started",
-            "tool_calls": []
+            "tool_calls": [],
+            "deps": deps,
+            "stream": None,
+            "use_cache": use_cache,
+            "settings": settings
         }
         
         # Thực thi luồng công việc
@@ -288,6 +451,9 @@ async def process_with_graph(thread_id: str, user_input: str, memory: Memory = N
             return assistant_messages[-1].content
         else:
             return "Không có phản hồi được tạo ra."
+    except AdmissionRejected:
+        # Quá tải: không lưu gì vào bộ nhớ, người gọi trả 429 để client thử lại
+        raise
     except Exception as e:
         import traceback
         error_msg = f"Lỗi trong luồng công việc: {str(e)}\n{traceback.format_exc()}"
@@ -296,5 +462,74 @@ async def process_with_graph(thread_id: str, user_input: str, memory: Memory = N
         # Lưu lỗi vào bộ nhớ
         memory.add_message("human", user_input)
         memory.add_message("ai", f"Xin lỗi, tôi đã gặp lỗi: {str(e)}")
-        save_memory(thread_id, memory)
-        return f"Lỗi trong luồng công việc: {str(e)}" 
\ No newline at end of file
+        await save_memory_async(thread_id, memory)
+        return f"Lỗi trong luồng công việc: {str(e)}"
+
+# Đánh dấu kết thúc stream trong hàng đợi
+_STREAM_END = object()
+
+async def stream_with_graph(
+    thread_id: str,
+    user_input: str,
+    memory: Memory = None,
+    deps: Optional[Deps] = None,
+    variant: str = "default",
+    use_cache: bool = True,
+    settings: Optional[RequestConfig] = None
+) -> AsyncIterator[str]:
+    """Xử lý đầu vào người dùng qua luồng công việc và trả về phản hồi theo từng đoạn.
+    
+    Đồ thị chạy trong một task riêng; node xử lý đẩy từng đoạn văn bản vào
+    hàng đợi. Nếu người gọi dừng đọc giữa chừng, task bị hủy và phần phản
+    hồi đã tạo được vẫn được lưu vào bộ nhớ.
+    
+    Args:
+        thread_id: ID cuộc trò chuyện
+        user_input: Tin nhắn của người dùng
+        memory: Đối tượng bộ nhớ với lịch sử hội thoại
+        deps: Dependencies dùng chung (tùy chọn)
+        variant: Biến thể luồng công việc cần dùng
+        use_cache: Dùng cache phản hồi nếu được bật (False để bỏ qua cache)
+        settings: Ảnh chụp cấu hình của request (hạng model, temperature, max_tokens)
+        
+    Yields:
+        Các đoạn văn bản mới của phản hồi
+    """
+    if memory is None:
+        memory = await load_memory_async(thread_id)
+    
+    workflow = get_compiled_workflow(variant)
+    queue: asyncio.Queue = asyncio.Queue()
+    state = {
+        "messages": [HumanMessage(content=user_input)],
+        "memory": memory,
+        "thread_id": thread_id,
+        "status": "started",
+        "tool_calls": [],
+        "deps": deps,
+        "stream": queue,
+        "use_cache": use_cache,
+        "settings": settings
+    }
+    
+    async def run_workflow():
+        # Đồ thị chạy trong task riêng nên lượt được đo ngay trong task đó
+        with get_metrics().turn("stream"):
+            return await workflow.ainvoke(state)
+    
+    task = asyncio.create_task(run_workflow())
+    task.add_done_callback(lambda _: queue.put_nowait(_STREAM_END))
+    try:
+        while True:
+            delta = await queue.get()
+            if delta is _STREAM_END:
+                break
+            yield delta
+        # Ném lại lỗi của đồ thị (nếu có) cho người gọi
+        await task
+    finally:
+        if not task.done():
+            task.cancel()
+            # Chờ node xử lý lưu phần phản hồi đã tạo trước khi người gọi nhả
+            # khóa của luồng; nếu không lượt kế tiếp có thể đọc bộ nhớ cũ
+            await asyncio.gather(task, return_exceptions=True)
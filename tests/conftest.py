@@ -1,9 +1,13 @@
 """
 Cấu hình pytest cho các tests của agent template.
 
-Cung cấp các fixtures và thiết lập cho việc chạy tests API.
+Cung cấp các fixtures và thiết lập cho việc chạy tests API, cùng các fixture
+dựng đối tượng dùng chung cho unit test. Các lớp unittest dùng chúng qua
+`@pytest.mark.usefixtures(...)`: fixture gắn hàm dựng vào lớp test (ví dụ
+`self.make_router(**kwargs)`).
 """
 
+import json
 import os
 import sys
 import pytest
@@ -14,6 +18,9 @@ from unittest.mock import MagicMock
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from agent_template.config import AppConfig
+from agent_template.core.router import SEED_EXAMPLES, ClassifierRouter, NgramClassifier
+from agent_template.utils.fallback import ModelFallback
+from agent_template.utils.rate_limit import MemoryBucketStore, RateLimiter, RateLimitMiddleware
 
 @pytest.fixture(scope="session")
 def api_url():
@@ -40,19 +47,74 @@ def setup_environment():
     # Thiết lập biến môi trường
     os.environ.setdefault("ANTHROPIC_API_KEY", "dummy_key_for_testing")
     os.environ.setdefault("OPENAI_API_KEY", "dummy_key_for_testing")
-    
-    # Kiểm tra xem API đã chạy chưa
+    yield
+
+@pytest.fixture(scope="session")
+def api_available():
+    """Kiểm tra một lần xem API đã chạy chưa; trả về lý do nếu chưa."""
     api_url = os.environ.get("API_URL", "http://localhost:5000")
     try:
         response = requests.get(f"{api_url}/health", timeout=2)
         if response.status_code != 200:
-            pytest.skip(f"API server không hoạt động tại {api_url}")
+            return f"API server không hoạt động tại {api_url}"
     except requests.RequestException:
-        pytest.skip(f"Không thể kết nối đến API server tại {api_url}")
-    
-    yield
+        return f"Không thể kết nối đến API server tại {api_url}"
+    return None
+
+@pytest.fixture(autouse=True)
+def require_api(request):
+    """Bỏ qua các test đánh dấu `api` khi API chưa chạy; unit test luôn chạy."""
+    if request.node.get_closest_marker("api"):
+        reason = request.getfixturevalue("api_available")
+        if reason:
+            pytest.skip(reason)
 
 @pytest.fixture(scope="function")
 def headers():
     """Headers chuẩn cho API requests."""
-    return {"Content-Type": "application/json"} 
\ No newline at end of file
+    return {"Content-Type": "application/json"} 
+
+# ===== FIXTURE CHO UNIT TEST =====
+@pytest.fixture(scope="class")
+def make_router(request):
+    """Gắn `make_router(**kwargs)`: bộ định tuyến trên dữ liệu mẫu, không trừ điểm chi phí."""
+    classifier = NgramClassifier().fit(SEED_EXAMPLES).calibrate(SEED_EXAMPLES)
+
+    def make(**kwargs) -> ClassifierRouter:
+        options = {"latency_targets": {"advanced": 1000}, "min_samples": 5, "stats_window": 20}
+        options.update(kwargs)
+        return ClassifierRouter(classifier, **options)
+
+    request.cls.make_router = staticmethod(make)
+
+@pytest.fixture(scope="class")
+def make_fallback(request):
+    """Gắn `make_fallback(timeout)`: chuỗi advanced>default>light, không chờ giữa hai lần thử."""
+    def make(timeout: float = 0.05) -> ModelFallback:
+        return ModelFallback(
+            {"advanced": ["default", "light"]},
+            {"advanced": timeout, "default": timeout, "light": timeout},
+            backoff_base=0
+        )
+
+    request.cls.make_fallback = staticmethod(make)
+
+async def echo_app(scope, receive, send):
+    """App giả: đọc body và trả lại độ dài body."""
+    message = await receive()
+    body = json.dumps({"length": len(message.get("body", b""))}).encode()
+    await send({"type": "http.response.start", "status": 200, "headers": []})
+    await send({"type": "http.response.body", "body": body})
+
+@pytest.fixture(scope="class")
+def make_middleware(request):
+    """Gắn `make_middleware(store, burst, key_sources)`: middleware trên echo_app, gần như không nạp lại token."""
+    def make(store=None, burst: float = 3, key_sources=("api_key", "ip")) -> RateLimitMiddleware:
+        limiter = RateLimiter(
+            store or MemoryBucketStore(),
+            {"message": (burst, 0.001), "read": (100, 100)},
+            key_sources
+        )
+        return RateLimitMiddleware(echo_app, limiter)
+
+    request.cls.make_middleware = staticmethod(make)
@@ -0,0 +1,111 @@
+"""
+Unit test cho giới hạn lệnh gọi model đồng thời theo hạng.
+
+Không gọi model và không cần API đang chạy; các chỗ chạy được giữ bằng Event.
+"""
+
+import asyncio
+import unittest
+
+from agent_template.utils.admission import AdmissionRejected, TierLimiter
+
+class TestTierLimiter(unittest.TestCase):
+    """Kiểm tra hàng đợi, từ chối và ước lượng Retry-After của TierLimiter."""
+
+    def make_limiter(self, max_queue: int = 1, queue_timeout: float = 5) -> TierLimiter:
+        """Bộ giới hạn một chỗ chạy."""
+        return TierLimiter("default", max_concurrent=1, max_queue=max_queue, queue_timeout=queue_timeout)
+
+    async def hold(self, limiter: TierLimiter, release: asyncio.Event):
+        """Giữ một chỗ chạy tới khi `release` được đặt."""
+        async with limiter.slot():
+            await release.wait()
+
+    async def queue(self, limiter: TierLimiter):
+        """Chờ trong hàng đợi rồi nhả chỗ ngay khi được chạy."""
+        async with limiter.slot() as waited:
+            return waited
+
+    def test_queue_full(self):
+        """Hàng đợi đầy thì từ chối ngay, không chờ."""
+        limiter = self.make_limiter(max_queue=1)
+
+        async def main():
+            release = asyncio.Event()
+            holder = asyncio.create_task(self.hold(limiter, release))
+            await asyncio.sleep(0)
+            waiter = asyncio.create_task(self.queue(limiter))
+            await asyncio.sleep(0)
+            self.assertEqual(limiter.waiting, 1)
+            with self.assertRaises(AdmissionRejected) as caught:
+                await self.queue(limiter)
+            release.set()
+            await asyncio.gather(holder, waiter)
+            return caught.exception
+
+        error = asyncio.run(main())
+        self.assertEqual((error.reason, error.tier), ("queue_full", "default"))
+        self.assertEqual(limiter.rejected, {"queue_full": 1, "queue_timeout": 0})
+        self.assertEqual((limiter.admitted, limiter.running, limiter.waiting), (2, 0, 0))
+
+    def test_queue_timeout(self):
+        """Chờ quá queue_timeout thì bị từ chối và rời hàng đợi."""
+        limiter = self.make_limiter(queue_timeout=0.05)
+
+        async def main():
+            release = asyncio.Event()
+            holder = asyncio.create_task(self.hold(limiter, release))
+            await asyncio.sleep(0)
+            with self.assertRaises(AdmissionRejected) as caught:
+                await self.queue(limiter)
+            self.assertEqual(limiter.waiting, 0)
+            release.set()
+            await holder
+            return caught.exception
+
+        self.assertEqual(asyncio.run(main()).reason, "queue_timeout")
+        self.assertEqual(limiter.rejected["queue_timeout"], 1)
+        self.assertEqual((limiter.admitted, limiter.running), (1, 0))
+
+    def test_cancel_while_queued(self):
+        """Request bị hủy khi đang chờ rời hàng đợi và không giữ mất chỗ chạy."""
+        limiter = self.make_limiter()
+
+        async def main():
+            release = asyncio.Event()
+            holder = asyncio.create_task(self.hold(limiter, release))
+            await asyncio.sleep(0)
+            waiter = asyncio.create_task(self.queue(limiter))
+            await asyncio.sleep(0)
+            self.assertEqual(limiter.waiting, 1)
+            waiter.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await waiter
+            self.assertEqual(limiter.waiting, 0)
+            release.set()
+            await holder
+            # Chỗ chạy đã được trả: request kế tiếp không phải chờ
+            return await asyncio.wait_for(self.queue(limiter), 1)
+
+        asyncio.run(main())
+        self.assertEqual(limiter.rejected, {"queue_full": 0, "queue_timeout": 0})
+        self.assertEqual((limiter.admitted, limiter.running, limiter.waiting), (2, 0, 0))
+
+    def test_retry_after(self):
+        """Retry-After là số vòng cần để xử lý hết hàng đợi nhân thời gian giữ chỗ trung bình."""
+        limiter = TierLimiter("default", max_concurrent=2, max_queue=8, queue_timeout=5)
+        self.assertEqual(limiter.retry_after(), 1)
+        limiter._avg_hold = 3.0
+        limiter.waiting = 3
+        self.assertEqual(limiter.retry_after(), 6)
+        limiter.waiting = 0
+        limiter._avg_hold = 0.01
+        self.assertEqual(limiter.retry_after(), 1)
+
+        # Thời gian giữ chỗ cập nhật theo EWMA sau mỗi lần nhả chỗ
+        limiter._avg_hold = 1.0
+        asyncio.run(self.queue(limiter))
+        self.assertAlmostEqual(limiter._avg_hold, 0.8, places=2)
+
+if __name__ == "__main__":
+    unittest.main()
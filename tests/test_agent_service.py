@@ -0,0 +1,51 @@
+"""
+Unit test cho xử lý tin nhắn theo lô của AgentService.
+
+Lượt xử lý được thay bằng hàm giả ghi lại thứ tự chạy, không cần API đang chạy.
+"""
+
+import asyncio
+import unittest
+
+from agent_template.config import AppConfig
+from agent_template.core.agent_service import AgentService
+
+class TestProcessMessages(unittest.TestCase):
+    """Kiểm tra gom tin nhắn theo luồng trong một lô."""
+
+    def test_default_thread_is_one_group(self):
+        """Tin nhắn không có thread_id chạy tuần tự với tin nhắn ghi rõ luồng mặc định."""
+        service = object.__new__(AgentService)
+        service.config = AppConfig()
+        service.config.thread_id = "default"
+        events = []
+
+        async def process_message(message, thread_id, **kwargs):
+            events.append(("start", thread_id, message))
+            await asyncio.sleep(0.01)
+            events.append(("end", thread_id, message))
+            return {"success": True, "response": message, "thread_id": thread_id}
+
+        service.process_message = process_message
+        items = [
+            {"message": "một"},
+            {"message": "hai", "thread_id": "default"},
+            {"message": "ba", "thread_id": None},
+            {"message": "bốn", "thread_id": "other"}
+        ]
+
+        async def main():
+            service.bulk_semaphore = asyncio.Semaphore(4)
+            return [result async for result in service.process_messages(items)]
+
+        results = asyncio.run(main())
+        self.assertEqual(sorted(result["index"] for result in results), [0, 1, 2, 3])
+        default_events = [(kind, message) for kind, thread_id, message in events if thread_id == "default"]
+        self.assertEqual(default_events, [
+            ("start", "một"), ("end", "một"), ("start", "hai"), ("end", "hai"), ("start", "ba"), ("end", "ba")
+        ])
+        # Luồng khác chạy song song với luồng mặc định
+        self.assertLess(events.index(("start", "other", "bốn")), events.index(("end", "default", "một")))
+
+if __name__ == "__main__":
+    unittest.main()
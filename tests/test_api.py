@@ -8,12 +8,16 @@ import os
 import json
 import time
 import unittest
+import pytest
 import requests
 
 # API URL mặc định
 DEFAULT_API_URL = "http://localhost:4000"
 API_URL = os.environ.get("API_URL", DEFAULT_API_URL)
 
+# Cần API đang chạy (xem conftest.py)
+pytestmark = pytest.mark.api
+
 class TestAgentTemplateAPI(unittest.TestCase):
     """Test case cho Agent Template API."""
     
@@ -47,6 +51,7 @@ class TestAgentTemplateAPI(unittest.TestCase):
         self.assertEqual(response.status_code, 200)
         data = response.json()
         self.assertEqual(data["status"], "ok")
+        self.assertTrue(data["ready"])
         print("✓ Health check thành công!")
     
     def test_create_conversation(self):
@@ -76,8 +81,46 @@ class TestAgentTemplateAPI(unittest.TestCase):
         data = response.json()
         self.assertIn("response", data)
         self.assertIn("thread_id", data)
+        self.assertIn(data["model_tier"], ["default", "advanced", "light"])
         print(f"✓ Gửi tin nhắn thành công, nhận phản hồi: '{data['response'][:30]}...'")
     
+    def test_send_message_stream(self):
+        """Kiểm tra gửi tin nhắn với phản hồi dạng stream."""
+        print("\n[TEST] Kiểm tra gửi tin nhắn dạng stream...")
+        response = requests.post(
+            f"{self.base_url}/send_message/stream",
+            headers=self.headers,
+            json={"message": "Xin chào", "thread_id": self.thread_id},
+            stream=True
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.headers["content-type"].startswith("text/event-stream"))
+        
+        events = []
+        for line in response.iter_lines(decode_unicode=True):
+            if line.startswith("data: "):
+                events.append(json.loads(line[len("data: "):]))
+        self.assertEqual(events[-1]["type"], "done")
+        self.assertEqual(events[-1]["response"], "".join(e["content"] for e in events if e["type"] == "delta"))
+        print(f"✓ Nhận phản hồi dạng stream thành công, số đoạn: {len(events) - 1}")
+    
+    def test_send_messages_bulk(self):
+        """Kiểm tra gửi một lô tin nhắn."""
+        print("\n[TEST] Kiểm tra gửi lô tin nhắn...")
+        messages = ["Tin nhắn thứ nhất", "Tin nhắn thứ hai", "Tin nhắn thứ ba"]
+        payload = {"messages": [{"message": msg, "thread_id": self.thread_id} for msg in messages]}
+        
+        response = requests.post(f"{self.base_url}/send_messages", headers=self.headers, json=payload)
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual([result["index"] for result in data["results"]], [0, 1, 2])
+        
+        # Các tin nhắn cùng luồng phải được lưu theo đúng thứ tự gửi
+        history = requests.get(f"{self.base_url}/conversations/{self.thread_id}/history").json()["history"]
+        human_messages = [m["content"] for m in history if m["role"] == "human"]
+        self.assertEqual(human_messages[-len(messages):], messages)
+        print(f"✓ Gửi lô tin nhắn thành công, thành công: {data['succeeded']}/{len(messages)}")
+    
     def test_list_conversations(self):
         """Kiểm tra danh sách cuộc trò chuyện."""
         print("\n[TEST] Kiểm tra danh sách cuộc trò chuyện...")
@@ -88,6 +131,27 @@ class TestAgentTemplateAPI(unittest.TestCase):
         self.assertIsInstance(data["conversations"], list)
         print(f"✓ Lấy danh sách cuộc trò chuyện thành công, số lượng: {len(data['conversations'])}")
     
+    def test_list_conversations_pagination(self):
+        """Kiểm tra phân trang danh sách cuộc trò chuyện bằng cursor."""
+        print("\n[TEST] Kiểm tra phân trang danh sách cuộc trò chuyện...")
+        # Đảm bảo có ít nhất hai cuộc trò chuyện
+        requests.post(f"{self.base_url}/conversations")
+        
+        response = requests.get(f"{self.base_url}/conversations", params={"limit": 1})
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(len(data["conversations"]), 1)
+        self.assertIsNotNone(data["next_cursor"])
+        
+        response = requests.get(
+            f"{self.base_url}/conversations",
+            params={"limit": 1, "cursor": data["next_cursor"]}
+        )
+        self.assertEqual(response.status_code, 200)
+        next_page = response.json()
+        self.assertNotEqual(data["conversations"][0]["id"], next_page["conversations"][0]["id"])
+        print("✓ Phân trang danh sách cuộc trò chuyện thành công")
+    
     def test_get_conversation_history(self):
         """Kiểm tra lịch sử cuộc trò chuyện."""
         print("\n[TEST] Kiểm tra lịch sử cuộc trò chuyện...")
@@ -125,6 +189,116 @@ class TestAgentTemplateAPI(unittest.TestCase):
         self.assertIn("model_name", data["config"])
         print(f"✓ Lấy cấu hình thành công, model: {data['config']['model_name']}")
 
+    def test_update_config(self):
+        """Kiểm tra cấu hình mặc định được lưu chung và quay về giá trị khởi động."""
+        print("\n[TEST] Kiểm tra cập nhật cấu hình mặc định...")
+        original = requests.get(f"{self.base_url}/config").json()["config"]
+        try:
+            response = requests.post(f"{self.base_url}/config", headers=self.headers, json={"max_tokens": 123})
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.json()["config"]["max_tokens"], 123)
+            # Mọi worker trả lời cùng cấu hình
+            for _ in range(5):
+                self.assertEqual(requests.get(f"{self.base_url}/config").json()["config"]["max_tokens"], 123)
+        finally:
+            response = requests.post(f"{self.base_url}/config", headers=self.headers, json={"max_tokens": None})
+        self.assertEqual(response.json()["config"]["max_tokens"], original["max_tokens"])
+        print("✓ Cập nhật cấu hình mặc định thành công")
+
+    def test_thread_config(self):
+        """Kiểm tra cấu hình mặc định theo luồng và ghi đè theo request."""
+        print("\n[TEST] Kiểm tra cấu hình theo luồng...")
+        response = requests.post(
+            f"{self.base_url}/conversations/{self.thread_id}/config",
+            headers=self.headers,
+            json={"model_type": "light", "temperature": 0.2}
+        )
+        self.assertEqual(response.status_code, 200)
+        config = response.json()["config"]
+        self.assertEqual(config["model_type"], "light")
+        self.assertEqual(config["temperature"], 0.2)
+
+        # Cấu hình của luồng không làm thay đổi mặc định của service
+        default_config = requests.get(f"{self.base_url}/config").json()["config"]
+        self.assertIsNone(default_config["model_type"])
+
+        # Ghi đè theo request và giá trị không hợp lệ
+        response = requests.post(
+            f"{self.base_url}/send_message",
+            headers=self.headers,
+            json={"message": "Xin chào", "thread_id": self.thread_id, "max_tokens": 50}
+        )
+        self.assertTrue(response.json()["success"])
+        response = requests.post(
+            f"{self.base_url}/conversations/{self.thread_id}/config",
+            headers=self.headers,
+            json={"model_type": "huge"}
+        )
+        self.assertEqual(response.status_code, 400)
+        print(f"✓ Cấu hình theo luồng thành công, model: {config['model_name']}")
+
+    def test_stats(self):
+        """Kiểm tra thống kê pool kết nối HTTP."""
+        print("\n[TEST] Kiểm tra thống kê runtime...")
+        response = requests.get(f"{self.base_url}/stats")
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertIn("http_pool", data)
+        self.assertIn("reuse_ratio", data["http_pool"])
+        self.assertIn("wait_ms_p95", data["thread_locks"])
+        self.assertIn("latency_ms_p95", data["router"]["tiers"]["default"])
+        self.assertIn("max_concurrent", data["tools"])
+        self.assertIn("usage", data)
+        self.assertGreaterEqual(data["agents"]["builds"], 1)
+        self.assertIn("admission", data)
+        self.assertIn("fallback", data)
+        print(f"✓ Lấy thống kê thành công, kết nối mở: {data['http_pool']['open_connections']}")
+
+    def test_metrics(self):
+        """Kiểm tra số liệu theo bước ở định dạng Prometheus."""
+        print("\n[TEST] Kiểm tra /metrics...")
+        requests.post(
+            f"{self.base_url}/send_message",
+            headers=self.headers,
+            json={"message": "Xin chào", "thread_id": self.thread_id}
+        )
+        response = requests.get(f"{self.base_url}/metrics")
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.headers["content-type"].startswith("text/plain"))
+        self.assertIn('agent_stage_seconds_bucket{stage="save_memory"', response.text)
+        self.assertIn("agent_turns_total", response.text)
+        print(f"✓ Lấy số liệu thành công, số dòng: {len(response.text.splitlines())}")
+
+    def test_send_message_profile(self):
+        """Kiểm tra profiling theo request qua header X-Profile."""
+        print("\n[TEST] Kiểm tra profiling theo request...")
+        response = requests.post(
+            f"{self.base_url}/send_message",
+            headers={**self.headers, "X-Profile": "timing"},
+            json={"message": "Xin chào", "thread_id": self.thread_id}
+        )
+        if response.status_code == 403:
+            self.skipTest("Server chưa bật PROFILING")
+        self.assertEqual(response.status_code, 200)
+        profile = response.json()["profile"]
+        stages = {stage["stage"] for stage in profile["stages"]}
+        self.assertTrue({"load_memory", "node:process", "save_memory"} <= stages)
+        print(f"✓ Profiling thành công, tổng thời gian: {profile['total_ms']} ms")
+    
+    def test_send_message_idempotency(self):
+        """Kiểm tra lần thử lại cùng Idempotency-Key nhận lại phản hồi cũ."""
+        print("\n[TEST] Kiểm tra gộp request theo Idempotency-Key...")
+        headers = {**self.headers, "Idempotency-Key": f"test-{self.thread_id}"}
+        payload = {"message": "Xin chào", "thread_id": self.thread_id}
+        first = requests.post(f"{self.base_url}/send_message", headers=headers, json=payload).json()
+        retry = requests.post(f"{self.base_url}/send_message", headers=headers, json=payload).json()
+        self.assertEqual(retry["response"], first["response"])
+        
+        # Chỉ một lượt được lưu
+        history = requests.get(f"{self.base_url}/conversations/{self.thread_id}/history").json()["history"]
+        self.assertEqual(len(history), 2)
+        print(f"✓ Gộp request thành công: {retry['coalesced']}")
+
 if __name__ == "__main__":
     # Nếu API đang chạy, chạy các test
     try:
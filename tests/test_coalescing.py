@@ -0,0 +1,93 @@
+"""
+Unit test cho bộ gộp request trùng nhau.
+
+Dùng hàm xử lý giả, không cần API đang chạy.
+"""
+
+import asyncio
+import time
+import unittest
+
+from agent_template.utils.coalescing import RequestCoalescer, coalesce_key
+
+class TestRequestCoalescer(unittest.TestCase):
+    """Kiểm tra single-flight, cửa sổ giữ kết quả và việc hủy kết quả theo lượt mới."""
+
+    def setUp(self):
+        self.calls = 0
+
+    async def handle(self, delay: float = 0.0):
+        """Hàm xử lý giả: đếm số lần chạy thật."""
+        self.calls += 1
+        await asyncio.sleep(delay)
+        return {"success": True, "response": f"lần {self.calls}"}
+
+    def test_single_flight(self):
+        """Các request giống hệt chạy đồng thời dùng chung một lần xử lý."""
+        coalescer = RequestCoalescer(window=0)
+        key = coalesce_key("thread", "Xin chào", "retry-1")
+
+        async def burst():
+            return await asyncio.gather(*[
+                coalescer.run(key, lambda: self.handle(0.05)) for _ in range(5)
+            ])
+
+        results = asyncio.run(burst())
+        self.assertEqual(self.calls, 1)
+        self.assertEqual({result["response"] for result, _ in results}, {"lần 1"})
+        self.assertEqual(sorted(str(shared) for _, shared in results), ["None"] + ["inflight"] * 4)
+        self.assertEqual(coalescer.get_stats()["inflight"], 0)
+
+    def test_window_expiry(self):
+        """Kết quả chỉ được dùng lại trong cửa sổ COALESCE_WINDOW."""
+        coalescer = RequestCoalescer(window=0.05)
+        key = coalesce_key("thread", "Xin chào", "retry-1")
+
+        _, shared = asyncio.run(coalescer.run(key, self.handle))
+        self.assertIsNone(shared)
+        result, shared = asyncio.run(coalescer.run(key, self.handle))
+        self.assertEqual((result["response"], shared), ("lần 1", "completed"))
+
+        time.sleep(0.06)
+        result, shared = asyncio.run(coalescer.run(key, self.handle))
+        self.assertEqual((result["response"], shared), ("lần 2", None))
+
+    def test_new_turn_invalidates_message_key(self):
+        """Tin nhắn lặp lại sau một lượt khác của luồng là lượt mới."""
+        coalescer = RequestCoalescer(window=60)
+        first = coalesce_key("thread", "Xin chào")
+        asyncio.run(coalescer.run(first, self.handle))
+        # Khác khoảng trắng và hoa thường vẫn là cùng một tin nhắn
+        _, shared = asyncio.run(coalescer.run(coalesce_key("thread", "  xin   CHÀO "), self.handle))
+        self.assertEqual(shared, "completed")
+
+        asyncio.run(coalescer.run(coalesce_key("thread", "Câu hỏi khác"), self.handle))
+        result, shared = asyncio.run(coalescer.run(first, self.handle))
+        self.assertEqual((result["response"], shared), ("lần 3", None))
+
+    def test_invalidate(self):
+        """invalidate() bỏ kết quả theo nội dung của luồng (lệnh hệ thống, stream)."""
+        coalescer = RequestCoalescer(window=60)
+        key = coalesce_key("thread", "Xin chào")
+        asyncio.run(coalescer.run(key, self.handle))
+        coalescer.invalidate("thread")
+        _, shared = asyncio.run(coalescer.run(key, self.handle))
+        self.assertIsNone(shared)
+        self.assertEqual(self.calls, 2)
+
+    def test_failure_is_not_kept(self):
+        """Kết quả lỗi không được giữ cho lần thử lại."""
+        coalescer = RequestCoalescer(window=60)
+        key = coalesce_key("thread", "Xin chào", "retry-1")
+
+        async def fail():
+            self.calls += 1
+            return {"success": False, "error": "lỗi model"}
+
+        asyncio.run(coalescer.run(key, fail))
+        _, shared = asyncio.run(coalescer.run(key, fail))
+        self.assertIsNone(shared)
+        self.assertEqual(self.calls, 2)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,81 @@
+"""
+Unit test cho cửa sổ lịch sử và message_history gửi cho model.
+
+Không gọi model và không cần API đang chạy.
+"""
+
+import unittest
+from unittest.mock import patch
+
+from pydantic_ai.messages import ModelRequest, ModelResponse, SystemPromptPart, UserPromptPart
+
+from agent_template.config import AppConfig
+from agent_template.memory import context
+from agent_template.memory.context import build_message_history, select_recent_window
+from agent_template.memory.persistence import Memory
+
+def make_memory(*turns) -> Memory:
+    """Bộ nhớ gồm các lượt (tin nhắn human, tin nhắn ai)."""
+    memory = Memory(messages=[])
+    for human, ai in turns:
+        memory.add_message("human", human)
+        memory.add_message("ai", ai)
+    return memory
+
+class TestSelectRecentWindow(unittest.TestCase):
+    """Kiểm tra giới hạn số lượt và ngân sách token của cửa sổ."""
+
+    def test_turn_limit(self):
+        """Chỉ giữ `max_turns` lượt gần nhất."""
+        memory = make_memory(*[(f"hỏi {i}", f"đáp {i}") for i in range(5)])
+        start, window = select_recent_window(memory.messages, max_turns=2, token_budget=10000)
+        self.assertEqual(start, 6)
+        self.assertEqual([message.content for message in window], ["hỏi 3", "đáp 3", "hỏi 4", "đáp 4"])
+
+    def test_budget_never_splits_a_turn(self):
+        """Ngân sách cắt giữa một lượt thì bỏ tin nhắn ai mồ côi."""
+        memory = make_memory(*[("x" * 4000, "y" * 40) for _ in range(3)])
+        start, window = select_recent_window(memory.messages, max_turns=10, token_budget=200)
+        self.assertEqual((start, window), (6, []))
+
+        memory = make_memory(("x" * 4000, "y" * 40), ("ngắn", "y" * 40))
+        start, window = select_recent_window(memory.messages, max_turns=10, token_budget=200)
+        self.assertEqual(start, 2)
+        self.assertEqual([message.role for message in window], ["human", "ai"])
+
+class TestBuildMessageHistory(unittest.TestCase):
+    """Kiểm tra thứ tự và dạng của message_history."""
+
+    def setUp(self):
+        self.config = AppConfig()
+        self.config.history_summary_enabled = False
+        self.config.history_max_turns = 10
+        self.config.history_token_budget = 200
+
+    def build(self, memory: Memory):
+        """Xây dựng lịch sử khi luồng chưa có model message đã lưu."""
+        with patch.object(context, "load_model_turns", return_value={}):
+            return build_message_history("thread", memory, "system", self.config)
+
+    def test_first_message_after_system_is_user_prompt(self):
+        """Sau system prompt, tin nhắn đầu tiên luôn là lời người dùng."""
+        memory = make_memory(("x" * 4000, "y" * 40), ("ngắn", "trả lời"))
+        history = self.build(memory)
+        self.assertEqual(history[0].parts[0].content, "system")
+        self.assertIsInstance(history[1], ModelRequest)
+        self.assertIsInstance(history[1].parts[0], UserPromptPart)
+        self.assertEqual(history[1].parts[0].content, "ngắn")
+        self.assertIsInstance(history[2], ModelResponse)
+        # Phần thay đổi theo ngày nằm cuối cùng
+        self.assertIsInstance(history[-1].parts[0], SystemPromptPart)
+        self.assertEqual(len(history), 4)
+
+    def test_window_cut_by_budget(self):
+        """Khi không lượt nào vừa ngân sách, lịch sử chỉ còn các system prompt."""
+        memory = make_memory(*[("x" * 4000, "y" * 40) for _ in range(3)])
+        history = self.build(memory)
+        self.assertEqual(len(history), 2)
+        self.assertTrue(all(isinstance(message, ModelRequest) for message in history))
+
+if __name__ == "__main__":
+    unittest.main()
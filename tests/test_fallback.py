@@ -0,0 +1,125 @@
+"""
+Unit test cho chuỗi model dự phòng.
+
+Dùng các lệnh gọi model giả, không cần API đang chạy.
+"""
+
+import asyncio
+import unittest
+
+import httpx
+import pytest
+
+from agent_template.utils.admission import AdmissionRejected
+
+@pytest.mark.usefixtures("make_fallback")
+class TestModelFallback(unittest.TestCase):
+    """Kiểm tra khi nào lượt được chuyển sang hạng dự phòng."""
+
+    def test_timeout_falls_back(self):
+        """Lần thử quá thời gian chuyển sang hạng tiếp theo."""
+        async def call(attempt):
+            attempt.start()
+            await asyncio.sleep(1 if attempt.tier == "advanced" else 0)
+            return attempt.tier
+
+        fallback = self.make_fallback()
+        result, served = asyncio.run(fallback.run("advanced", call))
+        self.assertEqual((result, served), ("default", "default"))
+        self.assertEqual(fallback.attempts["advanced"]["timeout"], 1)
+
+    def test_timeout_starts_after_admission(self):
+        """Thời gian chờ chỗ chạy không tính vào thời gian của lần thử."""
+        async def call(attempt):
+            await asyncio.sleep(0.1)
+            attempt.start()
+            return attempt.tier
+
+        self.assertEqual(asyncio.run(self.make_fallback().run("advanced", call))[1], "advanced")
+
+    def test_last_timeout_raises(self):
+        """Mọi hạng đều quá thời gian thì ném asyncio.TimeoutError."""
+        async def call(attempt):
+            attempt.start()
+            await asyncio.sleep(1)
+
+        with self.assertRaises(asyncio.TimeoutError):
+            asyncio.run(self.make_fallback().run("advanced", call))
+
+    def test_transport_error_falls_back(self):
+        """Lỗi kết nối tới model chuyển sang hạng tiếp theo."""
+        async def call(attempt):
+            if attempt.tier == "advanced":
+                raise httpx.ConnectError("không kết nối được")
+            return attempt.tier
+
+        self.assertEqual(asyncio.run(self.make_fallback().run("advanced", call))[1], "default")
+
+    def test_admission_rejected_is_raised(self):
+        """Request bị từ chối vì quá tải không được chuyển hạng."""
+        tiers = []
+
+        async def call(attempt):
+            tiers.append(attempt.tier)
+            raise AdmissionRejected(attempt.tier, 1, "queue_full")
+
+        with self.assertRaises(AdmissionRejected):
+            asyncio.run(self.make_fallback().run("advanced", call))
+        self.assertEqual(tiers, ["advanced"])
+
+    def test_other_error_is_raised(self):
+        """Lỗi không phải của model được ném ra ngay."""
+        tiers = []
+
+        async def call(attempt):
+            tiers.append(attempt.tier)
+            raise ValueError("lỗi trong mã ứng dụng")
+
+        with self.assertRaises(ValueError):
+            asyncio.run(self.make_fallback().run("advanced", call))
+        self.assertEqual(tiers, ["advanced"])
+
+    def test_committed_attempt_is_not_retried(self):
+        """Lần thử đã chạy công cụ không được chạy lại ở hạng khác."""
+        tiers = []
+
+        async def call(attempt):
+            tiers.append(attempt.tier)
+            attempt.commit()
+            raise httpx.ReadTimeout("model ngắt kết nối")
+
+        with self.assertRaises(httpx.ReadTimeout):
+            asyncio.run(self.make_fallback().run("advanced", call))
+        self.assertEqual(tiers, ["advanced"])
+
+    def test_stream_falls_back_before_first_chunk(self):
+        """Stream chuyển hạng khi chưa có đoạn nào được gửi đi."""
+        async def call(attempt):
+            attempt.start()
+            if attempt.tier == "advanced":
+                await asyncio.sleep(1)
+            yield attempt.tier
+            yield "!"
+
+        async def collect():
+            return [delta async for delta in self.make_fallback().stream("advanced", call)]
+
+        self.assertEqual(asyncio.run(collect()), ["default", "!"])
+
+    def test_stream_error_after_first_chunk_is_raised(self):
+        """Lỗi sau khi đã gửi đoạn đầu tiên không làm chuyển hạng."""
+        async def call(attempt):
+            yield attempt.tier
+            raise httpx.ReadError("model ngắt kết nối")
+
+        async def collect(parts):
+            async for delta in self.make_fallback().stream("advanced", call):
+                parts.append(delta)
+
+        parts = []
+        with self.assertRaises(httpx.ReadError):
+            asyncio.run(collect(parts))
+        self.assertEqual(parts, ["advanced"])
+
+if __name__ == "__main__":
+    unittest.main()
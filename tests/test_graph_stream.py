@@ -0,0 +1,71 @@
+"""
+Unit test cho stream qua LangGraph.
+
+Model được thay bằng stream giả và bộ nhớ được ghi vào dict, không cần API
+đang chạy.
+"""
+
+import asyncio
+import unittest
+from unittest.mock import MagicMock, patch
+
+from pydantic_ai.usage import Usage
+
+from agent_template.memory.persistence import Deps, Memory
+from agent_template.workflows import graph
+
+class FakeStream:
+    """Stream giả: trả các đoạn `deltas`, rồi treo nếu `hang` là True."""
+
+    def __init__(self, deltas, hang: bool):
+        self.deltas = deltas
+        self.hang = hang
+        self.tier = "default"
+        self.result = MagicMock()
+        self.result.usage.return_value = Usage()
+        self.result.new_messages.return_value = []
+
+    async def _iterate(self):
+        for delta in self.deltas:
+            yield delta
+        if self.hang:
+            await asyncio.sleep(60)
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def aclose(self):
+        pass
+
+class TestStreamWithGraph(unittest.TestCase):
+    """Kiểm tra lưu phần phản hồi khi stream bị hủy."""
+
+    def test_cancelled_stream_is_saved_before_next_turn(self):
+        """Phần phản hồi đã lưu xong khi aclose() trả về; lượt kế tiếp không ghi đè nó."""
+        saved = {}
+        streams = [FakeStream(["Xin ", "chào"], hang=True), FakeStream(["Tạm biệt"], hang=False)]
+
+        async def save_memory(thread_id, memory):
+            saved[thread_id] = memory.model_copy(deep=True)
+
+        async def main():
+            first = graph.stream_with_graph("thread", "Chào", Memory(messages=[]), deps=Deps(client=None), use_cache=False)
+            self.assertEqual(await first.__anext__(), "Xin ")
+            # Người gọi ngừng đọc rồi nhả khóa luồng; lượt kế tiếp đọc bộ nhớ ngay
+            await first.aclose()
+            memory = saved["thread"].model_copy(deep=True)
+            second = graph.stream_with_graph("thread", "Bye", memory, deps=Deps(client=None), use_cache=False)
+            return [delta async for delta in second]
+
+        with patch.object(graph, "AgentStream", side_effect=lambda *args, **kwargs: streams.pop(0)), \
+                patch.object(graph, "select_agent", return_value=(None, "default", None)), \
+                patch.object(graph, "build_message_history", return_value=[]), \
+                patch.object(graph, "schedule_summary_update"), \
+                patch.object(graph, "save_memory_async", side_effect=save_memory):
+            self.assertEqual(asyncio.run(main()), ["Tạm biệt"])
+
+        contents = [(message.role, message.content) for message in saved["thread"].messages]
+        self.assertEqual(contents, [("human", "Chào"), ("ai", "Xin chào"), ("human", "Bye"), ("ai", "Tạm biệt")])
+
+if __name__ == "__main__":
+    unittest.main()
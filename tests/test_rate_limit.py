@@ -0,0 +1,83 @@
+"""
+Unit test cho middleware giới hạn tốc độ.
+
+Gọi middleware trực tiếp qua ASGI với một app giả, không cần API đang chạy.
+"""
+
+import asyncio
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import pytest
+
+from agent_template.utils.rate_limit import SqliteBucketStore
+
+def call(middleware, path: str, payload=None, client: str = "10.0.0.1"):
+    """Gửi một request POST qua middleware, trả về (status, headers, body JSON)."""
+    body = json.dumps(payload).encode() if payload is not None else b""
+    scope = {"type": "http", "method": "POST", "path": path, "headers": [], "client": (client, 1234)}
+    sent = []
+
+    async def receive():
+        return {"type": "http.request", "body": body, "more_body": False}
+
+    async def send(message):
+        sent.append(message)
+
+    asyncio.run(middleware(scope, receive, send))
+    start, response = sent
+    return start["status"], dict(start["headers"]), json.loads(response["body"])
+
+@pytest.mark.usefixtures("make_middleware")
+class TestRateLimitMiddleware(unittest.TestCase):
+    """Kiểm tra cách tính token của middleware."""
+
+    def test_message_budget(self):
+        """Hết token thì trả 429 kèm Retry-After."""
+        middleware = self.make_middleware()
+        statuses = [call(middleware, "/send_message", {"message": "hi"})[0] for _ in range(4)]
+        self.assertEqual(statuses, [200, 200, 200, 429])
+        status, headers, _ = call(middleware, "/send_message", {"message": "hi"})
+        self.assertIn(b"retry-after", headers)
+
+    def test_bulk_charges_per_item(self):
+        """Mỗi tin nhắn trong lô tốn một token; body vẫn tới được app."""
+        middleware = self.make_middleware()
+        status, _, data = call(middleware, "/send_messages", {"messages": [{"message": "a"}, {"message": "b"}]})
+        self.assertEqual(status, 200)
+        self.assertGreater(data["length"], 0)
+        status, _, _ = call(middleware, "/send_messages", {"messages": [{"message": "a"}, {"message": "b"}]})
+        self.assertEqual(status, 429)
+
+    def test_bulk_larger_than_burst(self):
+        """Lô lớn hơn BURST không bao giờ đủ token nên nhận 413."""
+        middleware = self.make_middleware()
+        status, _, _ = call(middleware, "/send_messages", {"messages": [{"message": str(i)} for i in range(5)]})
+        self.assertEqual(status, 413)
+
+    def test_thread_key(self):
+        """Khóa theo thread_id tách ngân sách của từng luồng."""
+        middleware = self.make_middleware(burst=1, key_sources=("thread", "ip"))
+        self.assertEqual(call(middleware, "/send_message", {"message": "hi", "thread_id": "a"})[0], 200)
+        self.assertEqual(call(middleware, "/send_message", {"message": "hi", "thread_id": "b"})[0], 200)
+        self.assertEqual(call(middleware, "/send_message", {"message": "hi", "thread_id": "a"})[0], 429)
+
+    def test_sqlite_store(self):
+        """Backend SQLite chạy trong thread pool và mở lại kết nối sau close()."""
+        directory = tempfile.mkdtemp()
+        try:
+            store = SqliteBucketStore(os.path.join(directory, "rate_limit.db"))
+            middleware = self.make_middleware(store, burst=2)
+            statuses = [call(middleware, "/send_message", {"message": "hi"})[0] for _ in range(3)]
+            self.assertEqual(statuses, [200, 200, 429])
+            middleware.limiter.close()
+            self.assertEqual(call(middleware, "/send_message", {"message": "hi"})[0], 429)
+            middleware.limiter.close()
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+
+if __name__ == "__main__":
+    unittest.main()
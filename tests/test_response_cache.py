@@ -0,0 +1,37 @@
+"""
+Unit test cho khóa cache phản hồi.
+
+Không gọi model và không cần API đang chạy.
+"""
+
+import unittest
+
+from agent_template.core.agent import get_response_cache_key, is_cacheable_turn
+from agent_template.memory.persistence import Memory
+from agent_template.utils.response_cache import ResponseCache
+
+class TestResponseCacheKey(unittest.TestCase):
+    """Kiểm tra khóa cache dùng chung giữa các luồng."""
+
+    def test_key_ignores_whitespace_and_case(self):
+        """Tin nhắn khác khoảng trắng/hoa thường dùng chung khóa; hạng model khác thì khác khóa."""
+        key = get_response_cache_key("default", "Giờ mở cửa là mấy giờ?")
+        self.assertEqual(key, get_response_cache_key("default", "  giờ mở cửa   là mấy GIỜ? "))
+        self.assertNotEqual(key, get_response_cache_key("advanced", "Giờ mở cửa là mấy giờ?"))
+
+    def test_only_first_turn_is_cacheable(self):
+        """Lượt có lịch sử không được đọc hay ghi cache."""
+        memory = Memory(messages=[])
+        self.assertTrue(is_cacheable_turn(memory))
+        memory.add_message("human", "Xin chào")
+        memory.add_message("ai", "Chào bạn")
+        self.assertFalse(is_cacheable_turn(memory))
+
+    def test_shared_across_threads(self):
+        """Phản hồi của tin nhắn đầu tiên ở một luồng được dùng lại ở luồng khác."""
+        cache = ResponseCache(ttl=60, max_entries=10, max_bytes=1 << 20)
+        cache.set(get_response_cache_key("default", "Giờ mở cửa?"), "8 giờ sáng")
+        self.assertEqual(cache.get(get_response_cache_key("default", "giờ mở cửa?")), "8 giờ sáng")
+
+if __name__ == "__main__":
+    unittest.main()
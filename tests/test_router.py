@@ -0,0 +1,90 @@
+"""
+Unit test cho bộ định tuyến hạng model.
+
+Chạy hoàn toàn cục bộ, không gọi model và không cần API đang chạy.
+"""
+
+import json
+import os
+import tempfile
+import unittest
+
+import pytest
+
+from agent_template.core.router import SEED_EXAMPLES, NgramClassifier
+
+class TestNgramClassifier(unittest.TestCase):
+    """Kiểm tra bộ phân loại và việc hiệu chỉnh xác suất."""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.classifier = NgramClassifier().fit(SEED_EXAMPLES).calibrate(SEED_EXAMPLES)
+
+    def test_predicts_clear_cases(self):
+        """Các tin nhắn điển hình được xếp đúng hạng."""
+        cases = {
+            "Chào bạn nhé": "light",
+            "Viết hàm Python đọc file JSON": "default",
+            "Thiết kế kiến trúc hệ thống thanh toán phân tán và phân tích chi tiết các điểm nghẽn": "advanced",
+        }
+        for text, tier in cases.items():
+            probabilities = self.classifier.predict_proba(text)
+            self.assertEqual(max(probabilities, key=probabilities.get), tier, text)
+
+    def test_calibration_softens_probabilities(self):
+        """Tin nhắn không giống dữ liệu mẫu không nhận xác suất gần 1."""
+        raw = NgramClassifier().fit(SEED_EXAMPLES)
+        self.assertGreater(self.classifier.temperature, 1.0)
+        text = "Giúp tôi với bài toán này"
+        self.assertLess(max(self.classifier.predict_proba(text).values()), max(raw.predict_proba(text).values()))
+        self.assertLess(max(self.classifier.predict_proba("asdf qwer").values()), 0.6)
+
+@pytest.mark.usefixtures("make_router")
+class TestClassifierRouter(unittest.TestCase):
+    """Kiểm tra ngưỡng tin cậy, việc tránh hạng quá tải và log quyết định."""
+
+    def test_low_confidence_uses_default(self):
+        """Xác suất cao nhất dưới ngưỡng thì chọn hạng default."""
+        decision = self.make_router(min_confidence=0.99).route("Chào bạn nhé")
+        self.assertEqual((decision.tier, decision.reason), ("default", "low_confidence"))
+        decision = self.make_router(min_confidence=0.0).route("Chào bạn nhé")
+        self.assertEqual((decision.tier, decision.reason), ("light", "classifier"))
+
+    def test_avoids_unhealthy_tier_and_probes(self):
+        """Hạng vượt tỷ lệ lỗi bị tránh, và định kỳ được gửi thử."""
+        router = self.make_router(min_confidence=0.0)
+        text = "Thiết kế kiến trúc hệ thống thanh toán phân tán và phân tích chi tiết các điểm nghẽn"
+        self.assertEqual(router.route(text).tier, "advanced")
+
+        for _ in range(5):
+            router.record_outcome("advanced", 0.1, error=True)
+        decisions = [router.route(text) for _ in range(router.probe_every)]
+        self.assertEqual(decisions[0].tier, "default")
+        self.assertEqual(decisions[0].reason, "avoid[advanced:error_rate]")
+        self.assertEqual((decisions[-1].tier, decisions[-1].reason), ("advanced", "probe[error_rate]"))
+
+    def test_latency_target(self):
+        """Hạng vượt mục tiêu độ trễ p95 bị tránh."""
+        router = self.make_router(min_confidence=0.0)
+        for _ in range(5):
+            router.record_outcome("advanced", 2.0)
+        decision = router.route("Thiết kế kiến trúc hệ thống thanh toán phân tán và phân tích chi tiết các điểm nghẽn")
+        self.assertEqual((decision.tier, decision.reason), ("default", "avoid[advanced:latency]"))
+
+    def test_log_has_no_raw_text(self):
+        """Log quyết định chỉ có hash và độ dài của tin nhắn."""
+        directory = tempfile.mkdtemp()
+        path = os.path.join(directory, "router.jsonl")
+        try:
+            self.make_router(log_path=path).route("Số điện thoại của tôi là 0901234567")
+            with open(path, encoding="utf-8") as f:
+                record = json.loads(f.readline())
+            self.assertNotIn("0901234567", json.dumps(record, ensure_ascii=False))
+            self.assertEqual(len(record["text_hash"]), 16)
+            self.assertEqual(record["length"], len("Số điện thoại của tôi là 0901234567"))
+        finally:
+            os.remove(path)
+            os.rmdir(directory)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,325 @@
+"""
+Unit test cho các backend lưu trữ hội thoại.
+
+Không cần API đang chạy; mỗi test dùng một thư mục tạm riêng.
+"""
+
+import asyncio
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from unittest.mock import patch
+
+import pytest
+
+from agent_template.memory.persistence import Memory, Message
+from agent_template.memory.segment_log import SegmentLogStore
+from agent_template.memory.sqlite_store import SqliteStore
+from agent_template.memory import storage
+from agent_template.memory.storage import CoalescingStore, ConversationStore, FileStore, run_store_call
+from agent_template.memory.thread_data import ThreadDataLog
+from agent_template.memory.thread_index import COMPACT_SLACK, ThreadIndex
+
+pytestmark = pytest.mark.memory
+
+def make_memory(count: int) -> Memory:
+    """Tạo bộ nhớ gồm `count` tin nhắn."""
+    return Memory(messages=[
+        Message(role="human" if i % 2 == 0 else "ai", content=f"tin nhắn {i}") for i in range(count)
+    ])
+
+class FlakyStore(ConversationStore):
+    """Backend lỗi ở `failures` lần ghi đầu tiên."""
+
+    def __init__(self, failures: int):
+        self.failures = failures
+        self.saved = {}
+
+    def save_memory(self, thread_id, memory):
+        if self.failures > 0:
+            self.failures -= 1
+            raise OSError("đĩa đầy")
+        self.saved[thread_id] = memory
+
+    def load_memory(self, thread_id):
+        return self.saved.get(thread_id, Memory(messages=[]))
+
+class TestCoalescingStore(unittest.TestCase):
+    """Kiểm tra lớp gộp ghi CoalescingStore."""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def test_flushes_reuse_one_sqlite_connection(self):
+        """Các lần xả chạy trên một luồng nên không mở thêm kết nối SQLite."""
+        backend = SqliteStore(os.path.join(self.directory, "conversations.db"))
+        store = CoalescingStore(backend, flush_interval=0.01)
+        try:
+            for i in range(20):
+                store.save_memory("thread", make_memory(i + 1))
+                time.sleep(0.03)
+            # Kết nối của luồng test và của luồng xả
+            self.assertLessEqual(len(backend._connections), 2)
+            self.assertGreaterEqual(store.get_stats()["flushes"], 2)
+        finally:
+            store.close()
+        self.assertEqual(len(SqliteStore(os.path.join(self.directory, "conversations.db")).load_memory("thread").messages), 20)
+
+    def test_failed_write_is_requeued(self):
+        """Lần ghi lỗi được đưa lại hàng chờ và ghi ở lần xả sau."""
+        backend = FlakyStore(failures=1)
+        store = CoalescingStore(backend, flush_interval=60)
+        store.save_memory("thread", make_memory(2))
+        store.flush()
+        self.assertNotIn("thread", backend.saved)
+        self.assertEqual(len(store.load_memory("thread").messages), 2)
+
+        store.flush()
+        self.assertEqual(len(backend.saved["thread"].messages), 2)
+        self.assertEqual(store.get_stats()["failures"], 1)
+        store.close()
+
+    def test_requeue_keeps_newer_state(self):
+        """Bản chờ ghi mới hơn không bị bản cũ bị lỗi ghi đè."""
+        backend = FlakyStore(failures=1)
+        store = CoalescingStore(backend, flush_interval=60)
+        store.save_memory("thread", make_memory(2))
+        original_save = backend.save_memory
+
+        def save_then_update(thread_id, memory):
+            # Lượt mới được lưu trong lúc lần xả đang chạy
+            store._pending[thread_id] = make_memory(4)
+            original_save(thread_id, memory)
+
+        backend.save_memory = save_then_update
+        store.flush()
+        backend.save_memory = original_save
+        store.flush()
+        self.assertEqual(len(backend.saved["thread"].messages), 4)
+        store.close()
+
+    def test_thread_info_from_pending(self):
+        """Metadata của luồng đang chờ ghi lấy từ bản chờ, không xả xuống backend."""
+        backend = SqliteStore(os.path.join(self.directory, "conversations.db"))
+        store = CoalescingStore(backend, flush_interval=60)
+        store.create_thread("thread")
+        memory = Memory(messages=[])
+        for role in ("human", "ai", "human"):
+            memory.add_message(role, "tin nhắn")
+        store.save_memory("thread", memory)
+        info = store.get_thread_info("thread")
+        self.assertEqual(info["message_count"], 3)
+        self.assertEqual(info["last_updated"], memory.messages[-1].timestamp)
+        self.assertEqual(backend.get_thread_info("thread")["message_count"], 0)
+        self.assertEqual(store.get_stats()["flushes"], 0)
+
+        store.save_memory("new", make_memory(1))
+        self.assertEqual(store.get_thread_info("new")["message_count"], 1)
+        self.assertIsNone(backend.get_thread_info("new"))
+        store.close()
+
+class TestRunStoreCall(unittest.TestCase):
+    """Kiểm tra lệnh gọi backend từ event loop."""
+
+    def test_blocking_backend_runs_off_the_loop(self):
+        """Backend có I/O chặn chạy trong thread pool, backend khác chạy trực tiếp."""
+        directory = tempfile.mkdtemp()
+        try:
+            backends = {
+                True: SqliteStore(os.path.join(directory, "conversations.db")),
+                False: FileStore(os.path.join(directory, "index.log"), os.path.join(directory, "data"))
+            }
+            for blocking, backend in backends.items():
+                with self.subTest(blocking=blocking), patch.object(storage, "get_store", return_value=backend):
+                    self.assertEqual(backend.blocking, blocking)
+                    self.assertEqual(CoalescingStore(backend, flush_interval=60).blocking, blocking)
+                    thread = asyncio.run(run_store_call(threading.get_ident))
+                    self.assertEqual(thread != threading.get_ident(), blocking)
+                backend.close()
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+
+class TestSegmentLogStore(unittest.TestCase):
+    """Kiểm tra khả năng phục hồi của backend segment_log."""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def make_store(self) -> SegmentLogStore:
+        """Backend với segment nhỏ để mỗi luồng có nhiều segment."""
+        return SegmentLogStore(self.directory, segment_max_bytes=200, compact_segments=1000)
+
+    def contents(self, memory: Memory):
+        """Nội dung các tin nhắn của bộ nhớ."""
+        return [message.content for message in memory.messages]
+
+    def test_torn_tail_is_truncated(self):
+        """Bản ghi ghi dở ở cuối segment bị bỏ qua và cắt khỏi file."""
+        store = self.make_store()
+        store.save_memory("thread", make_memory(3))
+        _, path = store._segments("thread")[-1]
+        size = os.path.getsize(path)
+        with open(path, "ab") as f:
+            f.write(b'{"message": {"role": "ai", "cont')
+
+        reopened = self.make_store()
+        self.assertEqual(self.contents(reopened.load_memory("thread")), self.contents(make_memory(3)))
+        self.assertEqual(os.path.getsize(path), size)
+        reopened.save_memory("thread", make_memory(4))
+        self.assertEqual(len(self.make_store().load_memory("thread").messages), 4)
+
+    def test_shrink_rewrites_thread(self):
+        """Rút ngắn bộ nhớ viết lại luồng; segment cũ được dọn."""
+        store = self.make_store()
+        for count in range(1, 11):
+            store.save_memory("thread", make_memory(count))
+        self.assertGreater(len(store._segments("thread")), 1)
+        store.save_memory("thread", make_memory(2))
+        self.assertEqual(len(store._segments("thread")), 1)
+        self.assertEqual(self.contents(self.make_store().load_memory("thread")), self.contents(make_memory(2)))
+        store.save_memory("thread", make_memory(0))
+        self.assertEqual(self.make_store().load_memory("thread").messages, [])
+
+    def test_crash_during_rewrite(self):
+        """Dừng trước khi thay thế giữ nguyên bản cũ; dừng sau đó thấy bản mới."""
+        store = self.make_store()
+        store.save_memory("thread", make_memory(10))
+        original_replace = os.replace
+
+        def crash(src, dst):
+            raise OSError("tiến trình dừng")
+
+        os.replace = crash
+        try:
+            with self.assertRaises(OSError):
+                store.save_memory("thread", make_memory(2))
+        finally:
+            os.replace = original_replace
+        self.assertEqual(len(self.make_store().load_memory("thread").messages), 10)
+
+        # Dừng sau khi segment mới vào chỗ nhưng trước khi dọn segment cũ
+        original_live = SegmentLogStore._live_segments
+        SegmentLogStore._live_segments = lambda self, thread_id: self._segments(thread_id)
+        try:
+            store._rewrite("thread", make_memory(2).messages)
+        finally:
+            SegmentLogStore._live_segments = original_live
+        self.assertGreater(len(store._segments("thread")), 1)
+
+        reopened = self.make_store()
+        self.assertEqual(self.contents(reopened.load_memory("thread")), self.contents(make_memory(2)))
+        self.assertEqual(len(reopened._segments("thread")), 1)
+
+    def test_compaction_keeps_messages(self):
+        """Gộp segment không làm mất hay lặp tin nhắn."""
+        store = self.make_store()
+        for count in range(1, 13):
+            store.save_memory("thread", make_memory(count))
+        store.compact("thread")
+        self.assertLessEqual(len(store._segments("thread")), 2)
+        self.assertEqual(self.contents(self.make_store().load_memory("thread")), self.contents(make_memory(12)))
+        store.close()
+
+class TestThreadData(unittest.TestCase):
+    """Kiểm tra dữ liệu phụ của luồng ở các backend."""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def make_stores(self):
+        """Một backend của mỗi loại, trong thư mục tạm riêng."""
+        return {
+            "file": FileStore(os.path.join(self.directory, "index.log"), os.path.join(self.directory, "data")),
+            "segment_log": SegmentLogStore(os.path.join(self.directory, "threads")),
+            "sqlite": SqliteStore(os.path.join(self.directory, "conversations.db"))
+        }
+
+    def test_save_load_delete(self):
+        """Ghi, ghi đè, xóa khóa và xóa luồng."""
+        for name, store in self.make_stores().items():
+            with self.subTest(backend=name):
+                store.save_memory("thread", make_memory(2))
+                store.save_thread_data("thread", "turns", "0", [{"text": "a"}])
+                store.save_thread_data("thread", "turns", "2", [{"text": "b"}])
+                store.save_thread_data("thread", "turns", "0", [{"text": "c"}])
+                self.assertEqual(store.load_thread_data("thread", "turns"), {"0": [{"text": "c"}], "2": [{"text": "b"}]})
+
+                store.delete_thread_data("thread", "turns", ["0"])
+                self.assertEqual(list(store.load_thread_data("thread", "turns")), ["2"])
+                self.assertEqual(store.load_thread_data("other", "turns"), {})
+
+                store.delete_conversation("thread")
+                self.assertEqual(store.load_thread_data("thread", "turns"), {})
+                self.assertNotIn("_data", store.list_conversations())
+                store.close()
+
+    def test_cache_is_bounded(self):
+        """Cache dữ liệu đã đọc giữ tối đa `max_cached` mục, dùng gần nhất được giữ lại."""
+        data = ThreadDataLog(self.directory, max_cached=2)
+        for thread_id in ("a", "b", "c"):
+            data.save(thread_id, "settings", "value", thread_id)
+        self.assertEqual(list(data._cache), [("b", "settings"), ("c", "settings")])
+        self.assertEqual(data.load("a", "settings"), {"value": "a"})
+        self.assertEqual(list(data._cache), [("c", "settings"), ("a", "settings")])
+
+    def test_caches_thread_data(self):
+        """Chỉ backend trả lại cùng dict khi dữ liệu chưa đổi mới cho phép cache theo định danh."""
+        stores = self.make_stores()
+        flags = {name: store.caches_thread_data for name, store in stores.items()}
+        self.assertEqual(flags, {"file": True, "segment_log": True, "sqlite": False})
+        self.assertFalse(CoalescingStore(stores["sqlite"], flush_interval=60).caches_thread_data)
+        for store in stores.values():
+            store.close()
+
+    def test_log_is_compacted(self):
+        """Ghi đè nhiều lần không làm log lớn dần; dòng ghi dở bị bỏ qua."""
+        data = ThreadDataLog(self.directory)
+        for i in range(100):
+            data.save("thread", "settings", "value", i)
+        path = data._path("thread", "settings")
+        with open(path, encoding="utf-8") as f:
+            self.assertLess(len(f.readlines()), 20)
+
+        with open(path, "a", encoding="utf-8") as f:
+            f.write('{"key": "value", "val')
+        self.assertEqual(ThreadDataLog(self.directory).load("thread", "settings"), {"value": 99})
+
+class TestThreadIndex(unittest.TestCase):
+    """Kiểm tra log của chỉ mục metadata luồng."""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def test_log_is_compacted_at_runtime(self):
+        """Cập nhật liên tục một luồng không làm log lớn dần khi server đang chạy."""
+        path = os.path.join(self.directory, "threads_index.log")
+        index = ThreadIndex(path)
+        for i in range(5 * COMPACT_SLACK):
+            index.upsert("thread", i)
+        index.upsert("other", 1)
+        index.remove("other")
+        with open(path, encoding="utf-8") as f:
+            self.assertLessEqual(len(f.readlines()), 2 + COMPACT_SLACK + 1)
+
+        reopened = ThreadIndex(path)
+        self.assertEqual(reopened.get("thread")["message_count"], 5 * COMPACT_SLACK - 1)
+        self.assertIsNone(reopened.get("other"))
+        self.assertEqual([info["id"] for info in reopened.page()[0]], ["thread"])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,121 @@
+"""
+Unit test cho cache kết quả công cụ.
+
+Không cần API đang chạy; công cụ là các hàm giả đếm số lần thực thi.
+"""
+
+import asyncio
+import threading
+import time
+import unittest
+
+from agent_template.utils.tool_cache import ToolCache, cached_tool
+
+class TestToolCache(unittest.TestCase):
+    """Kiểm tra TTL, LRU và gộp lần gọi trùng (single-flight)."""
+
+    def test_ttl_expiry(self):
+        """Kết quả hết hạn sau TTL thì công cụ được gọi lại."""
+        calls = []
+
+        @cached_tool(ttl=0.05, name="test_ttl")
+        def tool(value: int) -> int:
+            calls.append(value)
+            return value * 2
+
+        self.assertEqual(tool(1), 2)
+        self.assertEqual(tool(1), 2)
+        self.assertEqual(len(calls), 1)
+        time.sleep(0.1)
+        self.assertEqual(tool(1), 2)
+        self.assertEqual(len(calls), 2)
+        stats = tool.tool_cache.get_stats()
+        self.assertEqual((stats["hits"], stats["misses"]), (1, 2))
+
+    def test_lru_eviction(self):
+        """Vượt giới hạn thì mục ít được dùng gần đây nhất bị loại."""
+        cache = ToolCache("test_lru", ttl=60, max_entries=2)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        self.assertEqual(cache.get("a"), (True, 1))
+        cache.set("c", 3)
+        self.assertEqual(cache.get("b"), (False, None))
+        self.assertEqual(cache.get("a"), (True, 1))
+        self.assertEqual(cache.get("c"), (True, 3))
+        self.assertEqual(cache.get_stats()["evictions"], 1)
+
+    def test_sync_single_flight(self):
+        """Các lần gọi đồng thời cùng tham số chỉ thực thi công cụ một lần."""
+        calls = []
+
+        @cached_tool(ttl=60, name="test_sync_flight")
+        def tool(value: int) -> int:
+            calls.append(value)
+            time.sleep(0.1)
+            return value
+
+        threads = [threading.Thread(target=tool, args=(1,)) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(calls), 1)
+        stats = tool.tool_cache.get_stats()
+        self.assertEqual((stats["misses"], stats["coalesced"]), (1, 7))
+
+    def test_sync_failure_hands_over_ownership(self):
+        """Lần thực thi lỗi không được cache; chỉ một người chờ thực thi lại."""
+        calls = []
+        first = threading.Event()
+
+        @cached_tool(ttl=60, name="test_sync_failure")
+        def tool(value: int) -> int:
+            calls.append(value)
+            if len(calls) == 1:
+                first.set()
+                time.sleep(0.1)
+                raise RuntimeError("lỗi")
+            time.sleep(0.1)
+            return value
+
+        results = []
+
+        def call():
+            try:
+                results.append(tool(1))
+            except RuntimeError:
+                results.append("lỗi")
+
+        owner = threading.Thread(target=call)
+        owner.start()
+        first.wait()
+        waiters = [threading.Thread(target=call) for _ in range(6)]
+        for thread in waiters:
+            thread.start()
+        for thread in [owner, *waiters]:
+            thread.join()
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(sorted(results, key=str), [1] * 6 + ["lỗi"])
+        stats = tool.tool_cache.get_stats()
+        self.assertEqual(stats["misses"] + stats["coalesced"], 7)
+        self.assertEqual(tool.tool_cache._inflight, {})
+
+    def test_async_single_flight(self):
+        """Công cụ bất đồng bộ: các lần gọi trùng dùng chung một lần thực thi."""
+        calls = []
+
+        @cached_tool(ttl=60, name="test_async_flight")
+        async def tool(value: int) -> int:
+            calls.append(value)
+            await asyncio.sleep(0.05)
+            return value
+
+        async def main():
+            return await asyncio.gather(*(tool(1) for _ in range(5)), tool(2))
+
+        self.assertEqual(asyncio.run(main()), [1, 1, 1, 1, 1, 2])
+        self.assertEqual(sorted(calls), [1, 2])
+        self.assertEqual(tool.tool_cache.get_stats()["coalesced"], 4)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,69 @@
+"""
+Unit test cho bộ thực thi công cụ ToolRunner.
+
+Không cần API đang chạy; công cụ là các hàm giả.
+"""
+
+import asyncio
+import threading
+import time
+import unittest
+
+from pydantic_ai import ModelRetry
+
+from agent_template.utils.tool_runner import ToolRunner
+
+def slow_tool(delay: float) -> str:
+    """Công cụ đồng bộ ngủ `delay` giây."""
+    time.sleep(delay)
+    return "xong"
+
+class TestToolRunner(unittest.TestCase):
+    """Kiểm tra thời gian chờ, thống kê và việc đóng thread pool."""
+
+    def test_timeout_becomes_model_retry(self):
+        """Công cụ quá thời gian chờ trả ModelRetry và được đếm."""
+        runner = ToolRunner(tool_timeout=0.05, turn_timeout=5, max_workers=2)
+        with self.assertRaises(ModelRetry):
+            asyncio.run(runner.run("slow", slow_tool, (0.3,), {}))
+        self.assertEqual(asyncio.run(runner.run("slow", slow_tool, (0,), {})), "xong")
+        stats = runner.get_stats()
+        self.assertEqual(stats["tools"]["slow"]["calls"], 2)
+        self.assertEqual(stats["tools"]["slow"]["timeouts"], 1)
+        self.assertEqual(stats["running"], 0)
+        runner.close()
+
+    def test_stats_from_several_loops(self):
+        """Lệnh gọi từ nhiều luồng, mỗi luồng một event loop, được đếm đủ."""
+        runner = ToolRunner(tool_timeout=5, turn_timeout=5, max_workers=8)
+
+        async def tool():
+            await asyncio.sleep(0)
+
+        def worker():
+            for _ in range(200):
+                asyncio.run(runner.run("tool", tool, (), {}))
+
+        threads = [threading.Thread(target=worker) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        stats = runner.get_stats()
+        self.assertEqual(stats["tools"]["tool"]["calls"], 800)
+        self.assertEqual(stats["running"], 0)
+
+    def test_close_shuts_down_executor(self):
+        """close() dừng thread pool; lần gọi sau tạo thread pool mới."""
+        runner = ToolRunner(tool_timeout=5, turn_timeout=5, max_workers=1)
+        asyncio.run(runner.run("slow", slow_tool, (0,), {}))
+        executor = runner._executor
+        runner.close()
+        self.assertIsNone(runner._executor)
+        with self.assertRaises(RuntimeError):
+            executor.submit(slow_tool, 0)
+        self.assertEqual(asyncio.run(runner.run("slow", slow_tool, (0,), {})), "xong")
+        runner.close()
+
+if __name__ == "__main__":
+    unittest.main()